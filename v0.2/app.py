@@ -6,14 +6,38 @@ import os
 import uuid
 import json
 import math
+from pathlib import Path
 
 import streamlit as st
 
 from parser_v02 import ParseError, parse_dsl, steps_to_dicts
+from budget_v02 import BUDGET_MODES, PromptBudget
+from builtins_v02 import ChatBuiltins
+from estimator_v02 import StepStatsHistory, estimate_run
 from executor_v02 import execute_steps
+from functions_v02 import FunctionRegistry, default_functions
+from fusion_v02 import execute_fused_steps
+from generation_v02 import GenerationPolicy
 from model_adapters_v02 import make_gemini_caller
-from gemini_client_v02 import call_gemini
-from state_store_v02 import load_chats, save_chats
+from map_cache_v02 import MapElementCache
+from map_reduce_v02 import MapReduceRetriever
+from gemini_client_v02 import call_gemini, count_tokens
+from checkpoint_v02 import CheckpointRecorder, load_checkpoint, resume_plan
+from coalesce_v02 import CoalescingCaller
+from context_cache_v02 import DEFAULT_REFERENCE_MIN_CHARS, ContextCachingCaller, GeminiContextCache
+from hedging_v02 import HedgedCaller
+from router_v02 import (
+    POLICY_CHEAP_FIRST,
+    POLICY_CHEAPEST_THAT_PASSES,
+    POLICY_LATENCY_SLO,
+    ModelRoute,
+    ModelRouter,
+    RoutingHistory,
+)
+from search_index_v02 import index_for_chat
+from state_store_v02 import open_chat_store
+from summary_cache_v02 import RollingSummarizer, SummaryCache
+from tokens_v02 import TokenCounter
 from versioning_v02 import (
     backfill_history_metadata,
     cutoff_index_for_version_view,
@@ -538,6 +562,93 @@ st.session_state.setdefault("copy_open", False)
 st.session_state.setdefault("history_view_chat_id", None)
 st.session_state.setdefault("history_view_message_id", None)
 
+def _chat_store():
+    # One store per session; the sqlite backend tracks row versions per store.
+    if "chat_store" not in st.session_state:
+        st.session_state.chat_store = open_chat_store()
+    return st.session_state.chat_store
+
+
+def save_chats(state: dict) -> None:
+    _chat_store().save_chats(state)
+
+
+@st.cache_resource
+def _summary_cache() -> SummaryCache:
+    # Shared by all sessions; summaries are keyed by segment content hash.
+    return SummaryCache(Path(__file__).resolve().parent / "state" / "summaries.json")
+
+
+@st.cache_resource
+def _chunk_extract_cache() -> SummaryCache:
+    # /IN map-reduce extracts, keyed by description + chunk content hash.
+    return SummaryCache(Path(__file__).resolve().parent / "state" / "chunk_extracts.json")
+
+
+@st.cache_resource
+def _routing_history() -> RoutingHistory:
+    # Per-step validation and latency history that the model router learns from.
+    return RoutingHistory()
+
+
+@st.cache_resource
+def _local_functions() -> FunctionRegistry:
+    # Functions available to /CALL steps; register project-specific ones here.
+    return default_functions()
+
+
+@st.cache_resource
+def _step_stats(chat_id: str) -> StepStatsHistory:
+    # Step latencies and token counts of this chat's runs, per model, for the pre-run estimate.
+    return StepStatsHistory(Path(__file__).resolve().parent / "state" / "step_stats" / f"{chat_id}.json")
+
+
+@st.cache_resource
+def _map_element_cache() -> MapElementCache:
+    # /MAP element responses, keyed by model, element prompt and generation config.
+    return MapElementCache(Path(__file__).resolve().parent / "state" / "map_elements.json")
+
+
+@st.cache_resource
+def _token_counter() -> TokenCounter:
+    # Per-model calibration against Gemini countTokens, shared by every chat.
+    return TokenCounter(Path(__file__).resolve().parent / "state" / "token_calibration.json")
+
+
+@st.cache_resource
+def _context_cache(model: str | None, timeout_s: float) -> ContextCachingCaller:
+    # Cached prefixes are shared by every session until their TTL runs out.
+    return ContextCachingCaller(GeminiContextCache(model=model, timeout_s=timeout_s))
+
+
+def _base_caller(model: str | None, timeout_s: float, cache_prefixes: bool):
+    if cache_prefixes:
+        return _context_cache(model, timeout_s)
+    return make_gemini_caller(model=model, timeout_s=timeout_s)
+
+
+@st.cache_resource
+def _hedged_caller(model: str | None, timeout_s: float, cache_prefixes: bool = False) -> HedgedCaller:
+    # One per model/timeout so the hedge threshold learns from every session.
+    return HedgedCaller(_base_caller(model, timeout_s, cache_prefixes))
+
+
+@st.cache_resource
+def _shared_caller(
+    model: str | None, timeout_s: float, hedge: bool, cache_prefixes: bool = False
+) -> CoalescingCaller:
+    # Shared by all sessions so identical in-flight prompts make one request.
+    if hedge:
+        inner = _hedged_caller(model, timeout_s, cache_prefixes)
+    else:
+        inner = _base_caller(model, timeout_s, cache_prefixes)
+    return CoalescingCaller(inner, model_id=model)
+
+
+def _checkpoint_path(chat_id: str) -> Path:
+    return Path(__file__).resolve().parent / "state" / "checkpoints" / f"{chat_id}.json"
+
+
 def _new_chat(name: str) -> dict:
     safe_name = name.strip() or "Untitled"
     return {
@@ -643,15 +754,92 @@ def _format_var_preview(value: object, max_len: int = 140) -> str:
     return preview
 
 
-def _approx_token_count(value: object) -> int:
-    if isinstance(value, str):
-        return len(value) // 4
-    if isinstance(value, (dict, list, tuple)):
-        try:
-            return len(json.dumps(value, ensure_ascii=True)) // 4
-        except TypeError:
-            return 0
-    return 0
+def _show_run_estimate(
+    dsl_text: str,
+    chat_history: list,
+    chat_vars: dict,
+    model: str | None,
+    history_token_budget: int,
+) -> None:
+    try:
+        steps = parse_dsl(dsl_text)
+    except ParseError as e:
+        st.error(f"Parse error: {e}")
+        return
+    counter = _token_counter()
+    history_tokens = sum(counter.count(str(msg.get("content", "")), model) for msg in chat_history)
+    if history_token_budget:
+        history_tokens = min(history_tokens, int(history_token_budget))
+    estimate = estimate_run(
+        steps,
+        dict(chat_vars),
+        model=model,
+        history=_step_stats(active_chat["id"]),
+        builtin_tokens={"CHAT": history_tokens, "ALL": history_tokens},
+        token_counter=counter,
+    )
+    cost = f"${estimate.cost_usd:.4f}" if estimate.cost_usd is not None else "cost unknown"
+    st.caption(
+        f"Estimate: {estimate.critical_path_latency_s:.1f}s on the critical path "
+        f"({estimate.sequential_latency_s:.1f}s sequential), "
+        f"{estimate.prompt_tokens:,} prompt + {estimate.output_tokens:,} output tokens, {cost}"
+    )
+    for warning in estimate.warnings:
+        st.warning(warning)
+    with st.expander("Per-step estimate", expanded=False):
+        st.dataframe(
+            [
+                {
+                    "Step": e.step_index,
+                    "Line": e.line_no,
+                    "Calls": e.calls,
+                    "Prompt tokens": e.prompt_tokens,
+                    "Output tokens": e.output_tokens,
+                    "Latency (s)": e.latency_s,
+                    "Source": e.source,
+                    "Notes": "; ".join(e.notes),
+                }
+                for e in estimate.steps
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def _calibrate_token_counter(chat_history: list, model: str | None, timeout_s: float) -> None:
+    prompts = []
+    for msg in reversed(chat_history):
+        for log in msg.get("meta", {}).get("execution_logs", []) or []:
+            if isinstance(log.get("prompt"), str):
+                prompts.append(log["prompt"])
+        if len(prompts) >= 5:
+            break
+    if not prompts:
+        st.info("Run a DSL program first; its prompts are used as calibration samples.")
+        return
+    try:
+        factor = _token_counter().calibrate(
+            model, prompts[:5], lambda text: count_tokens(text, model=model, timeout_s=timeout_s)
+        )
+    except Exception as e:
+        st.error(f"Calibration failed: {e}")
+        return
+    st.caption(f"Token counts for {model or 'the default model'} now scale by {factor:.2f}.")
+
+
+def _show_budget_notes(logs: list) -> None:
+    for log in logs:
+        entries = [log.get("budget")] + [e.get("budget") for e in log.get("map", {}).get("elements", [])]
+        for budget in filter(None, entries):
+            where = f"Step {log['step_index']} (line {log['start_line_no']})"
+            if budget.get("warning"):
+                st.warning(f"{where}: {budget['warning']}")
+            else:
+                trimmed = ", ".join(budget.get("dropped", []) + sorted(budget.get("truncated", {})))
+                st.info(
+                    f"{where}: prompt trimmed from {budget['tokens_before']:,} to "
+                    f"{budget['tokens']:,} tokens ({trimmed})"
+                )
 
 
 def _run_dsl(
@@ -663,6 +851,18 @@ def _run_dsl(
     chat_vars: dict,
     state: dict,
     edited_from_message_id: str | None = None,
+    cheap_model: str | None = None,
+    history_token_budget: int = 0,
+    routing_policy: str | None = None,
+    latency_slo_s: float = 0.0,
+    hedge_requests: bool = False,
+    fuse_steps: bool = False,
+    tune_generation: bool = False,
+    cache_prefixes: bool = False,
+    resume: bool = False,
+    repair_attempts: int = 0,
+    prompt_token_budget: int = 0,
+    budget_mode: str = "trim",
 ) -> None:
     if input_text.strip() == "":
         return
@@ -693,15 +893,124 @@ def _run_dsl(
         if isinstance(src_vars_before, dict):
             vars_before = dict(src_vars_before)
 
+    summarizer = None
+    if use_gemini and history_token_budget > 0:
+        summarizer = RollingSummarizer(
+            _shared_caller(cheap_model, timeout_s, False),
+            int(history_token_budget),
+            cache=_summary_cache(),
+        )
+    builtins = ChatBuiltins.for_chat(
+        active_chat["id"],
+        chat_history,
+        cutoff_index=(
+            cutoff_index_for_version_view(chat_history, edited_from_id) if edited_from_id else None
+        ),
+        run_input=input_text,
+        replaced_message_id=edited_from_id,
+        summarizer=summarizer,
+    )
+
+    retriever = None
+    if any(step.from_descriptions for step in steps):
+        retriever = index_for_chat(active_chat["id"]).for_timeline(builtins.timeline)
+        if use_gemini:
+            # Scopes too large for one prompt are searched chunk by chunk.
+            retriever = MapReduceRetriever(
+                _shared_caller(cheap_model, timeout_s, False),
+                retriever,
+                cache=_chunk_extract_cache(),
+            )
+
     ctx = dict(vars_before)
+    checkpoint_path = _checkpoint_path(active_chat["id"])
+    start = 0
+    resumed_logs: list = []
+    if resume:
+        saved = load_checkpoint(checkpoint_path)
+        if saved is not None:
+            try:
+                plan = resume_plan(saved, steps, ctx)
+            except ValueError as e:
+                st.error(f"Cannot resume: {e}")
+                st.stop()
+            plan.replay(builtins=builtins, retriever=retriever)
+            start, ctx, resumed_logs = plan.start, plan.context, plan.logs
+    recorder = CheckpointRecorder(steps, vars_before, path=checkpoint_path, resumed_logs=resumed_logs)
     try:
         call_model = None
+        router = None
         if use_gemini:
-            call_model = make_gemini_caller(model=model, timeout_s=timeout_s)
-        ctx, logs, outputs = execute_steps(steps, ctx, call_model=call_model)
+            call_model = _shared_caller(model, timeout_s, hedge_requests, cache_prefixes)
+            if routing_policy:
+                router = ModelRouter(
+                    [
+                        ModelRoute("main", call_model, cost_per_1k_tokens=1.0, model_id=model),
+                        ModelRoute(
+                            "cheap",
+                            _shared_caller(cheap_model, timeout_s, False, cache_prefixes),
+                            cost_per_1k_tokens=0.1,
+                            model_id=cheap_model,
+                        ),
+                    ],
+                    policy=routing_policy,
+                    history=_routing_history(),
+                    latency_slo_s=latency_slo_s or None,
+                )
+        # Routed steps derive their settings from the route's model_id; `model` is the fallback.
+        generation = GenerationPolicy(model=model) if use_gemini and tune_generation else None
+        reference_min_chars = DEFAULT_REFERENCE_MIN_CHARS if use_gemini and cache_prefixes else None
+        budget = None
+        if prompt_token_budget > 0:
+            budget = PromptBudget(
+                int(prompt_token_budget), mode=budget_mode, counter=_token_counter(), model=model
+            )
+        if fuse_steps and router is None:
+            ctx, logs, outputs = execute_fused_steps(
+                steps[start:],
+                ctx,
+                call_model=call_model,
+                on_step=recorder.record,
+                builtins=builtins,
+                retriever=retriever,
+                generation=generation,
+                reference_min_chars=reference_min_chars,
+                repair_attempts=repair_attempts,
+                functions=_local_functions(),
+                map_cache=_map_element_cache(),
+                budget=budget,
+            )
+        else:
+            ctx, logs, outputs = execute_steps(
+                steps[start:],
+                ctx,
+                call_model=call_model,
+                on_step=recorder.record,
+                builtins=builtins,
+                retriever=retriever,
+                router=router,
+                generation=generation,
+                reference_min_chars=reference_min_chars,
+                repair_attempts=repair_attempts,
+                functions=_local_functions(),
+                map_cache=_map_element_cache(),
+                budget=budget,
+            )
     except Exception as e:
-        st.error(f"Execution error: {e}")
+        recorder.fail(str(e))
+        if use_gemini:
+            _step_stats(active_chat["id"]).record_run(steps, recorder.checkpoint.logs, model or "default")
+        st.error(
+            f"Execution error: {e}\n\n{recorder.checkpoint.completed} committed step(s) were saved; "
+            "press ⟳ to resume from the failed step."
+        )
         st.stop()
+    recorder.clear()
+    if use_gemini:
+        _step_stats(active_chat["id"]).record_run(steps, logs, model or "default")
+    _show_budget_notes(logs)
+    logs = resumed_logs + logs
+    outputs = [log["parsed_json"]["out"] for log in resumed_logs] + outputs
 
     steps_dicts = steps_to_dicts(steps)
 
@@ -733,6 +1042,9 @@ def _run_dsl(
     if outputs:
         for idx, out in enumerate(outputs):
             step_log = output_logs[idx] if idx < len(output_logs) else None
+            if step_log is not None and step_log.get("skipped"):
+                # /IF or /UNLESS did not hold; the step stays in execution_logs only.
+                continue
             msg = {
                 "id": new_message_id("msg"),
                 "role": "assistant",
@@ -815,7 +1127,7 @@ def _run_raw(
     save_chats(state)
 
 if "chats_state" not in st.session_state:
-    st.session_state.chats_state = load_chats()
+    st.session_state.chats_state = _chat_store().load_chats()
 state = st.session_state.chats_state
 active_chat = _ensure_active_chat(state)
 chat_history = active_chat["history"]
@@ -964,6 +1276,34 @@ with st.sidebar:
     selected_label = st.selectbox("Model", model_labels, index=model_index)
     selected_model = model_options[model_labels.index(selected_label)][1]
 
+    cheap_label = st.selectbox("Cheap model", model_labels, index=0)
+    selected_cheap_model = model_options[model_labels.index(cheap_label)][1]
+
+    routing_options = [
+        ("Main model only", None),
+        ("Cheapest that passes", POLICY_CHEAPEST_THAT_PASSES),
+        ("Latency SLO", POLICY_LATENCY_SLO),
+        ("Cheap first, escalate on failure", POLICY_CHEAP_FIRST),
+    ]
+    routing_labels = [r[0] for r in routing_options]
+    routing_label = st.selectbox(
+        "Model routing",
+        routing_labels,
+        index=0,
+        help="Pick Model or Cheap model per step from step shape and past validation/latency.",
+    )
+    routing_policy = routing_options[routing_labels.index(routing_label)][1]
+    latency_slo_s = 0.0
+    if routing_policy == POLICY_CHEAP_FIRST:
+        escalations = _routing_history().escalation_report()
+        if escalations:
+            with st.expander("Escalation rates", expanded=False):
+                st.dataframe(escalations, use_container_width=True, hide_index=True)
+    if routing_policy == POLICY_LATENCY_SLO:
+        latency_slo_s = float(
+            st.number_input("Latency SLO (seconds, p90)", min_value=1, max_value=600, value=10, step=1)
+        )
+
     timeout_s = st.number_input(
         "Request timeout (seconds, 0 = no timeout)",
         min_value=0,
@@ -972,6 +1312,82 @@ with st.sidebar:
         step=10,
     )
 
+    fuse_steps = st.toggle(
+        "Fuse independent steps",
+        value=False,
+        disabled=routing_policy is not None,
+        help="Send consecutive steps that do not use each other's variables as one model call.",
+    )
+
+    tune_generation = st.toggle(
+        "Short outputs for typed steps",
+        value=False,
+        help="bool/int/float steps run with a small maxOutputTokens, no thinking and temperature 0.",
+    )
+
+    repair_attempts = int(
+        st.number_input(
+            "Repair attempts per step",
+            min_value=0,
+            max_value=3,
+            value=0,
+            step=1,
+            help="When a response breaks the step contract (invalid JSON, missing or mistyped /DEF value), "
+            "send the validation error back and ask for a corrected object instead of failing the run.",
+        )
+    )
+
+    cache_prefixes = st.toggle(
+        "Cache shared prompt prefixes",
+        value=False,
+        help="Put large inputs first in the prompt and reuse them through Gemini context caching "
+        "once the same prefix repeats.",
+    )
+    if cache_prefixes:
+        cache_stats = _context_cache(selected_model, timeout_s).stats()
+        if cache_stats["cacheable_requests"]:
+            st.caption(
+                f"Prefix cache: {cache_stats['hit_rate']:.0%} hit rate, "
+                f"{cache_stats['token_savings']:.0%} of prompt tokens served from cache"
+            )
+
+    hedge_requests = st.toggle(
+        "Hedge slow requests",
+        value=False,
+        help="Send a duplicate request when a call is slower than the recent p95; "
+        "at most 10% of calls are duplicated.",
+    )
+
+    history_token_budget = st.number_input(
+        "@CHAT/@ALL token budget (0 = unlimited)",
+        min_value=0,
+        max_value=1_000_000,
+        value=0,
+        step=1000,
+        help="Older history beyond the budget is summarized with the cheap model.",
+    )
+
+    prompt_token_budget = st.number_input(
+        "Prompt token budget per step (0 = unlimited)",
+        min_value=0,
+        max_value=2_000_000,
+        value=0,
+        step=1000,
+        help="Checked locally before each model call, using the calibrated token counter.",
+    )
+    budget_mode = st.selectbox(
+        "Over budget",
+        BUDGET_MODES,
+        index=BUDGET_MODES.index("trim"),
+        disabled=prompt_token_budget == 0,
+        help="warn: send anyway; fail: stop the run; trim: drop or truncate the lowest-priority inputs.",
+    )
+    if use_gemini and st.button("Calibrate token counts", use_container_width=True):
+        _calibrate_token_counter(chat_history, selected_model, timeout_s)
+
+    with st.expander("Local functions (/CALL)", expanded=False):
+        st.dataframe(_local_functions().describe(), use_container_width=True, hide_index=True)
+
     edit_msg = None
     if st.session_state.get("edit_target_chat_id") == active_chat.get("id"):
         edit_msg = _find_message_by_id(
@@ -995,16 +1411,30 @@ with st.sidebar:
             label_visibility="collapsed",
             help="Ctrl+Enter sends this draft.",
         )
-        draft_cols = st.columns(3)
+        draft_cols = st.columns(5)
         with draft_cols[0]:
             staging_send = st.form_submit_button(
                 "↩", type="secondary", help="Send", use_container_width=True
             )
         with draft_cols[1]:
+            staging_resume = st.form_submit_button(
+                "⟳",
+                help="Resume the last failed run: reuse its committed steps up to the first changed step",
+                disabled=mode != "Use DSL" or not _checkpoint_path(active_chat["id"]).exists(),
+                use_container_width=True,
+            )
+        with draft_cols[2]:
+            staging_estimate = st.form_submit_button(
+                "≈",
+                help="Estimate latency, tokens and cost from this chat's past runs",
+                disabled=mode != "Use DSL",
+                use_container_width=True,
+            )
+        with draft_cols[3]:
             st.form_submit_button(
                 "×", help="Clear", on_click=_clear_draft, use_container_width=True
             )
-        with draft_cols[2]:
+        with draft_cols[4]:
             staging_fullscreen = st.form_submit_button(
                 "⤢", help="Fullscreen", use_container_width=True
             )
@@ -1014,7 +1444,16 @@ with st.sidebar:
         st.session_state["draft_dialog"] = st.session_state.get("sidebar_draft", "")
         st.rerun()
 
-    if staging_send and staging_text:
+    if staging_estimate and staging_text and mode == "Use DSL":
+        _show_run_estimate(
+            staging_text,
+            chat_history,
+            chat_vars,
+            selected_model if use_gemini else None,
+            history_token_budget,
+        )
+
+    if (staging_send or staging_resume) and staging_text:
         if mode == "Use DSL":
             if "/NEXT" in staging_text:
                 st.warning("You used /NEXT. Use /THEN to start a new step.")
@@ -1030,6 +1469,18 @@ with st.sidebar:
                 chat_vars,
                 state,
                 edited_from_message_id=edit_source_id,
+                cheap_model=selected_cheap_model,
+                history_token_budget=history_token_budget,
+                routing_policy=routing_policy,
+                latency_slo_s=latency_slo_s,
+                hedge_requests=hedge_requests,
+                fuse_steps=fuse_steps,
+                tune_generation=tune_generation,
+                cache_prefixes=cache_prefixes,
+                repair_attempts=repair_attempts,
+                prompt_token_budget=prompt_token_budget,
+                budget_mode=budget_mode,
+                resume=staging_resume,
             )
             _clear_history_view()
             _clear_edit_state()
@@ -1080,6 +1531,17 @@ if dialog_available:
                     chat_vars,
                     state,
                     edited_from_message_id=edit_source_id,
+                    cheap_model=selected_cheap_model,
+                    history_token_budget=history_token_budget,
+                    routing_policy=routing_policy,
+                    latency_slo_s=latency_slo_s,
+                    hedge_requests=hedge_requests,
+                    fuse_steps=fuse_steps,
+                    tune_generation=tune_generation,
+                    cache_prefixes=cache_prefixes,
+                    repair_attempts=repair_attempts,
+                    prompt_token_budget=prompt_token_budget,
+                    budget_mode=budget_mode,
                 )
                 _clear_history_view()
                 _clear_edit_state()
@@ -1231,6 +1693,17 @@ if prompt:
             chat_vars,
             state,
             edited_from_message_id=edit_source_id,
+            cheap_model=selected_cheap_model,
+            history_token_budget=history_token_budget,
+            routing_policy=routing_policy,
+            latency_slo_s=latency_slo_s,
+            hedge_requests=hedge_requests,
+            fuse_steps=fuse_steps,
+            tune_generation=tune_generation,
+            cache_prefixes=cache_prefixes,
+            repair_attempts=repair_attempts,
+            prompt_token_budget=prompt_token_budget,
+            budget_mode=budget_mode,
         )
         _clear_history_view()
         _clear_edit_state()
@@ -1273,7 +1746,7 @@ if mode == "Use DSL" and vars_data is not None:
             rows.append(
                 {
                     "Name": name,
-                    "Tokens": _approx_token_count(value),
+                    "Tokens": _token_counter().count_value(value, selected_model),
                     "Preview": _format_var_preview(value),
                 }
             )
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from executor_v02 import step_embedded_refs
+from parser_v02 import Step
+from tokens_v02 import TokenCounter
+
+
+BUDGET_MODES = ("warn", "fail", "trim")
+_DEFAULT_MIN_KEPT_TOKENS = 64
+_TRIM_PASSES = 3
+
+
+class PromptBudgetError(ValueError):
+    """A prompt over its token budget, raised before the model call."""
+
+    def __init__(self, message: str, tokens: int, limit: int) -> None:
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+
+def _as_prompt_text(value: Any) -> str:
+    # Same rendering as prompt inputs; truncated values stay strings.
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _truncate(text: str, target_tokens: int, count: Callable[[str], int]) -> str:
+    """Longest head of `text` within `target_tokens`, found by bisecting on characters."""
+    # Even with the smallest calibration factor a token covers well under 64
+    # characters, so long values are not recounted in full on every probe.
+    low, high = 0, min(len(text), max(0, target_tokens) * 64)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count(text[:mid]) <= target_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+class PromptBudget:
+    """
+    Token limit for every prompt a step sends, checked locally before the
+    network call. `mode` decides what happens to an oversized prompt:
+
+    - "warn": send it unchanged and record a warning in the step log
+    - "fail": raise PromptBudgetError
+    - "trim": shrink the lowest-priority inputs until it fits, or raise
+
+    Trimming order, lowest priority first: inputs a step without /FROM
+    receives implicitly (dropped, oldest first), then /FROM inputs (last
+    listed first), then values referenced inline in the step text; the last
+    two are truncated down to `min_kept_tokens`, never dropped. Built-ins,
+    /FROM descriptions and the step's own text are never trimmed.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        mode: str = "trim",
+        counter: Optional[TokenCounter] = None,
+        model: Optional[str] = None,
+        min_kept_tokens: int = _DEFAULT_MIN_KEPT_TOKENS,
+    ) -> None:
+        if mode not in BUDGET_MODES:
+            raise ValueError(f"budget mode must be one of {', '.join(BUDGET_MODES)}, got {mode!r}")
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.max_tokens = int(max_tokens)
+        self.mode = mode
+        self.counter = counter or TokenCounter()
+        self.model = model
+        self.min_kept_tokens = max(1, min_kept_tokens)
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text, self.model)
+
+    def fits(self, prompt: str) -> bool:
+        return self.count(prompt) <= self.max_tokens
+
+    def fit(
+        self,
+        step: Step,
+        context: Dict[str, Any],
+        build_prompt: Callable[[Dict[str, Any]], str],
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """The prompt to send for `step` and its "budget" log entry (None when it fits as is)."""
+        prompt = build_prompt(context)
+        tokens = self.count(prompt)
+        if tokens <= self.max_tokens:
+            return prompt, None
+        where = f"Step {step.index} (line {step.start_line_no})"
+        over = f"prompt has {tokens} tokens, over the {self.max_tokens}-token budget"
+        log: Dict[str, Any] = {"limit": self.max_tokens, "mode": self.mode, "tokens_before": tokens}
+        if self.mode == "warn":
+            log.update(tokens=tokens, warning=over)
+            return prompt, log
+        if self.mode == "fail":
+            raise PromptBudgetError(f"{where}: {over}", tokens=tokens, limit=self.max_tokens)
+
+        trimmed = dict(context)
+        dropped: List[str] = []
+        truncated: Dict[str, Dict[str, int]] = {}
+        for name, droppable in self._trim_order(step, context):
+            for _ in range(_TRIM_PASSES):
+                excess = tokens - self.max_tokens
+                if excess <= 0:
+                    break
+                if droppable:
+                    del trimmed[name]
+                    dropped.append(name)
+                else:
+                    current = self.count(_as_prompt_text(trimmed[name]))
+                    target = max(self.min_kept_tokens, current - excess)
+                    if target >= current:
+                        break
+                    # Later passes cut the original again instead of stacking markers.
+                    source = _as_prompt_text(context[name])
+                    size = self.count(source)
+                    trimmed[name] = self._truncated(source, size, target)
+                    truncated[name] = {"from": size, "to": self.count(trimmed[name])}
+                prompt = build_prompt(trimmed)
+                tokens = self.count(prompt)
+                if droppable:
+                    break
+            if tokens <= self.max_tokens:
+                break
+        log.update(tokens=tokens, dropped=dropped, truncated=truncated)
+        if tokens > self.max_tokens:
+            raise PromptBudgetError(
+                f"{where}: prompt has {tokens} tokens after trimming "
+                f"({', '.join(dropped + sorted(truncated)) or 'no trimmable inputs'}), "
+                f"over the {self.max_tokens}-token budget",
+                tokens=tokens,
+                limit=self.max_tokens,
+            )
+        return prompt, log
+
+    def _truncated(self, source: str, size: int, target: int) -> str:
+        """`source` cut to at most `target` tokens, marker included."""
+        head_target = target - self.count(f" …[truncated {size} tokens]")
+        while True:
+            head = _truncate(source, max(0, head_target), self.count)
+            value = f"{head} …[truncated {size - self.count(head)} tokens]"
+            excess = self.count(value) - target
+            if excess <= 0 or head_target <= 0:
+                return value
+            head_target -= excess
+
+    def _trim_order(self, step: Step, context: Dict[str, Any]) -> List[Tuple[str, bool]]:
+        embedded = step_embedded_refs(step)
+        order: List[Tuple[str, bool]] = []
+        if step.from_vars is None:
+            order.extend((name, True) for name in context if name not in embedded)
+        else:
+            order.extend(
+                (name, False)
+                for name in reversed(step.from_vars)
+                if name in context and name not in embedded
+            )
+        inline = [name for name in context if name in embedded]
+        order.extend((name, False) for name in reversed(inline))
+        return order
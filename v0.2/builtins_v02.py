@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+from common_v02 import ChatRegistry
+from summary_cache_v02 import RollingSummarizer
+from versioning_v02 import project_visible_history
+
+
+BUILTIN_ALL = "ALL"
+BUILTIN_CHAT = "CHAT"
+BUILTIN_NAMES = frozenset({BUILTIN_ALL, BUILTIN_CHAT})
+
+
+def _render_message(msg: Dict[str, Any]) -> str:
+    role = msg.get("role", "assistant")
+    return f"{role}: {msg.get('content', '')}"
+
+
+class TimelineTranscript:
+    """
+    Incrementally serialized stored history for one chat, shared by every run
+    on that chat; it only ever holds committed messages. `sync` only renders
+    messages that are new since the last call; when the timeline changed (an
+    edit replaced a suffix) it re-renders from the first differing message.
+    """
+
+    def __init__(self) -> None:
+        self._ids: List[Any] = []
+        self._lines: List[str] = []
+        self._text = ""
+        self._lock = threading.Lock()
+        self.rendered_messages = 0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def lines_for(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """Rendered lines of `messages`, synced under the lock so concurrent runs get a consistent copy."""
+        with self._lock:
+            self._sync_locked(messages)
+            return list(self._lines)
+
+    def _common_prefix(self, messages: List[Dict[str, Any]]) -> int:
+        n = min(len(self._ids), len(messages))
+        # Projection only truncates and appends, so an unchanged boundary
+        # message means the whole prefix is unchanged.
+        if n and self._ids[n - 1] == messages[n - 1].get("id") and self._ids[0] == messages[0].get("id"):
+            return n
+        keep = 0
+        while keep < n and self._ids[keep] == messages[keep].get("id"):
+            keep += 1
+        return keep
+
+    def sync(self, messages: List[Dict[str, Any]]) -> str:
+        with self._lock:
+            return self._sync_locked(messages)
+
+    def _sync_locked(self, messages: List[Dict[str, Any]]) -> str:
+        keep = self._common_prefix(messages)
+        if keep < len(self._ids):
+            del self._ids[keep:]
+            del self._lines[keep:]
+            self._text = "\n".join(self._lines)
+        new_lines = [_render_message(msg) for msg in messages[keep:]]
+        if new_lines:
+            self._ids.extend(msg.get("id") for msg in messages[keep:])
+            self._lines.extend(new_lines)
+            joined = "\n".join(new_lines)
+            self._text = f"{self._text}\n{joined}" if self._text else joined
+            self.rendered_messages += len(new_lines)
+        return self._text
+
+
+_TRANSCRIPTS: ChatRegistry[TimelineTranscript] = ChatRegistry(TimelineTranscript)
+
+
+def transcript_for_chat(chat_id: str) -> TimelineTranscript:
+    """Per-chat transcript cache shared by every run in this process (LRU bounded)."""
+    return _TRANSCRIPTS.get(chat_id)
+
+
+def _render_vars(context: Dict[str, Any]) -> str:
+    lines = []
+    for name, value in context.items():
+        rendered = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        lines.append(f"- {name}: {rendered}")
+    return "\n".join(lines) if lines else "(none)"
+
+
+class ChatBuiltins:
+    """
+    Lazy `@CHAT` / `@ALL` values for one run.
+    Nothing is serialized until the executor asks for a name a step actually
+    uses; the transcript is then brought up to date incrementally. With a
+    `summarizer`, history beyond its token budget is replaced by cached
+    summaries of older segments.
+    """
+
+    def __init__(
+        self,
+        history: List[Dict[str, Any]],
+        transcript: Optional[TimelineTranscript] = None,
+        run_input: Optional[str] = None,
+        summarizer: Optional[RollingSummarizer] = None,
+    ) -> None:
+        self._history = history
+        self._transcript = transcript or TimelineTranscript()
+        self._summarizer = summarizer
+        # Lines of this run only; the shared transcript never sees them, so
+        # concurrent runs on one chat cannot read each other's input or outputs.
+        self._run_lines: List[str] = []
+        if run_input is not None:
+            self._run_lines.append(_render_message({"role": "user", "content": run_input}))
+        self.materialized: Dict[str, int] = {}
+
+    @classmethod
+    def for_chat(
+        cls,
+        chat_id: str,
+        chat_history: List[Dict[str, Any]],
+        cutoff_index: Optional[int] = None,
+        run_input: Optional[str] = None,
+        replaced_message_id: Optional[str] = None,
+        summarizer: Optional[RollingSummarizer] = None,
+    ) -> "ChatBuiltins":
+        """
+        Builtins over the projected timeline of a stored chat. When re-running an
+        edited message, pass its id as `replaced_message_id` so the timeline ends
+        just before it.
+        """
+        timeline = project_visible_history(chat_history, cutoff_index=cutoff_index)
+        if replaced_message_id is not None:
+            for pos, msg in enumerate(timeline):
+                if msg.get("id") == replaced_message_id:
+                    timeline = timeline[:pos]
+                    break
+        return cls(
+            timeline,
+            transcript_for_chat(chat_id),
+            run_input=run_input,
+            summarizer=summarizer,
+        )
+
+    @property
+    def timeline(self) -> List[Dict[str, Any]]:
+        return self._history
+
+    def names(self) -> frozenset[str]:
+        return BUILTIN_NAMES
+
+    def record_step_output(self, out: str) -> None:
+        """Make an earlier step's `out` visible to later steps of the same run."""
+        self._run_lines.append(_render_message({"role": "assistant", "content": out}))
+
+    def _chat_text(self) -> str:
+        if self._summarizer is not None:
+            return self._summarizer.render(self._transcript.lines_for(self._history) + self._run_lines)
+        stored = self._transcript.sync(self._history)
+        return "\n".join(filter(None, [stored, *self._run_lines]))
+
+    def resolve(self, name: str, context: Dict[str, Any]) -> str:
+        if name not in BUILTIN_NAMES:
+            raise KeyError(name)
+        self.materialized[name] = self.materialized.get(name, 0) + 1
+        chat = self._chat_text()
+        if name == BUILTIN_CHAT:
+            return chat
+        return f"Chat history:\n{chat}\n\nVariables:\n{_render_vars(context)}"
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from common_v02 import write_json_atomic
+from executor_v02 import BuiltinValues, DescriptionRetriever
+from parser_v02 import Step
+
+
+def _step_source(step: Step) -> Dict[str, Any]:
+    # Everything that shapes a step's prompt and contract; line numbers are left
+    # out so blank-line edits above a step do not invalidate it.
+    return {
+        "text": step.text,
+        "from_vars": step.from_vars,
+        "defs": [[d.var_name, d.value_type, d.as_text] for d in step.defs],
+        "out_text": step.out_text,
+        "from_descriptions": [[d.text, d.scope_var] for d in step.from_descriptions],
+        "commands": [[cmd.name, cmd.payload] for cmd in step.commands],
+        "call": step.call,
+        "map_over": step.map_over,
+        "condition": [step.condition, step.condition_negated],
+    }
+
+
+def prefix_hashes(steps: List[Step]) -> List[str]:
+    """Hash of steps[0..i] for every i; equal entries mean the program prefix is unchanged."""
+    hashes: List[str] = []
+    previous = ""
+    for step in steps:
+        digest = hashlib.sha256(previous.encode("utf-8"))
+        digest.update(json.dumps(_step_source(step), sort_keys=True).encode("utf-8"))
+        previous = digest.hexdigest()
+        hashes.append(previous)
+    return hashes
+
+
+def program_hash(steps: List[Step]) -> str:
+    hashes = prefix_hashes(steps)
+    return hashes[-1] if hashes else hashlib.sha256(b"").hexdigest()
+
+
+@dataclass
+class RunCheckpoint:
+    """Committed work of a run: one log per committed step, in program order."""
+
+    program_hash: str
+    prefix_hashes: List[str]
+    context_before: Dict[str, Any]
+    logs: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def completed(self) -> int:
+        return len(self.logs)
+
+    def context_after(self, count: int) -> Dict[str, Any]:
+        """Committed context after the first `count` steps."""
+        ctx = copy.deepcopy(self.context_before)
+        for log in self.logs[:count]:
+            ctx.update(copy.deepcopy(log["staged_updates"]))
+        return ctx
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunCheckpoint":
+        return cls(
+            program_hash=data["program_hash"],
+            prefix_hashes=list(data["prefix_hashes"]),
+            context_before=dict(data["context_before"]),
+            logs=list(data.get("logs") or []),
+            error=data.get("error"),
+        )
+
+
+def load_checkpoint(path: Path | str) -> Optional[RunCheckpoint]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return RunCheckpoint.from_dict(json.loads(path.read_text(encoding="utf-8")))
+
+
+def save_checkpoint(path: Path | str, checkpoint: RunCheckpoint) -> None:
+    write_json_atomic(path, checkpoint.to_dict(), ensure_ascii=False)
+
+
+class CheckpointRecorder:
+    """
+    `on_step` callback that checkpoints every committed step.
+    With `path`, the checkpoint is rewritten after each commit, so even a
+    killed process leaves the committed steps on disk.
+    """
+
+    def __init__(
+        self,
+        steps: List[Step],
+        context_before: Dict[str, Any],
+        path: Optional[Path | str] = None,
+        resumed_logs: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        hashes = prefix_hashes(steps)
+        self.path = Path(path) if path is not None else None
+        self.checkpoint = RunCheckpoint(
+            program_hash=hashes[-1] if hashes else program_hash(steps),
+            prefix_hashes=hashes,
+            context_before=copy.deepcopy(context_before),
+            logs=list(resumed_logs or []),
+        )
+
+    def record(self, step_log: Dict[str, Any]) -> None:
+        self.checkpoint.logs.append(step_log)
+        self._save()
+
+    __call__ = record
+
+    def fail(self, error: str) -> RunCheckpoint:
+        self.checkpoint.error = error
+        self._save()
+        return self.checkpoint
+
+    def clear(self) -> None:
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
+
+    def _save(self) -> None:
+        if self.path is not None:
+            save_checkpoint(self.path, self.checkpoint)
+
+
+@dataclass
+class ResumePlan:
+    start: int
+    context: Dict[str, Any]
+    logs: List[Dict[str, Any]]
+
+    @property
+    def outputs(self) -> List[str]:
+        return [log["parsed_json"]["out"] for log in self.logs]
+
+    def replay(
+        self,
+        builtins: Optional[BuiltinValues] = None,
+        retriever: Optional[DescriptionRetriever] = None,
+    ) -> None:
+        """Feed the reused steps to built-ins and the retriever as if they had just run."""
+        for log in self.logs:
+            if log.get("skipped"):
+                continue
+            if retriever is not None and log["staged_updates"]:
+                retriever.record_commit(log["staged_updates"])
+            if builtins is not None:
+                builtins.record_step_output(log["parsed_json"]["out"])
+
+
+def resume_plan(checkpoint: RunCheckpoint, steps: List[Step], context: Dict[str, Any]) -> ResumePlan:
+    """
+    Where a run of `steps` can pick up from `checkpoint`.
+    Committed steps are reused up to the first step whose program prefix
+    changed, so editing the failed step (or anything after it) keeps the work
+    before it. Raises ValueError when the starting context differs.
+    """
+    if context != checkpoint.context_before:
+        raise ValueError("checkpoint was taken with a different starting context")
+    hashes = prefix_hashes(steps)
+    start = 0
+    while (
+        start < min(checkpoint.completed, len(hashes))
+        and start < len(checkpoint.prefix_hashes)
+        and hashes[start] == checkpoint.prefix_hashes[start]
+    ):
+        start += 1
+    logs = [{**log, "from_checkpoint": True} for log in checkpoint.logs[:start]]
+    return ResumePlan(start=start, context=checkpoint.context_after(start), logs=logs)
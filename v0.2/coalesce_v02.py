@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from executor_v02 import ModelCall, ResponseSchema
+
+
+def call_key(
+    model_id: Optional[str],
+    prompt: str,
+    response_schema: ResponseSchema,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> str:
+    digest = hashlib.sha256()
+    for part in (
+        model_id or "",
+        prompt,
+        json.dumps(response_schema, sort_keys=True),
+        json.dumps(generation_config or {}, sort_keys=True),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class CoalescingCaller:
+    """
+    ModelCall wrapper that shares one upstream request between identical
+    concurrent calls (singleflight). Calls are identical when model id, prompt,
+    schema and generation config match. Nothing is cached: a call that starts
+    after the shared request finished goes upstream again.
+    """
+
+    def __init__(self, call_model: ModelCall, model_id: Optional[str] = None) -> None:
+        self.call_model = call_model
+        self.model_id = model_id
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    def __call__(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        key = call_key(self.model_id, prompt, response_schema, kwargs.get("generation_config"))
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.call_model(prompt, response_schema, **kwargs)
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "upstream_calls": self.upstream_calls,
+                "saved_calls": self.coalesced,
+                "in_flight": len(self._flights),
+            }
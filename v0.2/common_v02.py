@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+
+_DEFAULT_MAX_CHATS = 64
+_DEFAULT_BUSY_TIMEOUT_S = 30.0
+
+T = TypeVar("T")
+
+
+class ChatRegistry(Generic[T]):
+    """
+    Process-wide per-chat objects (transcripts, search indexes) shared by every
+    run on that chat; `factory` builds one on first use and the least
+    recently used chats are dropped beyond `max_chats`.
+    """
+
+    def __init__(self, factory: Callable[[], T], max_chats: int = _DEFAULT_MAX_CHATS) -> None:
+        self.factory = factory
+        self.max_chats = max(1, max_chats)
+        self._items: "OrderedDict[str, T]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: str) -> T:
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None:
+                item = self.factory()
+                self._items[chat_id] = item
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.max_chats:
+                self._items.popitem(last=False)
+            return item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def value_text(value: Any) -> str:
+    """A variable value as text: strings as is, anything else as JSON (like prompt inputs)."""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def step_label(text: str, max_chars: int = 80) -> str:
+    """First line of a step's text, cut to `max_chars`, for reports and logs."""
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    return first_line[:max_chars]
+
+
+def write_text_atomic(path: Path | str, text: str) -> None:
+    """Write `text` through a temporary file and a rename, so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def write_json_atomic(path: Path | str, data: Any, **dumps_kwargs: Any) -> None:
+    write_text_atomic(path, json.dumps(data, **dumps_kwargs))
+
+
+class SqliteConnections:
+    """
+    One connection per thread to a sqlite file in WAL mode, in autocommit
+    (transactions are opened explicitly with BEGIN IMMEDIATE).
+    """
+
+    def __init__(self, db_path: Path | str, busy_timeout_s: float = _DEFAULT_BUSY_TIMEOUT_S) -> None:
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.busy_timeout_s = busy_timeout_s
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                str(self.db_path),
+                timeout=self.busy_timeout_s,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Close the calling thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Protocol, Tuple
+
+from executor_v02 import ModelCall, ResponseSchema
+from gemini_client_v02 import GeminiHTTPError, call_gemini, create_cached_content
+from tokens_v02 import count_tokens
+
+
+# Inputs this long go into the cacheable Reference material block (~1k tokens).
+DEFAULT_REFERENCE_MIN_CHARS = 4000
+_DEFAULT_MIN_PREFIX_TOKENS = 1024
+_DEFAULT_TTL_S = 300.0
+_DEFAULT_MIN_USES = 2
+# Prefixes whose use counts are remembered before they earn a cache entry.
+_DEFAULT_MAX_TRACKED_PREFIXES = 1024
+# Re-create an entry slightly before the server-side TTL runs out.
+_EXPIRY_MARGIN_S = 5.0
+
+
+@dataclass
+class CachedPrefix:
+    name: str
+    token_count: int
+    expires_at: float
+
+
+class ContextCacheBackend(Protocol):
+    def create(self, prefix: str, ttl_s: float) -> CachedPrefix: ...
+
+    def generate(self, cached: CachedPrefix, suffix: str, response_schema: ResponseSchema, **kwargs: Any) -> str: ...
+
+    def generate_uncached(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str: ...
+
+
+class GeminiContextCache:
+    """cachedContents on the Gemini API: the prefix is uploaded once and referenced by name."""
+
+    def __init__(self, model: Optional[str], timeout_s: float) -> None:
+        self.model = model
+        self.timeout_s = timeout_s
+
+    def create(self, prefix: str, ttl_s: float) -> CachedPrefix:
+        resource = create_cached_content(prefix, model=self.model, ttl_s=ttl_s, timeout_s=self.timeout_s)
+        usage = resource.get("usageMetadata") or {}
+        return CachedPrefix(
+            name=resource["name"],
+            token_count=int(usage.get("totalTokenCount") or count_tokens(prefix)),
+            expires_at=time.monotonic() + ttl_s,
+        )
+
+    def generate(self, cached: CachedPrefix, suffix: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        return call_gemini(
+            suffix,
+            model=self.model,
+            timeout_s=self.timeout_s,
+            response_schema=response_schema,
+            cached_content=cached.name,
+            **kwargs,
+        )
+
+    def generate_uncached(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        return call_gemini(
+            prompt, model=self.model, timeout_s=self.timeout_s, response_schema=response_schema, **kwargs
+        )
+
+
+class LocalContextCache:
+    """
+    Stand-in backend for tests and offline runs: keeps prefixes in memory and
+    sends prefix + suffix to a plain ModelCall, so responses are unchanged.
+    """
+
+    def __init__(self, call_model: ModelCall, clock: Callable[[], float] = time.monotonic) -> None:
+        self.call_model = call_model
+        self.clock = clock
+        self.entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def create(self, prefix: str, ttl_s: float) -> CachedPrefix:
+        with self._lock:
+            name = f"cachedContents/local-{len(self.entries) + 1}"
+            self.entries[name] = prefix
+        return CachedPrefix(name=name, token_count=count_tokens(prefix), expires_at=self.clock() + ttl_s)
+
+    def generate(self, cached: CachedPrefix, suffix: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        with self._lock:
+            prefix = self.entries.get(cached.name)
+        if prefix is None:
+            raise GeminiHTTPError(404, f"{cached.name} not found")
+        return self.call_model(prefix + suffix, response_schema, **kwargs)
+
+    def generate_uncached(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        return self.call_model(prompt, response_schema, **kwargs)
+
+
+def _is_refusal(exc: Exception) -> bool:
+    # 400 is a definite answer about this prefix; timeouts, 429s and 5xx are not.
+    return isinstance(exc, GeminiHTTPError) and exc.status == 400
+
+
+def _is_missing_entry(exc: Exception) -> bool:
+    # The server answers 403/404 for cachedContents it expired or evicted early.
+    return isinstance(exc, GeminiHTTPError) and exc.status in (403, 404)
+
+
+class ContextCachingCaller:
+    """
+    ModelCall that serves repeated prompt prefixes from a context cache.
+    The executor passes the stable leading block of a prompt as `cache_prefix`.
+    A prefix of at least `min_prefix_tokens` seen `min_uses` times is stored
+    with a TTL; later calls send only the rest of the prompt. A prefix the
+    backend rejects with HTTP 400 (e.g. below the model's minimum) is not tried
+    again; other failures only send that call uncached. While one call creates
+    an entry, concurrent calls with the same prefix go uncached instead of
+    creating it a second time. An entry the server no longer has is dropped and
+    that call is sent uncached. Expired entries are pruned, and use counts are
+    kept for at most `max_tracked_prefixes` prefixes (least recently seen go first).
+    """
+
+    def __init__(
+        self,
+        backend: ContextCacheBackend,
+        min_prefix_tokens: int = _DEFAULT_MIN_PREFIX_TOKENS,
+        ttl_s: float = _DEFAULT_TTL_S,
+        min_uses: int = _DEFAULT_MIN_USES,
+        clock: Callable[[], float] = time.monotonic,
+        max_tracked_prefixes: int = _DEFAULT_MAX_TRACKED_PREFIXES,
+    ) -> None:
+        self.backend = backend
+        self.model_id = getattr(backend, "model", None)
+        self.min_prefix_tokens = min_prefix_tokens
+        self.ttl_s = ttl_s
+        self.min_uses = max(1, min_uses)
+        self.clock = clock
+        self.max_tracked_prefixes = max(1, max_tracked_prefixes)
+        self._entries: Dict[str, CachedPrefix] = {}
+        self._uses: "OrderedDict[str, int]" = OrderedDict()
+        self._refused: set[str] = set()
+        self._creating: set[str] = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cacheable_requests = 0
+        self.hits = 0
+        self.creations = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _prune_expired(self) -> None:
+        # Caller holds the lock.
+        now = self.clock()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at - _EXPIRY_MARGIN_S <= now]:
+            del self._entries[key]
+
+    def _entry_for(self, prefix: str) -> Tuple[str, Optional[CachedPrefix]]:
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._refused:
+                return key, None
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at - _EXPIRY_MARGIN_S > self.clock():
+                self.hits += 1
+                return key, entry
+            self._uses[key] = self._uses.get(key, 0) + 1
+            self._uses.move_to_end(key)
+            while len(self._uses) > self.max_tracked_prefixes:
+                self._uses.popitem(last=False)
+            if self._uses[key] < self.min_uses or key in self._creating:
+                return key, None
+            self._creating.add(key)
+        try:
+            entry = self.backend.create(prefix, self.ttl_s)
+        except Exception as exc:
+            with self._lock:
+                self._creating.discard(key)
+                if _is_refusal(exc):
+                    self._refused.add(key)
+            return key, None
+        # Local expiry follows our clock so stand-ins and tests can control it.
+        entry.expires_at = self.clock() + self.ttl_s
+        with self._lock:
+            self._creating.discard(key)
+            self._prune_expired()
+            self._entries[key] = entry
+            self.creations += 1
+        return key, entry
+
+    def _drop(self, key: str, entry: CachedPrefix) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def __call__(
+        self,
+        prompt: str,
+        response_schema: ResponseSchema,
+        cache_prefix: Optional[str] = None,
+        **kwargs: Any,
+    ) -> str:
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += count_tokens(prompt)
+        usable = (
+            cache_prefix is not None
+            and prompt.startswith(cache_prefix)
+            and len(prompt) > len(cache_prefix)
+            and count_tokens(cache_prefix) >= self.min_prefix_tokens
+        )
+        if not usable:
+            return self.backend.generate_uncached(prompt, response_schema, **kwargs)
+        with self._lock:
+            self.cacheable_requests += 1
+        key, entry = self._entry_for(cache_prefix)
+        if entry is None:
+            return self.backend.generate_uncached(prompt, response_schema, **kwargs)
+        try:
+            response = self.backend.generate(entry, prompt[len(cache_prefix) :], response_schema, **kwargs)
+        except Exception as exc:
+            if not _is_missing_entry(exc):
+                raise
+            self._drop(key, entry)
+            return self.backend.generate_uncached(prompt, response_schema, **kwargs)
+        with self._lock:
+            self.cached_tokens += entry.token_count
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "cacheable_requests": self.cacheable_requests,
+                "hits": self.hits,
+                "creations": self.creations,
+                "hit_rate": round(self.hits / self.cacheable_requests, 3) if self.cacheable_requests else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "token_savings": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            }
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+
+RECOVERY_FENCE = "fence"
+RECOVERY_BALANCED_OBJECT = "balanced_object"
+RECOVERY_TRAILING_COMMAS = "trailing_commas"
+
+_FENCE_PATTERN = re.compile(r"```[A-Za-z0-9_-]*[ \t]*\n?(.*?)```", re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+
+
+def _strip_fence(text: str) -> Optional[str]:
+    match = _FENCE_PATTERN.search(text)
+    return match.group(1).strip() if match else None
+
+
+def _first_balanced_object(text: str) -> Optional[str]:
+    """The first `{...}` span with balanced braces, ignoring braces inside strings."""
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for pos in range(start, len(text)):
+            ch = text[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start : pos + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
+def _drop_trailing_commas(text: str) -> str:
+    """Remove commas directly before `}` or `]`, leaving string contents alone."""
+    parts: List[str] = []
+    pos = 0
+    in_string = False
+    escaped = False
+    segment_start = 0
+    while pos < len(text):
+        ch = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                parts.append(text[segment_start : pos + 1])
+                segment_start = pos + 1
+        elif ch == '"':
+            parts.append(_TRAILING_COMMA_PATTERN.sub(r"\1", text[segment_start:pos]))
+            segment_start = pos
+            in_string = True
+        pos += 1
+    tail = text[segment_start:]
+    parts.append(tail if in_string else _TRAILING_COMMA_PATTERN.sub(r"\1", tail))
+    return "".join(parts)
+
+
+def decode_json_response(raw: str) -> Tuple[Any, Optional[str]]:
+    """
+    Parse a model response as JSON, recovering from common wrapping mistakes.
+    Strict parsing runs first; only when it fails are code fences stripped,
+    the first balanced `{...}` object cut out of surrounding prose, and
+    trailing commas dropped, in that order. Returns (value, recovery) where
+    recovery names the steps that fired ("fence+trailing_commas") or is None
+    for strict JSON. Raises the strict JSONDecodeError when nothing works.
+    """
+    try:
+        return json.loads(raw), None
+    except json.JSONDecodeError as strict_error:
+        error = strict_error
+
+    candidates: List[Tuple[str, List[str]]] = []
+    fenced = _strip_fence(raw)
+    if fenced is not None:
+        candidates.append((fenced, [RECOVERY_FENCE]))
+    for text, steps in list(candidates) + [(raw, [])]:
+        balanced = _first_balanced_object(text)
+        if balanced is not None and balanced != text:
+            candidates.append((balanced, steps + [RECOVERY_BALANCED_OBJECT]))
+
+    for text, steps in candidates:
+        try:
+            return json.loads(text), "+".join(steps)
+        except json.JSONDecodeError:
+            pass
+    for text, steps in candidates + [(raw.strip(), [])]:
+        cleaned = _drop_trailing_commas(text)
+        if cleaned == text:
+            continue
+        try:
+            return json.loads(cleaned), "+".join(steps + [RECOVERY_TRAILING_COMMAS])
+        except json.JSONDecodeError:
+            pass
+    raise error
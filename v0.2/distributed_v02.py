@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Protocol, Tuple
+
+from common_v02 import write_json_atomic
+from executor_v02 import ModelCall
+from parser_v02 import parse_dsl, steps_from_dicts, steps_to_dicts
+from runtime_v02 import RunResult, run_steps
+
+
+COORDINATOR_ADDRESS = "coordinator"
+_FS_POLL_INTERVAL_S = 0.02
+_DEFAULT_BATCH_TIMEOUT_S = 3600.0
+
+
+class Transport(Protocol):
+    """Point-to-point JSON message delivery between named endpoints."""
+
+    def send(self, address: str, message: Dict[str, Any]) -> None: ...
+
+    def recv(self, address: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]: ...
+
+
+class LocalQueueTransport:
+    """In-process transport (one queue per address) for tests and single-host runs."""
+
+    def __init__(self) -> None:
+        self._queues: Dict[str, "queue.Queue[str]"] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, address: str) -> "queue.Queue[str]":
+        with self._lock:
+            return self._queues.setdefault(address, queue.Queue())
+
+    def send(self, address: str, message: Dict[str, Any]) -> None:
+        # Serialize like a real transport so nothing non-JSON slips through.
+        self._queue(address).put(json.dumps(message))
+
+    def recv(self, address: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._queue(address).get(timeout=timeout))
+        except queue.Empty:
+            return None
+
+
+class FilesystemTransport:
+    """
+    Spool-directory transport: one directory per address, one file per message.
+    Works across hosts that share a filesystem; writes are atomic renames.
+    File names carry a per-sender sequence number, so messages from one sender
+    are read in the order they were sent even when host clocks differ or tick
+    coarsely. The sequence starts at the creation time, so a sender name reused
+    by a later session sorts after files an earlier session left behind.
+    Each inbox is listed once and drained before it is listed again.
+    """
+
+    def __init__(self, root: Path | str, sender: Optional[str] = None) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.sender = sender or uuid.uuid4().hex[:12]
+        self._seq = time.time_ns() // 1000
+        self._seq_lock = threading.Lock()
+        self._pending: Dict[str, Deque[Path]] = {}
+        self._pending_lock = threading.Lock()
+
+    def _inbox(self, address: str) -> Path:
+        inbox = self.root / address
+        inbox.mkdir(parents=True, exist_ok=True)
+        return inbox
+
+    def send(self, address: str, message: Dict[str, Any]) -> None:
+        inbox = self._inbox(address)
+        with self._seq_lock:
+            self._seq += 1
+            seq = self._seq
+        name = f"{seq:020d}-{self.sender}.json"
+        write_json_atomic(inbox / name, message)
+
+    def recv(self, address: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        inbox = self._inbox(address)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            path = self._next_pending(address, inbox)
+            while path is not None:
+                try:
+                    data = path.read_text(encoding="utf-8")
+                    path.unlink()
+                except FileNotFoundError:
+                    path = self._next_pending(address, inbox)
+                    continue  # another reader on the same inbox took it
+                return json.loads(data)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(_FS_POLL_INTERVAL_S)
+
+
+    def _next_pending(self, address: str, inbox: Path) -> Optional[Path]:
+        with self._pending_lock:
+            pending = self._pending.setdefault(address, deque())
+            if not pending:
+                pending.extend(sorted(inbox.glob("[0-9]*.json")))
+            return pending.popleft() if pending else None
+
+
+def partition_contexts(
+    contexts: List[Dict[str, Any]], parts: int
+) -> List[List[Tuple[int, Dict[str, Any]]]]:
+    """Split contexts into `parts` contiguous shards of near-equal size, keeping indices."""
+    parts = max(1, parts)
+    size, extra = divmod(len(contexts), parts)
+    shards: List[List[Tuple[int, Dict[str, Any]]]] = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        shards.append([(idx, contexts[idx]) for idx in range(start, end)])
+        start = end
+    return shards
+
+
+@dataclass
+class WorkerStats:
+    items: int = 0
+    ok: int = 0
+    failed: int = 0
+    steps: int = 0
+    busy_s: float = 0.0
+
+    def add(self, other: "WorkerStats") -> None:
+        self.items += other.items
+        self.ok += other.ok
+        self.failed += other.failed
+        self.steps += other.steps
+        self.busy_s += other.busy_s
+
+
+@dataclass
+class BatchOutcome:
+    results: List[Optional[RunResult]]
+    stats: WorkerStats
+    per_worker: Dict[str, WorkerStats] = field(default_factory=dict)
+    wall_s: float = 0.0
+    # Workers that did not finish before the batch timeout.
+    timed_out: List[str] = field(default_factory=list)
+
+
+def run_worker_node(
+    transport: Transport,
+    address: str,
+    call_model: Optional[ModelCall] = None,
+    concurrency: int = 1,
+    idle_timeout_s: Optional[float] = None,
+) -> WorkerStats:
+    """
+    Serve one coordinator session: receive the program once, run every item
+    shipped to this address and stream each RunResult back as it finishes.
+    """
+    programs: Dict[str, Any] = {}
+    stats = WorkerStats()
+    stats_lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"{address}-run")
+
+    def run_item(job_id: str, index: int, context: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        try:
+            result = run_steps(programs[job_id], context, call_model=call_model)
+        except Exception as exc:
+            # Report instead of losing it in the pool, so the coordinator gets every item.
+            result = RunResult(
+                ok=False,
+                outputs=[],
+                logs=[],
+                vars_after=dict(context),
+                parsed_steps=[],
+                error=f"{type(exc).__name__}: {exc}",
+            )
+        elapsed = time.perf_counter() - started
+        with stats_lock:
+            stats.items += 1
+            stats.ok += int(result.ok)
+            stats.failed += int(not result.ok)
+            stats.steps += len(result.logs)
+            stats.busy_s += elapsed
+        transport.send(
+            COORDINATOR_ADDRESS,
+            {
+                "type": "result",
+                "job": job_id,
+                "worker": address,
+                "index": index,
+                "elapsed_s": elapsed,
+                "result": asdict(result),
+            },
+        )
+
+    try:
+        while True:
+            msg = transport.recv(address, timeout=idle_timeout_s)
+            if msg is None:
+                break
+            kind = msg.get("type")
+            if kind == "program":
+                programs[msg["job"]] = steps_from_dicts(msg["steps"])
+            elif kind == "items":
+                for index, context in msg["items"]:
+                    pool.submit(run_item, msg["job"], index, context)
+            elif kind == "done":
+                pool.shutdown(wait=True)
+                transport.send(
+                    COORDINATOR_ADDRESS,
+                    {"type": "finished", "job": msg["job"], "worker": address, "stats": asdict(stats)},
+                )
+                break
+    finally:
+        pool.shutdown(wait=True)
+    return stats
+
+
+class Coordinator:
+    """Partitions a batch over worker addresses and merges what they stream back."""
+
+    def __init__(self, transport: Transport, workers: List[str]) -> None:
+        if not workers:
+            raise ValueError("at least one worker address is required")
+        self.transport = transport
+        self.workers = list(workers)
+
+    def run(
+        self,
+        program: str,
+        contexts: List[Dict[str, Any]],
+        timeout_s: Optional[float] = _DEFAULT_BATCH_TIMEOUT_S,
+    ) -> BatchOutcome:
+        """
+        Run `program` once per context on the workers. Workers that have not
+        finished within `timeout_s` (None waits forever) are listed in
+        `timed_out`; results they already sent are kept and their other items
+        get a failed RunResult. Messages from other jobs are read once and dropped.
+        """
+        steps = parse_dsl(program)
+        job_id = f"job-{uuid.uuid4().hex[:12]}"
+        shipped = steps_to_dicts(steps)
+        started = time.perf_counter()
+
+        assigned: Dict[int, str] = {}
+        for address, shard in zip(self.workers, partition_contexts(contexts, len(self.workers))):
+            assigned.update((index, address) for index, _ in shard)
+            self.transport.send(address, {"type": "program", "job": job_id, "steps": shipped})
+            if shard:
+                self.transport.send(address, {"type": "items", "job": job_id, "items": shard})
+            self.transport.send(address, {"type": "done", "job": job_id})
+
+        results: List[Optional[RunResult]] = [None] * len(contexts)
+        per_worker: Dict[str, WorkerStats] = {}
+        timed_out: List[str] = []
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+        while len(per_worker) < len(self.workers):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            msg = self.transport.recv(COORDINATOR_ADDRESS, timeout=remaining)
+            if msg is None:
+                timed_out = sorted(set(self.workers) - set(per_worker))
+                break
+            if msg.get("job") != job_id:
+                continue
+            if msg["type"] == "result":
+                results[msg["index"]] = RunResult(**msg["result"])
+            elif msg["type"] == "finished":
+                per_worker[msg["worker"]] = WorkerStats(**msg["stats"])
+        for index, result in enumerate(results):
+            if result is None:
+                # The worker timed out or finished without a result for this item
+                # (e.g. its send failed).
+                error = "no result received from the worker"
+                if assigned[index] in timed_out:
+                    error = f"worker {assigned[index]!r} did not finish within {timeout_s}s"
+                results[index] = RunResult(
+                    ok=False,
+                    outputs=[],
+                    logs=[],
+                    vars_after=dict(contexts[index]),
+                    parsed_steps=[],
+                    error=error,
+                )
+
+        merged = WorkerStats()
+        for worker_stats in per_worker.values():
+            merged.add(worker_stats)
+        return BatchOutcome(
+            results=results,
+            stats=merged,
+            per_worker=per_worker,
+            wall_s=time.perf_counter() - started,
+            timed_out=timed_out,
+        )
+
+
+def run_local_cluster(
+    program: str,
+    contexts: List[Dict[str, Any]],
+    workers: int = 2,
+    call_model: Optional[ModelCall] = None,
+    transport: Optional[Transport] = None,
+    concurrency_per_worker: int = 1,
+) -> BatchOutcome:
+    """Run coordinator and worker nodes as threads of this process (local stand-in)."""
+    transport = transport or LocalQueueTransport()
+    addresses = [f"worker-{i}" for i in range(max(1, workers))]
+    threads = [
+        threading.Thread(
+            target=run_worker_node,
+            args=(transport, address, call_model, concurrency_per_worker),
+            daemon=True,
+        )
+        for address in addresses
+    ]
+    for t in threads:
+        t.start()
+    outcome = Coordinator(transport, addresses).run(program, contexts)
+    for t in threads:
+        t.join()
+    return outcome
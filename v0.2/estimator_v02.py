@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import json
+import math
+import statistics
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Mapping, Optional
+
+from common_v02 import step_label, write_json_atomic
+from executor_v02 import DEFAULT_MAP_WORKERS, build_step_prompt, map_element_step
+from fusion_v02 import sees_run_history, step_reads
+from parser_v02 import BUILTIN_VARS, MAP_ITEM_VAR, Step, list_item_type
+from router_v02 import step_key
+from tokens_v02 import TokenCounter, count_tokens
+
+
+_DEFAULT_HISTORY_SIZE = 50
+_DEFAULT_MAX_PROMPT_TOKENS = 32_000
+# Latency model used until a model has history: fixed overhead plus decoding time.
+_DEFAULT_BASE_LATENCY_S = 0.8
+_DEFAULT_OUTPUT_TOKENS_PER_S = 80.0
+_MIN_DECODE_S = 0.05
+# Typical sizes (tokens) of values that are not known before the run.
+_DEFAULT_VALUE_TOKENS = {"bool": 2, "int": 4, "float": 4, "str": 48, "nat": 256}
+_DEFAULT_LIST_ITEMS = 8
+_DEFAULT_OUT_TOKENS = 48
+_DEFAULT_OUT_INTENT_TOKENS = 256
+_ENVELOPE_TOKENS = 16
+_LABEL_CHARS = 60
+
+
+@dataclass(frozen=True)
+class ModelPricing:
+    """USD per million prompt / output tokens."""
+
+    input_per_1m: float
+    output_per_1m: float
+
+    def cost(self, prompt_tokens: int, output_tokens: int) -> float:
+        return (prompt_tokens * self.input_per_1m + output_tokens * self.output_per_1m) / 1_000_000
+
+
+# List prices of the models offered in the app; pass `pricing` to override or extend.
+DEFAULT_PRICING: Dict[str, ModelPricing] = {
+    "gemini-2.5-flash": ModelPricing(0.30, 2.50),
+    "gemini-3-flash-preview": ModelPricing(0.50, 3.00),
+    "gemini-3-pro-preview": ModelPricing(2.00, 12.00),
+}
+
+
+@dataclass(frozen=True)
+class StepSample:
+    latency_s: float
+    prompt_tokens: int
+    output_tokens: int
+
+
+@dataclass
+class _StepRecord:
+    samples: Deque[StepSample]
+    fanouts: Deque[int]
+
+
+class StepStatsHistory:
+    """
+    Per-model step latencies and token counts taken from execution logs,
+    optionally persisted as JSON (the app keeps one file per chat).
+    Steps are keyed by router_v02.step_key, so a step keeps its history when
+    other steps of the program change. /MAP steps record one sample per
+    element plus their fan-out; local, skipped, fused and resumed steps are
+    not recorded because their timings say nothing about a standalone call.
+    """
+
+    def __init__(self, path: Optional[Path | str] = None, max_samples: int = _DEFAULT_HISTORY_SIZE) -> None:
+        self.path = Path(path) if path is not None else None
+        self.max_samples = max(1, max_samples)
+        self._records: Dict[str, Dict[str, _StepRecord]] = {}
+        self._lock = threading.Lock()
+        if self.path is not None and self.path.exists():
+            loaded = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            for model, steps in (loaded if isinstance(loaded, dict) else {}).items():
+                for key, data in steps.items():
+                    record = self._record(model, key)
+                    record.samples.extend(StepSample(*sample) for sample in data.get("samples", []))
+                    record.fanouts.extend(data.get("fanouts", []))
+
+    def _record(self, model: str, key: str) -> _StepRecord:
+        steps = self._records.setdefault(model, {})
+        if key not in steps:
+            steps[key] = _StepRecord(deque(maxlen=self.max_samples), deque(maxlen=self.max_samples))
+        return steps[key]
+
+    def record(self, model: str, key: str, samples: List[StepSample], fanout: Optional[int] = None) -> None:
+        with self._lock:
+            record = self._record(model, key)
+            record.samples.extend(samples)
+            if fanout is not None:
+                record.fanouts.append(fanout)
+
+    def record_run(self, steps: List[Step], logs: List[Dict[str, Any]], model: str) -> int:
+        """Add the samples of one run's step logs; returns how many were added."""
+        by_index = {step.index: step for step in steps}
+        added = 0
+        for log in logs:
+            step = by_index.get(log["step_index"])
+            skip = ("skipped", "from_checkpoint", "fused_with", "call")
+            if step is None or any(log.get(name) for name in skip) or "elapsed_ms" not in log:
+                continue
+            routing = log.get("routing") or {}
+            step_model = routing.get("model_id") or model
+            map_log = log.get("map")
+            if map_log is not None:
+                samples = [
+                    StepSample(
+                        entry["elapsed_ms"] / 1000,
+                        count_tokens(entry["prompt"]),
+                        count_tokens(entry["raw_response"]),
+                    )
+                    for entry in map_log["elements"]
+                    if not entry.get("cached") and "elapsed_ms" in entry
+                ]
+                self.record(step_model, step_key(step), samples, fanout=map_log["items"])
+            else:
+                samples = [
+                    StepSample(
+                        log["elapsed_ms"] / 1000,
+                        count_tokens(log["prompt"]),
+                        count_tokens(log["raw_response"]),
+                    )
+                ]
+                self.record(step_model, step_key(step), samples)
+            added += len(samples)
+        if added:
+            self._save()
+        return added
+
+    def step_samples(self, model: str, key: str) -> List[StepSample]:
+        with self._lock:
+            record = self._records.get(model, {}).get(key)
+            return list(record.samples) if record is not None else []
+
+    def fanout(self, model: str, key: str) -> Optional[int]:
+        with self._lock:
+            record = self._records.get(model, {}).get(key)
+            if record is None or not record.fanouts:
+                return None
+            return int(statistics.median(record.fanouts))
+
+    def model_samples(self, model: str) -> List[StepSample]:
+        with self._lock:
+            return [sample for record in self._records.get(model, {}).values() for sample in record.samples]
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {
+                model: {
+                    key: {
+                        "samples": [[s.latency_s, s.prompt_tokens, s.output_tokens] for s in record.samples],
+                        "fanouts": list(record.fanouts),
+                    }
+                    for key, record in steps.items()
+                }
+                for model, steps in self._records.items()
+            }
+        write_json_atomic(self.path, data)
+
+
+@dataclass
+class StepEstimate:
+    step_index: int
+    line_no: int
+    label: str
+    # Model calls the step makes (0 for /CALL, one per element for /MAP).
+    calls: int
+    prompt_tokens: int
+    output_tokens: int
+    latency_s: float
+    cost_usd: Optional[float]
+    # "history" (this step on this model), "model" (calibrated on the model's
+    # other steps), "default" (no history) or "local" (/CALL).
+    source: str
+    depends_on: List[int] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RunEstimate:
+    model: Optional[str]
+    steps: List[StepEstimate]
+    prompt_tokens: int
+    output_tokens: int
+    cost_usd: Optional[float]
+    sequential_latency_s: float
+    # Longest dependency chain: the wall time if independent steps ran in parallel.
+    critical_path_latency_s: float
+    critical_path: List[int]
+    warnings: List[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _value_tokens(type_name: str) -> int:
+    item_type = list_item_type(type_name)
+    if item_type is not None:
+        return 2 + _DEFAULT_LIST_ITEMS * _DEFAULT_VALUE_TOKENS.get(item_type, 48)
+    return _DEFAULT_VALUE_TOKENS.get(type_name, 48)
+
+
+def _default_output_tokens(step: Step) -> int:
+    out_tokens = _DEFAULT_OUT_INTENT_TOKENS if step.out_text is not None else _DEFAULT_OUT_TOKENS
+    return _ENVELOPE_TOKENS + out_tokens + sum(_value_tokens(spec.value_type) for spec in step.defs)
+
+
+def _median(values: List[float]) -> float:
+    return float(statistics.median(values))
+
+
+def _decode_rate(samples: List[StepSample]) -> Optional[float]:
+    """Output tokens per second over a model's samples, after the fixed overhead."""
+    rates = [
+        s.output_tokens / max(s.latency_s - _DEFAULT_BASE_LATENCY_S, _MIN_DECODE_S)
+        for s in samples
+        if s.output_tokens > 0
+    ]
+    return _median(rates) if rates else None
+
+
+def estimate_run(
+    steps: List[Step],
+    context: Dict[str, Any],
+    model: Optional[str] = None,
+    history: Optional[StepStatsHistory] = None,
+    pricing: Optional[Mapping[str, ModelPricing]] = None,
+    map_workers: int = DEFAULT_MAP_WORKERS,
+    max_prompt_tokens: int = _DEFAULT_MAX_PROMPT_TOKENS,
+    builtin_tokens: Optional[Mapping[str, int]] = None,
+    token_counter: Optional[TokenCounter] = None,
+) -> RunEstimate:
+    """
+    Predict latency, tokens and cost of running `steps` on `model` before sending anything.
+    Prompts are built from the known context; values that earlier steps will
+    define are sized from their /TYPE, and @CHAT/@ALL from `builtin_tokens`.
+    A step with history on this model uses its median latency and output
+    size; otherwise latency is a fixed overhead plus decoding time, with the
+    decoding rate calibrated on the model's other steps when there are any.
+    Conditional steps are counted as taken. Steps whose prompt exceeds
+    `max_prompt_tokens` are flagged in `warnings`. Prompts are counted with
+    `token_counter`'s calibration for `model` when given (see tokens_v02).
+    """
+    prices = {**DEFAULT_PRICING, **(pricing or {})}
+    price = prices.get(model) if model is not None else None
+    model_key = model or "default"
+    model_samples = history.model_samples(model_key) if history is not None else []
+    decode_rate = _decode_rate(model_samples) or _DEFAULT_OUTPUT_TOKENS_PER_S
+    builtin_tokens = builtin_tokens or {}
+
+    estimates: List[StepEstimate] = []
+    warnings: List[str] = []
+    defined_by: Dict[str, int] = {}
+    pending_tokens: Dict[str, int] = {}
+    for step in steps:
+        where = f"Step {step.index} (line {step.start_line_no})"
+        reads = step_reads(step, set(defined_by))
+        depends_on = {defined_by[name] for name in reads if name in defined_by}
+        if sees_run_history(step):
+            depends_on.update(e.step_index for e in estimates)
+        notes: List[str] = []
+        if step.condition is not None:
+            keyword = "/UNLESS" if step.condition_negated else "/IF"
+            notes.append(f"runs only {keyword[1:].lower()} @{step.condition}")
+
+        fanout = 1
+        if step.call is not None:
+            estimate = StepEstimate(
+                step.index, step.start_line_no, step_label(step.text, _LABEL_CHARS), 0, 0, 0, 0.0, 0.0 if price else None, "local"
+            )
+        else:
+            prompt_step = step
+            prompt_context = {name: value for name, value in context.items() if name not in pending_tokens}
+            calls = 1
+            if step.map_over is not None:
+                prompt_step = map_element_step(step)
+                items = context.get(step.map_over) if step.map_over not in pending_tokens else None
+                if isinstance(items, list):
+                    calls = len(items)
+                    prompt_context[MAP_ITEM_VAR] = items[0] if items else ""
+                else:
+                    known_fanout = history.fanout(model_key, step_key(step)) if history is not None else None
+                    calls = known_fanout or _DEFAULT_LIST_ITEMS
+                    notes.append(f"fan-out unknown before the run; assumed {calls} item(s)")
+                    prompt_context[MAP_ITEM_VAR] = ""
+                fanout = calls
+                if step.from_vars is None or step.map_over not in step.from_vars:
+                    prompt_context.pop(step.map_over, None)
+                notes.append(f"{calls} element call(s), {max(1, map_workers)} at a time")
+
+            prompt_text = build_step_prompt(prompt_step, prompt_context)
+            prompt_tokens = token_counter.count(prompt_text, model) if token_counter else count_tokens(prompt_text)
+            unknown = sorted(name for name in reads if name in pending_tokens and name != step.map_over)
+            prompt_tokens += sum(pending_tokens[name] for name in unknown)
+            if step.map_over is not None and step.map_over in pending_tokens:
+                prompt_tokens += pending_tokens[step.map_over] // max(calls, 1)
+            for name in sorted(reads & BUILTIN_VARS):
+                if name in builtin_tokens:
+                    prompt_tokens += builtin_tokens[name]
+                else:
+                    notes.append(f"@{name} size unknown")
+            if step.from_vars is None and context:
+                notes.append(f"no /FROM: all {len(context)} context variable(s) are sent")
+
+            samples = history.step_samples(model_key, step_key(step)) if history is not None else []
+            if samples:
+                source = "history"
+                output_tokens = int(_median([s.output_tokens for s in samples]))
+                if unknown or (reads & BUILTIN_VARS):
+                    prompt_tokens = int(_median([s.prompt_tokens for s in samples]))
+                latency_s = _median([s.latency_s for s in samples])
+            else:
+                source = "model" if model_samples else "default"
+                output_tokens = _default_output_tokens(prompt_step)
+                latency_s = _DEFAULT_BASE_LATENCY_S + output_tokens / decode_rate
+
+            if prompt_tokens > max_prompt_tokens:
+                warnings.append(
+                    f"{where}: estimated prompt of ~{prompt_tokens:,} tokens exceeds {max_prompt_tokens:,}"
+                )
+            waves = math.ceil(calls / max(1, map_workers)) if step.map_over is not None else calls
+            estimate = StepEstimate(
+                step_index=step.index,
+                line_no=step.start_line_no,
+                label=step_label(step.text, _LABEL_CHARS),
+                calls=calls,
+                prompt_tokens=prompt_tokens * calls,
+                output_tokens=output_tokens * calls,
+                latency_s=round(latency_s * waves, 3),
+                cost_usd=price.cost(prompt_tokens * calls, output_tokens * calls) if price else None,
+                source=source,
+            )
+        estimate.depends_on = sorted(depends_on)
+        estimate.notes = notes
+        for spec in step.defs:
+            defined_by[spec.var_name] = step.index
+            if step.map_over is not None:
+                pending_tokens[spec.var_name] = 2 + fanout * _value_tokens(list_item_type(spec.value_type) or "str")
+            else:
+                pending_tokens[spec.var_name] = _value_tokens(spec.value_type)
+        estimates.append(estimate)
+
+    finish: Dict[int, float] = {}
+    previous: Dict[int, Optional[int]] = {}
+    for estimate in estimates:
+        before = max(estimate.depends_on, key=lambda index: finish[index], default=None)
+        finish[estimate.step_index] = estimate.latency_s + (finish[before] if before is not None else 0.0)
+        previous[estimate.step_index] = before
+    end = max(finish, key=finish.get, default=None)
+    critical_path: List[int] = []
+    while end is not None:
+        critical_path.insert(0, end)
+        end = previous[end]
+
+    return RunEstimate(
+        model=model,
+        steps=estimates,
+        prompt_tokens=sum(e.prompt_tokens for e in estimates),
+        output_tokens=sum(e.output_tokens for e in estimates),
+        cost_usd=round(sum(e.cost_usd or 0.0 for e in estimates), 6) if price else None,
+        sequential_latency_s=round(sum(e.latency_s for e in estimates), 3),
+        critical_path_latency_s=round(max(finish.values(), default=0.0), 3),
+        critical_path=critical_path,
+        warnings=warnings,
+    )
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import re
-from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import AbstractSet, Any, Callable, Dict, List, Optional, Protocol, Tuple, TypedDict
 
-from parser_v02 import Step
+from decoder_v02 import decode_json_response
+from parser_v02 import BUILTIN_VARS, MAP_ITEM_VAR, FromDescription, Step, list_item_type
 
 
 class ResponseSchema(TypedDict):
@@ -13,8 +18,90 @@ class ResponseSchema(TypedDict):
     required: List[str]
 
 
+# Callers may also accept `generation_config` (Gemini generationConfig fields)
+# and `cache_prefix` (a stable leading part of the prompt) keywords; each is
+# only passed when the corresponding execute_steps option is in use.
 ModelCall = Callable[[str, ResponseSchema], str]
+StepCallback = Callable[[Dict[str, Any]], None]
+
+
+class BuiltinValues(Protocol):
+    """Lazily computed built-in variables such as @CHAT / @ALL (see builtins_v02)."""
+
+    def names(self) -> AbstractSet[str]: ...
+
+    def resolve(self, name: str, context: Dict[str, Any]) -> str: ...
+
+    def record_step_output(self, out: str) -> None: ...
+
+
+class DescriptionRetriever(Protocol):
+    """Resolves v0.3 /FROM descriptions to relevant snippets (see search_index_v02)."""
+
+    def retrieve(self, description: str, scope_var: Optional[str], context: Dict[str, Any]) -> List[str]: ...
+
+    def record_commit(self, updates: Dict[str, Any]) -> None: ...
+
+
+class RouteDecision(Protocol):
+    call_model: ModelCall
+
+    def as_log(self) -> Dict[str, Any]: ...
+
+
+class StepRouter(Protocol):
+    """Chooses the model for each step and learns from the outcome (see router_v02)."""
+
+    def route(self, step: Step, prompt: str, response_schema: ResponseSchema) -> RouteDecision: ...
+
+    def observe(self, decision: RouteDecision, ok: bool, latency_s: float) -> None: ...
+
+    def escalate(self, decision: RouteDecision, error: Exception) -> Optional[RouteDecision]: ...
+
+
+class LocalFunctions(Protocol):
+    """In-process functions that /CALL steps run instead of a model call (see functions_v02)."""
+
+    def __contains__(self, name: object) -> bool: ...
+
+    def call(self, name: str, args: List[Any]) -> Any: ...
+
+
+class MapResultCache(Protocol):
+    """Validated per-element /MAP responses keyed by model, element prompt and config (see map_cache_v02)."""
+
+    def get(self, key: str) -> Optional[str]: ...
+
+    def put(self, key: str, response: str) -> None: ...
+
+
+class MapStepError(ValueError):
+    """A /MAP step with failing elements; nothing is committed for the step."""
+
+    def __init__(self, message: str, failures: Dict[int, str], completed: int) -> None:
+        super().__init__(message)
+        self.failures = failures
+        self.completed = completed
+
+
+class GenerationSettings(Protocol):
+    """Per-step generation settings such as maxOutputTokens (see generation_v02)."""
+
+    def config_for(self, step: Step, model: Optional[str] = None) -> Optional[Dict[str, Any]]: ...
+
+
+class PromptBudgeter(Protocol):
+    """Token limit checked on each prompt before it is sent (see budget_v02)."""
+
+    def fits(self, prompt: str) -> bool: ...
+
+    def fit(
+        self, step: Step, context: Dict[str, Any], build_prompt: Callable[[Dict[str, Any]], str]
+    ) -> Tuple[str, Optional[Dict[str, Any]]]: ...
+
+
 _REF_PATTERN = re.compile(r"@([A-Za-z_][A-Za-z0-9_]*)")
+_REFERENCE_HEADER = "Reference material:"
 
 
 def _render_value(value: Any) -> str:
@@ -43,41 +130,147 @@ def _resolve_accessible_inputs(step: Step, context: Dict[str, Any]) -> Dict[str,
     return {name: context[name] for name in step.from_vars if name in context}
 
 
-def build_step_prompt(step: Step, context: Dict[str, Any]) -> str:
-    accessible = _resolve_accessible_inputs(step, context)
+def step_embedded_refs(step: Step) -> set[str]:
+    """Variables referenced inline in the step text or its /AS descriptions."""
     embedded: set[str] = set()
     embedded.update(_extract_refs(step.text))
     for spec in step.defs:
         embedded.update(_extract_refs(spec.as_text or ""))
+    return embedded
+
+
+def step_builtin_refs(step: Step, builtins: Optional[BuiltinValues]) -> List[str]:
+    """Built-ins this step actually uses via /FROM or embedded references."""
+    if builtins is None:
+        return []
+    used = set(step.from_vars or []) | step_embedded_refs(step)
+    return sorted(used & set(builtins.names()))
+
+
+def _resolve_description(
+    desc: FromDescription,
+    context: Dict[str, Any],
+    builtins: Optional[BuiltinValues],
+    retriever: Optional[DescriptionRetriever],
+) -> List[str]:
+    if retriever is not None:
+        return retriever.retrieve(desc.text, desc.scope_var, context)
+    # Slow path without an index: hand the model the whole scope to search.
+    scope = desc.scope_var or "ALL"
+    if builtins is not None and scope in builtins.names():
+        return [builtins.resolve(scope, context)]
+    if scope in context:
+        return [_render_value(context[scope])]
+    return []
+
+
+def step_prompt_blocks(
+    step: Step,
+    context: Dict[str, Any],
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    reference_min_chars: Optional[int] = None,
+) -> List[str]:
+    """
+    Task blocks of a step prompt (instruction through output intent), without format rules.
+    With `reference_min_chars`, inputs at least that long (inline references
+    included) are moved into a leading "Reference material" block so the
+    prompt starts with a stable prefix.
+    """
+    accessible = _resolve_accessible_inputs(step, context)
+    # Built-ins are only materialized when referenced; a step without /FROM does
+    # not pull the whole history in implicitly.
+    for name in step_builtin_refs(step, builtins):
+        accessible[name] = builtins.resolve(name, context)
+    embedded = step_embedded_refs(step)
 
-    instruction = _interpolate(step.text, accessible).strip()
+    reference_inputs: List[str] = []
+    if reference_min_chars is not None:
+        reference_inputs = sorted(
+            name for name in accessible
+            if len(_render_value(accessible[name])) >= reference_min_chars
+        )
+    # Large values referenced inline stay as @name and are read from the reference block.
+    inline = {name: value for name, value in accessible.items() if name not in reference_inputs}
+
+    instruction = _interpolate(step.text, inline).strip()
     blocks: List[str] = [f"Instruction:\n{instruction}" if instruction else "Instruction:"]
+    if reference_inputs:
+        reference_lines = "\n".join(
+            f"- {name}: {_render_value(accessible[name])}" for name in reference_inputs
+        )
+        blocks.insert(0, f"{_REFERENCE_HEADER}\n{reference_lines}")
 
-    extra_inputs = [name for name in accessible if name not in embedded]
+    extra_inputs = [name for name in inline if name not in embedded]
     if extra_inputs:
         inputs_lines = "\n".join(
             f"- {name}: {_render_value(accessible[name])}" for name in extra_inputs
         )
         blocks.append(f"Inputs:\n{inputs_lines}")
 
+    if step.from_descriptions:
+        desc_blocks: List[str] = []
+        for desc in step.from_descriptions:
+            scope = f"@{desc.scope_var}" if desc.scope_var else "@ALL"
+            snippets = _resolve_description(desc, context, builtins, retriever)
+            body = "\n".join(f"  > {snip}" for snip in snippets) if snippets else "  (no matching content)"
+            desc_blocks.append(f"- {desc.text} (searched in {scope}):\n{body}")
+        blocks.append("Relevant context:\n" + "\n".join(desc_blocks))
+
     if step.defs:
         required_lines: List[str] = []
         for spec in step.defs:
-            desc = _interpolate(spec.as_text or spec.var_name, accessible)
+            desc = _interpolate(spec.as_text or spec.var_name, inline)
             required_lines.append(f"- {spec.var_name} ({spec.value_type}): {desc}")
         blocks.append("Required variables:\n" + "\n".join(required_lines))
 
     if step.out_text is not None:
         blocks.append(f"Output intent:\n{step.out_text}")
+    return blocks
+
+
+def build_step_prompt(
+    step: Step,
+    context: Dict[str, Any],
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    reference_min_chars: Optional[int] = None,
+) -> str:
+    blocks = step_prompt_blocks(
+        step, context, builtins=builtins, retriever=retriever, reference_min_chars=reference_min_chars
+    )
+
+    blocks.extend(_format_blocks(step))
+    return "\n\n".join(blocks).strip()
+
+
+def _budgeted_prompt(
+    step: Step,
+    context: Dict[str, Any],
+    budget: Optional[PromptBudgeter],
+    builtins: Optional[BuiltinValues],
+    retriever: Optional[DescriptionRetriever],
+    reference_min_chars: Optional[int],
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    def build(values: Dict[str, Any]) -> str:
+        return build_step_prompt(
+            step, values, builtins=builtins, retriever=retriever, reference_min_chars=reference_min_chars
+        )
+
+    if budget is None:
+        return build(context), None
+    return budget.fit(step, context, build)
+
 
-    blocks.append(
+def _format_blocks(step: Step) -> List[str]:
+    blocks = [
         "Output format requirements:\n"
         "- Respond with ONLY a JSON object.\n"
         "- Do not wrap JSON in markdown/code fences.\n"
         "- Keys required in every response: error, out.\n"
         "- error must be 0 or 1.\n"
         "- out must be a natural-language JSON string."
-    )
+    ]
     if step.defs:
         blocks.append(
             "Also include:\n"
@@ -90,7 +283,34 @@ def build_step_prompt(step: Step, context: Dict[str, Any]) -> str:
         )
     else:
         blocks.append('Example JSON shape:\n{"error": 0, "out": "done"}')
+    return blocks
+
+
+_REPAIR_RESPONSE_MAX_CHARS = 4000
 
+
+def build_repair_prompt(step: Step, response: str, error: Exception) -> str:
+    """
+    Short follow-up asking the model to fix a response that broke the contract.
+    It carries the step instruction, the validation error and the previous
+    response, but not the step inputs, so it stays small.
+    """
+    previous = response
+    if len(previous) > _REPAIR_RESPONSE_MAX_CHARS:
+        previous = previous[:_REPAIR_RESPONSE_MAX_CHARS] + "..."
+    blocks = [
+        "Your previous response to the task below did not match the required output format. "
+        "Return the corrected JSON object. Keep every value that was already valid.",
+        f"Task:\n{step.text.strip()}",
+        f"Validation error:\n{error}",
+        f"Previous response:\n{previous}",
+    ]
+    if step.defs:
+        required_lines = [
+            f"- {spec.var_name} ({spec.value_type}): {spec.as_text or spec.var_name}" for spec in step.defs
+        ]
+        blocks.append("Required variables:\n" + "\n".join(required_lines))
+    blocks.extend(_format_blocks(step))
     return "\n\n".join(blocks).strip()
 
 
@@ -107,6 +327,13 @@ def _schema_type_for_def(type_name: str) -> str:
     return "string"
 
 
+def _schema_for_def(type_name: str) -> Dict[str, Any]:
+    item_type = list_item_type(type_name)
+    if item_type is not None:
+        return {"type": "array", "items": {"type": _schema_type_for_def(item_type)}}
+    return {"type": _schema_type_for_def(type_name)}
+
+
 def build_response_schema(step: Step) -> ResponseSchema:
     props: Dict[str, Any] = {
         "error": {
@@ -122,7 +349,7 @@ def build_response_schema(step: Step) -> ResponseSchema:
         vars_props: Dict[str, Any] = {}
         vars_required: List[str] = []
         for spec in step.defs:
-            vars_props[spec.var_name] = {"type": _schema_type_for_def(spec.value_type)}
+            vars_props[spec.var_name] = _schema_for_def(spec.value_type)
             vars_required.append(spec.var_name)
 
         props["vars"] = {
@@ -149,9 +376,11 @@ def _default_stub_response(step: Step) -> str:
     return json.dumps(payload)
 
 
-def _parse_runtime_response(raw_response: str, step: Step) -> Dict[str, Any]:
+def _parse_runtime_response(
+    raw_response: str, step: Step, recoveries: Optional[List[str]] = None
+) -> Dict[str, Any]:
     try:
-        parsed = json.loads(raw_response)
+        parsed, recovery = decode_json_response(raw_response)
     except json.JSONDecodeError as exc:
         snippet = raw_response.strip().replace("\n", "\\n")
         if len(snippet) > 220:
@@ -159,6 +388,8 @@ def _parse_runtime_response(raw_response: str, step: Step) -> Dict[str, Any]:
         raise ValueError(
             f"Step {step.index} (line {step.start_line_no}): model response is not valid JSON. Raw response starts with: {snippet!r}"
         ) from exc
+    if recovery is not None and recoveries is not None:
+        recoveries.append(recovery)
 
     if not isinstance(parsed, dict):
         raise ValueError(
@@ -202,6 +433,42 @@ def _parse_runtime_response(raw_response: str, step: Step) -> Dict[str, Any]:
     return parsed
 
 
+_TYPE_LABELS = {
+    "nat": "nat (string)",
+    "str": "str (string)",
+    "int": "int",
+    "float": "float",
+    "bool": "bool",
+}
+
+
+def _type_label(type_name: str) -> Optional[str]:
+    t = type_name.lower()
+    item_type = list_item_type(t)
+    if item_type is not None:
+        return f"list of {_TYPE_LABELS[item_type]}" if item_type in _TYPE_LABELS else None
+    return _TYPE_LABELS.get(t)
+
+
+def value_matches_type(type_name: str, value: Any) -> bool:
+    """The /TYPE rules shared by model responses and local functions (see functions_v02)."""
+    t = type_name.lower()
+    if _type_label(t) is None:
+        raise ValueError(f"unsupported /TYPE '{type_name}'")
+    if value is None:
+        return False
+    item_type = list_item_type(t)
+    if item_type is not None:
+        return isinstance(value, list) and all(value_matches_type(item_type, item) for item in value)
+    if t in {"nat", "str"}:
+        return isinstance(value, str)
+    if t == "int":
+        return type(value) is int
+    if t == "float":
+        return type(value) in {int, float}
+    return type(value) is bool
+
+
 def _validate_def_value(step: Step, var_name: str, type_name: str, value: Any) -> None:
     if value is None:
         raise ValueError(
@@ -209,81 +476,643 @@ def _validate_def_value(step: Step, var_name: str, type_name: str, value: Any) -
         )
 
     t = type_name.lower()
-    if t in {"nat", "str"}:
-        if not isinstance(value, str):
-            raise ValueError(
-                f"Step {step.index} (line {step.start_line_no}): '{var_name}' expected {t} (string)"
-            )
-        return
+    label = _type_label(t)
+    if label is None:
+        raise ValueError(
+            f"Step {step.index} (line {step.start_line_no}): unsupported /TYPE '{type_name}'"
+        )
+    if not value_matches_type(t, value):
+        raise ValueError(
+            f"Step {step.index} (line {step.start_line_no}): '{var_name}' expected {label}"
+        )
 
-    if t == "int":
-        if type(value) is not int:
-            raise ValueError(
-                f"Step {step.index} (line {step.start_line_no}): '{var_name}' expected int"
-            )
-        return
 
-    if t == "float":
-        if type(value) not in {int, float}:
-            raise ValueError(
-                f"Step {step.index} (line {step.start_line_no}): '{var_name}' expected float"
+def validate_step_response(
+    step: Step, response: str, recoveries: Optional[List[str]] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Check one raw response against the step contract; returns (parsed, staged /DEF values).
+    A response that needed a decoder recovery (see decoder_v02) appends its name to `recoveries`.
+    """
+    parsed = _parse_runtime_response(response, step, recoveries)
+
+    staged_updates: Dict[str, Any] = {}
+    if step.defs:
+        vars_payload = parsed["vars"]
+        for spec in step.defs:
+            value = vars_payload[spec.var_name]
+            _validate_def_value(step, spec.var_name, spec.value_type, value)
+            staged_updates[spec.var_name] = value
+    return parsed, staged_updates
+
+
+def reference_prefix(prompt: str) -> Optional[str]:
+    """The leading "Reference material" block of a prompt (with its separator), if any."""
+    if not prompt.startswith(_REFERENCE_HEADER):
+        return None
+    end = prompt.find("\n\nInstruction:")
+    return prompt[: end + 2] if end != -1 else None
+
+
+def invoke_model(
+    call_model: ModelCall,
+    prompt: str,
+    response_schema: ResponseSchema,
+    generation_config: Optional[Dict[str, Any]] = None,
+    cache_prefix: Optional[str] = None,
+) -> str:
+    extra: Dict[str, Any] = {}
+    if generation_config:
+        extra["generation_config"] = generation_config
+    if cache_prefix:
+        extra["cache_prefix"] = cache_prefix
+    return call_model(prompt, response_schema, **extra)
+
+
+def validate_with_repairs(
+    step: Step,
+    response: str,
+    repair: Optional[Callable[[str], str]],
+    repair_attempts: int,
+    repairs: List[Dict[str, Any]],
+    recoveries: Optional[List[str]] = None,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    """
+    Validate a response, sending up to `repair_attempts` repair prompts through
+    `repair` (prompt -> raw response) when it breaks the contract.
+    Only contract violations (ValueError) are repaired; error=1 is the model's
+    own verdict and is raised as is. Each failed attempt is appended to `repairs`;
+    the decoder recovery of the accepted response, if any, to `recoveries`.
+    """
+    while True:
+        attempt_recoveries: List[str] = []
+        try:
+            parsed, staged_updates = validate_step_response(step, response, attempt_recoveries)
+            if recoveries is not None:
+                recoveries.extend(attempt_recoveries)
+            return response, parsed, staged_updates
+        except ValueError as exc:
+            if repair is None or len(repairs) >= repair_attempts:
+                if repairs:
+                    raise ValueError(f"{exc} (after {len(repairs)} repair attempt(s))") from exc
+                raise
+            repair_prompt = build_repair_prompt(step, response, exc)
+            repairs.append({"error": str(exc), "raw_response": response, "repair_prompt": repair_prompt})
+            response = repair(repair_prompt)
+
+
+def _call_and_validate(
+    step: Step,
+    prompt: str,
+    response_schema: ResponseSchema,
+    call_model: Optional[ModelCall],
+    generation_config: Optional[Dict[str, Any]] = None,
+    cache_prefix: Optional[str] = None,
+    repair_attempts: int = 0,
+    repairs: Optional[List[Dict[str, Any]]] = None,
+    recoveries: Optional[List[str]] = None,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    if call_model is None:
+        response = _default_stub_response(step)
+        return (response, *validate_step_response(step, response))
+    response = invoke_model(call_model, prompt, response_schema, generation_config, cache_prefix)
+    return validate_with_repairs(
+        step,
+        response,
+        lambda repair_prompt: invoke_model(call_model, repair_prompt, response_schema, generation_config),
+        repair_attempts,
+        repairs if repairs is not None else [],
+        recoveries,
+    )
+
+
+def _generation_config(
+    generation: Optional[GenerationSettings], step: Step, model_id: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    if generation is None:
+        return None
+    if model_id is None:
+        return generation.config_for(step)
+    return generation.config_for(step, model=model_id)
+
+
+def _routed_call(
+    step: Step,
+    prompt: str,
+    response_schema: ResponseSchema,
+    router: StepRouter,
+    generation: Optional[GenerationSettings] = None,
+    cache_prefix: Optional[str] = None,
+    repair_attempts: int = 0,
+    repairs: Optional[List[Dict[str, Any]]] = None,
+    recoveries: Optional[List[str]] = None,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    decision = router.route(step, prompt, response_schema)
+    failed_attempts: List[Dict[str, Any]] = []
+    repairs = repairs if repairs is not None else []
+    while True:
+        # Thinking and temperature defaults differ per model, so each route gets its own config.
+        generation_config = _generation_config(generation, step, decision.as_log().get("model_id"))
+        started = time.monotonic()
+        try:
+            response = invoke_model(
+                decision.call_model, prompt, response_schema, generation_config, cache_prefix
             )
-        return
+        except Exception:
+            router.observe(decision, False, time.monotonic() - started)
+            raise
+        route_model = decision.call_model
+        try:
+            # Repairs stay on the routed model; escalation only follows once they run out.
+            response, parsed, staged_updates = validate_with_repairs(
+                step,
+                response,
+                lambda repair_prompt: invoke_model(route_model, repair_prompt, response_schema, generation_config),
+                repair_attempts,
+                repairs,
+                recoveries,
+            )
+        except (ValueError, RuntimeError) as exc:
+            # Contract failure (bad JSON, missing vars, type mismatch, error=1):
+            # the router may retry the same step on a stronger model.
+            router.observe(decision, False, time.monotonic() - started)
+            escalated = router.escalate(decision, exc)
+            if escalated is None:
+                raise
+            failed = {**decision.as_log(), "error": str(exc), "raw_response": response}
+            if generation_config:
+                failed["generation_config"] = generation_config
+            if repairs:
+                # The step's "repairs" are the accepted route's; keep these with their route.
+                failed["repairs"] = list(repairs)
+            failed_attempts.append(failed)
+            repairs.clear()
+            decision = escalated
+            continue
+        router.observe(decision, True, time.monotonic() - started)
+        routing = decision.as_log()
+        if generation_config:
+            routing["generation_config"] = generation_config
+        if failed_attempts:
+            routing["escalated_from"] = failed_attempts
+        return response, parsed, staged_updates, routing
 
-    if t == "bool":
-        if type(value) is not bool:
+
+def check_local_functions(steps: List[Step], functions: Optional[LocalFunctions]) -> None:
+    for st in steps:
+        if st.call is not None and (functions is None or st.call not in functions):
             raise ValueError(
-                f"Step {step.index} (line {step.start_line_no}): '{var_name}' expected bool"
+                f"Step {st.index} (line {st.start_line_no}): unknown function '{st.call}' in /CALL"
             )
-        return
 
-    raise ValueError(
-        f"Step {step.index} (line {step.start_line_no}): unsupported /TYPE '{type_name}'"
+
+def _run_local_function(
+    step: Step,
+    context: Dict[str, Any],
+    builtins: Optional[BuiltinValues],
+    functions: LocalFunctions,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Run a /CALL step: /FROM values are the positional arguments, the result fills the /DEFs."""
+    where = f"Step {step.index} (line {step.start_line_no})"
+    arg_names = list(step.from_vars or [])
+    args: List[Any] = []
+    for name in arg_names:
+        if builtins is not None and name in builtins.names():
+            args.append(builtins.resolve(name, context))
+        elif name in context:
+            args.append(context[name])
+        else:
+            raise ValueError(f"{where}: /CALL argument @{name} has no value")
+
+    started = time.perf_counter()
+    try:
+        result = functions.call(step.call, args)
+    except ValueError as exc:
+        raise ValueError(f"{where}: /CALL {step.call}: {exc}") from exc
+    except Exception as exc:
+        raise RuntimeError(f"{where}: /CALL {step.call} failed: {exc}") from exc
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    staged_updates: Dict[str, Any] = {}
+    if step.defs:
+        if len(step.defs) == 1 and not isinstance(result, dict):
+            result = {step.defs[0].var_name: result}
+        if not isinstance(result, dict):
+            raise ValueError(f"{where}: /CALL {step.call} must return an object keyed by /DEF names")
+        missing = [spec.var_name for spec in step.defs if spec.var_name not in result]
+        if missing:
+            raise ValueError(f"{where}: /CALL {step.call} result is missing /DEF values: {missing}")
+        for spec in step.defs:
+            _validate_def_value(step, spec.var_name, spec.value_type, result[spec.var_name])
+            staged_updates[spec.var_name] = result[spec.var_name]
+
+    out = "; ".join(f"{name} = {_render_value(value)}" for name, value in staged_updates.items())
+    parsed: Dict[str, Any] = {"error": 0, "out": out or f"{step.call} done"}
+    if step.defs:
+        parsed["vars"] = dict(staged_updates)
+    call_log = {"function": step.call, "args": arg_names, "elapsed_ms": round(elapsed_ms, 3)}
+    return json.dumps(parsed, ensure_ascii=False), parsed, staged_updates, call_log
+
+
+def condition_holds(step: Step, context: Dict[str, Any]) -> bool:
+    """Evaluate a step's /IF or /UNLESS flag against the committed context."""
+    if step.condition is None:
+        return True
+    keyword = "/UNLESS" if step.condition_negated else "/IF"
+    where = f"Step {step.index} (line {step.start_line_no})"
+    if step.condition not in context:
+        raise ValueError(f"{where}: {keyword} @{step.condition} has no value (its defining step was skipped)")
+    value = context[step.condition]
+    if type(value) is not bool:
+        raise ValueError(f"{where}: {keyword} @{step.condition} must be a bool")
+    return value is not step.condition_negated
+
+
+def check_step_inputs(step: Step, context: Dict[str, Any]) -> None:
+    """
+    Fail a step whose /FROM, /IN or /MAP variable has no value.
+    The parser only admits variables defined by earlier steps, so at run time
+    this means every step defining it was skipped by /IF or /UNLESS.
+    """
+    reads = list(step.from_vars or [])
+    reads.extend(desc.scope_var for desc in step.from_descriptions if desc.scope_var)
+    if step.map_over is not None:
+        reads.append(step.map_over)
+    missing = sorted({name for name in reads if name not in context and name not in BUILTIN_VARS})
+    if missing:
+        names = ", ".join(f"@{name}" for name in missing)
+        raise ValueError(
+            f"Step {step.index} (line {step.start_line_no}): {names} has no value (its defining step was skipped)"
+        )
+
+
+def skipped_step_log(step: Step) -> Dict[str, Any]:
+    """Log of a step whose /IF or /UNLESS condition did not hold; nothing was sent or committed."""
+    keyword = "/UNLESS" if step.condition_negated else "/IF"
+    return {
+        "step_index": step.index,
+        "start_line_no": step.start_line_no,
+        "text": step.text,
+        "prompt": None,
+        "response_schema": None,
+        "raw_response": None,
+        "parsed_json": {"error": 0, "out": ""},
+        "staged_updates": {},
+        "skipped": {"condition": f"{keyword} @{step.condition}", "value": step.condition_negated},
+    }
+
+
+DEFAULT_MAP_WORKERS = 4
+
+
+def map_element_step(step: Step) -> Step:
+    """The per-element form of a /MAP step: element-typed /DEFs and @ITEM as an input."""
+    return replace(
+        step,
+        defs=[replace(spec, value_type=list_item_type(spec.value_type) or spec.value_type) for spec in step.defs],
+        from_vars=step.from_vars + [MAP_ITEM_VAR] if step.from_vars is not None else None,
+        map_over=None,
     )
 
 
+def map_element_key(
+    prompt: str,
+    response_schema: ResponseSchema,
+    model_id: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> str:
+    digest = hashlib.sha256()
+    for part in (
+        model_id or "",
+        prompt,
+        json.dumps(response_schema, sort_keys=True),
+        json.dumps(generation_config or {}, sort_keys=True),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _route_model_ids(router: StepRouter) -> List[str]:
+    routes = getattr(router, "routes", None) or []
+    return [getattr(route, "model_id", None) or getattr(route, "name", "") for route in routes]
+
+
+def _caller_model_id(call_model: Optional[ModelCall], router: Optional[StepRouter]) -> Optional[str]:
+    # Wrapped callers (coalescing) and router routes carry the model they call.
+    if router is not None:
+        ids = _route_model_ids(router)
+        return "routes:" + ",".join(ids) if ids else None
+    return getattr(call_model, "model_id", None)
+
+
+def _run_map_step(
+    step: Step,
+    context: Dict[str, Any],
+    call_model: Optional[ModelCall],
+    builtins: Optional[BuiltinValues],
+    retriever: Optional[DescriptionRetriever],
+    router: Optional[StepRouter],
+    generation: Optional[GenerationSettings],
+    reference_min_chars: Optional[int],
+    repair_attempts: int,
+    map_workers: int,
+    map_cache: Optional[MapResultCache],
+    budget: Optional[PromptBudgeter] = None,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any], ResponseSchema, Dict[str, Any]]:
+    """
+    Run a /MAP step once per element of its list variable, `map_workers` at a time.
+    Element prompts are built up front in order; only the model calls run
+    concurrently. Results keep input order. Any failing element fails the
+    step with a MapStepError listing every failed element.
+    """
+    where = f"Step {step.index} (line {step.start_line_no})"
+    items = context.get(step.map_over)
+    if not isinstance(items, list):
+        raise ValueError(f"{where}: /MAP @{step.map_over} must be a list")
+    element_step = map_element_step(step)
+    response_schema = build_response_schema(element_step)
+    # Routed elements get their config per route (logged under "routing"); the
+    # cache key then covers every route's config, since any route may answer.
+    generation_config = _generation_config(generation, element_step) if router is None else None
+    key_config = generation_config
+    if router is not None and generation is not None:
+        key_config = {
+            model_id: _generation_config(generation, element_step, model_id)
+            for model_id in _route_model_ids(router)
+        }
+    # Each element sees the context without the whole list, unless /FROM asks for it.
+    base = {
+        name: value
+        for name, value in context.items()
+        if name != step.map_over or name in (step.from_vars or [])
+    }
+    budgeted = [
+        _budgeted_prompt(
+            element_step, {**base, MAP_ITEM_VAR: item}, budget, builtins, retriever, reference_min_chars
+        )
+        for item in items
+    ]
+    prompts = [prompt for prompt, _ in budgeted]
+    use_cache = map_cache is not None and (call_model is not None or router is not None)
+    model_id = _caller_model_id(call_model, router) if use_cache else None
+
+    def run_element(position: int) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        prompt = prompts[position]
+        entry: Dict[str, Any] = {"index": position, "prompt": prompt}
+        if budgeted[position][1] is not None:
+            entry["budget"] = budgeted[position][1]
+        started = time.perf_counter()
+        key = map_element_key(prompt, response_schema, model_id, key_config)
+        if use_cache:
+            cached = map_cache.get(key)
+            if cached is not None:
+                try:
+                    parsed, staged_updates = validate_step_response(element_step, cached)
+                except (ValueError, RuntimeError):
+                    pass
+                else:
+                    entry.update(raw_response=cached, cached=True)
+                    return entry, parsed, staged_updates
+        cache_prefix = reference_prefix(prompt) if reference_min_chars is not None else None
+        repairs: List[Dict[str, Any]] = []
+        recoveries: List[str] = []
+        if router is not None:
+            response, parsed, staged_updates, entry["routing"] = _routed_call(
+                element_step,
+                prompt,
+                response_schema,
+                router,
+                generation,
+                cache_prefix,
+                repair_attempts,
+                repairs,
+                recoveries,
+            )
+        else:
+            response, parsed, staged_updates = _call_and_validate(
+                element_step,
+                prompt,
+                response_schema,
+                call_model,
+                generation_config,
+                cache_prefix,
+                repair_attempts,
+                repairs,
+                recoveries,
+            )
+        if use_cache:
+            map_cache.put(key, response)
+        entry.update(raw_response=response, cached=False)
+        entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        if repairs:
+            entry["repairs"] = repairs
+        if recoveries:
+            entry["decode_recovery"] = recoveries[-1]
+        return entry, parsed, staged_updates
+
+    workers = max(1, min(map_workers, len(items)))
+    results: List[Optional[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]]] = [None] * len(items)
+    failures: Dict[int, str] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spl-map-step") as pool:
+            futures = [pool.submit(run_element, position) for position in range(len(items))]
+            for position, future in enumerate(futures):
+                try:
+                    results[position] = future.result()
+                except Exception as exc:
+                    failures[position] = str(exc).replace(f"{where}: ", "", 1)
+    finally:
+        # Persistent caches batch their writes; settle them once per step.
+        flush = getattr(map_cache, "flush", None) if use_cache else None
+        if callable(flush):
+            flush()
+    if failures:
+        details = "; ".join(f"[{position}] {error}" for position, error in sorted(failures.items()))
+        raise MapStepError(
+            f"{where}: /MAP @{step.map_over} failed for {len(failures)} of {len(items)} item(s): {details}",
+            failures=failures,
+            completed=len(items) - len(failures),
+        )
+
+    staged_updates = {
+        spec.var_name: [result[2][spec.var_name] for result in results] for spec in step.defs
+    }
+    parsed: Dict[str, Any] = {"error": 0, "out": "\n".join(result[1]["out"] for result in results)}
+    if step.defs:
+        parsed["vars"] = dict(staged_updates)
+    elements = [result[0] for result in results]
+    map_log: Dict[str, Any] = {
+        "over": step.map_over,
+        "items": len(items),
+        "workers": workers,
+        "cached": sum(1 for entry in elements if entry["cached"]),
+        "elements": elements,
+    }
+    if generation_config:
+        map_log["generation_config"] = generation_config
+    raw_response = json.dumps([entry["raw_response"] for entry in elements], ensure_ascii=False)
+    return raw_response, parsed, staged_updates, response_schema, map_log
+
+
 def execute_steps(
     steps: List[Step],
     context: Dict[str, Any],
     call_model: Optional[ModelCall] = None,
+    on_step: Optional[StepCallback] = None,
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    router: Optional[StepRouter] = None,
+    generation: Optional[GenerationSettings] = None,
+    reference_min_chars: Optional[int] = None,
+    repair_attempts: int = 0,
+    functions: Optional[LocalFunctions] = None,
+    map_workers: int = DEFAULT_MAP_WORKERS,
+    map_cache: Optional[MapResultCache] = None,
+    budget: Optional[PromptBudgeter] = None,
 ) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
-    """Execute steps with prompt construction and model-call injection support."""
+    """
+    Execute steps with prompt construction and model-call injection support.
+    `on_step` receives each step log right after that step commits.
+    `builtins` supplies @CHAT/@ALL values for steps that reference them.
+    `retriever` narrows /FROM descriptions to relevant snippets and is told
+    about every commit so it can index new variable values.
+    `router` picks the model per step instead of `call_model` and may escalate
+    a step whose response breaks the contract; its decisions are recorded in
+    the step log under "routing".
+    `generation` supplies per-step generation settings, passed to the model
+    call as `generation_config` and logged under "generation_config".
+    `reference_min_chars` lays prompts out with large inputs first and passes
+    that block to the model call as `cache_prefix` (see context_cache_v02).
+    `repair_attempts` lets a step whose response breaks the contract send up
+    to that many short follow-ups with the validation error before the run
+    fails; the failed attempts are logged under "repairs".
+    Fenced, prose-wrapped or trailing-comma JSON is recovered without another
+    call (see decoder_v02); the recovery used is logged under "decode_recovery".
+    `functions` runs /CALL steps in-process instead of calling the model; their
+    results pass the same /TYPE checks and atomic commit, and the call is
+    logged under "call". Unknown functions fail before any step runs.
+    /MAP steps run once per list element with up to `map_workers` concurrent
+    model calls; `map_cache` reuses validated element responses across runs.
+    The per-element prompts and responses are logged under "map".
+    A step whose /IF or /UNLESS condition does not hold is skipped before its
+    prompt is built: it commits nothing, its output is empty and its log has
+    "skipped". Reading a variable that only a skipped step defines is an error.
+    `budget` checks every prompt against a token limit before it is sent and
+    may warn, fail the step, or trim its lowest-priority inputs; what it did
+    is logged under "budget" (per element for /MAP steps).
+    """
     logs: List[Dict[str, Any]] = []
     visible_outputs: List[str] = []
 
+    check_local_functions(steps, functions)
     for st in steps:
-        prompt = build_step_prompt(st, context)
-        response_schema = build_response_schema(st)
-        if call_model is None:
-            response = _default_stub_response(st)
+        if not condition_holds(st, context):
+            step_log = skipped_step_log(st)
+            visible_outputs.append("")
+            logs.append(step_log)
+            if on_step is not None:
+                on_step(step_log)
+            continue
+        check_step_inputs(st, context)
+        started = time.perf_counter()
+        routing: Optional[Dict[str, Any]] = None
+        repairs: List[Dict[str, Any]] = []
+        recoveries: List[str] = []
+        generation_config: Optional[Dict[str, Any]] = None
+        call_log: Optional[Dict[str, Any]] = None
+        map_log: Optional[Dict[str, Any]] = None
+        budget_log: Optional[Dict[str, Any]] = None
+        prompt: Optional[str] = None
+        response_schema: Optional[ResponseSchema] = None
+        if st.call is not None:
+            response, parsed, staged_updates, call_log = _run_local_function(st, context, builtins, functions)
+        elif st.map_over is not None:
+            response, parsed, staged_updates, response_schema, map_log = _run_map_step(
+                st,
+                context,
+                call_model,
+                builtins,
+                retriever,
+                router,
+                generation,
+                reference_min_chars,
+                repair_attempts,
+                map_workers,
+                map_cache,
+                budget,
+            )
         else:
-            response = call_model(prompt, response_schema)
-
-        parsed = _parse_runtime_response(response, st)
+            prompt, budget_log = _budgeted_prompt(st, context, budget, builtins, retriever, reference_min_chars)
+            cache_prefix = reference_prefix(prompt) if reference_min_chars is not None else None
+            response_schema = build_response_schema(st)
+            if router is not None:
+                response, parsed, staged_updates, routing = _routed_call(
+                    st,
+                    prompt,
+                    response_schema,
+                    router,
+                    generation,
+                    cache_prefix,
+                    repair_attempts,
+                    repairs,
+                    recoveries,
+                )
+                generation_config = routing.get("generation_config")
+            else:
+                generation_config = _generation_config(generation, st)
+                response, parsed, staged_updates = _call_and_validate(
+                    st,
+                    prompt,
+                    response_schema,
+                    call_model,
+                    generation_config,
+                    cache_prefix,
+                    repair_attempts,
+                    repairs,
+                    recoveries,
+                )
 
-        staged_updates: Dict[str, Any] = {}
-        if st.defs:
-            vars_payload = parsed["vars"]
-            for spec in st.defs:
-                value = vars_payload[spec.var_name]
-                _validate_def_value(st, spec.var_name, spec.value_type, value)
-                staged_updates[spec.var_name] = value
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
 
         # Commit only after all values in this step are validated.
         context.update(staged_updates)
+        if retriever is not None and staged_updates:
+            retriever.record_commit(staged_updates)
 
         visible_outputs.append(parsed["out"])
-        logs.append(
-            {
-                "step_index": st.index,
-                "start_line_no": st.start_line_no,
-                "text": st.text,
-                "prompt": prompt,
-                "response_schema": response_schema,
-                "raw_response": response,
-                "parsed_json": parsed,
-                "staged_updates": staged_updates,
-            }
-        )
+        step_log = {
+            "step_index": st.index,
+            "start_line_no": st.start_line_no,
+            "text": st.text,
+            "prompt": prompt,
+            "response_schema": response_schema,
+            "raw_response": response,
+            "parsed_json": parsed,
+            "staged_updates": staged_updates,
+            "elapsed_ms": elapsed_ms,
+        }
+        if generation_config:
+            step_log["generation_config"] = generation_config
+        if routing is not None:
+            step_log["routing"] = routing
+        if repairs:
+            step_log["repairs"] = repairs
+        if recoveries:
+            step_log["decode_recovery"] = recoveries[-1]
+        if call_log is not None:
+            step_log["call"] = call_log
+        if map_log is not None:
+            step_log["map"] = map_log
+        if budget_log is not None:
+            step_log["budget"] = budget_log
+        used_builtins = step_builtin_refs(st, builtins)
+        if used_builtins:
+            step_log["builtins_used"] = used_builtins
+        if builtins is not None:
+            builtins.record_step_output(parsed["out"])
+        logs.append(step_log)
+        if on_step is not None:
+            on_step(step_log)
 
     return context, logs, visible_outputs
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from executor_v02 import value_matches_type
+
+
+@dataclass(frozen=True)
+class LocalFunction:
+    """
+    A Python callable usable as a /CALL step.
+    `input_types` are the /TYPE names of the positional arguments (the step's
+    /FROM variables, in order); `varargs_type` types any further arguments.
+    A type may list alternatives separated by `|` (e.g. `str|list[str]`).
+    Without `input_types` the arguments are passed through unchecked.
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    input_types: Optional[Tuple[str, ...]] = None
+    varargs_type: Optional[str] = None
+    description: str = ""
+
+    def check_args(self, args: Sequence[Any]) -> None:
+        if self.input_types is None:
+            return
+        fixed = len(self.input_types)
+        if len(args) < fixed or (self.varargs_type is None and len(args) > fixed):
+            expected = f"{fixed}+" if self.varargs_type is not None else str(fixed)
+            raise ValueError(f"takes {expected} argument(s), got {len(args)}")
+        for position, value in enumerate(args, start=1):
+            type_name = self.input_types[position - 1] if position <= fixed else self.varargs_type
+            if not any(value_matches_type(option, value) for option in type_name.split("|")):
+                raise ValueError(f"argument {position} expected {type_name}")
+
+
+class FunctionRegistry:
+    """Named local functions for /CALL steps; pass it to execute_steps as `functions`."""
+
+    def __init__(self, functions: Iterable[LocalFunction] = ()) -> None:
+        self._functions: Dict[str, LocalFunction] = {}
+        for function in functions:
+            self._functions[function.name] = function
+
+    def register(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        input_types: Optional[Sequence[str]] = None,
+        varargs_type: Optional[str] = None,
+        description: str = "",
+    ) -> LocalFunction:
+        function = LocalFunction(
+            name=name,
+            fn=fn,
+            input_types=tuple(t.lower() for t in input_types) if input_types is not None else None,
+            varargs_type=varargs_type.lower() if varargs_type is not None else None,
+            description=description,
+        )
+        self._functions[name] = function
+        return function
+
+    def function(
+        self,
+        name: Optional[str] = None,
+        input_types: Optional[Sequence[str]] = None,
+        varargs_type: Optional[str] = None,
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Decorator form of `register`; the function name is the default /CALL name."""
+
+        def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+            self.register(
+                name or fn.__name__,
+                fn,
+                input_types=input_types,
+                varargs_type=varargs_type,
+                description=(fn.__doc__ or "").strip(),
+            )
+            return fn
+
+        return decorate
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._functions
+
+    def names(self) -> List[str]:
+        return sorted(self._functions)
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": f.name,
+                "input_types": list(f.input_types) if f.input_types is not None else None,
+                "varargs_type": f.varargs_type,
+                "description": f.description,
+            }
+            for f in sorted(self._functions.values(), key=lambda f: f.name)
+        ]
+
+    def call(self, name: str, args: List[Any]) -> Any:
+        function = self._functions.get(name)
+        if function is None:
+            raise ValueError(f"unknown function '{name}'")
+        function.check_args(args)
+        return function.fn(*args)
+
+
+def _count_lines(text: str) -> int:
+    return sum(1 for line in text.splitlines() if line.strip())
+
+
+def _split_lines(text: str) -> List[str]:
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def default_functions() -> FunctionRegistry:
+    """A fresh registry with small text and number transforms."""
+    registry = FunctionRegistry()
+    variadic = [
+        ("concat", lambda *parts: "".join(parts), "str", "Join strings without a separator."),
+        ("join_lines", lambda *parts: "\n".join(parts), "str", "Join strings with newlines."),
+        ("sum", lambda *values: sum(values), "float", "Add numbers."),
+    ]
+    for name, fn, varargs_type, description in variadic:
+        registry.register(name, fn, input_types=(), varargs_type=varargs_type, description=description)
+    registry.register(
+        "length",
+        len,
+        input_types=("str|list[str]|list[int]|list[float]|list[bool]",),
+        description="Number of characters, or of items in a list.",
+    )
+    unary = [
+        ("count_lines", _count_lines, "Number of non-blank lines."),
+        ("count_words", lambda text: len(text.split()), "Number of words."),
+        ("upper", str.upper, "Uppercase text."),
+        ("lower", str.lower, "Lowercase text."),
+        ("strip", str.strip, "Trim surrounding whitespace."),
+    ]
+    for name, fn, description in unary:
+        registry.register(name, fn, input_types=("str",), description=description)
+    registry.register(
+        "split_lines", _split_lines, input_types=("str",), description="Non-blank lines as a list[str]."
+    )
+    registry.register(
+        "join_list", lambda items: "\n".join(items), input_types=("list[str]",), description="Join a list[str] with newlines."
+    )
+    return registry
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
+
+from decoder_v02 import decode_json_response
+from executor_v02 import (
+    DEFAULT_MAP_WORKERS,
+    BuiltinValues,
+    DescriptionRetriever,
+    GenerationSettings,
+    LocalFunctions,
+    MapResultCache,
+    ModelCall,
+    PromptBudgeter,
+    ResponseSchema,
+    StepCallback,
+    build_response_schema,
+    check_local_functions,
+    check_step_inputs,
+    condition_holds,
+    execute_steps,
+    invoke_model,
+    skipped_step_log,
+    step_builtin_refs,
+    step_embedded_refs,
+    step_prompt_blocks,
+    validate_with_repairs,
+)
+from generation_v02 import merge_generation_configs
+from parser_v02 import BUILTIN_VARS, Step
+
+
+_DEFAULT_MAX_GROUP = 8
+
+
+def _task_key(step: Step) -> str:
+    return f"step_{step.index}"
+
+
+def step_reads(step: Step, available: AbstractSet[str] = frozenset()) -> set[str]:
+    """
+    Variables a step depends on: its /FROM list, inline references, /IN scopes, /MAP list and /IF flag.
+    A step without /FROM gets the whole context as Inputs, so it also reads
+    every variable in `available` (the variables earlier steps define).
+    """
+    reads = set(step.from_vars or []) | step_embedded_refs(step)
+    if step.from_vars is None:
+        reads.update(available)
+    reads.update(desc.scope_var for desc in step.from_descriptions if desc.scope_var)
+    reads.update(name for name in (step.map_over, step.condition) if name is not None)
+    return reads
+
+
+def sees_run_history(step: Step) -> bool:
+    # @CHAT/@ALL and unscoped descriptions include earlier steps' outputs.
+    if any(desc.scope_var in (None, *BUILTIN_VARS) for desc in step.from_descriptions):
+        return True
+    return bool((set(step.from_vars or []) | step_embedded_refs(step)) & BUILTIN_VARS)
+
+
+def plan_fusion(steps: List[Step], max_group: int = _DEFAULT_MAX_GROUP) -> List[List[Step]]:
+    """
+    Group consecutive steps that do not depend on each other.
+    A step starts a new group when it reads a variable defined earlier in the
+    current group, when it sees the run history, or when the group is full.
+    A step without /FROM sees the whole context, so it starts a new group
+    after any step of the current group that has a /DEF. /CALL steps run
+    locally and /MAP steps fan out on their own, so both always form a group
+    of their own.
+    """
+    groups: List[List[Step]] = []
+    current: List[Step] = []
+    defined: set[str] = set()
+    for step in steps:
+        if step.call is not None or step.map_over is not None:
+            if current:
+                groups.append(current)
+            groups.append([step])
+            current, defined = [], set()
+            continue
+        if current:
+            dependent = sees_run_history(step) or bool(step_reads(step, defined) & defined)
+            if dependent or len(current) >= max_group:
+                groups.append(current)
+                current, defined = [], set()
+        current.append(step)
+        defined.update(spec.var_name for spec in step.defs)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_fused_prompt(
+    group: List[Step],
+    context: Dict[str, Any],
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+) -> str:
+    keys = [_task_key(step) for step in group]
+    blocks: List[str] = [
+        f"Complete the following {len(group)} independent tasks. "
+        "Answer each task on its own; tasks cannot see each other's results."
+    ]
+    for key, step in zip(keys, group):
+        task_blocks = step_prompt_blocks(step, context, builtins=builtins, retriever=retriever)
+        blocks.append(f"=== Task {key} ===\n" + "\n\n".join(task_blocks))
+
+    sample_tasks: List[str] = []
+    for key, step in zip(keys, group):
+        if step.defs:
+            sample_vars = ", ".join(f'"{spec.var_name}": <{spec.value_type}>' for spec in step.defs)
+            sample_tasks.append(f'"{key}": {{"error": 0, "out": "done", "vars": {{{sample_vars}}}}}')
+        else:
+            sample_tasks.append(f'"{key}": {{"error": 0, "out": "done"}}')
+    blocks.append(
+        "Output format requirements:\n"
+        "- Respond with ONLY a JSON object.\n"
+        "- Do not wrap JSON in markdown/code fences.\n"
+        f"- Include one key per task: {', '.join(keys)}.\n"
+        "- Each task value is an object with keys error (0 or 1) and out (a natural-language string).\n"
+        "- A task with required variables also includes vars: a JSON object containing "
+        "every required variable of that task by exact name."
+    )
+    blocks.append("Example JSON shape:\n{" + ", ".join(sample_tasks) + "}")
+    return "\n\n".join(blocks).strip()
+
+
+def build_fused_schema(group: List[Step]) -> ResponseSchema:
+    return {
+        "type": "object",
+        "properties": {_task_key(step): build_response_schema(step) for step in group},
+        "required": [_task_key(step) for step in group],
+    }
+
+
+def split_fused_response(
+    raw_response: str, group: List[Step], recoveries: Optional[List[str]] = None
+) -> List[str]:
+    """Per-step raw responses (JSON text) cut out of a fused response."""
+    first = group[0]
+    try:
+        parsed, recovery = decode_json_response(raw_response)
+    except json.JSONDecodeError as exc:
+        raise ValueError(
+            f"Step {first.index} (line {first.start_line_no}): fused model response is not valid JSON"
+        ) from exc
+    if recovery is not None and recoveries is not None:
+        recoveries.append(recovery)
+    if not isinstance(parsed, dict):
+        raise ValueError(
+            f"Step {first.index} (line {first.start_line_no}): fused model response must be a JSON object"
+        )
+    parts: List[str] = []
+    for step in group:
+        key = _task_key(step)
+        if key not in parsed:
+            raise ValueError(
+                f"Step {step.index} (line {step.start_line_no}): fused response missing task key '{key}'"
+            )
+        parts.append(json.dumps(parsed[key], ensure_ascii=False))
+    return parts
+
+
+def _runnable_steps(group: List[Step], context: Dict[str, Any]) -> Optional[List[Step]]:
+    """
+    Steps of a group whose /IF or /UNLESS condition holds. A group never
+    defines its own flags, so the context at the start of the group decides.
+    None when a condition or input cannot be checked; sequential execution
+    then commits the steps before the failing one and reports the error.
+    """
+    try:
+        runnable = [step for step in group if condition_holds(step, context)]
+        for step in runnable:
+            check_step_inputs(step, context)
+    except ValueError:
+        return None
+    return runnable
+
+
+def execute_fused_steps(
+    steps: List[Step],
+    context: Dict[str, Any],
+    call_model: Optional[ModelCall] = None,
+    on_step: Optional[StepCallback] = None,
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    max_group: int = _DEFAULT_MAX_GROUP,
+    generation: Optional[GenerationSettings] = None,
+    reference_min_chars: Optional[int] = None,
+    repair_attempts: int = 0,
+    functions: Optional[LocalFunctions] = None,
+    map_workers: int = DEFAULT_MAP_WORKERS,
+    map_cache: Optional[MapResultCache] = None,
+    budget: Optional[PromptBudgeter] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[str]]:
+    """
+    `execute_steps` with independent consecutive steps sent as one model call.
+    The fused response is split back per step and each step is validated and
+    committed in program order, so a failing step still leaves the earlier
+    steps of its group committed, exactly as in sequential execution.
+    `reference_min_chars` only applies to steps that run on their own.
+    A group whose fused prompt is over `budget` runs step by step instead, so
+    each step is budgeted (and trimmed) on its own.
+    """
+    check_local_functions(steps, functions)
+    logs: List[Dict[str, Any]] = []
+    visible_outputs: List[str] = []
+    for group in plan_fusion(steps, max_group=max_group):
+        runnable = _runnable_steps(group, context) if len(group) > 1 else None
+        prompt: Optional[str] = None
+        if runnable is not None and len(runnable) > 1 and call_model is not None:
+            prompt = build_fused_prompt(runnable, context, builtins=builtins, retriever=retriever)
+            if budget is not None and not budget.fits(prompt):
+                prompt = None
+        if prompt is None:
+            context, group_logs, group_outputs = execute_steps(
+                group,
+                context,
+                call_model=call_model,
+                on_step=on_step,
+                builtins=builtins,
+                retriever=retriever,
+                generation=generation,
+                reference_min_chars=reference_min_chars,
+                repair_attempts=repair_attempts,
+                functions=functions,
+                map_workers=map_workers,
+                map_cache=map_cache,
+                budget=budget,
+            )
+            logs.extend(group_logs)
+            visible_outputs.extend(group_outputs)
+            continue
+
+        fused_schema = build_fused_schema(runnable)
+        generation_config = None
+        if generation is not None:
+            generation_config = merge_generation_configs(generation.config_for(step) for step in runnable)
+        started = time.perf_counter()
+        raw_response = invoke_model(call_model, prompt, fused_schema, generation_config)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        group_recoveries: List[str] = []
+        split_parts = split_fused_response(raw_response, runnable, group_recoveries)
+        parts = {step.index: part for step, part in zip(runnable, split_parts)}
+        fused_with = [step.index for step in runnable]
+        for step in group:
+            if step.index not in parts:
+                # Condition did not hold: logged in program order, never sent.
+                step_log = skipped_step_log(step)
+                visible_outputs.append("")
+                logs.append(step_log)
+                if on_step is not None:
+                    on_step(step_log)
+                continue
+            part = parts[step.index]
+            step_schema = build_response_schema(step)
+            step_config = generation.config_for(step) if generation is not None else None
+            repairs: List[Dict[str, Any]] = []
+            # A broken task is repaired on its own, with its own schema.
+            part, parsed, staged_updates = validate_with_repairs(
+                step,
+                part,
+                lambda repair_prompt: invoke_model(call_model, repair_prompt, step_schema, step_config),
+                repair_attempts,
+                repairs,
+            )
+            context.update(staged_updates)
+            if retriever is not None and staged_updates:
+                retriever.record_commit(staged_updates)
+            visible_outputs.append(parsed["out"])
+            step_log = {
+                "step_index": step.index,
+                "start_line_no": step.start_line_no,
+                "text": step.text,
+                "prompt": prompt,
+                "response_schema": fused_schema,
+                "raw_response": part,
+                "parsed_json": parsed,
+                "staged_updates": staged_updates,
+                "fused_with": fused_with,
+                "elapsed_ms": elapsed_ms,
+            }
+            if generation_config:
+                step_log["generation_config"] = generation_config
+            if repairs:
+                step_log["repairs"] = repairs
+            if group_recoveries:
+                step_log["decode_recovery"] = group_recoveries[-1]
+            used_builtins = step_builtin_refs(step, builtins)
+            if used_builtins:
+                step_log["builtins_used"] = used_builtins
+            if builtins is not None:
+                builtins.record_step_output(parsed["out"])
+            logs.append(step_log)
+            if on_step is not None:
+                on_step(step_log)
+    return context, logs, visible_outputs
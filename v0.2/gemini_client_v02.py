@@ -17,6 +17,19 @@ _RETRY_MAX = 3
 _RETRY_BASE_DELAY_S = 1.0
 
 
+class GeminiHTTPError(RuntimeError):
+    """A non-success HTTP status from the Gemini API."""
+
+    def __init__(self, status: int, body: str) -> None:
+        super().__init__(f"Gemini HTTP error {status}: {body}")
+        self.status = status
+
+
+def resolve_model(model: Optional[str]) -> str:
+    """The model a request goes to: `model`, or GEMINI_MODEL / gemini-2.5-flash."""
+    return model or _DEFAULT_MODEL
+
+
 def _get_default_timeout() -> float:
     raw = os.environ.get("GEMINI_TIMEOUT", "120")
     try:
@@ -25,46 +38,20 @@ def _get_default_timeout() -> float:
         return 120.0
 
 
-def call_gemini(
-    prompt: str,
-    model: Optional[str] = None,
-    timeout_s: Optional[float] = None,
-    response_schema: Optional[Dict[str, Any]] = None,
-) -> str:
-    if not isinstance(prompt, str) or prompt.strip() == "":
-        raise ValueError("prompt must be a non-empty string")
-
+def _api_key() -> str:
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         raise EnvironmentError("GEMINI_API_KEY is not set")
+    return api_key
 
-    model_name = model or _DEFAULT_MODEL
-    url = f"{_API_BASE}/models/{model_name}:generateContent"
-
-    generation_config: Dict[str, Any] = {
-        "responseMimeType": "application/json",
-    }
-    if response_schema is not None:
-        generation_config["responseSchema"] = response_schema
-
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt}
-                ]
-            }
-        ],
-        # Ask Gemini to emit JSON text directly to reduce markdown/prose drift.
-        "generationConfig": generation_config,
-    }
 
+def _post_json(url: str, payload: Dict[str, Any], timeout_s: Optional[float]) -> Dict[str, Any]:
     req = urllib.request.Request(
         url,
         data=json.dumps(payload).encode("utf-8"),
         headers={
             "Content-Type": "application/json",
-            "x-goog-api-key": api_key,
+            "x-goog-api-key": _api_key(),
         },
         method="POST",
     )
@@ -84,12 +71,81 @@ def call_gemini(
                 delay += random.random() * 0.25
                 time.sleep(delay)
                 continue
-            raise RuntimeError(f"Gemini HTTP error {e.code}: {body}") from e
+            raise GeminiHTTPError(e.code, body) from e
         except urllib.error.URLError as e:
             raise RuntimeError(f"Gemini connection error: {e}") from e
 
     if "error" in data:
         raise RuntimeError(f"Gemini API error: {data['error']}")
+    return data
+
+
+def create_cached_content(
+    text: str,
+    model: Optional[str] = None,
+    ttl_s: float = 300.0,
+    timeout_s: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Store `text` as a Gemini cachedContents entry usable as a prompt prefix.
+    Returns the API resource (`name`, `expireTime`, `usageMetadata`, ...).
+    """
+    model_name = resolve_model(model)
+    payload = {
+        "model": f"models/{model_name}",
+        "contents": [{"role": "user", "parts": [{"text": text}]}],
+        "ttl": f"{max(1, int(ttl_s))}s",
+    }
+    return _post_json(f"{_API_BASE}/cachedContents", payload, timeout_s)
+
+
+def count_tokens(text: str, model: Optional[str] = None, timeout_s: Optional[float] = None) -> int:
+    """Exact prompt token count of `text` from the Gemini countTokens endpoint (no generation)."""
+    model_name = resolve_model(model)
+    payload = {"contents": [{"parts": [{"text": text}]}]}
+    data = _post_json(f"{_API_BASE}/models/{model_name}:countTokens", payload, timeout_s)
+    return int(data.get("totalTokens", 0))
+
+
+def call_gemini(
+    prompt: str,
+    model: Optional[str] = None,
+    timeout_s: Optional[float] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    cached_content: Optional[str] = None,
+) -> str:
+    if not isinstance(prompt, str) or prompt.strip() == "":
+        raise ValueError("prompt must be a non-empty string")
+
+    _api_key()
+
+    model_name = resolve_model(model)
+    url = f"{_API_BASE}/models/{model_name}:generateContent"
+
+    # Caller settings (maxOutputTokens, thinkingConfig, temperature, ...) never
+    # replace the JSON response contract below.
+    request_config: Dict[str, Any] = dict(generation_config or {})
+    request_config["responseMimeType"] = "application/json"
+    if response_schema is not None:
+        request_config["responseSchema"] = response_schema
+
+    payload: Dict[str, Any] = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": prompt}
+                ]
+            }
+        ],
+        # Ask Gemini to emit JSON text directly to reduce markdown/prose drift.
+        "generationConfig": request_config,
+    }
+    if cached_content is not None:
+        # `prompt` is then only the part after the cached prefix.
+        payload["cachedContent"] = cached_content
+
+    data = _post_json(url, payload, timeout_s)
 
     candidates = data.get("candidates", [])
     if not candidates:
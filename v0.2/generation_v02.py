@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from parser_v02 import Step, list_item_type
+
+
+_STRUCTURED_TYPES = frozenset({"bool", "int", "float"})
+# Room for the JSON envelope and a one-sentence `out` around each value.
+_STRUCTURED_BASE_TOKENS = 192
+_STRUCTURED_PER_DEF_TOKENS = 32
+_SHORT_TEXT_BASE_TOKENS = 512
+_SHORT_TEXT_PER_DEF_TOKENS = 256
+# Pro models cannot turn thinking off; this is their smallest budget.
+_PRO_MIN_THINKING_BUDGET = 128
+# Gemini 3 sets thinking by level; room for its thoughts within maxOutputTokens.
+_THINKING_LEVEL_RESERVE_TOKENS = 1024
+_THINKING_LEVELS = ("minimal", "low", "medium", "high")
+
+
+@dataclass(frozen=True)
+class GenerationConfig:
+    """Per-request generation settings; None leaves the model default in place."""
+
+    max_output_tokens: Optional[int] = None
+    thinking_budget: Optional[int] = None
+    thinking_level: Optional[str] = None
+    temperature: Optional[float] = None
+
+    def to_gemini(self) -> Dict[str, Any]:
+        config: Dict[str, Any] = {}
+        if self.max_output_tokens is not None:
+            # Gemini counts thinking tokens against maxOutputTokens.
+            thinking = self.thinking_budget or 0
+            if self.thinking_budget is None and self.thinking_level is not None:
+                thinking = _THINKING_LEVEL_RESERVE_TOKENS
+            config["maxOutputTokens"] = self.max_output_tokens + thinking
+        if self.thinking_budget is not None:
+            config["thinkingConfig"] = {"thinkingBudget": self.thinking_budget}
+        elif self.thinking_level is not None:
+            config["thinkingConfig"] = {"thinkingLevel": self.thinking_level}
+        if self.temperature is not None:
+            config["temperature"] = self.temperature
+        return config
+
+
+def _least_thinking(model: Optional[str]) -> Dict[str, Any]:
+    """GenerationConfig fields for the least thinking `model` allows."""
+    # Imported here so the runtime does not load the HTTP client up front.
+    from gemini_client_v02 import resolve_model
+
+    name = resolve_model(model).lower().rsplit("/", 1)[-1]
+    if name.startswith("gemini-3"):
+        return {"thinking_level": "low"}
+    if "pro" in name:
+        return {"thinking_budget": _PRO_MIN_THINKING_BUDGET}
+    if name.startswith("gemini-2.5"):
+        return {"thinking_budget": 0}
+    # Models without thinking (or unknown ones): leave thinkingConfig unset.
+    return {}
+
+
+def derive_generation_config(step: Step, model: Optional[str] = None) -> GenerationConfig:
+    """
+    Settings implied by a step's contract, for `model` (default: GEMINI_MODEL).
+    bool/int/float-only steps get a short output limit, the least thinking
+    the model allows and temperature 0 (model default on Gemini 3); short
+    `str` values get a moderate limit; steps with `nat` or list values or an
+    /OUT intent keep the model defaults.
+    """
+    types = [spec.value_type for spec in step.defs]
+    if step.out_text is not None or not types or "nat" in types:
+        return GenerationConfig()
+    if any(list_item_type(t) is not None for t in types):
+        return GenerationConfig()
+    thinking = _least_thinking(model)
+    if all(t in _STRUCTURED_TYPES for t in types):
+        # Gemini 3 is tuned for its default temperature; 0 can make it loop.
+        greedy = "thinking_level" not in thinking
+        return GenerationConfig(
+            max_output_tokens=_STRUCTURED_BASE_TOKENS + _STRUCTURED_PER_DEF_TOKENS * len(types),
+            temperature=0.0 if greedy else None,
+            **thinking,
+        )
+    return GenerationConfig(
+        max_output_tokens=_SHORT_TEXT_BASE_TOKENS + _SHORT_TEXT_PER_DEF_TOKENS * len(types),
+        **thinking,
+    )
+
+
+def merge_generation_configs(configs: Iterable[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    One Gemini config for a request that answers several steps (see fusion_v02).
+    A setting is kept only when every step sets it: output limits add up, and
+    the largest thinking budget (or level) and temperature win.
+    """
+    configs = [c or {} for c in configs]
+    if not configs:
+        return None
+    merged: Dict[str, Any] = {}
+    if all("maxOutputTokens" in c for c in configs):
+        merged["maxOutputTokens"] = sum(c["maxOutputTokens"] for c in configs)
+    thinking = [c.get("thinkingConfig") or {} for c in configs]
+    if all("thinkingBudget" in t for t in thinking):
+        merged["thinkingConfig"] = {"thinkingBudget": max(t["thinkingBudget"] for t in thinking)}
+    elif all(t.get("thinkingLevel") in _THINKING_LEVELS for t in thinking):
+        level = max((t["thinkingLevel"] for t in thinking), key=_THINKING_LEVELS.index)
+        merged["thinkingConfig"] = {"thinkingLevel": level}
+    if all("temperature" in c for c in configs):
+        merged["temperature"] = max(c["temperature"] for c in configs)
+    return merged or None
+
+
+_FIELD_NAMES = frozenset(f.name for f in fields(GenerationConfig))
+
+
+def _checked_overrides(overrides: Mapping[str, Any]) -> Dict[str, Any]:
+    unknown = set(overrides) - _FIELD_NAMES
+    if unknown:
+        raise ValueError(
+            f"unknown generation settings {sorted(unknown)}; allowed: {sorted(_FIELD_NAMES)}"
+        )
+    return dict(overrides)
+
+
+class GenerationPolicy:
+    """
+    Derive generation settings per step for `model`, then apply overrides.
+    `overrides` apply to every step and `step_overrides` (keyed by step index)
+    win over both; a None override value restores the model default.
+    """
+
+    def __init__(
+        self,
+        overrides: Optional[Mapping[str, Any]] = None,
+        step_overrides: Optional[Mapping[int, Mapping[str, Any]]] = None,
+        model: Optional[str] = None,
+    ) -> None:
+        self.model = model
+        self.overrides = _checked_overrides(overrides or {})
+        self.step_overrides = {
+            int(index): _checked_overrides(values) for index, values in (step_overrides or {}).items()
+        }
+
+    def settings_for(self, step: Step, model: Optional[str] = None) -> GenerationConfig:
+        config = replace(derive_generation_config(step, model or self.model), **self.overrides)
+        return replace(config, **self.step_overrides.get(step.index, {}))
+
+    def config_for(self, step: Step, model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Gemini `generationConfig` fields for this step, or None when there is nothing
+        to set. `model` (e.g. the routed model) replaces the policy's default model.
+        """
+        return self.settings_for(step, model).to_gemini() or None
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Optional
+
+from decoder_v02 import decode_json_response
+from executor_v02 import ModelCall, ResponseSchema
+
+
+_DEFAULT_PERCENTILE = 0.95
+_DEFAULT_MIN_SAMPLES = 20
+_DEFAULT_MAX_HEDGE_RATE = 0.1
+_DEFAULT_WINDOW = 200
+_DEFAULT_MAX_WORKERS = 32
+
+
+def _is_valid_response(raw: str, response_schema: ResponseSchema) -> bool:
+    """Cheap shape check: a JSON object carrying every top-level required key."""
+    try:
+        parsed, _ = decode_json_response(raw)
+    except (TypeError, json.JSONDecodeError):
+        return False
+    return isinstance(parsed, dict) and all(key in parsed for key in response_schema.get("required", []))
+
+
+class HedgedCaller:
+    """
+    ModelCall wrapper that fires a duplicate request when the first is slow.
+    If the primary call has not returned after the `percentile` latency of
+    recent calls, the same prompt is sent to `hedge_call` (default: the
+    primary again) and the first valid response wins. Hedges are capped at
+    `max_hedge_rate` of all calls. Primaries run on their own thread and
+    hedges on a pool of `max_workers`, so a burst of hedges never queues a
+    primary; latency is timed from when the call starts, not when it is queued.
+    A losing request is abandoned: it is dropped if it has not started,
+    otherwise its result is ignored when the blocking HTTP call returns.
+    """
+
+    def __init__(
+        self,
+        call_model: ModelCall,
+        hedge_call: Optional[ModelCall] = None,
+        percentile: float = _DEFAULT_PERCENTILE,
+        min_samples: int = _DEFAULT_MIN_SAMPLES,
+        max_hedge_rate: float = _DEFAULT_MAX_HEDGE_RATE,
+        initial_delay_s: Optional[float] = None,
+        window: int = _DEFAULT_WINDOW,
+        max_workers: int = _DEFAULT_MAX_WORKERS,
+    ) -> None:
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1")
+        self.call_model = call_model
+        self.model_id = getattr(call_model, "model_id", None)
+        self.hedge_call = hedge_call or call_model
+        self.percentile = percentile
+        self.min_samples = max(1, min_samples)
+        self.max_hedge_rate = max(0.0, max_hedge_rate)
+        self.initial_delay_s = initial_delay_s
+        self._latencies: Deque[float] = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spl-hedge")
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_skips = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little latency data."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay_s
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def _timed_primary(self, prompt: str, response_schema: ResponseSchema, kwargs: Dict[str, Any]) -> str:
+        started = time.monotonic()
+        response = self.call_model(prompt, response_schema, **kwargs)
+        # Recorded even when the primary loses, so the threshold is not biased towards fast calls.
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return response
+
+    def _start_primary(self, prompt: str, response_schema: ResponseSchema, kwargs: Dict[str, Any]) -> Future:
+        future: Future = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self._timed_primary(prompt, response_schema, kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        threading.Thread(target=run, name="spl-hedge-primary", daemon=True).start()
+        return future
+
+    def _take_hedge_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_rate * self.calls:
+                self.budget_skips += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def __call__(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        with self._lock:
+            self.calls += 1
+        primary = self._start_primary(prompt, response_schema, kwargs)
+
+        delay = self.hedge_delay()
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge_budget():
+            return primary.result()
+
+        hedge = self._pool.submit(self.hedge_call, prompt, response_schema, **kwargs)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and _is_valid_response(future.result(), response_schema):
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        # Neither response is valid: surface the primary outcome so callers see
+        # the usual contract error (or the transport exception).
+        return primary.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, hedges = self.calls, self.hedges
+            wins, skips = self.hedge_wins, self.budget_skips
+        return {
+            "calls": calls,
+            "hedges": hedges,
+            "hedge_rate": round(hedges / calls, 3) if calls else 0.0,
+            "hedge_wins": wins,
+            "budget_skips": skips,
+            "hedge_delay_s": self.hedge_delay(),
+        }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from common_v02 import SqliteConnections
+from executor_v02 import ModelCall
+from parser_v02 import Step, parse_dsl
+from runtime_v02 import RunResult, run_steps
+
+
+_DEFAULT_LEASE_S = 300.0
+_DEFAULT_MAX_ATTEMPTS = 3
+_BUSY_TIMEOUT_S = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    program TEXT NOT NULL,
+    max_attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    context TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_by_status ON items (status, lease_expires);
+"""
+
+# Item states: pending -> leased -> done | failed; a failed attempt or an
+# expired lease puts the item back to pending until max_attempts is used up.
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+@dataclass
+class WorkItem:
+    job_id: str
+    index: int
+    program: str
+    context: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+    lease_owner: str
+
+
+class JobQueue:
+    """
+    Durable batch queue in a sqlite (WAL) file.
+    Every context of a batch is one item; workers lease items, and a lease that
+    is not completed before it expires is handed out again, so a killed worker
+    only costs the items it was holding.
+    """
+
+    def __init__(self, db_path: Path | str) -> None:
+        self.db_path = Path(db_path)
+        self._connections = SqliteConnections(self.db_path, busy_timeout_s=_BUSY_TIMEOUT_S)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def close(self) -> None:
+        self._connections.close()
+
+    def submit(
+        self,
+        program: str,
+        contexts: List[Dict[str, Any]],
+        job_id: Optional[str] = None,
+        max_attempts: int = _DEFAULT_MAX_ATTEMPTS,
+    ) -> str:
+        """
+        Enqueue one item per context. The program is parsed first so parse errors
+        surface here rather than in every worker. Re-submitting an existing
+        `job_id` with the same program only adds missing items.
+        """
+        parse_dsl(program)
+        job_id = job_id or f"job-{uuid.uuid4().hex[:12]}"
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT program FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, program, max_attempts, created_at) VALUES (?, ?, ?, ?)",
+                    (job_id, program, max_attempts, time.time()),
+                )
+            elif row[0] != program:
+                raise ValueError(f"job {job_id!r} already exists with a different program")
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (job_id, idx, context, status) VALUES (?, ?, ?, ?)",
+                [
+                    (job_id, idx, json.dumps(ctx), STATUS_PENDING)
+                    for idx, ctx in enumerate(contexts)
+                ],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def lease(
+        self,
+        worker_id: str,
+        lease_s: float = _DEFAULT_LEASE_S,
+        job_id: Optional[str] = None,
+    ) -> Optional[WorkItem]:
+        """Atomically claim the next runnable item, or return None when nothing is left."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases whose attempts are used up will never run again.
+            conn.execute(
+                "UPDATE items SET status = ?, error = COALESCE(error, 'lease expired') "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= "
+                "(SELECT max_attempts FROM jobs WHERE jobs.id = items.job_id)",
+                (STATUS_FAILED, STATUS_LEASED, now),
+            )
+            query = (
+                "SELECT items.job_id, items.idx, items.context, items.attempts, "
+                "jobs.program, jobs.max_attempts "
+                "FROM items JOIN jobs ON jobs.id = items.job_id "
+                "WHERE (items.status = ? OR (items.status = ? AND items.lease_expires < ?)) "
+                "AND items.attempts < jobs.max_attempts"
+            )
+            params: List[Any] = [STATUS_PENDING, STATUS_LEASED, now]
+            if job_id is not None:
+                query += " AND items.job_id = ?"
+                params.append(job_id)
+            query += " ORDER BY jobs.created_at, items.job_id, items.idx LIMIT 1"
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            item_job_id, idx, context, attempts, program, max_attempts = row
+            conn.execute(
+                "UPDATE items SET status = ?, attempts = ?, lease_owner = ?, lease_expires = ? "
+                "WHERE job_id = ? AND idx = ?",
+                (STATUS_LEASED, attempts + 1, worker_id, now + lease_s, item_job_id, idx),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return WorkItem(
+            job_id=item_job_id,
+            index=int(idx),
+            program=program,
+            context=json.loads(context),
+            attempts=int(attempts) + 1,
+            max_attempts=int(max_attempts),
+            lease_owner=worker_id,
+        )
+
+    def heartbeat(self, item: WorkItem, lease_s: float = _DEFAULT_LEASE_S) -> bool:
+        cur = self._connect().execute(
+            "UPDATE items SET lease_expires = ? "
+            "WHERE job_id = ? AND idx = ? AND status = ? AND lease_owner = ?",
+            (time.time() + lease_s, item.job_id, item.index, STATUS_LEASED, item.lease_owner),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, item: WorkItem, result: RunResult) -> bool:
+        """
+        Store the result of a successful item. Only the current lease holder can
+        complete it; an item that is already done keeps its first result, and a
+        lease that expired and went to another worker is not overwritten. Returns
+        False in both cases.
+        """
+        cur = self._connect().execute(
+            "UPDATE items SET status = ?, result = ?, error = NULL, lease_owner = NULL, "
+            "lease_expires = NULL WHERE job_id = ? AND idx = ? AND status = ? AND lease_owner = ?",
+            (
+                STATUS_DONE,
+                json.dumps(asdict(result)),
+                item.job_id,
+                item.index,
+                STATUS_LEASED,
+                item.lease_owner,
+            ),
+        )
+        return cur.rowcount == 1
+
+    def fail(self, item: WorkItem, error: str, result: Optional[RunResult] = None) -> Optional[str]:
+        """
+        Record a failed attempt; returns the item's new status (pending or failed),
+        or None when this worker no longer holds the lease and nothing was recorded.
+        """
+        status = STATUS_FAILED if item.attempts >= item.max_attempts else STATUS_PENDING
+        cur = self._connect().execute(
+            "UPDATE items SET status = ?, error = ?, result = ?, lease_owner = NULL, "
+            "lease_expires = NULL WHERE job_id = ? AND idx = ? AND status = ? AND lease_owner = ?",
+            (
+                status,
+                error,
+                json.dumps(asdict(result)) if result is not None else None,
+                item.job_id,
+                item.index,
+                STATUS_LEASED,
+                item.lease_owner,
+            ),
+        )
+        return status if cur.rowcount == 1 else None
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        counts = {STATUS_PENDING: 0, STATUS_LEASED: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        for status, count in self._connect().execute(
+            "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+        ):
+            counts[status] = int(count)
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def results(self, job_id: str) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT idx, status, attempts, result, error FROM items WHERE job_id = ? ORDER BY idx",
+            (job_id,),
+        ).fetchall()
+        return [
+            {
+                "index": int(idx),
+                "status": status,
+                "attempts": int(attempts),
+                "result": json.loads(result) if result else None,
+                "error": error,
+            }
+            for idx, status, attempts, result, error in rows
+        ]
+
+
+def _keep_leased(queue: JobQueue, item: WorkItem, lease_s: float, stop: threading.Event) -> None:
+    """Extend the lease every third of `lease_s` until `stop` is set or the lease is lost."""
+    try:
+        while not stop.wait(lease_s / 3):
+            if not queue.heartbeat(item, lease_s=lease_s):
+                return
+    finally:
+        # Heartbeats use this thread's own connection.
+        queue.close()
+
+
+def run_worker(
+    queue: JobQueue,
+    call_model: Optional[ModelCall] = None,
+    worker_id: Optional[str] = None,
+    job_id: Optional[str] = None,
+    lease_s: float = _DEFAULT_LEASE_S,
+    max_items: Optional[int] = None,
+) -> int:
+    """
+    Process items until the queue has nothing runnable; returns items handled.
+    Leases are renewed in the background while an item runs, so `lease_s` only
+    bounds how long a killed worker holds its item, not how long a run may take.
+    """
+    worker_id = worker_id or f"worker-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    parsed: Dict[str, List[Step]] = {}
+    handled = 0
+    while max_items is None or handled < max_items:
+        item = queue.lease(worker_id, lease_s=lease_s, job_id=job_id)
+        if item is None:
+            break
+        steps = parsed.get(item.job_id)
+        if steps is None:
+            steps = parse_dsl(item.program)
+            parsed[item.job_id] = steps
+        stop = threading.Event()
+        keeper = threading.Thread(target=_keep_leased, args=(queue, item, lease_s, stop), daemon=True)
+        keeper.start()
+        try:
+            result = run_steps(steps, item.context, call_model=call_model)
+        finally:
+            stop.set()
+            keeper.join()
+        if result.ok:
+            queue.complete(item, result)
+        else:
+            queue.fail(item, result.error or "unknown error", result=result)
+        handled += 1
+    return handled
+
+
+def _worker_process_main(
+    db_path: str,
+    make_call_model: Optional[Callable[[], ModelCall]],
+    job_id: Optional[str],
+    lease_s: float,
+) -> None:
+    queue = JobQueue(db_path)
+    call_model = make_call_model() if make_call_model is not None else None
+    try:
+        run_worker(queue, call_model=call_model, job_id=job_id, lease_s=lease_s)
+    finally:
+        queue.close()
+
+
+def run_workers(
+    db_path: Path | str,
+    processes: Optional[int] = None,
+    make_call_model: Optional[Callable[[], ModelCall]] = None,
+    job_id: Optional[str] = None,
+    lease_s: float = _DEFAULT_LEASE_S,
+) -> None:
+    """
+    Drain the queue with N worker processes (default: one per CPU).
+    `make_call_model` must be picklable (e.g. a functools.partial of
+    make_gemini_caller); each process builds its own caller.
+    """
+    count = processes or os.cpu_count() or 1
+    procs = [
+        multiprocessing.Process(
+            target=_worker_process_main,
+            args=(str(db_path), make_call_model, job_id, lease_s),
+            daemon=True,
+        )
+        for _ in range(count)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
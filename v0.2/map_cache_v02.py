@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from common_v02 import write_text_atomic
+
+
+_DEFAULT_MAX_ENTRIES = 4096
+_DEFAULT_FLUSH_EVERY = 64
+_DEFAULT_FLUSH_INTERVAL_S = 5.0
+
+
+class MapElementCache:
+    """
+    Validated /MAP element responses keyed by `executor_v02.map_element_key`
+    (model, element prompt, schema and generation config), optionally
+    persisted as JSON. Because each element has its own key, a list that grew
+    or changed by one item only misses for that item, and a /MAP step that
+    failed on some elements redoes only those when run again.
+    The least recently used entries are dropped beyond `max_entries`.
+    Writes are batched: the file is rewritten after `flush_every` new entries,
+    when `flush_interval_s` has passed since the last write, or on `flush()`
+    (the executor flushes after every /MAP step).
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path | str] = None,
+        max_entries: int = _DEFAULT_MAX_ENTRIES,
+        flush_every: int = _DEFAULT_FLUSH_EVERY,
+        flush_interval_s: float = _DEFAULT_FLUSH_INTERVAL_S,
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.max_entries = max(1, max_entries)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval_s = flush_interval_s
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.path.exists():
+            loaded = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            if isinstance(loaded, dict):
+                self._entries.update({k: v for k, v in loaded.items() if isinstance(v, str)})
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, response: str) -> None:
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            due = self.path is not None and (
+                self._unsaved >= self.flush_every
+                or time.monotonic() - self._saved_at >= self.flush_interval_s
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write pending entries to `path`; a no-op when nothing changed."""
+        if self.path is None:
+            return
+        # The snapshot is taken under the entry lock, the file written outside it,
+        # so lookups from other /MAP workers never wait on disk.
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                data = json.dumps(self._entries)
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+            write_text_atomic(self.path, data)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from common_v02 import value_text
+from decoder_v02 import decode_json_response
+from executor_v02 import DescriptionRetriever, ModelCall, ResponseSchema
+from search_index_v02 import chunk_text
+from summary_cache_v02 import SummaryCache, segment_hash
+from tokens_v02 import count_tokens
+
+
+_DEFAULT_THRESHOLD_TOKENS = 6000
+_DEFAULT_CHUNK_WORDS = 2000
+_DEFAULT_CHUNK_OVERLAP = 200
+_DEFAULT_MAX_WORKERS = 4
+_DEFAULT_REDUCE_FANOUT = 8
+# Paragraphs, then lines, then sentences: the coarsest boundary that fits a chunk wins.
+_BOUNDARIES = (re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"(?<=[.!?])\s+"))
+# A chunk also ends after a unit whose hash is 0 mod this (once it is a quarter full),
+# so chunk ends depend on content rather than on position in the document.
+_CUT_EVERY = 4
+_EXTRACT_SCHEMA: ResponseSchema = {
+    "type": "object",
+    "properties": {"extract": {"type": "string"}},
+    "required": ["extract"],
+}
+
+
+def _build_map_prompt(description: str, chunk: str, part: int, total: int) -> str:
+    return (
+        "Instruction:\n"
+        f"Extract everything in this excerpt (part {part} of {total}) that is relevant to: "
+        f"{description}\n"
+        "Quote or closely paraphrase the relevant passages. If nothing is relevant, "
+        "return an empty string.\n\n"
+        f"Excerpt:\n{chunk}\n\n"
+        "Output format requirements:\n"
+        "- Respond with ONLY a JSON object.\n"
+        '- Example JSON shape:\n{"extract": "..."}'
+    )
+
+
+def _build_reduce_prompt(description: str, partials: Sequence[str]) -> str:
+    body = "\n".join(f"- {p}" for p in partials)
+    return (
+        "Instruction:\n"
+        f"These notes were extracted from different parts of one document for: {description}\n"
+        "Merge them into one answer. Remove duplicates (parts overlap), keep every "
+        "distinct fact, and keep document order.\n\n"
+        f"Notes:\n{body}\n\n"
+        "Output format requirements:\n"
+        "- Respond with ONLY a JSON object.\n"
+        '- Example JSON shape:\n{"extract": "..."}'
+    )
+
+
+def _units(text: str, max_words: int, overlap: int, level: int = 0) -> List[str]:
+    if len(text.split()) <= max_words:
+        return [text.strip()] if text.strip() else []
+    if level == len(_BOUNDARIES):
+        # One sentence longer than a chunk: only this unit falls back to word windows.
+        return chunk_text(text, max_words, overlap)
+    parts = [part for part in _BOUNDARIES[level].split(text) if part.strip()]
+    units: List[str] = []
+    for part in parts:
+        units.extend(_units(part, max_words, overlap, level + 1))
+    return units
+
+
+def boundary_chunks(value: Any, chunk_words: int, overlap: int = 0) -> List[str]:
+    """
+    Split a value into chunks of at most `chunk_words` words on message
+    (list element), paragraph, line or sentence boundaries. Chunks end on
+    content-defined cuts, so editing one passage only changes the chunks
+    around it and every other chunk keeps its text (and its cached extract).
+    """
+    texts = [value_text(item) for item in value] if isinstance(value, list) else [value_text(value)]
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for unit in (unit for text in texts for unit in _units(text, chunk_words, overlap)):
+        words = len(unit.split())
+        if current and size + words > chunk_words:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += words
+        if size * 4 >= chunk_words and int(segment_hash([unit])[:8], 16) % _CUT_EVERY == 0:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _parse_extract(raw: str) -> str:
+    try:
+        parsed, _ = decode_json_response(raw)
+    except json.JSONDecodeError:
+        return raw.strip()
+    if isinstance(parsed, dict) and isinstance(parsed.get("extract"), str):
+        return parsed["extract"].strip()
+    return raw.strip()
+
+
+class MapReduceRetriever:
+    """
+    Resolve `/IN @var` descriptions over variables too large for one prompt.
+    The variable is split into chunks on message and paragraph boundaries
+    (see `boundary_chunks`); each chunk is searched with
+    its own model call on a bounded pool (map), and the partial extracts are
+    merged by a final call (reduce). Map results are cached by the hash of
+    description + chunk, so a re-run only calls the model for changed chunks.
+    Other scopes, and variables under `threshold_tokens`, go to `inner`.
+    """
+
+    def __init__(
+        self,
+        call_model: ModelCall,
+        inner: DescriptionRetriever,
+        cache: Optional[SummaryCache] = None,
+        threshold_tokens: int = _DEFAULT_THRESHOLD_TOKENS,
+        chunk_words: int = _DEFAULT_CHUNK_WORDS,
+        chunk_overlap: int = _DEFAULT_CHUNK_OVERLAP,
+        max_workers: int = _DEFAULT_MAX_WORKERS,
+        reduce_fanout: int = _DEFAULT_REDUCE_FANOUT,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        self.call_model = call_model
+        self.inner = inner
+        self.cache = cache or SummaryCache()
+        self.threshold_tokens = threshold_tokens
+        self.chunk_words = chunk_words
+        self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers
+        self.reduce_fanout = max(2, reduce_fanout)
+        self._lock = threading.Lock()
+        self.map_calls = 0
+        self.reduce_calls = 0
+
+    def _cached_call(self, key: str, prompt: str, counter: str) -> str:
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        extract = _parse_extract(self.call_model(prompt, _EXTRACT_SCHEMA))
+        self.cache.put(key, extract)
+        return extract
+
+    def _map(self, description: str, chunks: List[str]) -> List[str]:
+        def run(item: tuple[int, str]) -> str:
+            i, chunk = item
+            key = "map:" + segment_hash([description, chunk])
+            prompt = _build_map_prompt(description, chunk, i + 1, len(chunks))
+            return self._cached_call(key, prompt, "map_calls")
+
+        if not chunks:
+            return []
+        workers = min(self.max_workers, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spl-map") as pool:
+            return list(pool.map(run, enumerate(chunks)))
+
+    def _reduce(self, description: str, partials: List[str]) -> str:
+        while len(partials) > 1:
+            groups = [
+                partials[i : i + self.reduce_fanout]
+                for i in range(0, len(partials), self.reduce_fanout)
+            ]
+            partials = [
+                self._cached_call(
+                    "reduce:" + segment_hash([description, *group]),
+                    _build_reduce_prompt(description, group),
+                    "reduce_calls",
+                )
+                for group in groups
+            ]
+        return partials[0] if partials else ""
+
+    def map_reduce(self, description: str, value: Any) -> str:
+        chunks = boundary_chunks(value, self.chunk_words, self.chunk_overlap)
+        try:
+            partials = [p for p in self._map(description, chunks) if p]
+            return self._reduce(description, partials)
+        finally:
+            self.cache.flush()
+
+    def retrieve(self, description: str, scope_var: Optional[str], context: Dict[str, Any]) -> List[str]:
+        if scope_var is not None and scope_var in context:
+            value = context[scope_var]
+            if count_tokens(value_text(value)) > self.threshold_tokens:
+                merged = self.map_reduce(description, value)
+                return [merged] if merged else []
+        return self.inner.retrieve(description, scope_var, context)
+
+    def record_commit(self, updates: Dict[str, Any]) -> None:
+        self.inner.record_commit(updates)
@@ -1,18 +1,30 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from executor_v02 import ModelCall, ResponseSchema
 from gemini_client_v02 import call_gemini
 
 
 def make_gemini_caller(model: Optional[str], timeout_s: float) -> ModelCall:
-    def _caller(prompt: str, response_schema: ResponseSchema) -> str:
+    def _caller(
+        prompt: str,
+        response_schema: ResponseSchema,
+        generation_config: Optional[Dict[str, Any]] = None,
+        cache_prefix: Optional[str] = None,
+    ) -> str:
+        # cache_prefix is only a hint for ContextCachingCaller; the full prompt is sent.
+        extra: Dict[str, Any] = {}
+        if generation_config:
+            extra["generation_config"] = generation_config
         return call_gemini(
             prompt,
             model=model,
             timeout_s=timeout_s,
             response_schema=response_schema,
+            **extra,
         )
 
+    # Read by model-aware caches (see executor_v02.map_element_key).
+    _caller.model_id = model  # type: ignore[attr-defined]
     return _caller
@@ -24,6 +24,13 @@ class DefSpec:
     line_no: int = 0
 
 
+@dataclass
+class FromDescription:
+    text: str
+    scope_var: Optional[str] = None
+    line_no: int = 0
+
+
 @dataclass
 class Step:
     index: int
@@ -33,6 +40,14 @@ class Step:
     from_vars: Optional[List[str]] = None
     defs: List[DefSpec] = field(default_factory=list)
     out_text: Optional[str] = None
+    from_descriptions: List[FromDescription] = field(default_factory=list)
+    # Name of a local function (/CALL) that replaces the model call.
+    call: Optional[str] = None
+    # List variable (/MAP) the step runs over, once per element.
+    map_over: Optional[str] = None
+    # bool variable of an /IF (or, when negated, /UNLESS) condition.
+    condition: Optional[str] = None
+    condition_negated: bool = False
 
 
 @dataclass
@@ -58,9 +73,21 @@ class _StepBuilder:
 
 _COMMAND_PATTERN = re.compile(r"^\s*/([A-Za-z][A-Za-z0-9_]*)\b(?:\s+(.*))?$")
 _DEF_MARKER_PATTERN = re.compile(r"/(TYPE|AS)\b")
+_IN_MARKER_PATTERN = re.compile(r"(?:^|\s)/IN\b", re.IGNORECASE)
 _ALLOWED_TYPES = {"nat", "str", "int", "float", "bool"}
+_LIST_TYPE_PATTERN = re.compile(r"^list\s*\[\s*([A-Za-z]+)\s*\]$")
 _VAR_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
-_KNOWN_COMMANDS = {"FROM", "DEF", "OUT", "TYPE", "AS"}
+_KNOWN_COMMANDS = {"FROM", "DEF", "OUT", "TYPE", "AS", "CALL", "MAP", "IF", "UNLESS"}
+# Predefined variables (v0.3): always defined, never assignable.
+BUILTIN_VARS = frozenset({"ALL", "CHAT"})
+# The current element inside a /MAP step.
+MAP_ITEM_VAR = "ITEM"
+
+
+def list_item_type(type_name: str) -> Optional[str]:
+    """Element type of a `list[...]` /TYPE, or None for scalar types."""
+    match = _LIST_TYPE_PATTERN.match(type_name.strip().lower())
+    return match.group(1) if match else None
 
 
 def _parse_command_line(line: str) -> Optional[tuple[str, str]]:
@@ -94,9 +121,13 @@ def _supports_multiline_continuation(cmd: Command) -> bool:
 
 def _validate_type_name(type_name: str, line_no: int) -> str:
     normalized = type_name.strip().lower()
+    item_type = list_item_type(normalized)
+    if item_type is not None and item_type in _ALLOWED_TYPES:
+        return f"list[{item_type}]"
     if normalized not in _ALLOWED_TYPES:
         raise ParseError(
-            f"Line {line_no}: invalid /TYPE value {type_name!r}; allowed: {sorted(_ALLOWED_TYPES)}"
+            f"Line {line_no}: invalid /TYPE value {type_name!r}; allowed: {sorted(_ALLOWED_TYPES)} "
+            "or list[<type>]"
         )
     return normalized
 
@@ -177,10 +208,43 @@ def _apply_def_block_command(state: _DefParseState, cmd: Command) -> None:
         return
 
 
+def _parse_from_item(item: str, line_no: int, sigil: str) -> tuple[Optional[str], Optional[FromDescription]]:
+    """
+    Classify one /FROM element: `@var`, `description` (scoped to @ALL) or
+    `description /IN @var`. Returns (var_name, None) or (None, description).
+    """
+    token = item.strip()
+    markers = list(_IN_MARKER_PATTERN.finditer(token))
+    if not markers:
+        if token.startswith(sigil):
+            name = _validate_var_name(token[len(sigil):].strip(), line_no=line_no, source="/FROM")
+            return name, None
+        return None, FromDescription(text=token, scope_var=None, line_no=line_no)
+
+    if len(markers) > 1:
+        raise ParseError(f"Line {line_no}: /IN may appear at most once per /FROM element")
+    marker = markers[0]
+    desc = token[: marker.start()].strip()
+    scope = token[marker.end():].strip()
+    if not desc:
+        raise ParseError(f"Line {line_no}: /IN requires a preceding description")
+    if desc.startswith(sigil):
+        raise ParseError(f"Line {line_no}: /IN cannot be applied to a variable reference")
+    if not scope.startswith(sigil) or len(scope.split()) != 1:
+        raise ParseError(f"Line {line_no}: /IN must be followed by exactly one {sigil}variable")
+    scope_var = _validate_var_name(scope[len(sigil):], line_no=line_no, source="/IN")
+    return None, FromDescription(text=desc, scope_var=scope_var, line_no=line_no)
+
+
 def _populate_step_fields(step: Step, sigil: str) -> None:
     from_vars: Optional[List[str]] = None
+    from_descriptions: List[FromDescription] = []
     defs: List[DefSpec] = []
     out_lines: List[str] = []
+    call: Optional[str] = None
+    map_over: Optional[str] = None
+    condition: Optional[str] = None
+    condition_negated = False
 
     i = 0
     while i < len(step.commands):
@@ -189,14 +253,11 @@ def _populate_step_fields(step: Step, sigil: str) -> None:
         if name == "FROM":
             vars_out: List[str] = []
             for item in _split_csv_items(cmd.payload):
-                token = item.strip()
-                if not token.startswith(sigil):
-                    raise ParseError(
-                        f"Line {cmd.line_no}: /FROM expects variable references prefixed with {sigil!r}"
-                    )
-                token = token[len(sigil):].strip()
-                token = _validate_var_name(token, line_no=cmd.line_no, source="/FROM")
-                vars_out.append(token)
+                var_name, description = _parse_from_item(item, line_no=cmd.line_no, sigil=sigil)
+                if var_name is not None:
+                    vars_out.append(var_name)
+                else:
+                    from_descriptions.append(description)
             from_vars = vars_out
             i += 1
             continue
@@ -224,14 +285,66 @@ def _populate_step_fields(step: Step, sigil: str) -> None:
             i += 1
             continue
 
+        if name == "CALL":
+            if call is not None:
+                raise ParseError(f"Line {cmd.line_no}: /CALL may appear at most once per step")
+            call = cmd.payload.strip()
+            if not _VAR_NAME_PATTERN.match(call):
+                raise ParseError(f"Line {cmd.line_no}: /CALL requires one function name, got {call!r}")
+            i += 1
+            continue
+
+        if name == "MAP":
+            if map_over is not None:
+                raise ParseError(f"Line {cmd.line_no}: /MAP may appear at most once per step")
+            target = cmd.payload.strip()
+            if not target.startswith(sigil) or len(target.split()) != 1:
+                raise ParseError(f"Line {cmd.line_no}: /MAP requires exactly one {sigil}variable")
+            map_over = _validate_var_name(target[len(sigil):], line_no=cmd.line_no, source="/MAP")
+            i += 1
+            continue
+
+        if name in {"IF", "UNLESS"}:
+            if condition is not None:
+                raise ParseError(f"Line {cmd.line_no}: at most one /IF or /UNLESS per step")
+            target = cmd.payload.strip()
+            if not target.startswith(sigil) or len(target.split()) != 1:
+                raise ParseError(f"Line {cmd.line_no}: /{name} requires exactly one {sigil}variable")
+            condition = _validate_var_name(target[len(sigil):], line_no=cmd.line_no, source=f"/{name}")
+            condition_negated = name == "UNLESS"
+            i += 1
+            continue
+
         if name in {"TYPE", "AS"}:
             raise ParseError(f"Line {cmd.line_no}: /{name} is only valid inside a /DEF block")
 
         i += 1
 
+    if call is not None:
+        if out_lines:
+            raise ParseError(f"Step {step.index} (line {step.start_line_no}): /OUT cannot be combined with /CALL")
+        if from_descriptions:
+            raise ParseError(
+                f"Step {step.index} (line {step.start_line_no}): /CALL arguments must be {sigil}variables, not descriptions"
+            )
+
+    if map_over is not None:
+        if call is not None:
+            raise ParseError(f"Step {step.index} (line {step.start_line_no}): /MAP cannot be combined with /CALL")
+        for spec in defs:
+            if list_item_type(spec.value_type) is None:
+                raise ParseError(
+                    f"Line {spec.line_no}: /DEF {spec.var_name} in a /MAP step must have a list[...] /TYPE"
+                )
+
     step.from_vars = from_vars
+    step.from_descriptions = from_descriptions
     step.defs = defs
     step.out_text = "\n".join(out_lines) if out_lines else None
+    step.call = call
+    step.map_over = map_over
+    step.condition = condition
+    step.condition_negated = condition_negated
 
 
 def _finalize_step(builder: _StepBuilder, steps: List[Step], sigil: str) -> None:
@@ -266,16 +379,54 @@ def _extract_step_embedded_refs(step: Step, sigil: str) -> set[str]:
 
 
 def _validate_from_symbols(steps: List[Step], sigil: str) -> None:
-    known_vars: set[str] = set()
+    known_vars: set[str] = set(BUILTIN_VARS)
+    known_types: Dict[str, str] = {}
     for step in steps:
+        for spec in step.defs:
+            if spec.var_name in BUILTIN_VARS or spec.var_name == MAP_ITEM_VAR:
+                raise ParseError(
+                    f"Line {spec.line_no}: {sigil}{spec.var_name} is a built-in variable and cannot be defined"
+                )
+        if step.condition is not None:
+            keyword = "/UNLESS" if step.condition_negated else "/IF"
+            if step.condition not in known_types:
+                raise ParseError(
+                    f"Step {step.index} (line {step.start_line_no}): {keyword} references undefined variable {sigil}{step.condition}"
+                )
+            if known_types[step.condition] != "bool":
+                raise ParseError(
+                    f"Step {step.index} (line {step.start_line_no}): {keyword} {sigil}{step.condition} is not a bool variable"
+                )
+        step_vars = set(known_vars)
+        if step.map_over is not None:
+            if step.map_over not in known_types:
+                raise ParseError(
+                    f"Step {step.index} (line {step.start_line_no}): /MAP references undefined variable {sigil}{step.map_over}"
+                )
+            if list_item_type(known_types[step.map_over]) is None:
+                raise ParseError(
+                    f"Step {step.index} (line {step.start_line_no}): /MAP {sigil}{step.map_over} is not a list[...] variable"
+                )
+            step_vars.add(MAP_ITEM_VAR)
         embedded_refs = _extract_step_embedded_refs(step, sigil=sigil)
+        if MAP_ITEM_VAR in embedded_refs and step.map_over is None:
+            raise ParseError(
+                f"Step {step.index} (line {step.start_line_no}): {sigil}{MAP_ITEM_VAR} is only available in /MAP steps"
+            )
         if step.from_vars is not None:
             allowed = set(step.from_vars)
+            if step.map_over is not None:
+                allowed.add(MAP_ITEM_VAR)
             for name in step.from_vars:
-                if name not in known_vars:
+                if name not in step_vars:
                     raise ParseError(
                         f"Step {step.index} (line {step.start_line_no}): /FROM references undefined variable {sigil}{name}"
                     )
+            for desc in step.from_descriptions:
+                if desc.scope_var is not None and desc.scope_var not in known_vars:
+                    raise ParseError(
+                        f"Step {step.index} (line {step.start_line_no}): /IN references undefined variable {sigil}{desc.scope_var}"
+                    )
             for name in sorted(embedded_refs):
                 if name not in allowed:
                     raise ParseError(
@@ -283,6 +434,7 @@ def _validate_from_symbols(steps: List[Step], sigil: str) -> None:
                     )
         for spec in step.defs:
             known_vars.add(spec.var_name)
+            known_types[spec.var_name] = spec.value_type
 
 
 def parse_dsl(text: str, sigil: str = "@") -> List[Step]:
@@ -348,10 +500,53 @@ def steps_to_dicts(steps: List[Step]) -> List[Dict[str, Any]]:
                 for d in st.defs
             ],
             "out_text": st.out_text,
+            "from_descriptions": [
+                {"text": d.text, "scope_var": d.scope_var, "line_no": d.line_no}
+                for d in st.from_descriptions
+            ],
             "commands": [
                 {"name": cmd.name, "payload": cmd.payload, "line_no": cmd.line_no}
                 for cmd in st.commands
             ],
+            "call": st.call,
+            "map_over": st.map_over,
+            "condition": st.condition,
+            "condition_negated": st.condition_negated,
         }
         for st in steps
     ]
+
+
+def steps_from_dicts(items: List[Dict[str, Any]]) -> List[Step]:
+    """Rebuild Step objects from `steps_to_dicts` output (e.g. after JSON transport)."""
+    return [
+        Step(
+            index=item["index"],
+            start_line_no=item["start_line_no"],
+            text=item["text"],
+            commands=[
+                Command(name=cmd["name"], payload=cmd["payload"], line_no=cmd["line_no"])
+                for cmd in item.get("commands", [])
+            ],
+            from_vars=list(item["from_vars"]) if item.get("from_vars") is not None else None,
+            defs=[
+                DefSpec(
+                    var_name=d["var_name"],
+                    value_type=d["value_type"],
+                    as_text=d.get("as_text"),
+                    line_no=d.get("line_no", 0),
+                )
+                for d in item.get("defs", [])
+            ],
+            out_text=item.get("out_text"),
+            from_descriptions=[
+                FromDescription(text=d["text"], scope_var=d.get("scope_var"), line_no=d.get("line_no", 0))
+                for d in item.get("from_descriptions", [])
+            ],
+            call=item.get("call"),
+            map_over=item.get("map_over"),
+            condition=item.get("condition"),
+            condition_negated=bool(item.get("condition_negated", False)),
+        )
+        for item in items
+    ]
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from coalesce_v02 import call_key
+from executor_v02 import ModelCall, ResponseSchema
+
+
+@dataclass
+class TraceEntry:
+    """One recorded model call; `error` is set instead of `response` when the call raised."""
+
+    prompt: str
+    response_schema: ResponseSchema
+    response: Optional[str]
+    latency_s: float
+    generation_config: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def key(self) -> str:
+        return call_key(None, self.prompt, self.response_schema, self.generation_config)
+
+
+def load_trace(path: Path | str) -> List[TraceEntry]:
+    """Entries of a JSON-lines trace written by RecordingCaller, in call order."""
+    entries: List[TraceEntry] = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            entries.append(TraceEntry(**json.loads(line)))
+    return entries
+
+
+class RecordingCaller:
+    """
+    ModelCall wrapper that appends every call (prompt, schema, response,
+    latency) to a JSON-lines trace file. Lines are written as calls finish,
+    so a trace survives a crashed run; failed calls are recorded with their
+    error and re-raised.
+    """
+
+    def __init__(
+        self,
+        call_model: ModelCall,
+        path: Path | str,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.call_model = call_model
+        self.model_id = getattr(call_model, "model_id", None)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def __call__(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        started = self._clock()
+        entry = TraceEntry(
+            prompt=prompt,
+            response_schema=response_schema,
+            response=None,
+            latency_s=0.0,
+            generation_config=kwargs.get("generation_config"),
+        )
+        try:
+            entry.response = self.call_model(prompt, response_schema, **kwargs)
+            return entry.response
+        except Exception as exc:
+            entry.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            entry.latency_s = round(self._clock() - started, 6)
+            line = json.dumps(asdict(entry), ensure_ascii=False)
+            with self._lock:
+                with self.path.open("a", encoding="utf-8") as fh:
+                    fh.write(line + "\n")
+                self.recorded += 1
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+class ReplayCaller:
+    """
+    ModelCall that serves recorded responses instead of calling a model.
+    Calls are matched by prompt, schema and generation config; repeated
+    identical calls get their recordings in order, and the last one is reused
+    once they run out. `latency_scale` replays the recorded latency times that
+    factor (None or 0 answers immediately). Recorded failures are raised
+    again as RuntimeError; an unrecorded call raises ReplayMiss.
+    `simulated_latency_s` sums every replayed delay; `model_wait_s` is the
+    wall time during which at least one delay was running, which is what
+    concurrent calls (e.g. /MAP elements) actually cost.
+    """
+
+    def __init__(
+        self,
+        trace: List[TraceEntry] | Path | str,
+        latency_scale: Optional[float] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        entries = trace if isinstance(trace, list) else load_trace(trace)
+        self.latency_scale = latency_scale
+        self._sleep = sleep
+        self._queues: Dict[str, Deque[TraceEntry]] = {}
+        for entry in entries:
+            self._queues.setdefault(entry.key(), deque()).append(entry)
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = 0
+        self.simulated_latency_s = 0.0
+        self.model_wait_s = 0.0
+        self._waiting = 0
+        self._wait_started = 0.0
+
+    def _wait(self, delay: float) -> None:
+        with self._lock:
+            if self._waiting == 0:
+                self._wait_started = time.perf_counter()
+            self._waiting += 1
+        try:
+            self._sleep(delay)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                if self._waiting == 0:
+                    self.model_wait_s += time.perf_counter() - self._wait_started
+
+    def __call__(self, prompt: str, response_schema: ResponseSchema, **kwargs: Any) -> str:
+        key = call_key(None, prompt, response_schema, kwargs.get("generation_config"))
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                self.misses += 1
+                raise ReplayMiss(f"no recorded response for prompt starting {prompt[:80]!r}")
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.served += 1
+            delay = entry.latency_s * self.latency_scale if self.latency_scale else 0.0
+            self.simulated_latency_s += delay
+        if delay > 0:
+            self._wait(delay)
+        if entry.error is not None:
+            raise RuntimeError(f"replayed failure: {entry.error}")
+        return entry.response
+
+
+def benchmark_replay(
+    run: Callable[[ModelCall], Any],
+    trace: List[TraceEntry] | Path | str,
+    repeats: int = 5,
+    latency_scale: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Time `run(call_model)` (e.g. a run_dsl_text call) against a replayed trace.
+    Each repeat gets a fresh ReplayCaller, so results are reproducible.
+    `overhead_s` is wall time minus the time spent waiting on replayed
+    latency (overlapping waits count once): the cost of the executor and
+    everything around it.
+    """
+    entries = trace if isinstance(trace, list) else load_trace(trace)
+    wall: List[float] = []
+    overhead: List[float] = []
+    for _ in range(max(1, repeats)):
+        caller = ReplayCaller(entries, latency_scale=latency_scale)
+        started = time.perf_counter()
+        run(caller)
+        elapsed = time.perf_counter() - started
+        wall.append(elapsed)
+        overhead.append(max(0.0, elapsed - caller.model_wait_s))
+    return {
+        "repeats": len(wall),
+        "calls": caller.served,
+        "misses": caller.misses,
+        "wall_s": {"median": statistics.median(wall), "min": min(wall), "max": max(wall)},
+        "overhead_s": {"median": statistics.median(overhead), "min": min(overhead), "max": max(overhead)},
+        "simulated_latency_s": caller.simulated_latency_s,
+        "model_wait_s": caller.model_wait_s,
+    }
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from common_v02 import step_label
+from executor_v02 import ModelCall, ResponseSchema
+from parser_v02 import Step
+from tokens_v02 import count_tokens
+
+
+POLICY_CHEAPEST_THAT_PASSES = "cheapest_that_passes"
+POLICY_LATENCY_SLO = "latency_slo"
+POLICY_CHEAP_FIRST = "cheap_first"
+POLICIES = (POLICY_CHEAPEST_THAT_PASSES, POLICY_LATENCY_SLO, POLICY_CHEAP_FIRST)
+
+_STRUCTURED_TYPES = frozenset({"bool", "int", "float"})
+_DEFAULT_MIN_SUCCESS_RATE = 0.9
+_DEFAULT_MIN_SAMPLES = 3
+_DEFAULT_HISTORY_SIZE = 50
+
+
+def step_key(step: Step) -> str:
+    """Stable identity of a step across runs: its text and /DEF contract, not its inputs."""
+    digest = hashlib.sha256(step.text.encode("utf-8"))
+    for spec in step.defs:
+        digest.update(f"\x00{spec.var_name}:{spec.value_type}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class StepFeatures:
+    step_key: str
+    label: str
+    prompt_tokens: int
+    def_types: Tuple[str, ...]
+    # Every /DEF is a bool/int/float extraction and there is no /OUT intent.
+    structured_only: bool
+
+    @classmethod
+    def from_step(cls, step: Step, prompt: str) -> "StepFeatures":
+        def_types = tuple(spec.value_type for spec in step.defs)
+        structured = bool(def_types) and all(t in _STRUCTURED_TYPES for t in def_types)
+        return cls(
+            step_key=step_key(step),
+            label=step_label(step.text),
+            prompt_tokens=count_tokens(prompt),
+            def_types=def_types,
+            structured_only=structured and step.out_text is None,
+        )
+
+
+@dataclass
+class ModelRoute:
+    """One model the router may pick; `cost_per_1k_tokens` only needs to be comparable."""
+
+    name: str
+    call_model: ModelCall
+    cost_per_1k_tokens: float
+    model_id: Optional[str] = None
+    # Skip this route for prompts larger than this (e.g. a small context window).
+    max_prompt_tokens: Optional[int] = None
+
+
+@dataclass
+class RoutingDecision:
+    route: ModelRoute
+    policy: str
+    reason: str
+    features: StepFeatures
+
+    @property
+    def call_model(self) -> ModelCall:
+        return self.route.call_model
+
+    def as_log(self) -> Dict[str, Any]:
+        log: Dict[str, Any] = {
+            "model": self.route.name,
+            "policy": self.policy,
+            "reason": self.reason,
+            "step_key": self.features.step_key,
+            "prompt_tokens": self.features.prompt_tokens,
+        }
+        if self.route.model_id:
+            log["model_id"] = self.route.model_id
+        return log
+
+
+@dataclass
+class RouteStats:
+    attempts: int = 0
+    successes: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=_DEFAULT_HISTORY_SIZE))
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    def copy(self) -> "RouteStats":
+        return RouteStats(self.attempts, self.successes, deque(self.latencies, maxlen=self.latencies.maxlen))
+
+    def latency_percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+
+@dataclass
+class CascadeStats:
+    label: str
+    runs: int = 0
+    escalations: int = 0
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalations / self.runs if self.runs else 0.0
+
+
+class RoutingHistory:
+    """Per-step and per-model validation outcomes and latencies, shared across runs."""
+
+    def __init__(self) -> None:
+        self._by_step: Dict[Tuple[str, str], RouteStats] = {}
+        self._by_model: Dict[str, RouteStats] = {}
+        self._cascades: Dict[str, CascadeStats] = {}
+        self._lock = threading.Lock()
+
+    def record_cascade(self, step_key: str, label: str, escalated: bool = False) -> None:
+        """Count a cheap-first run of a step, or (escalated=True) one escalation of it."""
+        with self._lock:
+            stats = self._cascades.setdefault(step_key, CascadeStats(label=label))
+            if escalated:
+                stats.escalations += 1
+            else:
+                stats.runs += 1
+
+    def escalation_report(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "step_key": key,
+                    "step": stats.label,
+                    "runs": stats.runs,
+                    "escalations": stats.escalations,
+                    "escalation_rate": round(stats.escalation_rate, 3),
+                }
+                for key, stats in sorted(
+                    self._cascades.items(), key=lambda item: -item[1].escalation_rate
+                )
+            ]
+
+    def record(self, step_key: str, route_name: str, ok: bool, latency_s: float) -> None:
+        with self._lock:
+            for stats in (
+                self._by_step.setdefault((step_key, route_name), RouteStats()),
+                self._by_model.setdefault(route_name, RouteStats()),
+            ):
+                stats.attempts += 1
+                stats.successes += int(ok)
+                stats.latencies.append(latency_s)
+
+    def for_step(self, step_key: str, route_name: str) -> RouteStats:
+        with self._lock:
+            stats = self._by_step.get((step_key, route_name))
+            return stats.copy() if stats is not None else RouteStats()
+
+    def for_model(self, route_name: str) -> RouteStats:
+        with self._lock:
+            stats = self._by_model.get(route_name)
+            return stats.copy() if stats is not None else RouteStats()
+
+
+class ModelRouter:
+    """
+    Pick a model per step.
+    `cheapest_that_passes` takes the cheapest route whose history for this step
+    shows at least `min_success_rate` valid responses; without enough history,
+    cheaper routes are only tried for short bool/int/float extractions.
+    `latency_slo` applies the same filter, then takes the cheapest route whose
+    p90 latency is within `latency_slo_s` (or the fastest when none is).
+    `cheap_first` always starts on the cheapest route and escalates a step to
+    the next route when its response breaks the contract.
+    The most expensive route is the fallback.
+    """
+
+    def __init__(
+        self,
+        routes: Sequence[ModelRoute],
+        policy: str = POLICY_CHEAPEST_THAT_PASSES,
+        history: Optional[RoutingHistory] = None,
+        min_success_rate: float = _DEFAULT_MIN_SUCCESS_RATE,
+        min_samples: int = _DEFAULT_MIN_SAMPLES,
+        latency_slo_s: Optional[float] = None,
+    ) -> None:
+        if not routes:
+            raise ValueError("at least one route is required")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown routing policy {policy!r}; expected one of {list(POLICIES)}")
+        if policy == POLICY_LATENCY_SLO and not latency_slo_s:
+            raise ValueError("latency_slo policy requires latency_slo_s")
+        self.routes: List[ModelRoute] = sorted(routes, key=lambda r: r.cost_per_1k_tokens)
+        self.policy = policy
+        self.history = history or RoutingHistory()
+        self.min_success_rate = min_success_rate
+        self.min_samples = max(1, min_samples)
+        self.latency_slo_s = latency_slo_s
+
+    def _qualifies(self, route: ModelRoute, features: StepFeatures) -> Tuple[bool, str]:
+        if not self._fits(route, features):
+            return False, f"prompt too large for {route.name}"
+        if route is self.routes[-1]:
+            return True, "most capable route"
+        stats = self.history.for_step(features.step_key, route.name)
+        if stats.attempts >= self.min_samples:
+            rate = stats.success_rate
+            verdict = rate >= self.min_success_rate
+            return verdict, f"{route.name} valid {rate:.0%} of {stats.attempts} runs"
+        if features.structured_only:
+            return True, "short structured extraction"
+        return False, "no history; step needs free-form generation"
+
+    def _p90(self, route: ModelRoute, features: StepFeatures) -> Optional[float]:
+        stats = self.history.for_step(features.step_key, route.name)
+        if not stats.latencies:
+            stats = self.history.for_model(route.name)
+        return stats.latency_percentile(0.9)
+
+    def _fits(self, route: ModelRoute, features: StepFeatures) -> bool:
+        return route.max_prompt_tokens is None or features.prompt_tokens <= route.max_prompt_tokens
+
+    def route(self, step: Step, prompt: str, response_schema: ResponseSchema) -> RoutingDecision:
+        features = StepFeatures.from_step(step, prompt)
+        if self.policy == POLICY_CHEAP_FIRST:
+            route = next((r for r in self.routes if self._fits(r, features)), self.routes[-1])
+            self.history.record_cascade(features.step_key, features.label)
+            return RoutingDecision(route, self.policy, "cheap first", features)
+
+        candidates: List[Tuple[ModelRoute, str]] = []
+        for route in self.routes:
+            ok, reason = self._qualifies(route, features)
+            if ok:
+                candidates.append((route, reason))
+        if not candidates:
+            # Every route is over its prompt limit; the largest model is the best bet.
+            return RoutingDecision(self.routes[-1], self.policy, "fallback", features)
+
+        if self.policy == POLICY_CHEAPEST_THAT_PASSES:
+            route, reason = candidates[0]
+            return RoutingDecision(route, self.policy, reason, features)
+
+        timed = [(route, reason, self._p90(route, features)) for route, reason in candidates]
+        for route, reason, p90 in timed:
+            if p90 is None or p90 <= self.latency_slo_s:
+                within = "no latency data" if p90 is None else f"p90 {p90:.1f}s"
+                return RoutingDecision(route, self.policy, f"{reason}; {within}", features)
+        route, reason, p90 = min(timed, key=lambda item: item[2])
+        return RoutingDecision(
+            route, self.policy, f"{reason}; fastest, p90 {p90:.1f}s over SLO", features
+        )
+
+    def observe(self, decision: RoutingDecision, ok: bool, latency_s: float) -> None:
+        self.history.record(decision.features.step_key, decision.route.name, ok, latency_s)
+
+    def escalate(self, decision: RoutingDecision, error: Exception) -> Optional[RoutingDecision]:
+        """Next route to retry a step whose response broke the contract (cheap_first only)."""
+        if self.policy != POLICY_CHEAP_FIRST:
+            return None
+        features = decision.features
+        position = self.routes.index(decision.route)
+        for route in self.routes[position + 1 :]:
+            if self._fits(route, features):
+                self.history.record_cascade(features.step_key, features.label, escalated=True)
+                reason = f"escalated from {decision.route.name}: {type(error).__name__}"
+                return RoutingDecision(route, self.policy, reason, features)
+        return None
+
+    def cascade_savings(self) -> Dict[str, Any]:
+        """Share of cheap-first runs kept on the cheapest route and the estimated cost saved."""
+        report = self.history.escalation_report()
+        runs = sum(item["runs"] for item in report)
+        escalations = sum(item["escalations"] for item in report)
+        cheap, main = self.routes[0], self.routes[-1]
+        saved = 0.0
+        if runs and main.cost_per_1k_tokens > 0:
+            # Relative to running every step on the main route once.
+            spent = runs * cheap.cost_per_1k_tokens + escalations * main.cost_per_1k_tokens
+            saved = 1 - spent / (runs * main.cost_per_1k_tokens)
+        latency = {
+            route.name: self.history.for_model(route.name).latency_percentile(0.5)
+            for route in self.routes
+        }
+        return {
+            "runs": runs,
+            "escalations": escalations,
+            "escalation_rate": round(escalations / runs, 3) if runs else 0.0,
+            "estimated_cost_saved": round(saved, 3),
+            "p50_latency_s": latency,
+        }
@@ -1,10 +1,26 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
-from executor_v02 import ModelCall, execute_steps
-from parser_v02 import ParseError, steps_to_dicts, parse_dsl
+from executor_v02 import (
+    DEFAULT_MAP_WORKERS,
+    BuiltinValues,
+    DescriptionRetriever,
+    GenerationSettings,
+    LocalFunctions,
+    MapResultCache,
+    ModelCall,
+    PromptBudgeter,
+    StepCallback,
+    StepRouter,
+    execute_steps,
+)
+from checkpoint_v02 import CheckpointRecorder, RunCheckpoint, resume_plan
+from functions_v02 import default_functions
+from fusion_v02 import execute_fused_steps
+from parser_v02 import ParseError, Step, steps_to_dicts, parse_dsl
 
 
 @dataclass
@@ -15,12 +31,36 @@ class RunResult:
     vars_after: Dict[str, Any]
     parsed_steps: List[Dict[str, Any]]
     error: Optional[str] = None
+    checkpoint: Optional[Dict[str, Any]] = None
+
+
+def _failed_checkpoint(
+    recorder: Optional[CheckpointRecorder], resume_from: Optional[RunCheckpoint], error: str
+) -> Optional[Dict[str, Any]]:
+    if recorder is not None:
+        return recorder.fail(error).to_dict()
+    # The resume itself was rejected: hand back the checkpoint it was given, unchanged.
+    return resume_from.to_dict() if resume_from is not None else None
 
 
 def run_dsl_text(
     text: str,
     context: Dict[str, Any],
     call_model: Optional[ModelCall] = None,
+    on_step: Optional[StepCallback] = None,
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    router: Optional[StepRouter] = None,
+    fuse_steps: bool = False,
+    generation: Optional[GenerationSettings] = None,
+    reference_min_chars: Optional[int] = None,
+    repair_attempts: int = 0,
+    functions: Optional[LocalFunctions] = None,
+    map_workers: int = DEFAULT_MAP_WORKERS,
+    map_cache: Optional[MapResultCache] = None,
+    budget: Optional[PromptBudgeter] = None,
+    checkpoint_path: Optional[Path | str] = None,
+    resume_from: Optional[RunCheckpoint] = None,
 ) -> RunResult:
     """
     App-facing helper for parse + execute.
@@ -37,24 +77,133 @@ def run_dsl_text(
             parsed_steps=[],
             error=f"Parse error: {exc}",
         )
+    return run_steps(
+        steps,
+        context,
+        call_model=call_model,
+        on_step=on_step,
+        builtins=builtins,
+        retriever=retriever,
+        router=router,
+        fuse_steps=fuse_steps,
+        generation=generation,
+        reference_min_chars=reference_min_chars,
+        repair_attempts=repair_attempts,
+        functions=functions,
+        map_workers=map_workers,
+        map_cache=map_cache,
+        budget=budget,
+        checkpoint_path=checkpoint_path,
+        resume_from=resume_from,
+    )
+
 
+def run_steps(
+    steps: List[Step],
+    context: Dict[str, Any],
+    call_model: Optional[ModelCall] = None,
+    on_step: Optional[StepCallback] = None,
+    builtins: Optional[BuiltinValues] = None,
+    retriever: Optional[DescriptionRetriever] = None,
+    router: Optional[StepRouter] = None,
+    fuse_steps: bool = False,
+    generation: Optional[GenerationSettings] = None,
+    reference_min_chars: Optional[int] = None,
+    repair_attempts: int = 0,
+    functions: Optional[LocalFunctions] = None,
+    map_workers: int = DEFAULT_MAP_WORKERS,
+    map_cache: Optional[MapResultCache] = None,
+    budget: Optional[PromptBudgeter] = None,
+    checkpoint_path: Optional[Path | str] = None,
+    resume_from: Optional[RunCheckpoint] = None,
+) -> RunResult:
+    """
+    Execute already-parsed steps; lets callers reuse one parse across many runs.
+    `fuse_steps` sends independent consecutive steps as one model call (see fusion_v02).
+    `reference_min_chars` puts large inputs in a cacheable prompt prefix (see context_cache_v02).
+    `repair_attempts` bounds the follow-ups sent for a response that breaks the contract.
+    /CALL steps use `functions`, by default the built-ins of functions_v02.
+    /MAP steps run up to `map_workers` element calls at once and reuse
+    element results from `map_cache` (see map_cache_v02).
+    `budget` enforces a prompt token limit before each model call (see budget_v02).
+    Every committed step is checkpointed; a failed result keeps the outputs,
+    logs and context of the steps committed before the failure and carries the
+    checkpoint, which is also written to `checkpoint_path` after each commit
+    and removed on success. `resume_from` skips the checkpointed steps whose
+    program prefix is unchanged and continues with their committed context.
+    """
+    if fuse_steps and router is not None:
+        raise ValueError("fuse_steps cannot be combined with a router")
+    if functions is None:
+        functions = default_functions()
+    start = 0
     ctx = dict(context)
+    resumed_logs: List[Dict[str, Any]] = []
+    recorder: Optional[CheckpointRecorder] = None
+
+    def _on_step(step_log: Dict[str, Any]) -> None:
+        recorder.record(step_log)
+        if on_step is not None:
+            on_step(step_log)
+
     try:
-        ctx, logs, outputs = execute_steps(steps, context=ctx, call_model=call_model)
+        if resume_from is not None:
+            plan = resume_plan(resume_from, steps, context)
+            plan.replay(builtins=builtins, retriever=retriever)
+            start, ctx, resumed_logs = plan.start, plan.context, plan.logs
+        recorder = CheckpointRecorder(steps, context, path=checkpoint_path, resumed_logs=resumed_logs)
+        if fuse_steps:
+            ctx, logs, outputs = execute_fused_steps(
+                steps[start:],
+                context=ctx,
+                call_model=call_model,
+                on_step=_on_step,
+                builtins=builtins,
+                retriever=retriever,
+                generation=generation,
+                reference_min_chars=reference_min_chars,
+                repair_attempts=repair_attempts,
+                functions=functions,
+                map_workers=map_workers,
+                map_cache=map_cache,
+                budget=budget,
+            )
+        else:
+            ctx, logs, outputs = execute_steps(
+                steps[start:],
+                context=ctx,
+                call_model=call_model,
+                on_step=_on_step,
+                builtins=builtins,
+                retriever=retriever,
+                router=router,
+                generation=generation,
+                reference_min_chars=reference_min_chars,
+                repair_attempts=repair_attempts,
+                functions=functions,
+                map_workers=map_workers,
+                map_cache=map_cache,
+                budget=budget,
+            )
     except Exception as exc:  # runtime/model errors are surfaced to UI
+        error = f"Execution error: {exc}"
+        # Steps committed before the failure (resumed ones included) stay visible.
+        committed = list(recorder.checkpoint.logs) if recorder is not None else []
         return RunResult(
             ok=False,
-            outputs=[],
-            logs=[],
-            vars_after=dict(context),
+            outputs=[log["parsed_json"]["out"] for log in committed],
+            logs=committed,
+            vars_after=recorder.checkpoint.context_after(len(committed)) if recorder is not None else dict(context),
             parsed_steps=steps_to_dicts(steps),
-            error=f"Execution error: {exc}",
+            error=error,
+            checkpoint=_failed_checkpoint(recorder, resume_from, error),
         )
 
+    recorder.clear()
     return RunResult(
         ok=True,
-        outputs=outputs,
-        logs=logs,
+        outputs=[log["parsed_json"]["out"] for log in resumed_logs] + outputs,
+        logs=resumed_logs + logs,
         vars_after=ctx,
         parsed_steps=steps_to_dicts(steps),
         error=None,
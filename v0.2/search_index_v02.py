@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from common_v02 import ChatRegistry, value_text
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was "
+    "were will with".split()
+)
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+_DEFAULT_TOP_K = 4
+_DEFAULT_CHUNK_WORDS = 120
+_DEFAULT_CHUNK_OVERLAP = 30
+
+# Scope names understood by ChatSearchIndex.search besides regular variables.
+_SCOPE_ALL = "ALL"
+_SCOPE_CHAT = "CHAT"
+
+
+def tokenize(text: str) -> List[str]:
+    return [tok for tok in _TOKEN_PATTERN.findall(text.lower()) if tok not in _STOPWORDS]
+
+
+def chunk_text(
+    text: str, chunk_words: int = _DEFAULT_CHUNK_WORDS, overlap: int = _DEFAULT_CHUNK_OVERLAP
+) -> List[str]:
+    """Split text into word windows of `chunk_words` that overlap by `overlap` words."""
+    words = text.split()
+    if len(words) <= chunk_words:
+        return [text] if text.strip() else []
+    stride = max(1, chunk_words - max(0, overlap))
+    chunks = []
+    for start in range(0, len(words), stride):
+        chunks.append(" ".join(words[start : start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+@dataclass
+class SearchHit:
+    doc_id: str
+    source: str
+    score: float
+    text: str
+
+
+class InvertedIndex:
+    """BM25 over an in-memory inverted index; documents can be added and removed at any time."""
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._docs: Dict[str, Tuple[str, str, int]] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, text: str, source: str) -> None:
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._docs[doc_id] = (source, text, len(tokens))
+        self._total_len += len(tokens)
+
+    def remove(self, doc_id: str) -> None:
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        self._total_len -= entry[2]
+        for term in set(tokenize(entry[1])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(
+        self, query: str, k: int = _DEFAULT_TOP_K, sources: Optional[set[str]] = None
+    ) -> List[SearchHit]:
+        n_docs = len(self._docs)
+        if n_docs == 0:
+            return []
+        avg_len = self._total_len / n_docs or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                source, _, length = self._docs[doc_id]
+                if sources is not None and source not in sources:
+                    continue
+                denom = tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_BM25_K1 + 1) / denom
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[: max(0, k)]
+        return [
+            SearchHit(doc_id=doc_id, source=self._docs[doc_id][0], score=score, text=self._docs[doc_id][1])
+            for doc_id, score in ranked
+        ]
+
+
+class ChatSearchIndex:
+    """
+    Per-chat index over history messages and chunked variable values.
+    Messages are indexed as the timeline grows; when it changed (an edit
+    replaced a suffix) they are re-indexed from the first differing message.
+    A variable is re-chunked only when its value changes and dropped when it
+    is no longer in the run's context. @ALL searches only see the variables
+    of the context they are called with. Runs use `for_timeline`, which syncs
+    the history to the run's own timeline in the same critical section as each
+    search, so concurrent runs on other branches never see each other's messages.
+    Implements the executor's description-retriever interface.
+    """
+
+    def __init__(
+        self,
+        top_k: int = _DEFAULT_TOP_K,
+        chunk_words: int = _DEFAULT_CHUNK_WORDS,
+        chunk_overlap: int = _DEFAULT_CHUNK_OVERLAP,
+    ) -> None:
+        self.top_k = top_k
+        self.chunk_words = chunk_words
+        self.chunk_overlap = chunk_overlap
+        self._index = InvertedIndex()
+        self._message_ids: List[str] = []
+        self._var_chunks: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def sync_history(self, messages: List[Dict[str, Any]]) -> int:
+        """Index the timeline from the first message that differs from the last sync; returns additions."""
+        with self._lock:
+            return self._sync_history_locked(messages)
+
+    def _sync_history_locked(self, messages: List[Dict[str, Any]]) -> int:
+        timeline = [msg for msg in messages if msg.get("id")]
+        keep = 0
+        while (
+            keep < min(len(self._message_ids), len(timeline))
+            and self._message_ids[keep] == str(timeline[keep].get("id"))
+        ):
+            keep += 1
+        for msg_id in self._message_ids[keep:]:
+            self._index.remove(f"msg:{msg_id}")
+        del self._message_ids[keep:]
+        for msg in timeline[keep:]:
+            content = str(msg.get("content", ""))
+            self._index.add(f"msg:{msg['id']}", f"{msg.get('role', 'assistant')}: {content}", "CHAT")
+            self._message_ids.append(str(msg["id"]))
+        return len(timeline) - keep
+
+    def for_timeline(self, messages: List[Dict[str, Any]]) -> "TimelineSearch":
+        """Retriever for one run over `messages` (its projected timeline)."""
+        return TimelineSearch(self, messages)
+
+    def index_variable(self, name: str, value: Any) -> bool:
+        """(Re)index one variable's chunks; returns False when the value is unchanged."""
+        text = value_text(value)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            previous = self._var_chunks.get(name)
+            if previous is not None and previous[0] == digest:
+                return False
+            if previous is not None:
+                self._remove_variable_locked(name)
+            chunks = chunk_text(text, self.chunk_words, self.chunk_overlap)
+            for i, chunk in enumerate(chunks):
+                self._index.add(f"var:{name}:{i}", chunk, f"var:{name}")
+            self._var_chunks[name] = (digest, len(chunks))
+            return True
+
+    def _remove_variable_locked(self, name: str) -> None:
+        _, count = self._var_chunks.pop(name)
+        for i in range(count):
+            self._index.remove(f"var:{name}:{i}")
+
+    def sync_variables(self, context: Dict[str, Any]) -> None:
+        """Index the context's variables and drop ones that left it (e.g. after an edit)."""
+        with self._lock:
+            for name in [name for name in self._var_chunks if name not in context]:
+                self._remove_variable_locked(name)
+        for name, value in context.items():
+            self.index_variable(name, value)
+
+    def search(
+        self,
+        description: str,
+        scope_var: Optional[str] = None,
+        k: Optional[int] = None,
+        variables: Optional[Iterable[str]] = None,
+    ) -> List[SearchHit]:
+        """Top hits in `scope_var`; for @ALL, `variables` limits which variables count."""
+        with self._lock:
+            return self._search_locked(description, scope_var, k, variables)
+
+    def _search_locked(
+        self,
+        description: str,
+        scope_var: Optional[str],
+        k: Optional[int],
+        variables: Optional[Iterable[str]],
+    ) -> List[SearchHit]:
+        if scope_var is None or scope_var == _SCOPE_ALL:
+            sources = None
+            if variables is not None:
+                sources = {"CHAT"} | {f"var:{name}" for name in variables}
+        elif scope_var == _SCOPE_CHAT:
+            sources = {"CHAT"}
+        else:
+            sources = {f"var:{scope_var}"}
+        return self._index.search(description, k=self.top_k if k is None else k, sources=sources)
+
+    def retrieve(
+        self,
+        description: str,
+        scope_var: Optional[str],
+        context: Dict[str, Any],
+        messages: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[str]:
+        """Texts for `description`; with `messages`, the history is first synced to that timeline."""
+        if scope_var not in (None, _SCOPE_ALL, _SCOPE_CHAT):
+            if scope_var in context:
+                self.index_variable(scope_var, context[scope_var])
+            return [hit.text for hit in self.search(description, scope_var)]
+        variables = None
+        if scope_var != _SCOPE_CHAT:
+            self.sync_variables(context)
+            # Another run on this chat may have synced a different context since.
+            variables = context
+        with self._lock:
+            if messages is not None:
+                self._sync_history_locked(messages)
+            hits = self._search_locked(description, scope_var, None, variables)
+        return [hit.text for hit in hits]
+
+    def record_commit(self, updates: Dict[str, Any]) -> None:
+        for name, value in updates.items():
+            self.index_variable(name, value)
+
+
+class TimelineSearch:
+    """A ChatSearchIndex seen from one run's timeline (see `ChatSearchIndex.for_timeline`)."""
+
+    def __init__(self, index: ChatSearchIndex, messages: List[Dict[str, Any]]) -> None:
+        self.index = index
+        self.messages = messages
+
+    def retrieve(self, description: str, scope_var: Optional[str], context: Dict[str, Any]) -> List[str]:
+        return self.index.retrieve(description, scope_var, context, messages=self.messages)
+
+    def record_commit(self, updates: Dict[str, Any]) -> None:
+        self.index.record_commit(updates)
+
+
+_INDEXES: ChatRegistry[ChatSearchIndex] = ChatRegistry(ChatSearchIndex)
+
+
+def index_for_chat(chat_id: str) -> ChatSearchIndex:
+    """Per-chat index shared by every run in this process (LRU bounded)."""
+    return _INDEXES.get(chat_id)
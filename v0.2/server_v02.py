@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import signal
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from executor_v02 import ModelCall
+from parser_v02 import ParseError, Step, parse_dsl, steps_to_dicts
+from runtime_v02 import RunResult, run_steps
+
+
+_MAX_BODY_BYTES = 8 * 1024 * 1024
+_DEFAULT_PARSE_CACHE_SIZE = 256
+_REJECT_DRAIN_TIMEOUT_S = 0.2
+_REJECT_DRAIN_MAX_BYTES = 64 * 1024
+_MAX_OVERFLOW_THREADS = 16
+
+
+class ParseCache:
+    """Thread-safe LRU of parsed programs keyed by DSL text hash."""
+
+    def __init__(self, max_entries: int = _DEFAULT_PARSE_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[Step]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, text: str) -> List[Step]:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+        steps = parse_dsl(text)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = steps
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return steps
+
+
+class DslService:
+    """
+    Request handling shared by every HTTP connection: one model caller, one
+    parse cache and one pool for fanning out batch items.
+    """
+
+    def __init__(
+        self,
+        call_model: Optional[ModelCall] = None,
+        batch_concurrency: int = 4,
+        parse_cache: Optional[ParseCache] = None,
+        reference_min_chars: Optional[int] = None,
+    ) -> None:
+        self.call_model = call_model
+        self.reference_min_chars = reference_min_chars
+        self.parse_cache = parse_cache or ParseCache()
+        self._batch_pool = ThreadPoolExecutor(
+            max_workers=max(1, batch_concurrency), thread_name_prefix="dsl-batch"
+        )
+
+    def close(self) -> None:
+        self._batch_pool.shutdown(wait=True)
+
+    def _parse_or_error(self, text: str, context: Dict[str, Any]) -> Tuple[Optional[List[Step]], Optional[RunResult]]:
+        try:
+            return self.parse_cache.parse(text), None
+        except ParseError as exc:
+            return None, RunResult(
+                ok=False,
+                outputs=[],
+                logs=[],
+                vars_after=dict(context),
+                parsed_steps=[],
+                error=f"Parse error: {exc}",
+            )
+
+    def parse(self, text: str) -> Dict[str, Any]:
+        try:
+            steps = self.parse_cache.parse(text)
+        except ParseError as exc:
+            return {"ok": False, "error": f"Parse error: {exc}", "parsed_steps": []}
+        return {"ok": True, "error": None, "parsed_steps": steps_to_dicts(steps)}
+
+    def run(
+        self,
+        text: str,
+        context: Dict[str, Any],
+        on_step: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> RunResult:
+        steps, failed = self._parse_or_error(text, context)
+        if failed is not None:
+            return failed
+        return run_steps(
+            steps,
+            context,
+            call_model=self.call_model,
+            on_step=on_step,
+            reference_min_chars=self.reference_min_chars,
+        )
+
+    def run_batch(self, text: str, contexts: List[Dict[str, Any]]) -> List[RunResult]:
+        steps, failed = self._parse_or_error(text, {})
+        if failed is not None:
+            return [
+                RunResult(
+                    ok=False,
+                    outputs=[],
+                    logs=[],
+                    vars_after=dict(ctx),
+                    parsed_steps=[],
+                    error=failed.error,
+                )
+                for ctx in contexts
+            ]
+        futures = [
+            self._batch_pool.submit(
+                run_steps,
+                steps,
+                ctx,
+                self.call_model,
+                reference_min_chars=self.reference_min_chars,
+            )
+            for ctx in contexts
+        ]
+        return [f.result() for f in futures]
+
+
+class _RequestError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _require_context(value: Any, name: str) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise _RequestError(400, f"'{name}' must be a JSON object")
+    return value
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "DslHTTPServer"
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, data: Any) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > _MAX_BODY_BYTES:
+            raise _RequestError(413, "request body too large")
+        raw = self.rfile.read(length) if length else b""
+        try:
+            data = json.loads(raw.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise _RequestError(400, f"request body is not valid JSON: {exc}") from exc
+        if not isinstance(data, dict):
+            raise _RequestError(400, "request body must be a JSON object")
+        text = data.get("text")
+        if not isinstance(text, str):
+            raise _RequestError(400, "'text' must be a string")
+        return data
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, self.server.stats())
+            return
+        self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        service = self.server.service
+        try:
+            if self.path not in {"/parse", "/run", "/run/batch", "/run/stream"}:
+                raise _RequestError(404, f"unknown path {self.path}")
+            data = self._read_json()
+
+            if self.path == "/parse":
+                self._send_json(200, service.parse(data["text"]))
+            elif self.path == "/run":
+                context = _require_context(data.get("context"), "context")
+                self._send_json(200, asdict(service.run(data["text"], context)))
+            elif self.path == "/run/batch":
+                contexts = data.get("contexts")
+                if not isinstance(contexts, list):
+                    raise _RequestError(400, "'contexts' must be a list of JSON objects")
+                contexts = [_require_context(c, "contexts[]") for c in contexts]
+                results = service.run_batch(data["text"], contexts)
+                self._send_json(200, {"results": [asdict(r) for r in results]})
+            else:
+                self._stream_run(data)
+        except _RequestError as exc:
+            self._send_json(exc.status, {"error": str(exc)})
+
+    def _stream_run(self, data: Dict[str, Any]) -> None:
+        context = _require_context(data.get("context"), "context")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        def emit(event: Dict[str, Any]) -> None:
+            self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+        result = self.server.service.run(
+            data["text"], context, on_step=lambda log: emit({"event": "step", "log": log})
+        )
+        emit({"event": "result", "result": asdict(result)})
+
+
+def _is_health_check(request: socket.socket) -> bool:
+    """Whether the connection's request line is `GET /health`, without consuming it."""
+    try:
+        request.settimeout(_REJECT_DRAIN_TIMEOUT_S)
+        head = request.recv(len(b"GET /health "), socket.MSG_PEEK | socket.MSG_WAITALL)
+        request.settimeout(None)
+    except OSError:
+        return False
+    return head == b"GET /health "
+
+
+class DslHTTPServer(HTTPServer):
+    """
+    HTTP server with a bounded worker pool.
+    At most `workers` requests run at once and `max_queue` more may wait; any
+    further connection is answered with 429 immediately instead of piling up.
+    Overflow connections are handled off the accept thread, and `GET /health`
+    is still served when every slot is taken.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        service: DslService,
+        workers: int = 8,
+        max_queue: int = 32,
+        verbose: bool = False,
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.service = service
+        self.verbose = verbose
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dsl-http")
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max(0, max_queue))
+        self._overflow = threading.BoundedSemaphore(_MAX_OVERFLOW_THREADS)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._served = 0
+        self._rejected = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {
+                "in_flight": self._in_flight,
+                "served": self._served,
+                "rejected": self._rejected,
+            }
+        stats["parse_cache"] = {
+            "hits": self.service.parse_cache.hits,
+            "misses": self.service.parse_cache.misses,
+        }
+        # Wrapped callers (coalescing, hedging) report their own counters.
+        caller_stats = getattr(self.service.call_model, "stats", None)
+        if callable(caller_stats):
+            stats["model_caller"] = caller_stats()
+        return stats
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        if not self._slots.acquire(blocking=False):
+            if not self._overflow.acquire(blocking=False):
+                # Even the overflow handlers are busy: drop without a reply.
+                with self._stats_lock:
+                    self._rejected += 1
+                self.shutdown_request(request)
+                return
+            threading.Thread(
+                target=self._process_overflow, args=(request, client_address), daemon=True
+            ).start()
+            return
+        with self._stats_lock:
+            self._in_flight += 1
+        self._pool.submit(self._process_in_worker, request, client_address)
+
+    def _process_in_worker(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._served += 1
+            self._slots.release()
+
+    def _process_overflow(self, request: Any, client_address: Any) -> None:
+        try:
+            if _is_health_check(request):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+                return
+            with self._stats_lock:
+                self._rejected += 1
+            self._reject_busy(request)
+        finally:
+            self._overflow.release()
+
+    def _reject_busy(self, request: Any) -> None:
+        body = json.dumps({"error": "server busy, retry later"}).encode("utf-8")
+        head = (
+            "HTTP/1.0 429 Too Many Requests\r\n"
+            "Content-Type: application/json\r\n"
+            "Retry-After: 1\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("ascii")
+        try:
+            request.sendall(head + body)
+            request.shutdown(socket.SHUT_WR)
+            # Read what the client already sent; closing with unread data would
+            # reset the connection before the client sees the 429. Bounded in
+            # time and size so a slow or endless upload cannot hold the thread.
+            deadline = time.monotonic() + _REJECT_DRAIN_TIMEOUT_S
+            drained = 0
+            while drained < _REJECT_DRAIN_MAX_BYTES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                request.settimeout(remaining)
+                chunk = request.recv(65536)
+                if not chunk:
+                    break
+                drained += len(chunk)
+        except OSError:
+            pass
+        self.close_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        # Drain queued and in-flight requests before tearing down shared layers.
+        self._pool.shutdown(wait=True)
+        self.service.close()
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    call_model: Optional[ModelCall] = None,
+    workers: int = 8,
+    max_queue: int = 32,
+    batch_concurrency: int = 4,
+    verbose: bool = False,
+    reference_min_chars: Optional[int] = None,
+) -> None:
+    """Run the service until SIGINT/SIGTERM, then finish in-flight requests and exit."""
+    service = DslService(
+        call_model=call_model,
+        batch_concurrency=batch_concurrency,
+        reference_min_chars=reference_min_chars,
+    )
+    server = DslHTTPServer(
+        (host, port), service, workers=workers, max_queue=max_queue, verbose=verbose
+    )
+
+    def _stop(_signum: int, _frame: Any) -> None:
+        # shutdown() blocks until serve_forever returns, so call it off the main thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    previous = {sig: signal.signal(sig, _stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
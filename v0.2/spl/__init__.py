@@ -0,0 +1,54 @@
+"""
+Headless entry point for the Chat DSL v0.2 core.
+
+Submodules and common names are imported on first attribute access, so
+`import spl` stays cheap for CLI start-up and never pulls in Streamlit.
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import Any, Dict, Tuple
+
+
+_SUBMODULES: Dict[str, str] = {
+    "parser": "parser_v02",
+    "executor": "executor_v02",
+    "runtime": "runtime_v02",
+    "gemini_client": "gemini_client_v02",
+    "model_adapters": "model_adapters_v02",
+    "state_store": "state_store_v02",
+    "versioning": "versioning_v02",
+}
+
+_EXPORTS: Dict[str, Tuple[str, str]] = {
+    "ParseError": ("parser_v02", "ParseError"),
+    "Step": ("parser_v02", "Step"),
+    "parse_dsl": ("parser_v02", "parse_dsl"),
+    "steps_to_dicts": ("parser_v02", "steps_to_dicts"),
+    "ModelCall": ("executor_v02", "ModelCall"),
+    "build_step_prompt": ("executor_v02", "build_step_prompt"),
+    "execute_steps": ("executor_v02", "execute_steps"),
+    "RunResult": ("runtime_v02", "RunResult"),
+    "run_dsl_text": ("runtime_v02", "run_dsl_text"),
+    "make_gemini_caller": ("model_adapters_v02", "make_gemini_caller"),
+}
+
+__all__ = sorted(list(_SUBMODULES) + list(_EXPORTS))
+
+
+def __getattr__(name: str) -> Any:
+    if name in _SUBMODULES:
+        module = importlib.import_module(_SUBMODULES[name])
+        globals()[name] = module
+        return module
+    if name in _EXPORTS:
+        module_name, attr = _EXPORTS[name]
+        value = getattr(importlib.import_module(module_name), attr)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module 'spl' has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return __all__
@@ -0,0 +1,6 @@
+import sys
+
+from spl.cli import main
+
+
+sys.exit(main())
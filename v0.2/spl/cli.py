@@ -0,0 +1,537 @@
+"""Command line interface: `spl run program.dsl --vars vars.json`."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _read_text(path: str) -> str:
+    if path == "-":
+        return sys.stdin.read()
+    with open(path, encoding="utf-8") as fh:
+        return fh.read()
+
+
+def _load_vars(path: Optional[str]) -> Dict[str, Any]:
+    if path is None:
+        return {}
+    loaded = json.loads(_read_text(path))
+    if not isinstance(loaded, dict):
+        raise ValueError(f"--vars must contain a JSON object, got {type(loaded).__name__}")
+    return loaded
+
+
+def _write_json(data: Any, indent: Optional[int]) -> None:
+    json.dump(data, sys.stdout, ensure_ascii=False, indent=indent)
+    sys.stdout.write("\n")
+
+
+def _context_caching_caller(args: argparse.Namespace) -> Tuple[Any, int]:
+    from context_cache_v02 import DEFAULT_REFERENCE_MIN_CHARS, ContextCachingCaller, GeminiContextCache
+
+    caller = ContextCachingCaller(GeminiContextCache(model=args.model, timeout_s=args.timeout))
+    return caller, DEFAULT_REFERENCE_MIN_CHARS
+
+
+def _cmd_run(args: argparse.Namespace) -> int:
+    from runtime_v02 import run_dsl_text
+
+    text = _read_text(args.program)
+    context = _load_vars(args.vars)
+
+    call_model = None
+    generation = None
+    reference_min_chars = None
+    if args.replay is not None:
+        from replay_v02 import ReplayCaller
+
+        call_model = ReplayCaller(args.replay, latency_scale=args.replay_latency)
+    elif not args.stub:
+        from model_adapters_v02 import make_gemini_caller
+
+        if args.context_cache:
+            call_model, reference_min_chars = _context_caching_caller(args)
+        else:
+            call_model = make_gemini_caller(model=args.model, timeout_s=args.timeout)
+        if args.tune_generation:
+            from generation_v02 import GenerationPolicy
+
+            generation = GenerationPolicy(model=args.model)
+    if args.record is not None:
+        from replay_v02 import RecordingCaller
+
+        if call_model is None:
+            raise ValueError("--record needs a model; it cannot be combined with --stub")
+        call_model = RecordingCaller(call_model, args.record)
+
+    resume_from = None
+    if args.resume:
+        from checkpoint_v02 import load_checkpoint
+
+        if args.checkpoint is None:
+            raise ValueError("--resume needs --checkpoint")
+        resume_from = load_checkpoint(args.checkpoint)
+
+    budget = None
+    if args.max_prompt_tokens is not None:
+        from budget_v02 import PromptBudget
+        from tokens_v02 import TokenCounter
+
+        budget = PromptBudget(
+            args.max_prompt_tokens,
+            mode=args.budget_mode,
+            counter=TokenCounter(args.token_calibration),
+            model=args.model,
+        )
+
+    map_cache = None
+    if args.map_cache is not None:
+        from map_cache_v02 import MapElementCache
+
+        map_cache = MapElementCache(args.map_cache)
+
+    result = run_dsl_text(
+        text,
+        context=context,
+        call_model=call_model,
+        fuse_steps=args.fuse,
+        generation=generation,
+        reference_min_chars=reference_min_chars,
+        repair_attempts=args.repair,
+        map_workers=args.map_workers,
+        map_cache=map_cache,
+        budget=budget,
+        checkpoint_path=args.checkpoint,
+        resume_from=resume_from,
+    )
+    if args.step_stats is not None and call_model is not None and args.replay is None:
+        from estimator_v02 import StepStatsHistory
+        from parser_v02 import steps_from_dicts
+
+        StepStatsHistory(args.step_stats).record_run(
+            steps_from_dicts(result.parsed_steps), result.logs, args.model or "default"
+        )
+    _write_json(asdict(result), args.indent)
+    return 0 if result.ok else 1
+
+
+def _cmd_serve(args: argparse.Namespace) -> int:
+    from server_v02 import serve
+
+    call_model = None
+    reference_min_chars = None
+    if not args.stub:
+        from model_adapters_v02 import make_gemini_caller
+
+        if args.context_cache:
+            call_model, reference_min_chars = _context_caching_caller(args)
+        else:
+            call_model = make_gemini_caller(model=args.model, timeout_s=args.timeout)
+        if args.hedge_rate > 0:
+            from hedging_v02 import HedgedCaller
+
+            call_model = HedgedCaller(call_model, max_hedge_rate=args.hedge_rate)
+        if args.coalesce:
+            from coalesce_v02 import CoalescingCaller
+
+            call_model = CoalescingCaller(call_model, model_id=args.model)
+
+    print(f"spl: serving on http://{args.host}:{args.port}", file=sys.stderr)
+    serve(
+        host=args.host,
+        port=args.port,
+        call_model=call_model,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        batch_concurrency=args.batch_concurrency,
+        verbose=args.verbose,
+        reference_min_chars=reference_min_chars,
+    )
+    return 0
+
+
+def _load_contexts(path: str) -> List[Dict[str, Any]]:
+    text = _read_text(path).strip()
+    if text.startswith("["):
+        loaded = json.loads(text)
+    else:
+        loaded = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not all(isinstance(item, dict) for item in loaded):
+        raise ValueError("contexts must be JSON objects (a JSON list or one object per line)")
+    return loaded
+
+
+def _cmd_jobs(args: argparse.Namespace) -> int:
+    from job_queue_v02 import JobQueue, run_workers
+
+    queue = JobQueue(args.db)
+    if args.jobs_command == "submit":
+        job_id = queue.submit(
+            _read_text(args.program),
+            _load_contexts(args.contexts),
+            job_id=args.job_id,
+            max_attempts=args.max_attempts,
+        )
+        _write_json({"job_id": job_id, "progress": queue.progress(job_id)}, args.indent)
+        return 0
+    if args.jobs_command == "work":
+        make_call_model = None
+        if not args.stub:
+            from functools import partial
+
+            from model_adapters_v02 import make_gemini_caller
+
+            make_call_model = partial(make_gemini_caller, args.model, args.timeout)
+        run_workers(
+            args.db,
+            processes=args.processes,
+            make_call_model=make_call_model,
+            job_id=args.job_id,
+            lease_s=args.lease,
+        )
+        if args.job_id:
+            _write_json({"job_id": args.job_id, "progress": queue.progress(args.job_id)}, args.indent)
+        return 0
+    if args.jobs_command == "status":
+        _write_json({"job_id": args.job_id, "progress": queue.progress(args.job_id)}, args.indent)
+        return 0
+    _write_json({"job_id": args.job_id, "items": queue.results(args.job_id)}, args.indent)
+    return 0
+
+
+def _cmd_dist(args: argparse.Namespace) -> int:
+    from distributed_v02 import Coordinator, FilesystemTransport, run_worker_node
+
+    transport = FilesystemTransport(args.spool)
+    if args.dist_command == "worker":
+        call_model = None
+        if not args.stub:
+            from model_adapters_v02 import make_gemini_caller
+
+            call_model = make_gemini_caller(model=args.model, timeout_s=args.timeout)
+        stats = run_worker_node(transport, args.name, call_model, concurrency=args.concurrency)
+        _write_json(asdict(stats), args.indent)
+        return 0
+
+    workers = [w.strip() for w in args.workers.split(",") if w.strip()]
+    outcome = Coordinator(transport, workers).run(
+        _read_text(args.program), _load_contexts(args.contexts), timeout_s=args.wait
+    )
+    _write_json(
+        {
+            "results": [asdict(r) if r is not None else None for r in outcome.results],
+            "stats": asdict(outcome.stats),
+            "per_worker": {k: asdict(v) for k, v in outcome.per_worker.items()},
+            "wall_s": outcome.wall_s,
+            "timed_out": outcome.timed_out,
+        },
+        args.indent,
+    )
+    return 0 if outcome.stats.failed == 0 and not outcome.timed_out else 1
+
+
+def _cmd_parse(args: argparse.Namespace) -> int:
+    from parser_v02 import ParseError, parse_dsl, steps_to_dicts
+
+    try:
+        steps = parse_dsl(_read_text(args.program))
+    except ParseError as exc:
+        _write_json({"ok": False, "error": f"Parse error: {exc}", "parsed_steps": []}, args.indent)
+        return 1
+    _write_json({"ok": True, "error": None, "parsed_steps": steps_to_dicts(steps)}, args.indent)
+    return 0
+
+
+def _cmd_estimate(args: argparse.Namespace) -> int:
+    from estimator_v02 import StepStatsHistory, estimate_run
+    from parser_v02 import ParseError, parse_dsl
+    from tokens_v02 import TokenCounter
+
+    try:
+        steps = parse_dsl(_read_text(args.program))
+    except ParseError as exc:
+        _write_json({"ok": False, "error": f"Parse error: {exc}"}, args.indent)
+        return 1
+    history = StepStatsHistory(args.step_stats) if args.step_stats is not None else None
+    counter = TokenCounter(args.token_calibration) if args.token_calibration is not None else None
+    estimate = estimate_run(
+        steps,
+        _load_vars(args.vars),
+        model=args.model,
+        history=history,
+        map_workers=args.map_workers,
+        max_prompt_tokens=args.max_prompt_tokens,
+        token_counter=counter,
+    )
+    _write_json({"ok": True, "error": None, "estimate": estimate.to_dict()}, args.indent)
+    return 0
+
+
+def _cmd_tokens(args: argparse.Namespace) -> int:
+    from tokens_v02 import TokenCounter, count_tokens
+
+    counter = TokenCounter(args.token_calibration)
+    texts = {path: _read_text(path) for path in args.files}
+    if args.calibrate:
+        from gemini_client_v02 import count_tokens as gemini_count_tokens
+
+        counter.calibrate(
+            args.model,
+            texts.values(),
+            lambda text: gemini_count_tokens(text, model=args.model, timeout_s=args.timeout),
+        )
+    files = [
+        {"file": path, "local": count_tokens(text), "tokens": counter.count(text, args.model)}
+        for path, text in texts.items()
+    ]
+    _write_json(
+        {"ok": True, "error": None, "factor": counter.factor(args.model), "files": files}, args.indent
+    )
+    return 0
+
+
+def _cmd_bench(args: argparse.Namespace) -> int:
+    from replay_v02 import benchmark_replay
+    from runtime_v02 import run_dsl_text
+
+    text = _read_text(args.program)
+    context = _load_vars(args.vars)
+    outcomes: List[bool] = []
+
+    def run(call_model: Any) -> None:
+        result = run_dsl_text(
+            text,
+            context=dict(context),
+            call_model=call_model,
+            fuse_steps=args.fuse,
+            map_workers=args.map_workers,
+        )
+        outcomes.append(result.ok)
+
+    report = benchmark_replay(run, args.trace, repeats=args.repeats, latency_scale=args.latency_scale)
+    ok = all(outcomes)
+    _write_json({"ok": ok, "error": None if ok else "a replayed run failed", "bench": report}, args.indent)
+    return 0 if ok else 1
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="spl", description="Run Chat DSL v0.2 programs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="parse and execute a DSL file, print RunResult JSON")
+    run_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    run_p.add_argument("--vars", help="JSON file with the initial variable context")
+    run_p.add_argument("--model", default=None, help="Gemini model id (default: GEMINI_MODEL)")
+    run_p.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    run_p.add_argument("--stub", action="store_true", help="use built-in stub responses")
+    run_p.add_argument(
+        "--fuse", action="store_true", help="send independent consecutive steps as one model call"
+    )
+    run_p.add_argument(
+        "--tune-generation",
+        action="store_true",
+        help="derive maxOutputTokens/thinking budget/temperature from each step's /DEF types",
+    )
+    run_p.add_argument(
+        "--context-cache",
+        action="store_true",
+        help="put large inputs in a shared prompt prefix and reuse it via Gemini context caching",
+    )
+    run_p.add_argument(
+        "--repair",
+        type=int,
+        default=0,
+        help="follow-ups per step that ask the model to fix a response breaking the contract",
+    )
+    run_p.add_argument(
+        "--map-workers",
+        type=int,
+        default=4,
+        help="concurrent element calls of a /MAP step",
+    )
+    run_p.add_argument(
+        "--map-cache",
+        default=None,
+        help="JSON file caching /MAP element responses across runs",
+    )
+    run_p.add_argument(
+        "--step-stats",
+        default=None,
+        help="JSON file collecting step latencies and token counts for `spl estimate`",
+    )
+    run_p.add_argument(
+        "--checkpoint",
+        default=None,
+        help="write committed steps to this JSON file; removed when the run succeeds",
+    )
+    run_p.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue from --checkpoint, skipping committed steps whose program prefix is unchanged",
+    )
+    run_p.add_argument(
+        "--max-prompt-tokens",
+        type=int,
+        default=None,
+        help="token budget checked on every prompt before it is sent",
+    )
+    run_p.add_argument(
+        "--budget-mode",
+        choices=["warn", "fail", "trim"],
+        default="trim",
+        help="what to do with a prompt over --max-prompt-tokens (default: trim low-priority inputs)",
+    )
+    run_p.add_argument(
+        "--token-calibration",
+        default=None,
+        help="per-model token count calibration written by `spl tokens --calibrate`",
+    )
+    run_p.add_argument("--record", default=None, help="append every model call to this JSON-lines trace")
+    run_p.add_argument(
+        "--replay", default=None, help="answer model calls from a trace written by --record instead of Gemini"
+    )
+    run_p.add_argument(
+        "--replay-latency",
+        type=float,
+        default=None,
+        help="with --replay, wait the recorded latency times this factor (default: answer immediately)",
+    )
+    run_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    run_p.set_defaults(func=_cmd_run)
+
+    parse_p = sub.add_parser("parse", help="parse a DSL file and print its steps as JSON")
+    parse_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    parse_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    parse_p.set_defaults(func=_cmd_parse)
+
+    estimate_p = sub.add_parser("estimate", help="predict latency, tokens and cost without running")
+    estimate_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    estimate_p.add_argument("--vars", help="JSON file with the initial variable context")
+    estimate_p.add_argument("--model", default=None, help="Gemini model id used for history and pricing")
+    estimate_p.add_argument("--step-stats", default=None, help="history file written by `spl run --step-stats`")
+    estimate_p.add_argument("--map-workers", type=int, default=4, help="concurrent element calls of a /MAP step")
+    estimate_p.add_argument(
+        "--max-prompt-tokens", type=int, default=32_000, help="flag steps with larger estimated prompts"
+    )
+    estimate_p.add_argument(
+        "--token-calibration", default=None, help="per-model token count calibration written by `spl tokens --calibrate`"
+    )
+    estimate_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    estimate_p.set_defaults(func=_cmd_estimate)
+
+    tokens_p = sub.add_parser("tokens", help="count prompt tokens locally, optionally calibrating against Gemini")
+    tokens_p.add_argument("files", nargs="+", help="text files to count, or - for stdin")
+    tokens_p.add_argument("--model", default=None, help="Gemini model id the calibration belongs to")
+    tokens_p.add_argument("--token-calibration", default=None, help="JSON file holding per-model calibration")
+    tokens_p.add_argument(
+        "--calibrate", action="store_true", help="fetch exact counts from Gemini countTokens and update the calibration"
+    )
+    tokens_p.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    tokens_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    tokens_p.set_defaults(func=_cmd_tokens)
+
+    bench_p = sub.add_parser("bench", help="time repeated runs against a recorded model trace")
+    bench_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    bench_p.add_argument("trace", help="trace written by `spl run --record`")
+    bench_p.add_argument("--vars", help="JSON file with the initial variable context")
+    bench_p.add_argument("--repeats", type=int, default=5, help="number of timed runs")
+    bench_p.add_argument(
+        "--latency-scale",
+        type=float,
+        default=None,
+        help="replay recorded latencies times this factor (default: answer immediately)",
+    )
+    bench_p.add_argument("--fuse", action="store_true", help="run with step fusion, as in `spl run --fuse`")
+    bench_p.add_argument("--map-workers", type=int, default=4, help="concurrent element calls of a /MAP step")
+    bench_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    bench_p.set_defaults(func=_cmd_bench)
+
+    serve_p = sub.add_parser("serve", help="run the local HTTP service")
+    serve_p.add_argument("--host", default="127.0.0.1")
+    serve_p.add_argument("--port", type=int, default=8765)
+    serve_p.add_argument("--workers", type=int, default=8, help="concurrent requests")
+    serve_p.add_argument("--max-queue", type=int, default=32, help="waiting requests before 429")
+    serve_p.add_argument("--batch-concurrency", type=int, default=4, help="parallel batch items")
+    serve_p.add_argument("--model", default=None, help="Gemini model id (default: GEMINI_MODEL)")
+    serve_p.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    serve_p.add_argument("--stub", action="store_true", help="use built-in stub responses")
+    serve_p.add_argument(
+        "--hedge-rate",
+        type=float,
+        default=0.0,
+        help="max share of model calls that may be duplicated when slow (0 = no hedging)",
+    )
+    serve_p.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="share one model request between identical concurrent calls",
+    )
+    serve_p.add_argument(
+        "--context-cache",
+        action="store_true",
+        help="put large inputs in a shared prompt prefix and reuse it via Gemini context caching",
+    )
+    serve_p.add_argument("--verbose", action="store_true", help="log every request")
+    serve_p.set_defaults(func=_cmd_serve)
+
+    jobs_p = sub.add_parser("jobs", help="durable batch queue (sqlite)")
+    jobs_p.add_argument("--db", default="spl_jobs.sqlite3", help="queue database path")
+    jobs_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    jobs_sub = jobs_p.add_subparsers(dest="jobs_command", required=True)
+
+    submit_p = jobs_sub.add_parser("submit", help="enqueue a program over many contexts")
+    submit_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    submit_p.add_argument("contexts", help="JSON list or JSON-lines file of contexts")
+    submit_p.add_argument("--job-id", default=None, help="stable id; resubmitting adds missing items")
+    submit_p.add_argument("--max-attempts", type=int, default=3)
+
+    work_p = jobs_sub.add_parser("work", help="drain the queue with worker processes")
+    work_p.add_argument("--processes", type=int, default=None, help="default: one per CPU")
+    work_p.add_argument("--job-id", default=None, help="only work on this job")
+    work_p.add_argument("--lease", type=float, default=300.0, help="lease length in seconds")
+    work_p.add_argument("--model", default=None, help="Gemini model id (default: GEMINI_MODEL)")
+    work_p.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    work_p.add_argument("--stub", action="store_true", help="use built-in stub responses")
+
+    for name in ("status", "results"):
+        p = jobs_sub.add_parser(name, help=f"print job {name}")
+        p.add_argument("job_id")
+    jobs_p.set_defaults(func=_cmd_jobs)
+
+    dist_p = sub.add_parser("dist", help="coordinator/worker batch runs over a shared spool dir")
+    dist_p.add_argument("--spool", required=True, help="shared directory used as the transport")
+    dist_p.add_argument("--indent", type=int, default=None, help="pretty-print JSON output")
+    dist_sub = dist_p.add_subparsers(dest="dist_command", required=True)
+
+    coord_p = dist_sub.add_parser("run", help="partition contexts over workers and merge results")
+    coord_p.add_argument("program", help="path to the DSL file, or - for stdin")
+    coord_p.add_argument("contexts", help="JSON list or JSON-lines file of contexts")
+    coord_p.add_argument("--workers", required=True, help="comma-separated worker names")
+    coord_p.add_argument("--wait", type=float, default=3600.0, help="give up after N seconds (default 3600)")
+
+    node_p = dist_sub.add_parser("worker", help="serve one coordinator run, then exit")
+    node_p.add_argument("--name", required=True, help="worker name (its inbox in the spool)")
+    node_p.add_argument("--concurrency", type=int, default=4, help="items run in parallel")
+    node_p.add_argument("--model", default=None, help="Gemini model id (default: GEMINI_MODEL)")
+    node_p.add_argument("--timeout", type=float, default=120.0, help="request timeout in seconds")
+    node_p.add_argument("--stub", action="store_true", help="use built-in stub responses")
+    dist_p.set_defaults(func=_cmd_dist)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    try:
+        return int(args.func(args))
+    except (OSError, ValueError) as exc:
+        print(f"spl: {exc}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
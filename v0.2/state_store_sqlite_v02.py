@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from common_v02 import SqliteConnections
+
+
+_DEFAULT_DB_PATH = Path(__file__).resolve().parent / "state" / "chats.sqlite3"
+_ROW_VERSION_KEY = "row_version"
+_MERGE_RETRY_MAX = 5
+_BUSY_TIMEOUT_S = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class VersionConflictError(RuntimeError):
+    pass
+
+
+class ChatDeletedError(VersionConflictError):
+    """The chat was loaded at some version and has since been deleted by another writer."""
+
+
+def _chat_payload(chat: Dict[str, Any]) -> str:
+    body = {k: v for k, v in chat.items() if k != _ROW_VERSION_KEY}
+    return json.dumps(body, sort_keys=True)
+
+
+def _merge_vars(
+    remote: Dict[str, Any], local: Dict[str, Any], base: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    if base is None:
+        return {**remote, **local}
+    merged = dict(remote)
+    for key in set(local) | set(base):
+        if key in local and (key not in base or local[key] != base[key]):
+            merged[key] = local[key]
+        elif key not in local:
+            merged.pop(key, None)
+    return merged
+
+
+def merge_chats(
+    remote: Dict[str, Any], local: Dict[str, Any], base_vars: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Merge a locally edited chat onto the newer stored row.
+    History is append-only, so remote messages are kept in order and local
+    messages the remote has not seen are appended; other scalar fields take the
+    local value. `vars` merge by key: with `base_vars` (the vars the local copy
+    was loaded with) only keys the local copy set or removed override the remote,
+    without it remote-only keys are kept and local keys win.
+    """
+    merged = dict(remote)
+    for key, value in local.items():
+        if key in {"history", "vars", _ROW_VERSION_KEY}:
+            continue
+        merged[key] = value
+    if "vars" in local or "vars" in remote:
+        merged["vars"] = _merge_vars(remote.get("vars") or {}, local.get("vars") or {}, base_vars)
+
+    remote_history = list(remote.get("history", []))
+    seen_ids = {msg.get("id") for msg in remote_history if isinstance(msg, dict)}
+    for msg in local.get("history", []):
+        msg_id = msg.get("id") if isinstance(msg, dict) else None
+        if msg_id is not None and msg_id in seen_ids:
+            continue
+        remote_history.append(msg)
+        if msg_id is not None:
+            seen_ids.add(msg_id)
+    merged["history"] = remote_history
+    return merged
+
+
+class SqliteChatStore:
+    """
+    Chat state backend for several processes sharing one state directory.
+    Each chat is a row with its own version; writes are compare-and-swap on that
+    version, so tabs editing different chats never overwrite each other.
+    """
+
+    def __init__(self, db_path: Optional[Path | str] = None) -> None:
+        self.db_path = Path(db_path) if db_path is not None else _DEFAULT_DB_PATH
+        self._connections = SqliteConnections(self.db_path, busy_timeout_s=_BUSY_TIMEOUT_S)
+        # Chat id -> (row version, vars) as this store last loaded or saved it.
+        self._loaded: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def close(self) -> None:
+        self._connections.close()
+
+    def journal_mode(self) -> str:
+        return str(self._connect().execute("PRAGMA journal_mode").fetchone()[0])
+
+    def load_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT payload, version FROM chats WHERE id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        chat = json.loads(row[0])
+        chat[_ROW_VERSION_KEY] = int(row[1])
+        return chat
+
+    def save_chat(self, chat: Dict[str, Any], position: Optional[int] = None) -> int:
+        """
+        Write one chat if its `row_version` still matches the stored row.
+        New chats (no `row_version`) are inserted at version 1.
+        Returns the new version and stores it on the chat.
+        """
+        chat_id = chat.get("id")
+        if not isinstance(chat_id, str) or not chat_id:
+            raise ValueError("chat must have a non-empty string 'id'")
+        expected = chat.get(_ROW_VERSION_KEY)
+        payload = _chat_payload(chat)
+        name = str(chat.get("name", chat_id))
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT payload, version, position FROM chats WHERE id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                if expected is not None:
+                    raise ChatDeletedError(f"chat {chat_id!r} was deleted by another writer")
+                new_version = 1
+                conn.execute(
+                    "INSERT INTO chats (id, position, name, payload, version) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, 0 if position is None else position, name, payload, new_version),
+                )
+            else:
+                stored_payload, stored_version, stored_position = row
+                if expected != stored_version:
+                    if stored_payload == payload:
+                        new_version = int(stored_version)
+                    else:
+                        raise VersionConflictError(
+                            f"chat {chat_id!r} is at version {stored_version}, expected {expected}"
+                        )
+                elif stored_payload == payload and (position is None or position == stored_position):
+                    new_version = int(stored_version)
+                else:
+                    new_version = int(stored_version) + 1
+                    conn.execute(
+                        "UPDATE chats SET position = ?, name = ?, payload = ?, version = ? "
+                        "WHERE id = ? AND version = ?",
+                        (
+                            stored_position if position is None else position,
+                            name,
+                            payload,
+                            new_version,
+                            chat_id,
+                            stored_version,
+                        ),
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        chat[_ROW_VERSION_KEY] = new_version
+        self._loaded[chat_id] = (new_version, json.loads(payload).get("vars") or {})
+        return new_version
+
+    def delete_chat(self, chat_id: str, version: Optional[int] = None) -> bool:
+        """
+        Delete a chat; with `version`, only if the row is still at that version,
+        so edits another writer made since are kept. Returns whether a row was deleted.
+        """
+        if version is None:
+            cursor = self._connect().execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        else:
+            cursor = self._connect().execute(
+                "DELETE FROM chats WHERE id = ? AND version = ?", (chat_id, version)
+            )
+        self._loaded.pop(chat_id, None)
+        return cursor.rowcount > 0
+
+    def _save_chat_merging(self, chat: Dict[str, Any], position: int) -> Optional[Dict[str, Any]]:
+        """The saved (possibly merged) chat, or None when another writer deleted it."""
+        current = chat
+        for _ in range(_MERGE_RETRY_MAX):
+            try:
+                self.save_chat(current, position=position)
+                return current
+            except ChatDeletedError:
+                # A stored version that vanished is a deletion; do not re-insert it.
+                return None
+            except VersionConflictError:
+                remote = self.load_chat(current["id"])
+                if remote is None:
+                    return None
+                loaded = self._loaded.get(current["id"])
+                merged = merge_chats(remote, current, loaded[1] if loaded is not None else None)
+                merged[_ROW_VERSION_KEY] = remote[_ROW_VERSION_KEY]
+                current = merged
+        raise VersionConflictError(
+            f"chat {chat.get('id')!r} kept changing; gave up after {_MERGE_RETRY_MAX} attempts"
+        )
+
+    def load_chats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT payload, version FROM chats ORDER BY position, id"
+        ).fetchall()
+        chats: List[Dict[str, Any]] = []
+        self._loaded = {}
+        for payload, version in rows:
+            chat = json.loads(payload)
+            self._loaded[chat["id"]] = (int(version), json.loads(payload).get("vars") or {})
+            chat[_ROW_VERSION_KEY] = int(version)
+            chats.append(chat)
+
+        active = conn.execute(
+            "SELECT value FROM meta WHERE key = 'active_chat_id'"
+        ).fetchone()
+        active_chat_id = active[0] if active else (chats[0]["id"] if chats else None)
+        return {"active_chat_id": active_chat_id, "chats": chats}
+
+    def save_chats(self, state: Dict[str, Any]) -> None:
+        """
+        Persist every chat in `state` with per-chat compare-and-swap.
+        Conflicting rows are merged (see `merge_chats`) and the merged chat replaces
+        the local one in `state`, so the caller sees messages written elsewhere.
+        Chats another writer deleted since they were loaded are removed from
+        `state` instead of being written back; chats dropped from `state` are only
+        deleted if no other writer changed them since they were loaded.
+        """
+        if not isinstance(state, dict):
+            raise ValueError("state must be a dict")
+        chats = state.get("chats")
+        if not isinstance(chats, list):
+            raise ValueError("state missing 'chats' list")
+
+        previously_loaded = {chat_id: version for chat_id, (version, _) in self._loaded.items()}
+        present: set[str] = set()
+        kept: List[Dict[str, Any]] = []
+        for chat in chats:
+            saved = self._save_chat_merging(chat, len(kept))
+            if saved is None:
+                continue
+            if saved is not chat:
+                chat.clear()
+                chat.update(saved)
+            present.add(chat["id"])
+            kept.append(chat)
+        chats[:] = kept
+
+        for chat_id in sorted(set(previously_loaded) - present):
+            self.delete_chat(chat_id, version=previously_loaded[chat_id])
+
+        active_chat_id = state.get("active_chat_id")
+        if active_chat_id not in present and kept:
+            active_chat_id = state["active_chat_id"] = kept[0]["id"]
+        if isinstance(active_chat_id, str):
+            self._connect().execute(
+                "INSERT INTO meta (key, value) VALUES ('active_chat_id', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (active_chat_id,),
+            )
+
+    def import_state(self, state: Dict[str, Any]) -> Tuple[int, int]:
+        """Seed the store from a JSON-backend state; existing chats are kept."""
+        inserted = 0
+        skipped = 0
+        for position, chat in enumerate(state.get("chats", [])):
+            if self.load_chat(chat["id"]) is not None:
+                skipped += 1
+                continue
+            fresh = {k: v for k, v in chat.items() if k != _ROW_VERSION_KEY}
+            self.save_chat(fresh, position=position)
+            inserted += 1
+        return inserted, skipped
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
 import json
+import os
 from pathlib import Path
 from typing import Any, Dict, List
 
+from common_v02 import write_json_atomic
+
 
 _STATE_DIR = Path(__file__).resolve().parent / "state"
 _VARS_PATH = _STATE_DIR / "vars.json"
 _HISTORY_PATH = _STATE_DIR / "chat_history.json"
 _CHATS_PATH = _STATE_DIR / "chats.json"
+_BACKEND_ENV = "CHAT_DSL_STATE_BACKEND"
 
 
 def _ensure_state_dir() -> None:
@@ -26,9 +30,7 @@ def _load_json(path: Path, default: Any) -> Any:
 
 def _save_json(path: Path, data: Any) -> None:
     _ensure_state_dir()
-    tmp_path = path.with_suffix(path.suffix + ".tmp")
-    tmp_path.write_text(json.dumps(data, indent=2), encoding="utf-8")
-    tmp_path.replace(path)
+    write_json_atomic(path, data, indent=2)
 
 
 def load_vars() -> Dict[str, Any]:
@@ -96,3 +98,32 @@ def save_chats(state: Dict[str, Any]) -> None:
     if not isinstance(state, dict):
         raise ValueError("state must be a dict")
     _save_json(_CHATS_PATH, state)
+
+
+class JsonChatStore:
+    """Single-writer backend over chats.json (the default)."""
+
+    def load_chats(self) -> Dict[str, Any]:
+        return load_chats()
+
+    def save_chats(self, state: Dict[str, Any]) -> None:
+        save_chats(state)
+
+
+def open_chat_store(backend: str | None = None) -> Any:
+    """
+    Return a chat store with `load_chats()` / `save_chats(state)`.
+    `backend` (or CHAT_DSL_STATE_BACKEND) selects "json" or "sqlite"; the sqlite
+    store is safe for several app processes sharing this state directory.
+    """
+    name = (backend or os.environ.get(_BACKEND_ENV, "json")).strip().lower()
+    if name == "json":
+        return JsonChatStore()
+    if name == "sqlite":
+        from state_store_sqlite_v02 import SqliteChatStore
+
+        store = SqliteChatStore(_STATE_DIR / "chats.sqlite3")
+        if not store.load_chats()["chats"] and (_CHATS_PATH.exists() or _HISTORY_PATH.exists()):
+            store.import_state(load_chats())
+        return store
+    raise ValueError(f"unknown state backend {name!r}; expected 'json' or 'sqlite'")
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from common_v02 import write_text_atomic
+from decoder_v02 import decode_json_response
+from executor_v02 import ModelCall, ResponseSchema
+from tokens_v02 import count_tokens
+
+
+_DEFAULT_SEGMENT_SIZE = 20
+_DEFAULT_MAX_ENTRIES = 8192
+_DEFAULT_FLUSH_EVERY = 32
+_DEFAULT_FLUSH_INTERVAL_S = 5.0
+_DEFAULT_TAIL_RATIO = 0.6
+_SUMMARY_SCHEMA: ResponseSchema = {
+    "type": "object",
+    "properties": {"summary": {"type": "string"}},
+    "required": ["summary"],
+}
+
+
+def segment_hash(lines: Sequence[str]) -> str:
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """
+    Segment summaries keyed by content hash, optionally persisted as JSON.
+    Because keys are content hashes, an edit only misses for segments whose
+    messages actually changed. The least recently used entries are dropped
+    beyond `max_entries`; the file is rewritten after `flush_every` new
+    entries, after `flush_interval_s`, or on `flush()`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path | str] = None,
+        max_entries: int = _DEFAULT_MAX_ENTRIES,
+        flush_every: int = _DEFAULT_FLUSH_EVERY,
+        flush_interval_s: float = _DEFAULT_FLUSH_INTERVAL_S,
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.max_entries = max(1, max_entries)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval_s = flush_interval_s
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.path.exists():
+            loaded = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            if isinstance(loaded, dict):
+                self._entries.update({k: v for k, v in loaded.items() if isinstance(v, str)})
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            due = self.path is not None and (
+                self._unsaved >= self.flush_every
+                or time.monotonic() - self._saved_at >= self.flush_interval_s
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write pending entries to `path`; a no-op when nothing changed."""
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                data = json.dumps(self._entries)
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+            write_text_atomic(self.path, data)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _build_summary_prompt(lines: Sequence[str], max_tokens: int) -> str:
+    body = "\n".join(lines)
+    return (
+        "Instruction:\n"
+        "Summarize this part of a chat transcript. Keep names, numbers, decisions "
+        "and open questions; drop pleasantries.\n"
+        f"Keep the summary under about {max_tokens} tokens.\n\n"
+        f"Transcript:\n{body}\n\n"
+        "Output format requirements:\n"
+        "- Respond with ONLY a JSON object.\n"
+        '- Example JSON shape:\n{"summary": "..."}'
+    )
+
+
+def _parse_summary(raw: str) -> str:
+    try:
+        parsed, _ = decode_json_response(raw)
+    except json.JSONDecodeError:
+        return raw.strip()
+    if isinstance(parsed, dict) and isinstance(parsed.get("summary"), str):
+        return parsed["summary"].strip()
+    return raw.strip()
+
+
+class RollingSummarizer:
+    """
+    Keep a transcript within a token budget.
+    Messages are grouped into fixed segments counted from the start of the
+    timeline, so old segments never shift. The newest segments that fit in
+    `tail_ratio` of the budget are kept verbatim; every older segment is
+    replaced by its cached summary (made once with the cheap model). If the
+    summaries still do not fit, they are summarized again in groups.
+    """
+
+    def __init__(
+        self,
+        call_model: ModelCall,
+        token_budget: int,
+        cache: Optional[SummaryCache] = None,
+        segment_size: int = _DEFAULT_SEGMENT_SIZE,
+        tail_ratio: float = _DEFAULT_TAIL_RATIO,
+    ) -> None:
+        if token_budget <= 0:
+            raise ValueError("token_budget must be positive")
+        self.call_model = call_model
+        self.token_budget = token_budget
+        self.cache = cache or SummaryCache()
+        self.segment_size = max(1, segment_size)
+        self.tail_ratio = min(max(tail_ratio, 0.0), 1.0)
+        self.model_calls = 0
+
+    def _summarize(self, lines: Sequence[str], max_tokens: int) -> str:
+        key = segment_hash(lines)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        self.model_calls += 1
+        summary = _parse_summary(self.call_model(_build_summary_prompt(lines, max_tokens), _SUMMARY_SCHEMA))
+        self.cache.put(key, summary)
+        return summary
+
+    def _split_tail(self, lines: List[str]) -> int:
+        """Index where the verbatim tail starts (always a segment boundary when possible)."""
+        tail_budget = int(self.token_budget * self.tail_ratio)
+        boundaries = list(range(0, len(lines), self.segment_size))
+        used = 0
+        start = len(lines)
+        for boundary in reversed(boundaries):
+            cost = sum(count_tokens(line) + 1 for line in lines[boundary:start])
+            if used + cost > tail_budget:
+                break
+            used += cost
+            start = boundary
+        if start == len(lines):
+            # Even the newest segment is too big: keep as many recent lines as fit.
+            while start > 0 and used + count_tokens(lines[start - 1]) + 1 <= tail_budget:
+                start -= 1
+                used += count_tokens(lines[start]) + 1
+        return start
+
+    def render(self, lines: Sequence[str]) -> str:
+        lines = list(lines)
+        full = "\n".join(lines)
+        if count_tokens(full) <= self.token_budget:
+            return full
+
+        tail_start = self._split_tail(lines)
+        tail = lines[tail_start:]
+        tail_text = "\n".join(tail)
+        summary_budget = max(1, self.token_budget - count_tokens(tail_text))
+
+        older = lines[:tail_start]
+        segments = [older[i : i + self.segment_size] for i in range(0, len(older), self.segment_size)]
+        per_segment = max(16, summary_budget // max(1, len(segments)))
+        summaries = [self._summarize(seg, per_segment) for seg in segments]
+        while len(summaries) > 1 and count_tokens("\n".join(summaries)) > summary_budget:
+            groups = [
+                summaries[i : i + self.segment_size]
+                for i in range(0, len(summaries), self.segment_size)
+            ]
+            if len(groups) == len(summaries):
+                groups = [summaries]
+            per_group = max(16, summary_budget // len(groups))
+            summaries = [self._summarize(group, per_group) for group in groups]
+
+        self.cache.flush()
+        blocks = []
+        if summaries:
+            blocks.append("Earlier conversation (summarized):\n" + "\n".join(f"- {s}" for s in summaries))
+        if tail:
+            blocks.append("Recent messages:\n" + tail_text)
+        return "\n\n".join(blocks)
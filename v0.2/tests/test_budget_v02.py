@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from budget_v02 import PromptBudget, PromptBudgetError
+from executor_v02 import execute_steps
+from fusion_v02 import execute_fused_steps
+from parser_v02 import parse_dsl
+from runtime_v02 import run_dsl_text
+
+
+class _Model:
+    """Records prompts and answers every /DEF with a short value (or `values`)."""
+
+    def __init__(self, values: dict | None = None) -> None:
+        self.values = values or {}
+        self.prompts: list[str] = []
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        self.prompts.append(prompt)
+        names = schema["properties"].get("vars", {}).get("required", [])
+        return json.dumps({"error": 0, "out": "ok", "vars": {n: self.values.get(n, f"{n}!") for n in names}})
+
+
+LONG = "lorem ipsum dolor sit amet " * 400
+
+
+def test_small_prompts_are_untouched() -> None:
+    model = _Model()
+    _, logs, _ = execute_steps(parse_dsl("Say hi\n/DEF greeting /TYPE str"), {}, call_model=model, budget=PromptBudget(500))
+    assert "budget" not in logs[0]
+
+
+def test_warn_sends_the_prompt_and_fail_stops_before_the_call() -> None:
+    program = "Load\n/DEF notes /TYPE str\n/THEN Summarize everything\n/DEF summary /TYPE str"
+
+    model = _Model({"notes": LONG})
+    _, logs, _ = execute_steps(parse_dsl(program), {}, call_model=model, budget=PromptBudget(300, mode="warn"))
+    assert logs[1]["budget"]["warning"].startswith("prompt has")
+    assert LONG in model.prompts[1]
+
+    model = _Model({"notes": LONG})
+    with pytest.raises(PromptBudgetError, match=r"Step 1 \(line 3\): prompt has \d+ tokens, over the 300-token budget"):
+        execute_steps(parse_dsl(program), {}, call_model=model, budget=PromptBudget(300, mode="fail"))
+    assert len(model.prompts) == 1
+
+
+def test_trim_drops_implicit_inputs_before_truncating_requested_ones() -> None:
+    program = (
+        "Load\n/DEF notes /TYPE str\n/DEF topic /TYPE str\n"
+        "/THEN Write about @topic\n/DEF essay /TYPE str\n"
+        "/THEN Check the essay\n/FROM @essay, @notes\n/DEF verdict /TYPE str"
+    )
+    model = _Model({"notes": LONG, "topic": "owls", "essay": "short essay"})
+    ctx, logs, _ = execute_steps(parse_dsl(program), {}, call_model=model, budget=PromptBudget(300))
+
+    # Step 1 has no /FROM: the unrequested notes are dropped, the inline topic stays.
+    assert logs[1]["budget"]["dropped"] == ["notes"]
+    assert "owls" in model.prompts[1] and "lorem" not in model.prompts[1]
+    # Step 2 asked for the notes: they are truncated, not dropped, and the context is untouched.
+    budget = logs[2]["budget"]
+    assert budget["dropped"] == [] and list(budget["truncated"]) == ["notes"]
+    assert budget["tokens"] <= 300 < budget["tokens_before"]
+    assert "…[truncated" in model.prompts[2] and "short essay" in model.prompts[2]
+    assert ctx["notes"] == LONG
+
+
+def test_trim_fails_when_only_untrimmable_text_remains() -> None:
+    result = run_dsl_text(f"Translate this: {LONG}", {}, call_model=_Model(), budget=PromptBudget(100))
+    assert result.ok is False
+    assert "after trimming (no trimmable inputs)" in result.error
+
+
+def test_map_elements_are_budgeted_one_by_one() -> None:
+    program = "Load\n/DEF docs /TYPE list[str]\n/THEN Tag @ITEM\n/MAP @docs\n/DEF tag /TYPE list[str]"
+    model = _Model({"docs": ["short", LONG]})
+    _, logs, _ = execute_steps(parse_dsl(program), {}, call_model=model, budget=PromptBudget(300))
+    elements = logs[1]["map"]["elements"]
+    assert "budget" not in elements[0]
+    assert list(elements[1]["budget"]["truncated"]) == ["ITEM"]
+
+
+def test_fused_group_over_budget_runs_step_by_step() -> None:
+    program = (
+        "Load\n/DEF notes /TYPE str\n"
+        "/THEN Summarize @notes\n/DEF a /TYPE str\n"
+        "/THEN Title @notes\n/DEF b /TYPE str"
+    )
+    model = _Model({"notes": LONG})
+    _, logs, _ = execute_fused_steps(parse_dsl(program), {}, call_model=model, budget=PromptBudget(600))
+    assert len(model.prompts) == 3
+    assert all("fused_with" not in log for log in logs)
+    assert logs[1]["budget"]["tokens"] <= 600 and logs[2]["budget"]["tokens"] <= 600
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from builtins_v02 import ChatBuiltins, TimelineTranscript
+from executor_v02 import build_step_prompt, execute_steps
+from parser_v02 import ParseError, parse_dsl
+
+
+HISTORY = [
+    {"id": "u1", "role": "user", "mode": "dsl", "content": "hello", "meta": {}},
+    {"id": "a1", "role": "assistant", "mode": "dsl", "content": "hi there", "meta": {}},
+]
+
+
+def test_parser_accepts_builtins_in_from_and_rejects_defining_them() -> None:
+    steps = parse_dsl("Summarize the chat\n/FROM @CHAT, @ALL")
+    assert steps[0].from_vars == ["CHAT", "ALL"]
+    with pytest.raises(ParseError, match="built-in variable"):
+        parse_dsl("Overwrite\n/DEF CHAT")
+
+
+def test_builtins_are_not_materialized_when_unused() -> None:
+    builtins = ChatBuiltins(HISTORY)
+    prompt = build_step_prompt(parse_dsl("Say hi")[0], {"x": 1}, builtins=builtins)
+    assert "hi there" not in prompt
+    assert builtins.materialized == {}
+
+
+def test_from_chat_appends_transcript_to_inputs() -> None:
+    builtins = ChatBuiltins(HISTORY)
+    prompt = build_step_prompt(parse_dsl("Summarize\n/FROM @CHAT")[0], {"x": 1}, builtins=builtins)
+    assert "- CHAT: user: hello\nassistant: hi there" in prompt
+    assert "- x:" not in prompt
+    assert builtins.materialized == {"CHAT": 1}
+
+
+def test_embedded_all_includes_history_and_variables() -> None:
+    builtins = ChatBuiltins(HISTORY)
+    prompt = build_step_prompt(parse_dsl("Review @ALL")[0], {"x": 1}, builtins=builtins)
+    assert "Chat history:\nuser: hello\nassistant: hi there" in prompt
+    assert "Variables:\n- x: 1" in prompt
+
+
+def test_later_steps_see_run_input_and_earlier_outputs() -> None:
+    steps = parse_dsl("First\n/THEN Recap\n/FROM @CHAT")
+    builtins = ChatBuiltins(HISTORY, run_input="First\n/THEN Recap")
+    prompts: list[str] = []
+    replies = iter(["step one done", "recap"])
+
+    def fake_model(prompt: str, _: dict) -> str:
+        prompts.append(prompt)
+        return json.dumps({"error": 0, "out": next(replies)})
+
+    _, logs, _ = execute_steps(steps, {}, call_model=fake_model, builtins=builtins)
+    assert "user: First\n/THEN Recap\nassistant: step one done" in prompts[1]
+    assert "builtins_used" not in logs[0]
+    assert logs[1]["builtins_used"] == ["CHAT"]
+
+
+def test_transcript_renders_only_new_messages_and_handles_edits() -> None:
+    transcript = TimelineTranscript()
+    transcript.sync(HISTORY)
+    assert transcript.rendered_messages == 2
+
+    grown = HISTORY + [{"id": "u2", "role": "user", "content": "more"}]
+    assert transcript.sync(grown).endswith("user: more")
+    assert transcript.rendered_messages == 3
+
+    edited = HISTORY[:1] + [{"id": "a1b", "role": "assistant", "content": "edited"}]
+    assert transcript.sync(edited) == "user: hello\nassistant: edited"
+    assert transcript.rendered_messages == 4
+
+
+def test_for_chat_drops_replaced_message_from_timeline() -> None:
+    builtins = ChatBuiltins.for_chat("chat-test-edit", HISTORY, replaced_message_id="a1")
+    assert builtins.resolve("CHAT", {}) == "user: hello"
+
+
+def test_concurrent_runs_on_one_chat_keep_their_own_lines() -> None:
+    chat_id = "chat-test-concurrent"
+    run_a = ChatBuiltins.for_chat(chat_id, HISTORY[:1], run_input="A input")
+    run_b = ChatBuiltins.for_chat(chat_id, HISTORY[:1], run_input="B input")
+    run_b.resolve("CHAT", {})
+    run_b.record_step_output("B step0 out")
+    run_b.resolve("CHAT", {})
+
+    assert run_a.resolve("CHAT", {}) == "user: hello\nuser: A input"
+    assert run_b.resolve("CHAT", {}) == "user: hello\nuser: B input\nassistant: B step0 out"
+
+    def run(name: str, results: dict) -> None:
+        builtins = ChatBuiltins.for_chat(chat_id, HISTORY, run_input=f"{name} input")
+        for step in range(50):
+            builtins.record_step_output(f"{name} out {step}")
+            results[name] = builtins.resolve("CHAT", {})
+
+    results: dict = {}
+    threads = [threading.Thread(target=run, args=(name, results)) for name in ("A", "B")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, other in (("A", "B"), ("B", "A")):
+        assert results[name].startswith("user: hello\nassistant: hi there\nuser: " + name)
+        assert f"{other} " not in results[name]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from checkpoint_v02 import RunCheckpoint, load_checkpoint, prefix_hashes, resume_plan
+from parser_v02 import parse_dsl
+from runtime_v02 import run_dsl_text
+from spl import cli
+
+
+PROGRAM = (
+    "Create a\n/DEF a /TYPE int\n"
+    "/THEN Create b\n/DEF b /TYPE int\n"
+    "/THEN Create c\n/DEF c /TYPE int\n"
+)
+
+
+class _Model:
+    """Answers each step with its variable; fails the steps listed in `broken`."""
+
+    def __init__(self, broken: tuple[str, ...] = ()) -> None:
+        self.broken = broken
+        self.calls: list[str] = []
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        name = next(iter(schema["properties"]["vars"]["required"]))
+        self.calls.append(name)
+        if name in self.broken:
+            return "not-json"
+        return json.dumps({"error": 0, "out": f"made {name}", "vars": {name: len(self.calls)}})
+
+
+def test_failed_run_carries_committed_steps() -> None:
+    result = run_dsl_text(PROGRAM, {"seed": 1}, call_model=_Model(broken=("c",)))
+
+    assert result.ok is False
+    assert result.vars_after == {"seed": 1, "a": 1, "b": 2}
+    assert result.outputs == ["made a", "made b"]
+    assert [log["step_index"] for log in result.logs] == [0, 1]
+    checkpoint = RunCheckpoint.from_dict(result.checkpoint)
+    assert checkpoint.completed == 2
+    assert checkpoint.context_after(2) == {"seed": 1, "a": 1, "b": 2}
+    assert "Execution error:" in checkpoint.error
+
+
+def test_resume_skips_committed_steps() -> None:
+    failed = run_dsl_text(PROGRAM, {}, call_model=_Model(broken=("c",)))
+    model = _Model()
+    result = run_dsl_text(
+        PROGRAM, {}, call_model=model, resume_from=RunCheckpoint.from_dict(failed.checkpoint)
+    )
+
+    assert result.ok is True
+    assert model.calls == ["c"]
+    assert result.vars_after == {"a": 1, "b": 2, "c": 1}
+    assert result.outputs == ["made a", "made b", "made c"]
+    assert [log.get("from_checkpoint", False) for log in result.logs] == [True, True, False]
+
+
+def test_edited_prefix_step_reruns_from_the_edit() -> None:
+    failed = run_dsl_text(PROGRAM, {}, call_model=_Model(broken=("c",)))
+    checkpoint = RunCheckpoint.from_dict(failed.checkpoint)
+
+    edited_failing = parse_dsl(PROGRAM.replace("Create c", "Create c carefully"))
+    assert resume_plan(checkpoint, edited_failing, {}).start == 2
+
+    edited_second = parse_dsl(PROGRAM.replace("Create b", "Create b twice"))
+    plan = resume_plan(checkpoint, edited_second, {})
+    assert plan.start == 1
+    assert plan.context == {"a": 1}
+
+
+def test_resume_rejects_a_different_starting_context() -> None:
+    failed = run_dsl_text(PROGRAM, {"seed": 1}, call_model=_Model(broken=("c",)))
+    with pytest.raises(ValueError, match="starting context"):
+        resume_plan(RunCheckpoint.from_dict(failed.checkpoint), parse_dsl(PROGRAM), {"seed": 2})
+
+
+def test_run_with_mismatched_resume_returns_an_error_result(tmp_path) -> None:
+    path = tmp_path / "run.ckpt.json"
+    failed = run_dsl_text(PROGRAM, {"seed": 1}, call_model=_Model(broken=("c",)), checkpoint_path=path)
+    model = _Model()
+    result = run_dsl_text(
+        PROGRAM, {"seed": 2}, call_model=model, checkpoint_path=path, resume_from=load_checkpoint(path)
+    )
+
+    assert result.ok is False
+    assert "starting context" in result.error
+    assert model.calls == []
+    assert result.vars_after == {"seed": 2}
+    assert result.checkpoint == failed.checkpoint
+    assert load_checkpoint(path).completed == 2
+
+
+def test_prefix_hashes_ignore_line_numbers() -> None:
+    assert prefix_hashes(parse_dsl(PROGRAM)) == prefix_hashes(parse_dsl("\n\n" + PROGRAM))
+
+
+def test_checkpoint_file_is_written_per_step_and_removed_on_success(tmp_path) -> None:
+    path = tmp_path / "run.ckpt.json"
+    run_dsl_text(PROGRAM, {}, call_model=_Model(broken=("c",)), checkpoint_path=path)
+    assert load_checkpoint(path).completed == 2
+
+    result = run_dsl_text(PROGRAM, {}, call_model=_Model(), checkpoint_path=path, resume_from=load_checkpoint(path))
+    assert result.ok is True
+    assert not path.exists()
+
+
+def test_cli_resume_reuses_checkpointed_steps(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Create x\n/DEF x /TYPE str\n/THEN Use @x\n/FROM @x", encoding="utf-8")
+    ckpt = tmp_path / "run.ckpt.json"
+
+    def break_second(prompt: str, schema: dict, **kwargs) -> str:
+        if "Use" in prompt:
+            raise RuntimeError("transport down")
+        return json.dumps({"error": 0, "out": "made x", "vars": {"x": "real"}})
+
+    run_dsl_text(program.read_text(encoding="utf-8"), {}, call_model=break_second, checkpoint_path=ckpt)
+
+    code = cli.main(["run", str(program), "--stub", "--checkpoint", str(ckpt), "--resume"])
+    result = json.loads(capsys.readouterr().out)
+
+    assert code == 0
+    assert result["vars_after"] == {"x": "real"}
+    assert result["logs"][0]["from_checkpoint"] is True
+    assert not ckpt.exists()
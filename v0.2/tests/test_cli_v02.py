@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from dataclasses import asdict
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import build_response_schema, build_step_prompt
+from parser_v02 import parse_dsl
+from replay_v02 import TraceEntry
+from spl import cli
+
+
+def test_run_stub_prints_run_result_json(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Create x\n/DEF x /TYPE str\n/THEN Use @x\n/FROM @x", encoding="utf-8")
+    vars_path = tmp_path / "vars.json"
+    vars_path.write_text(json.dumps({"seed": 1}), encoding="utf-8")
+
+    code = cli.main(["run", str(program), "--vars", str(vars_path), "--stub"])
+    result = json.loads(capsys.readouterr().out)
+
+    assert code == 0
+    assert result["ok"] is True
+    assert result["vars_after"] == {"seed": 1, "x": "stub value for x"}
+    assert len(result["logs"]) == 2
+    assert result["error"] is None
+
+
+def test_run_parse_error_exits_nonzero_with_error_json(tmp_path, capsys) -> None:
+    program = tmp_path / "bad.dsl"
+    program.write_text("/OUT only output", encoding="utf-8")
+
+    code = cli.main(["run", str(program), "--stub"])
+    result = json.loads(capsys.readouterr().out)
+
+    assert code == 1
+    assert result["ok"] is False
+    assert "Parse error:" in result["error"]
+
+
+def test_run_rejects_non_object_vars(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Say hi", encoding="utf-8")
+    vars_path = tmp_path / "vars.json"
+    vars_path.write_text("[1, 2]", encoding="utf-8")
+
+    assert cli.main(["run", str(program), "--vars", str(vars_path), "--stub"]) == 2
+    assert "JSON object" in capsys.readouterr().err
+
+
+def test_estimate_prints_prediction_without_running(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Create x\n/DEF x /TYPE str\n/THEN Use @x\n/FROM @x", encoding="utf-8")
+
+    code = cli.main(["estimate", str(program), "--model", "gemini-2.5-flash"])
+    result = json.loads(capsys.readouterr().out)
+
+    assert code == 0
+    assert result["estimate"]["critical_path"] == [0, 1]
+    assert result["estimate"]["cost_usd"] > 0
+
+
+def test_run_replay_and_bench_serve_a_recorded_trace(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Create x\n/DEF x /TYPE str", encoding="utf-8")
+    step = parse_dsl(program.read_text(encoding="utf-8"))[0]
+    entry = TraceEntry(
+        prompt=build_step_prompt(step, {}),
+        response_schema=build_response_schema(step),
+        response=json.dumps({"error": 0, "out": "ok", "vars": {"x": "recorded"}}),
+        latency_s=1.5,
+    )
+    trace = tmp_path / "trace.jsonl"
+    trace.write_text(json.dumps(asdict(entry)) + "\n", encoding="utf-8")
+
+    assert cli.main(["run", str(program), "--replay", str(trace)]) == 0
+    assert json.loads(capsys.readouterr().out)["vars_after"] == {"x": "recorded"}
+
+    assert cli.main(["bench", str(program), str(trace), "--repeats", "2"]) == 0
+    report = json.loads(capsys.readouterr().out)["bench"]
+    assert report["repeats"] == 2 and report["calls"] == 1 and report["misses"] == 0
+
+
+def test_run_enforces_prompt_budget_and_tokens_counts_files(tmp_path, capsys) -> None:
+    program = tmp_path / "program.dsl"
+    program.write_text("Summarize\n/DEF summary /TYPE str", encoding="utf-8")
+    vars_path = tmp_path / "vars.json"
+    vars_path.write_text(json.dumps({"notes": "word " * 2000}), encoding="utf-8")
+
+    args = ["run", str(program), "--vars", str(vars_path), "--stub", "--max-prompt-tokens", "500"]
+    assert cli.main(args + ["--budget-mode", "fail"]) == 1
+    assert "over the 500-token budget" in json.loads(capsys.readouterr().out)["error"]
+    assert cli.main(args) == 0
+    assert json.loads(capsys.readouterr().out)["logs"][0]["budget"]["dropped"] == ["notes"]
+
+    assert cli.main(["tokens", str(vars_path)]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["factor"] == 1.0 and result["files"][0]["tokens"] == result["files"][0]["local"]
+
+
+def test_import_spl_is_lazy_and_skips_streamlit() -> None:
+    code = (
+        "import sys, spl\n"
+        "assert 'runtime_v02' not in sys.modules\n"
+        "assert 'streamlit' not in sys.modules\n"
+        "spl.run_dsl_text\n"
+        "assert 'runtime_v02' in sys.modules\n"
+        "assert 'gemini_client_v02' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=V02_DIR, check=True)
+
+
+def test_module_entry_point_reads_program_from_stdin() -> None:
+    proc = subprocess.run(
+        [sys.executable, "-m", "spl", "parse", "-"],
+        cwd=V02_DIR,
+        input="Step one\n/THEN Step two",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(proc.stdout)
+    assert [s["text"] for s in result["parsed_steps"]] == ["Step one", "Step two"]
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from coalesce_v02 import CoalescingCaller, call_key
+
+
+SCHEMA = {"type": "object", "properties": {}, "required": ["error", "out"]}
+
+
+class _SlowModel:
+    def __init__(self, delay_s: float = 0.1) -> None:
+        self.delay_s = delay_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay_s)
+        return f'{{"error": 0, "out": "{prompt}"}}'
+
+
+def test_identical_concurrent_calls_share_one_request() -> None:
+    model = _SlowModel()
+    caller = CoalescingCaller(model, model_id="m")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: caller("same", SCHEMA), range(8)))
+
+    assert model.calls == 1
+    assert set(results) == {'{"error": 0, "out": "same"}'}
+    assert caller.stats() == {"calls": 8, "upstream_calls": 1, "saved_calls": 7, "in_flight": 0}
+
+
+def test_different_prompts_and_sequential_calls_are_not_coalesced() -> None:
+    model = _SlowModel(delay_s=0.0)
+    caller = CoalescingCaller(model)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: caller(f"p{i}", SCHEMA), range(4)))
+    caller("p0", SCHEMA)
+    assert model.calls == 5
+    assert caller.stats()["saved_calls"] == 0
+
+
+def test_key_covers_model_schema_and_generation_config() -> None:
+    base = call_key("m", "p", SCHEMA)
+    assert call_key("m", "p", dict(SCHEMA)) == base
+    assert call_key("other", "p", SCHEMA) != base
+    assert call_key("m", "p", SCHEMA, {"temperature": 0.0}) != base
+
+
+def test_followers_receive_the_leader_error() -> None:
+    started = threading.Event()
+
+    def failing(prompt: str, schema: dict) -> str:
+        started.set()
+        time.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    caller = CoalescingCaller(failing)
+    errors: list[str] = []
+
+    def call() -> None:
+        try:
+            caller("p", SCHEMA)
+        except RuntimeError as exc:
+            errors.append(str(exc))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join()
+    follower.join()
+    assert errors == ["upstream down", "upstream down"]
+    assert caller.stats()["saved_calls"] == 1
+
+    with pytest.raises(RuntimeError):
+        caller("p", SCHEMA)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from common_v02 import ChatRegistry, SqliteConnections, step_label, value_text, write_json_atomic
+
+
+def test_chat_registry_shares_per_chat_objects_and_drops_least_recent() -> None:
+    registry: ChatRegistry[list] = ChatRegistry(list, max_chats=2)
+    first = registry.get("a")
+    assert registry.get("a") is first
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert len(registry) == 2
+    assert registry.get("a") is first
+    assert registry.get("b") is not None and len(registry) == 2
+
+
+def test_write_json_atomic_creates_parents_and_leaves_no_temp_file(tmp_path) -> None:
+    path = tmp_path / "state" / "data.json"
+    write_json_atomic(path, {"a": 1}, indent=2)
+    write_json_atomic(path, {"a": 2})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 2}
+    assert [p.name for p in path.parent.iterdir()] == ["data.json"]
+
+
+def test_sqlite_connections_are_per_thread_and_use_wal(tmp_path) -> None:
+    connections = SqliteConnections(tmp_path / "db" / "x.sqlite3")
+    conn = connections.get()
+    assert connections.get() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    others: list = []
+    thread = threading.Thread(target=lambda: others.append(connections.get()))
+    thread.start()
+    thread.join()
+    assert others[0] is not conn
+    connections.close()
+    assert connections.get() is not conn
+
+
+def test_value_text_keeps_strings_and_renders_other_values_as_json() -> None:
+    assert value_text("plain") == "plain"
+    assert value_text(["é", 1]) == '["é", 1]'
+
+
+def test_step_label_is_the_first_line_cut_to_width() -> None:
+    assert step_label("  Summarize @doc.\nThen more", 9) == "Summarize"
+    assert step_label("   ") == ""
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+import context_cache_v02
+from context_cache_v02 import ContextCachingCaller, LocalContextCache
+from executor_v02 import build_step_prompt, execute_steps, reference_prefix
+from gemini_client_v02 import GeminiHTTPError
+from parser_v02 import parse_dsl
+
+
+SCHEMA = {"type": "object", "properties": {}, "required": ["error", "out"]}
+PREFIX = "Reference material:\n" + "word " * 2000 + "\n\n"
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _Model:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        self.prompts.append(prompt)
+        return json.dumps({"error": 0, "out": "ok", "vars": {"summary": "s"}})
+
+
+def _caller(model: _Model, clock: _Clock, **kwargs) -> tuple[ContextCachingCaller, LocalContextCache]:
+    backend = LocalContextCache(model, clock=clock)
+    return ContextCachingCaller(backend, ttl_s=60, clock=clock, **kwargs), backend
+
+
+def test_repeated_prefix_is_cached_after_min_uses() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock)
+    for i in range(4):
+        caller(PREFIX + f"Instruction:\nquestion {i}", SCHEMA, cache_prefix=PREFIX)
+
+    stats = caller.stats()
+    # The second call creates the entry; only the two reuses after it are hits.
+    assert stats["creations"] == 1
+    assert stats["hits"] == 2
+    assert stats["cacheable_requests"] == 4
+    assert stats["hit_rate"] == 0.5
+    assert stats["token_savings"] > 0.5
+    assert len(backend.entries) == 1
+    # The stand-in reassembles the full prompt, so the model sees the same text.
+    assert model.prompts[-1] == PREFIX + "Instruction:\nquestion 3"
+
+
+def test_short_or_missing_prefix_is_sent_uncached() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock)
+    caller("Reference material:\nshort\n\nInstruction:\nq", SCHEMA, cache_prefix="Reference material:\nshort\n\n")
+    caller("Instruction:\nq", SCHEMA)
+    caller("Instruction:\nq", SCHEMA)
+
+    stats = caller.stats()
+    assert stats["requests"] == 3
+    assert stats["cacheable_requests"] == 0
+    assert stats["hits"] == 0
+    assert backend.entries == {}
+
+
+def test_expired_entry_is_created_again() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock, min_uses=1)
+    caller(PREFIX + "Instruction:\na", SCHEMA, cache_prefix=PREFIX)
+    clock.now = 30
+    caller(PREFIX + "Instruction:\nb", SCHEMA, cache_prefix=PREFIX)
+    assert caller.stats()["creations"] == 1
+
+    clock.now = 120
+    caller(PREFIX + "Instruction:\nc", SCHEMA, cache_prefix=PREFIX)
+    assert caller.stats()["creations"] == 2
+    assert len(backend.entries) == 2
+
+
+def test_expired_entries_are_pruned_and_use_counts_are_bounded() -> None:
+    model, clock = _Model(), _Clock()
+    caller, _ = _caller(model, clock, min_uses=1, max_tracked_prefixes=2)
+    other = PREFIX.replace("word", "term")
+    caller(PREFIX + "Instruction:\na", SCHEMA, cache_prefix=PREFIX)
+    clock.now = 120
+    caller(other + "Instruction:\nb", SCHEMA, cache_prefix=other)
+    assert len(caller._entries) == 1
+
+    for word in ("alpha", "beta", "gamma"):
+        prefix = PREFIX.replace("word", word)
+        caller(prefix + "Instruction:\nc", SCHEMA, cache_prefix=prefix)
+    assert len(caller._uses) == 2
+
+
+def test_entry_gone_on_the_server_falls_back_to_uncached() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock, min_uses=1)
+    caller(PREFIX + "Instruction:\na", SCHEMA, cache_prefix=PREFIX)
+    backend.entries.clear()
+
+    out = caller(PREFIX + "Instruction:\nb", SCHEMA, cache_prefix=PREFIX)
+    assert json.loads(out)["out"] == "ok"
+    assert model.prompts[-1] == PREFIX + "Instruction:\nb"
+    assert caller._entries == {}
+    caller(PREFIX + "Instruction:\nc", SCHEMA, cache_prefix=PREFIX)
+    assert caller.stats()["creations"] == 2
+
+
+def test_refused_prefix_is_not_retried() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock, min_uses=1)
+
+    attempts: list[str] = []
+
+    def refuse(prefix: str, ttl_s: float):
+        attempts.append(prefix)
+        raise GeminiHTTPError(400, "cached content is too small")
+
+    backend.create = refuse
+    for _ in range(3):
+        out = caller(PREFIX + "Instruction:\nq", SCHEMA, cache_prefix=PREFIX)
+        assert json.loads(out)["out"] == "ok"
+    assert caller.stats()["hits"] == 0
+    assert len(model.prompts) == 3
+    assert len(attempts) == 1
+
+
+def test_transient_create_failure_is_retried() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock, min_uses=1)
+    create = backend.create
+    failures = [GeminiHTTPError(503, "unavailable"), TimeoutError("timed out")]
+
+    def flaky(prefix: str, ttl_s: float):
+        if failures:
+            raise failures.pop(0)
+        return create(prefix, ttl_s)
+
+    backend.create = flaky
+    for _ in range(3):
+        caller(PREFIX + "Instruction:\nq", SCHEMA, cache_prefix=PREFIX)
+    assert caller.stats()["creations"] == 1 and caller.stats()["hits"] == 0
+
+
+def test_concurrent_calls_create_the_entry_once() -> None:
+    model, clock = _Model(), _Clock()
+    caller, backend = _caller(model, clock, min_uses=1)
+    create = backend.create
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_create(prefix: str, ttl_s: float):
+        entered.set()
+        release.wait(5)
+        return create(prefix, ttl_s)
+
+    backend.create = slow_create
+    first = threading.Thread(target=caller, args=(PREFIX + "Instruction:\na", SCHEMA), kwargs={"cache_prefix": PREFIX})
+    first.start()
+    assert entered.wait(5)
+    # The second call does not wait for or repeat the creation in flight.
+    caller(PREFIX + "Instruction:\nb", SCHEMA, cache_prefix=PREFIX)
+    release.set()
+    first.join(5)
+    assert caller.stats()["creations"] == 1
+    assert len(backend.entries) == 1
+
+
+def test_steps_reading_the_same_document_share_one_cached_prefix() -> None:
+    steps = parse_dsl(
+        "Summarize @doc.\n"
+        "/DEF summary\n"
+        "/THEN List the risks in @doc.\n"
+        "/DEF risks\n"
+    )
+    doc = "clause " * 1000
+    model, clock = _Model(), _Clock()
+    caller, _ = _caller(model, clock, min_uses=1, min_prefix_tokens=100)
+
+    def respond(prompt: str, schema: dict, **kwargs) -> str:
+        model.prompts.append(prompt)
+        name = "summary" if "Summarize" in prompt else "risks"
+        return json.dumps({"error": 0, "out": "ok", "vars": {name: "x"}})
+
+    caller.backend.call_model = respond
+    ctx, logs, _ = execute_steps(steps, {"doc": doc}, call_model=caller, reference_min_chars=1000)
+
+    assert ctx["risks"] == "x"
+    assert all(log["prompt"].startswith("Reference material:") for log in logs)
+    assert "Instruction:\nSummarize @doc." in logs[0]["prompt"]
+    assert reference_prefix(logs[0]["prompt"]) == reference_prefix(logs[1]["prompt"])
+    assert caller.stats()["creations"] == 1
+    assert caller.stats()["hits"] == 1
+
+
+def test_default_layout_is_unchanged_without_reference_min_chars() -> None:
+    step = parse_dsl("Summarize @doc.\n/DEF summary\n")[0]
+    prompt = build_step_prompt(step, {"doc": "clause " * 1000})
+    assert not prompt.startswith("Reference material:")
+    assert reference_prefix(prompt) is None
+
+
+def test_gemini_backend_sends_suffix_with_cache_name(monkeypatch) -> None:
+    calls: list = []
+    monkeypatch.setattr(
+        context_cache_v02,
+        "create_cached_content",
+        lambda text, model=None, ttl_s=300.0, timeout_s=None: {
+            "name": "cachedContents/xyz",
+            "usageMetadata": {"totalTokenCount": 1500},
+        },
+    )
+    monkeypatch.setattr(
+        context_cache_v02,
+        "call_gemini",
+        lambda prompt, **kwargs: calls.append((prompt, kwargs)) or '{"error": 0, "out": "ok"}',
+    )
+    caller = ContextCachingCaller(context_cache_v02.GeminiContextCache("m", 30), min_uses=1)
+    caller(PREFIX + "Instruction:\nq", SCHEMA, cache_prefix=PREFIX, generation_config={"temperature": 0})
+
+    prompt, kwargs = calls[0]
+    assert prompt == "Instruction:\nq"
+    assert kwargs["cached_content"] == "cachedContents/xyz"
+    assert kwargs["generation_config"] == {"temperature": 0}
+    assert caller.stats()["cached_tokens"] == 1500
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from decoder_v02 import decode_json_response
+from executor_v02 import execute_steps
+from fusion_v02 import execute_fused_steps
+from parser_v02 import parse_dsl
+
+
+OBJ = {"error": 0, "out": "ok, {done}", "vars": {"x": 1}}
+TEXT = json.dumps(OBJ)
+
+
+@pytest.mark.parametrize(
+    ("raw", "recovery"),
+    [
+        (TEXT, None),
+        (f"```json\n{TEXT}\n```", "fence"),
+        (f"Here is the result:\n{TEXT}\nLet me know if you need more.", "balanced_object"),
+        (f"Sure!\n```json\nResult: {TEXT}\n```", "fence+balanced_object"),
+        ('{"error": 0, "out": "ok, {done}", "vars": {"x": 1,},}', "trailing_commas"),
+        ('```\n{"error": 0, "out": "ok, {done}", "vars": {"x": 1,}}\n```', "fence+trailing_commas"),
+    ],
+)
+def test_recoveries(raw: str, recovery) -> None:
+    assert decode_json_response(raw) == (OBJ, recovery)
+
+
+def test_commas_inside_strings_are_kept() -> None:
+    value, recovery = decode_json_response('{"out": "a,}", "list": [1, 2,],}')
+    assert value == {"out": "a,}", "list": [1, 2]}
+    assert recovery == "trailing_commas"
+
+
+def test_unrecoverable_text_raises_the_strict_error() -> None:
+    with pytest.raises(json.JSONDecodeError):
+        decode_json_response("no json here {")
+
+
+def test_recovered_response_needs_no_second_call_and_is_logged() -> None:
+    calls: list[str] = []
+
+    def model(prompt: str, schema: dict, **kwargs) -> str:
+        calls.append(prompt)
+        return f"```json\n{TEXT}\n```"
+
+    ctx, logs, _ = execute_steps(parse_dsl("Create x\n/DEF x /TYPE int"), {}, call_model=model, repair_attempts=2)
+    assert ctx == {"x": 1}
+    assert len(calls) == 1
+    assert logs[0]["decode_recovery"] == "fence"
+    assert logs[0]["raw_response"].startswith("```json")
+    assert "repairs" not in logs[0]
+
+
+def test_strict_response_has_no_recovery_in_log() -> None:
+    _, logs, _ = execute_steps(
+        parse_dsl("Create x\n/DEF x /TYPE int"), {}, call_model=lambda *_: TEXT
+    )
+    assert "decode_recovery" not in logs[0]
+
+
+def test_fused_response_wrapped_in_prose_is_recovered() -> None:
+    steps = parse_dsl("Create a\n/DEF a /TYPE int\n/THEN Create b\n/FROM\n/DEF b /TYPE int")
+    fused = json.dumps(
+        {
+            "step_0": {"error": 0, "out": "a", "vars": {"a": 1}},
+            "step_1": {"error": 0, "out": "b", "vars": {"b": 2}},
+        }
+    )
+    ctx, logs, _ = execute_fused_steps(steps, {}, call_model=lambda *_: "Answer:\n" + fused)
+    assert ctx == {"a": 1, "b": 2}
+    assert [log["decode_recovery"] for log in logs] == ["balanced_object", "balanced_object"]
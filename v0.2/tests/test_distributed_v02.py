@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from distributed_v02 import (
+    Coordinator,
+    FilesystemTransport,
+    LocalQueueTransport,
+    partition_contexts,
+    run_local_cluster,
+    run_worker_node,
+)
+from parser_v02 import parse_dsl, steps_from_dicts, steps_to_dicts
+
+
+PROGRAM = "Echo @n\n/DEF y /TYPE int\n/THEN Use @y\n/FROM @y"
+
+
+def _echo_model(prompt: str, schema: dict) -> str:
+    if "vars" in schema["properties"]:
+        n = int(prompt.split("Echo ", 1)[1].split("\n", 1)[0])
+        return json.dumps({"error": 0, "out": "echo", "vars": {"y": n * 10}})
+    return json.dumps({"error": 0, "out": "used"})
+
+
+def test_steps_round_trip_through_dicts() -> None:
+    steps = parse_dsl(PROGRAM)
+    rebuilt = steps_from_dicts(json.loads(json.dumps(steps_to_dicts(steps))))
+    assert rebuilt == steps
+
+
+def test_partition_contexts_is_contiguous_and_balanced() -> None:
+    shards = partition_contexts([{"n": i} for i in range(7)], 3)
+    assert [[idx for idx, _ in shard] for shard in shards] == [[0, 1, 2], [3, 4], [5, 6]]
+
+
+def test_local_cluster_merges_results_in_input_order() -> None:
+    contexts = [{"n": i} for i in range(9)]
+    outcome = run_local_cluster(
+        PROGRAM, contexts, workers=3, call_model=_echo_model, concurrency_per_worker=2
+    )
+    assert [r.vars_after["y"] for r in outcome.results] == [i * 10 for i in range(9)]
+    assert outcome.stats.items == 9
+    assert outcome.stats.ok == 9
+    assert outcome.stats.steps == 18
+    assert sorted(outcome.per_worker) == ["worker-0", "worker-1", "worker-2"]
+
+
+class _CountingTransport(LocalQueueTransport):
+    def __init__(self) -> None:
+        super().__init__()
+        self.sent: list[tuple[str, str]] = []
+
+    def send(self, address: str, message: dict) -> None:
+        self.sent.append((address, message["type"]))
+        super().send(address, message)
+
+
+def test_program_is_shipped_once_per_worker() -> None:
+    transport = _CountingTransport()
+    run_local_cluster(PROGRAM, [{"n": i} for i in range(6)], workers=2, transport=transport)
+    program_msgs = [addr for addr, kind in transport.sent if kind == "program"]
+    assert sorted(program_msgs) == ["worker-0", "worker-1"]
+
+
+def test_filesystem_transport_runs_batch_with_failures_reported(tmp_path) -> None:
+    transport = FilesystemTransport(tmp_path / "spool")
+
+    def model(prompt: str, schema: dict) -> str:
+        if "Echo 2" in prompt:
+            return "not json"
+        return _echo_model(prompt, schema)
+
+    threads = [
+        threading.Thread(target=run_worker_node, args=(transport, name, model), daemon=True)
+        for name in ("a", "b")
+    ]
+    for t in threads:
+        t.start()
+    outcome = Coordinator(transport, ["a", "b"]).run(
+        PROGRAM, [{"n": i} for i in range(4)], timeout_s=10
+    )
+    for t in threads:
+        t.join(5)
+
+    assert [r.ok for r in outcome.results] == [True, True, False, True]
+    assert outcome.stats.failed == 1
+    assert "not valid JSON" in outcome.results[2].error
+    assert list((tmp_path / "spool" / "coordinator").glob("*.json")) == []
+
+
+def test_filesystem_transport_keeps_each_senders_order(tmp_path, monkeypatch) -> None:
+    # A coarse or skewed clock must not reorder messages from one sender.
+    monkeypatch.setattr("time.time_ns", lambda: 0)
+    sender = FilesystemTransport(tmp_path / "spool")
+    other = FilesystemTransport(tmp_path / "spool")
+    for n in range(20):
+        sender.send("inbox", {"n": n})
+    other.send("inbox", {"n": "other"})
+    received = [other.recv("inbox", timeout=1)["n"] for _ in range(21)]
+    assert [n for n in received if n != "other"] == list(range(20))
+    assert "other" in received
+
+
+def test_timeout_keeps_partial_results(tmp_path) -> None:
+    transport = FilesystemTransport(tmp_path / "spool")
+    worker = threading.Thread(
+        target=run_worker_node, args=(transport, "a", _echo_model), kwargs={"idle_timeout_s": 2}
+    )
+    worker.start()
+    outcome = Coordinator(transport, ["a", "gone"]).run(PROGRAM, [{"n": 1}, {"n": 2}], timeout_s=1)
+    worker.join()
+
+    assert outcome.timed_out == ["gone"]
+    assert outcome.results[0].ok
+    assert not outcome.results[1].ok and "'gone' did not finish" in outcome.results[1].error
+
+
+def test_reused_sender_name_sorts_after_old_files(tmp_path) -> None:
+    old = FilesystemTransport(tmp_path / "spool", sender="coord")
+    for n in range(3):
+        old.send("inbox", {"n": f"old-{n}"})
+    FilesystemTransport(tmp_path / "spool", sender="coord").send("inbox", {"n": "new"})
+    reader = FilesystemTransport(tmp_path / "spool")
+    assert [reader.recv("inbox", timeout=1)["n"] for _ in range(4)][-1] == "new"
+
+
+def test_item_that_raises_is_reported_as_a_failed_result(monkeypatch) -> None:
+    import distributed_v02
+
+    real_run_steps = distributed_v02.run_steps
+
+    def flaky_run_steps(steps, context, **kwargs):
+        if context["n"] == 1:
+            raise RuntimeError("worker crashed")
+        return real_run_steps(steps, context, **kwargs)
+
+    monkeypatch.setattr(distributed_v02, "run_steps", flaky_run_steps)
+    outcome = run_local_cluster(PROGRAM, [{"n": i} for i in range(3)], workers=2, call_model=_echo_model)
+    assert [r.ok for r in outcome.results] == [True, False, True]
+    assert outcome.results[1].error == "RuntimeError: worker crashed"
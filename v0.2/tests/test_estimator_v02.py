@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from estimator_v02 import ModelPricing, StepStatsHistory, estimate_run
+from executor_v02 import execute_steps
+from parser_v02 import parse_dsl
+
+
+PROGRAM = (
+    "Summarize the report\n/DEF summary /TYPE str\n"
+    "/THEN Extract the year\n/FROM\n/DEF year /TYPE int\n"
+    "/THEN Write a headline from @summary\n/FROM @summary\n/DEF headline /TYPE str"
+)
+
+
+def _answer(prompt: str, schema: dict, **kwargs) -> str:
+    names = schema["properties"]["vars"]["required"]
+    values = {"summary": "A short summary.", "year": 2024, "headline": "Big news"}
+    return json.dumps({"error": 0, "out": "ok", "vars": {n: values[n] for n in names}})
+
+
+def test_estimate_without_history_uses_defaults_and_dependency_graph() -> None:
+    steps = parse_dsl(PROGRAM)
+    estimate = estimate_run(steps, {}, model="gemini-2.5-flash")
+
+    assert [e.source for e in estimate.steps] == ["default"] * 3
+    assert [e.depends_on for e in estimate.steps] == [[], [], [0]]
+    # Steps 0 and 1 are independent, so the critical path is 0 -> 2.
+    assert estimate.critical_path == [0, 2]
+    assert estimate.critical_path_latency_s < estimate.sequential_latency_s
+    assert estimate.cost_usd is not None and estimate.cost_usd > 0
+    assert estimate.prompt_tokens == sum(e.prompt_tokens for e in estimate.steps)
+
+
+def test_step_without_from_depends_on_every_earlier_definition() -> None:
+    steps = parse_dsl("Write a long report\n/DEF report /TYPE str\n/THEN Write a greeting")
+    with_from = parse_dsl("Write a long report\n/DEF report /TYPE str\n/THEN Write a greeting\n/FROM")
+    estimate = estimate_run(steps, {})
+    independent = estimate_run(with_from, {})
+
+    assert estimate.steps[1].depends_on == [0]
+    assert estimate.critical_path == [0, 1]
+    assert independent.steps[1].depends_on == []
+    # The pending report is part of the greeting prompt.
+    assert estimate.steps[1].prompt_tokens > independent.steps[1].prompt_tokens
+
+
+def test_history_from_logs_drives_latency_and_persists(tmp_path) -> None:
+    steps = parse_dsl(PROGRAM)
+    _, logs, _ = execute_steps(steps, {}, call_model=_answer)
+    for log, seconds in zip(logs, (2.0, 0.5, 1.0)):
+        log["elapsed_ms"] = seconds * 1000
+
+    path = tmp_path / "stats.json"
+    assert StepStatsHistory(path).record_run(steps, logs, "gemini-2.5-flash") == 3
+    estimate = estimate_run(steps, {}, model="gemini-2.5-flash", history=StepStatsHistory(path))
+
+    assert [e.source for e in estimate.steps] == ["history"] * 3
+    assert [e.latency_s for e in estimate.steps] == [2.0, 0.5, 1.0]
+    assert estimate.sequential_latency_s == 3.5
+    assert estimate.critical_path_latency_s == 3.0
+    # Another model has no history for these steps.
+    assert estimate_run(steps, {}, model="other", history=StepStatsHistory(path)).steps[0].source == "default"
+
+
+def test_unknown_steps_are_calibrated_on_the_model_history() -> None:
+    history = StepStatsHistory()
+    steps = parse_dsl(PROGRAM)
+    _, logs, _ = execute_steps(steps, {}, call_model=_answer)
+    for log in logs:
+        log["elapsed_ms"] = 20_000
+    history.record_run(steps, logs, "slow-model")
+
+    new_step = parse_dsl("Something new\n/DEF note /TYPE str")
+    slow = estimate_run(new_step, {}, model="slow-model", history=history).steps[0]
+    fresh = estimate_run(new_step, {}, model="fresh-model", history=history).steps[0]
+    assert slow.source == "model" and fresh.source == "default"
+    assert slow.latency_s > fresh.latency_s
+
+
+def test_large_prompts_are_flagged_and_map_fan_out_is_counted() -> None:
+    steps = parse_dsl(
+        "List\n/DEF items /TYPE list[str]\n"
+        "/THEN Rate @ITEM\n/MAP @items\n/DEF score /TYPE list[int]\n"
+        "/THEN Review everything\n/DEF verdict /TYPE str"
+    )
+    context = {"notes": "word " * 50_000}
+    estimate = estimate_run(steps, context, max_prompt_tokens=10_000, map_workers=4)
+
+    assert estimate.steps[1].calls == 8
+    assert "fan-out unknown" in estimate.steps[1].notes[0]
+    assert any("no /FROM" in note for note in estimate.steps[2].notes)
+    assert [w.split(":")[0] for w in estimate.warnings] == ["Step 0 (line 1)", "Step 1 (line 3)", "Step 2 (line 6)"]
+    assert estimate.cost_usd is None
+
+
+def test_local_steps_cost_nothing_and_custom_pricing_applies() -> None:
+    steps = parse_dsl("Text\n/DEF t /TYPE str\n/THEN Count\n/CALL count_words\n/FROM @t\n/DEF n /TYPE int")
+    estimate = estimate_run(steps, {}, model="mine", pricing={"mine": ModelPricing(1_000_000.0, 0.0)})
+    assert estimate.steps[1].source == "local"
+    assert estimate.steps[1].latency_s == 0.0 and estimate.steps[1].calls == 0
+    assert estimate.cost_usd == float(estimate.steps[0].prompt_tokens)
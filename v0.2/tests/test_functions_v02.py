@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import execute_steps
+from functions_v02 import FunctionRegistry, default_functions
+from fusion_v02 import execute_fused_steps, plan_fusion
+from parser_v02 import ParseError, parse_dsl, steps_from_dicts, steps_to_dicts
+from runtime_v02 import run_dsl_text
+
+
+def _no_model(*_args, **_kwargs) -> str:
+    raise AssertionError("model must not be called")
+
+
+def _answers(**values):
+    """Model that answers every model step with `values` restricted to its /DEFs."""
+    calls: list[str] = []
+
+    def model(prompt: str, schema: dict, **kwargs) -> str:
+        calls.append(prompt)
+        names = schema["properties"]["vars"]["required"]
+        return json.dumps({"error": 0, "out": "ok", "vars": {n: values[n] for n in names}})
+
+    model.calls = calls
+    return model
+
+
+def test_call_step_runs_locally_and_commits_typed_values() -> None:
+    steps = parse_dsl(
+        "Extract the name\n/DEF first /TYPE str\n/DEF space /TYPE str\n/DEF last /TYPE str\n"
+        "/THEN Join the name\n/CALL concat\n/FROM @first, @space, @last\n/DEF full /TYPE str\n"
+        "/THEN Count words\n/CALL count_words\n/FROM @full\n/DEF n /TYPE int"
+    )
+    model = _answers(first="Ada", space=" ", last="Lovelace")
+    ctx, logs, outputs = execute_steps(steps, {}, call_model=model, functions=default_functions())
+
+    assert len(model.calls) == 1
+    assert ctx["full"] == "Ada Lovelace"
+    assert ctx["n"] == 2
+    assert outputs[1:] == ["full = Ada Lovelace", "n = 2"]
+    assert logs[1]["prompt"] is None
+    assert logs[1]["call"]["function"] == "concat"
+    assert logs[1]["call"]["args"] == ["first", "space", "last"]
+    assert logs[2]["parsed_json"]["vars"] == {"n": 2}
+
+
+def test_function_returning_a_mapping_fills_several_defs() -> None:
+    registry = FunctionRegistry()
+
+    @registry.function(input_types=["str"])
+    def split_name(full: str) -> dict:
+        """Split a full name."""
+        first, _, last = full.partition(" ")
+        return {"first": first, "last": last}
+
+    steps = parse_dsl(
+        "Name\n/DEF full /TYPE str\n/THEN Split\n/CALL split_name\n/FROM @full\n/DEF first /TYPE str\n/DEF last /TYPE str"
+    )
+    ctx, _, _ = execute_steps(steps, {}, call_model=_answers(full="Grace Hopper"), functions=registry)
+    assert ctx == {"full": "Grace Hopper", "first": "Grace", "last": "Hopper"}
+    assert registry.describe()[0]["description"] == "Split a full name."
+
+
+def test_wrong_result_type_fails_without_partial_commit() -> None:
+    registry = FunctionRegistry()
+    registry.register("pair", lambda: {"a": 1, "b": "two"})
+    steps = parse_dsl("Pair\n/CALL pair\n/DEF a /TYPE int\n/DEF b /TYPE int")
+    ctx: dict = {}
+    with pytest.raises(ValueError, match="'b' expected int"):
+        execute_steps(steps, ctx, functions=registry)
+    assert ctx == {}
+
+
+def test_argument_types_are_checked() -> None:
+    steps = parse_dsl("Number\n/DEF n /TYPE int\n/THEN Length\n/CALL length\n/FROM @n\n/DEF size /TYPE int")
+    with pytest.raises(ValueError, match="argument 1 expected str"):
+        execute_steps(steps, {}, call_model=_answers(n=5), functions=default_functions())
+
+
+def test_length_counts_list_items() -> None:
+    steps = parse_dsl("Items\n/DEF items /TYPE list[str]\n/THEN Count\n/CALL length\n/FROM @items\n/DEF n /TYPE int")
+    ctx, _, _ = execute_steps(steps, {}, call_model=_answers(items=["a", "bb", "c"]), functions=default_functions())
+    assert ctx["n"] == 3
+
+
+def test_function_exception_is_a_runtime_error() -> None:
+    registry = FunctionRegistry()
+    registry.register("boom", lambda: 1 / 0)
+    steps = parse_dsl("Boom\n/CALL boom\n/DEF x /TYPE int")
+    with pytest.raises(RuntimeError, match="/CALL boom failed"):
+        execute_steps(steps, {}, functions=registry)
+
+
+def test_unknown_function_fails_before_any_model_call() -> None:
+    steps = parse_dsl("Ask\n/DEF a /TYPE int\n/THEN Local\n/CALL nope\n/DEF b /TYPE int")
+    with pytest.raises(ValueError, match="unknown function 'nope'"):
+        execute_steps(steps, {}, call_model=_no_model, functions=default_functions())
+
+
+@pytest.mark.parametrize(
+    ("text", "message"),
+    [
+        ("X\n/CALL a\n/CALL b", "at most once"),
+        ("X\n/CALL two words", "one function name"),
+        ("X\n/CALL upper\n/OUT shout", "/OUT cannot be combined"),
+        ("X\n/CALL upper\n/FROM the title", "not descriptions"),
+    ],
+)
+def test_call_parse_errors(text: str, message: str) -> None:
+    with pytest.raises(ParseError, match=message):
+        parse_dsl(text)
+
+
+def test_call_survives_step_dict_round_trip() -> None:
+    steps = parse_dsl("Shout\n/CALL upper\n/DEF y /TYPE str")
+    assert steps_from_dicts(json.loads(json.dumps(steps_to_dicts(steps))))[0].call == "upper"
+
+
+def test_call_steps_are_never_fused() -> None:
+    steps = parse_dsl(
+        "A\n/DEF x /TYPE str\n/THEN A2\n/FROM\n/DEF a /TYPE int\n"
+        "/THEN Local\n/CALL upper\n/FROM @x\n/DEF y /TYPE str\n/THEN B\n/DEF b /TYPE int"
+    )
+    assert [[s.index for s in g] for g in plan_fusion(steps)] == [[0, 1], [2], [3]]
+    fused = json.dumps(
+        {
+            "step_0": {"error": 0, "out": "ok", "vars": {"x": "hi"}},
+            "step_1": {"error": 0, "out": "ok", "vars": {"a": 1}},
+        }
+    )
+    replies = [fused, json.dumps({"error": 0, "out": "ok", "vars": {"b": 2}})]
+    ctx, logs, _ = execute_fused_steps(
+        steps, {}, call_model=lambda *_a, **_k: replies.pop(0), functions=default_functions()
+    )
+    assert ctx == {"x": "hi", "a": 1, "y": "HI", "b": 2}
+    assert logs[2]["call"]["function"] == "upper"
+
+
+def test_runtime_uses_built_in_functions_by_default() -> None:
+    result = run_dsl_text(
+        "Numbers\n/DEF a /TYPE int\n/DEF b /TYPE float\n/THEN Sum\n/CALL sum\n/FROM @a, @b\n/DEF total /TYPE float",
+        {},
+        call_model=_answers(a=1, b=2.5),
+    )
+    assert result.ok is True
+    assert result.vars_after["total"] == 3.5
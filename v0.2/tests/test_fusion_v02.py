@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import execute_steps
+from fusion_v02 import build_fused_schema, execute_fused_steps, plan_fusion
+from parser_v02 import parse_dsl
+from runtime_v02 import run_dsl_text
+
+
+CHECKS = (
+    "Is it urgent?\n/DEF urgent\n/TYPE bool\n"
+    "/THEN Is it a refund?\n/FROM\n/DEF refund\n/TYPE bool\n"
+    "/THEN Count items\n/FROM\n/DEF items\n/TYPE int\n"
+    "/THEN Summarize @urgent and @refund\n/FROM @urgent, @refund"
+)
+
+
+class _FusedModel:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+        self.schemas: list[dict] = []
+
+    def __call__(self, prompt: str, schema: dict) -> str:
+        self.prompts.append(prompt)
+        self.schemas.append(schema)
+        values = {"urgent": True, "refund": False, "items": 3}
+        if "step_0" not in schema["properties"]:
+            return json.dumps({"error": 0, "out": "summary"})
+        reply = {}
+        for key, sub in schema["properties"].items():
+            task = {"error": 0, "out": f"{key} done"}
+            if "vars" in sub["properties"]:
+                task["vars"] = {name: values[name] for name in sub["properties"]["vars"]["required"]}
+            reply[key] = task
+        return json.dumps(reply)
+
+
+def test_plan_groups_independent_steps_and_breaks_on_dependencies() -> None:
+    groups = plan_fusion(parse_dsl(CHECKS))
+    assert [[s.index for s in g] for g in groups] == [[0, 1, 2], [3]]
+
+    assert [len(g) for g in plan_fusion(parse_dsl(CHECKS), max_group=2)] == [2, 2]
+
+
+def test_steps_using_run_history_or_earlier_values_start_a_group() -> None:
+    embedded = parse_dsl("A\n/DEF a\n/THEN B uses @a")
+    assert [len(g) for g in plan_fusion(embedded)] == [1, 1]
+
+    scoped = parse_dsl("A\n/DEF a\n/THEN B\n/FROM details /IN @a")
+    assert [len(g) for g in plan_fusion(scoped)] == [1, 1]
+
+    history = parse_dsl("A\n/THEN Recap\n/FROM @CHAT")
+    assert [len(g) for g in plan_fusion(history)] == [1, 1]
+
+    no_defs = parse_dsl("A\n/THEN B")
+    assert [len(g) for g in plan_fusion(no_defs)] == [2]
+
+
+def test_step_without_from_is_not_fused_after_a_def() -> None:
+    steps = parse_dsl("Extract the customer name\n/DEF name\n/THEN Write a greeting")
+    assert [[s.index for s in g] for g in plan_fusion(steps)] == [[0], [1]]
+
+    prompts: list[str] = []
+
+    def model(prompt: str, schema: dict) -> str:
+        prompts.append(prompt)
+        vars_ = {"vars": {"name": "Ada"}} if "vars" in schema["properties"] else {}
+        return json.dumps({"error": 0, "out": "ok", **vars_})
+
+    execute_fused_steps(steps, {}, call_model=model)
+    assert "- name: Ada" in prompts[1]
+
+    # An empty /FROM declares that the step needs no context, so it can still be fused.
+    independent = parse_dsl("Extract the customer name\n/DEF name\n/THEN Write a greeting\n/FROM")
+    assert [len(g) for g in plan_fusion(independent)] == [2]
+
+
+def test_fused_schema_namespaces_vars_per_step() -> None:
+    group = plan_fusion(parse_dsl(CHECKS))[0]
+    schema = build_fused_schema(group)
+    assert schema["required"] == ["step_0", "step_1", "step_2"]
+    assert schema["properties"]["step_2"]["properties"]["vars"]["properties"] == {
+        "items": {"type": "integer"}
+    }
+
+
+def test_fused_execution_matches_sequential_with_fewer_calls() -> None:
+    model = _FusedModel()
+    context, logs, outputs = execute_fused_steps(parse_dsl(CHECKS), {}, call_model=model)
+
+    assert len(model.prompts) == 2
+    assert "=== Task step_1 ===\nInstruction:\nIs it a refund?" in model.prompts[0]
+    assert context == {"urgent": True, "refund": False, "items": 3}
+    assert outputs == ["step_0 done", "step_1 done", "step_2 done", "summary"]
+    assert [log["step_index"] for log in logs] == [0, 1, 2, 3]
+    assert logs[1]["fused_with"] == [0, 1, 2]
+    assert logs[1]["staged_updates"] == {"refund": False}
+    assert "fused_with" not in logs[3]
+
+
+def test_invalid_step_in_fused_group_keeps_earlier_commits() -> None:
+    def model(prompt: str, schema: dict) -> str:
+        return json.dumps(
+            {
+                "step_0": {"error": 0, "out": "ok", "vars": {"urgent": True}},
+                "step_1": {"error": 0, "out": "ok", "vars": {"refund": "no"}},
+                "step_2": {"error": 0, "out": "ok", "vars": {"items": 1}},
+            }
+        )
+
+    context: dict = {}
+    committed: list[int] = []
+    with pytest.raises(ValueError, match="'refund' expected bool"):
+        execute_fused_steps(
+            parse_dsl(CHECKS), context, call_model=model, on_step=lambda log: committed.append(log["step_index"])
+        )
+    assert context == {"urgent": True}
+    assert committed == [0]
+
+
+def test_missing_task_key_is_reported_for_that_step() -> None:
+    def model(prompt: str, schema: dict) -> str:
+        return json.dumps({"step_0": {"error": 0, "out": "ok", "vars": {"urgent": True}}})
+
+    with pytest.raises(ValueError, match="Step 1 .*missing task key 'step_1'"):
+        execute_fused_steps(parse_dsl(CHECKS), {}, call_model=model)
+
+
+def test_stub_mode_and_runtime_flag() -> None:
+    program = "A\n/DEF a\n/THEN B\n/FROM\n/DEF b"
+    stub_context, _, _ = execute_fused_steps(parse_dsl(program), {})
+    seq_context, _, _ = execute_steps(parse_dsl(program), {})
+    assert stub_context == seq_context
+
+    result = run_dsl_text(CHECKS, {}, call_model=_FusedModel(), fuse_steps=True)
+    assert result.ok
+    assert result.vars_after["items"] == 3
@@ -48,3 +48,91 @@ def test_call_gemini_requests_json_mime_type(monkeypatch) -> None:
     assert out == '{"error":0,"out":"ok"}'
     assert captured["payload"]["generationConfig"]["responseMimeType"] == "application/json"
     assert captured["payload"]["generationConfig"]["responseSchema"] == schema
+
+
+def test_call_gemini_merges_generation_config_without_overriding_contract(monkeypatch) -> None:
+    captured: dict = {}
+
+    class FakeResp(io.BytesIO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc, tb):
+            return False
+
+    def fake_urlopen(req, timeout=None):
+        captured["payload"] = json.loads(req.data.decode("utf-8"))
+        response_data = {"candidates": [{"content": {"parts": [{"text": "{}"}]}}]}
+        return FakeResp(json.dumps(response_data).encode("utf-8"))
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(gemini_client_v02.urllib.request, "urlopen", fake_urlopen)
+
+    gemini_client_v02.call_gemini(
+        "hello",
+        generation_config={
+            "maxOutputTokens": 64,
+            "thinkingConfig": {"thinkingBudget": 0},
+            "responseMimeType": "text/plain",
+        },
+    )
+    config = captured["payload"]["generationConfig"]
+    assert config["maxOutputTokens"] == 64
+    assert config["thinkingConfig"] == {"thinkingBudget": 0}
+    assert config["responseMimeType"] == "application/json"
+
+
+def test_cached_content_is_created_and_referenced(monkeypatch) -> None:
+    requests: list = []
+
+    class FakeResp(io.BytesIO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc, tb):
+            return False
+
+    def fake_urlopen(req, timeout=None):
+        requests.append((req.full_url, json.loads(req.data.decode("utf-8"))))
+        if req.full_url.endswith("/cachedContents"):
+            response_data = {"name": "cachedContents/abc", "usageMetadata": {"totalTokenCount": 2048}}
+        else:
+            response_data = {"candidates": [{"content": {"parts": [{"text": "{}"}]}}]}
+        return FakeResp(json.dumps(response_data).encode("utf-8"))
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(gemini_client_v02.urllib.request, "urlopen", fake_urlopen)
+
+    resource = gemini_client_v02.create_cached_content("long document", model="gemini-2.5-flash", ttl_s=120)
+    gemini_client_v02.call_gemini("question", model="gemini-2.5-flash", cached_content=resource["name"])
+
+    (create_url, create_payload), (_, generate_payload) = requests
+    assert create_url.endswith("/cachedContents")
+    assert create_payload["model"] == "models/gemini-2.5-flash"
+    assert create_payload["ttl"] == "120s"
+    assert create_payload["contents"][0]["parts"][0]["text"] == "long document"
+    assert generate_payload["cachedContent"] == "cachedContents/abc"
+    assert generate_payload["contents"][0]["parts"][0]["text"] == "question"
+
+
+def test_count_tokens_calls_count_endpoint(monkeypatch) -> None:
+    captured: dict = {}
+
+    class FakeResp(io.BytesIO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc, tb):
+            return False
+
+    def fake_urlopen(req, timeout=None):
+        captured["url"] = req.full_url
+        captured["payload"] = json.loads(req.data.decode("utf-8"))
+        return FakeResp(json.dumps({"totalTokens": 42}).encode("utf-8"))
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(gemini_client_v02.urllib.request, "urlopen", fake_urlopen)
+
+    assert gemini_client_v02.count_tokens("hello there", model="gemini-2.5-flash") == 42
+    assert captured["url"].endswith("/models/gemini-2.5-flash:countTokens")
+    assert captured["payload"] == {"contents": [{"parts": [{"text": "hello there"}]}]}
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import execute_steps
+from fusion_v02 import execute_fused_steps
+from generation_v02 import (
+    GenerationConfig,
+    GenerationPolicy,
+    derive_generation_config,
+    merge_generation_configs,
+)
+from parser_v02 import parse_dsl
+
+
+def _step(dsl: str):
+    return parse_dsl(dsl)[0]
+
+
+def test_structured_extractions_get_short_limit_and_no_thinking() -> None:
+    config = derive_generation_config(_step("Urgent?\n/DEF urgent\n/TYPE bool"), "gemini-2.5-flash")
+    assert config == GenerationConfig(max_output_tokens=224, thinking_budget=0, temperature=0.0)
+    assert config.to_gemini() == {
+        "maxOutputTokens": 224,
+        "thinkingConfig": {"thinkingBudget": 0},
+        "temperature": 0.0,
+    }
+
+
+def test_thinking_and_temperature_follow_the_model() -> None:
+    step = _step("Urgent?\n/DEF urgent\n/TYPE bool")
+    assert derive_generation_config(step, "gemini-2.5-pro").to_gemini() == {
+        "maxOutputTokens": 224 + 128,
+        "thinkingConfig": {"thinkingBudget": 128},
+        "temperature": 0.0,
+    }
+    assert derive_generation_config(step, "gemini-3-pro-preview").to_gemini() == {
+        "maxOutputTokens": 224 + 1024,
+        "thinkingConfig": {"thinkingLevel": "low"},
+    }
+    assert derive_generation_config(step, "gemini-2.0-flash").to_gemini() == {
+        "maxOutputTokens": 224,
+        "temperature": 0.0,
+    }
+    assert GenerationPolicy(model="gemini-2.5-pro").config_for(_step("Name?\n/DEF name\n/TYPE str")) == {
+        "maxOutputTokens": 768 + 128,
+        "thinkingConfig": {"thinkingBudget": 128},
+    }
+
+
+def test_short_strings_get_moderate_limit_and_free_text_keeps_defaults() -> None:
+    assert derive_generation_config(_step("Name?\n/DEF name\n/TYPE str")).max_output_tokens == 768
+    assert derive_generation_config(_step("Write\n/DEF essay")) == GenerationConfig()
+    assert derive_generation_config(_step("Count\n/DEF n\n/TYPE int\n/OUT a friendly note")) == GenerationConfig()
+    assert derive_generation_config(_step("Chat")) == GenerationConfig()
+
+
+def test_overrides_apply_globally_then_per_step() -> None:
+    policy = GenerationPolicy(
+        overrides={"thinking_budget": 128},
+        step_overrides={1: {"max_output_tokens": None, "temperature": 0.7}},
+    )
+    steps = parse_dsl("Urgent?\n/DEF urgent\n/TYPE bool\n/THEN Count\n/DEF n\n/TYPE int")
+    assert policy.config_for(steps[0]) == {
+        "maxOutputTokens": 224 + 128,
+        "thinkingConfig": {"thinkingBudget": 128},
+        "temperature": 0.0,
+    }
+    assert policy.config_for(steps[1]) == {"thinkingConfig": {"thinkingBudget": 128}, "temperature": 0.7}
+    assert GenerationPolicy().config_for(_step("Write")) is None
+    with pytest.raises(ValueError, match="unknown generation settings"):
+        GenerationPolicy(overrides={"top_k": 3})
+
+
+def test_merge_keeps_only_settings_every_step_has() -> None:
+    merged = merge_generation_configs(
+        [
+            {"maxOutputTokens": 100, "thinkingConfig": {"thinkingBudget": 0}, "temperature": 0.0},
+            {"maxOutputTokens": 50, "thinkingConfig": {"thinkingBudget": 64}},
+        ]
+    )
+    assert merged == {"maxOutputTokens": 150, "thinkingConfig": {"thinkingBudget": 64}}
+    assert merge_generation_configs([{"maxOutputTokens": 10}, None]) is None
+    assert merge_generation_configs(
+        [{"thinkingConfig": {"thinkingLevel": "low"}}, {"thinkingConfig": {"thinkingLevel": "high"}}]
+    ) == {"thinkingConfig": {"thinkingLevel": "high"}}
+
+
+def test_executor_passes_config_only_when_set_and_logs_it() -> None:
+    calls: list[dict] = []
+
+    def model(prompt: str, schema: dict, **kwargs) -> str:
+        calls.append(kwargs)
+        if "vars" in schema["properties"]:
+            return json.dumps({"error": 0, "out": "ok", "vars": {"urgent": True}})
+        return json.dumps({"error": 0, "out": "ok"})
+
+    steps = parse_dsl("Urgent?\n/DEF urgent\n/TYPE bool\n/THEN Explain")
+    _, logs, _ = execute_steps(steps, {}, call_model=model, generation=GenerationPolicy())
+    assert calls[0]["generation_config"]["maxOutputTokens"] == 224
+    assert calls[1] == {}
+    assert logs[0]["generation_config"]["temperature"] == 0.0
+    assert "generation_config" not in logs[1]
+
+
+def test_fused_groups_send_merged_config() -> None:
+    seen: list[dict] = []
+
+    def model(prompt: str, schema: dict, generation_config=None) -> str:
+        seen.append(generation_config)
+        return json.dumps(
+            {
+                "step_0": {"error": 0, "out": "ok", "vars": {"a": True}},
+                "step_1": {"error": 0, "out": "ok", "vars": {"b": 2}},
+            }
+        )
+
+    steps = parse_dsl("A?\n/DEF a\n/TYPE bool\n/THEN B?\n/FROM\n/DEF b\n/TYPE int")
+    execute_fused_steps(steps, {}, call_model=model, generation=GenerationPolicy())
+    assert seen == [
+        {"maxOutputTokens": 448, "thinkingConfig": {"thinkingBudget": 0}, "temperature": 0.0}
+    ]
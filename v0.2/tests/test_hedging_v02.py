@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from hedging_v02 import HedgedCaller
+
+
+SCHEMA = {"type": "object", "properties": {}, "required": ["error", "out"]}
+
+
+class _Model:
+    def __init__(self, delays: list[float], out: str = "ok") -> None:
+        self.delays = list(delays)
+        self.out = out
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str, schema: dict) -> str:
+        with self._lock:
+            delay = self.delays[self.calls] if self.calls < len(self.delays) else self.delays[-1]
+            self.calls += 1
+        time.sleep(delay)
+        return json.dumps({"error": 0, "out": self.out})
+
+
+def test_no_hedging_until_latency_history_exists() -> None:
+    model = _Model([0.0])
+    caller = HedgedCaller(model, min_samples=5)
+    assert caller.hedge_delay() is None
+    for _ in range(5):
+        caller("p", SCHEMA)
+    time.sleep(0.01)
+    assert caller.hedge_delay() is not None
+    assert caller.stats()["hedges"] == 0
+    caller.close()
+
+
+def test_slow_primary_is_hedged_and_fast_hedge_wins() -> None:
+    primary = _Model([0.5])
+    hedge = _Model([0.0], out="hedged")
+    caller = HedgedCaller(primary, hedge_call=hedge, initial_delay_s=0.02, max_hedge_rate=1.0)
+
+    started = time.monotonic()
+    assert json.loads(caller("p", SCHEMA))["out"] == "hedged"
+    assert time.monotonic() - started < 0.4
+    assert caller.stats()["hedge_wins"] == 1
+    caller.close()
+
+
+def test_fast_primary_is_not_hedged() -> None:
+    hedge = _Model([0.0], out="hedged")
+    caller = HedgedCaller(_Model([0.0]), hedge_call=hedge, initial_delay_s=0.5, max_hedge_rate=1.0)
+    assert json.loads(caller("p", SCHEMA))["out"] == "ok"
+    assert hedge.calls == 0
+    caller.close()
+
+
+def test_invalid_fast_response_does_not_win() -> None:
+    def broken(prompt: str, schema: dict) -> str:
+        return "not json"
+
+    primary = _Model([0.1])
+    caller = HedgedCaller(primary, hedge_call=broken, initial_delay_s=0.01, max_hedge_rate=1.0)
+    assert json.loads(caller("p", SCHEMA))["out"] == "ok"
+    assert caller.stats()["hedge_wins"] == 0
+    caller.close()
+
+
+def test_hedge_rate_is_capped_by_budget() -> None:
+    primary = _Model([0.03])
+    hedge = _Model([0.0], out="hedged")
+    caller = HedgedCaller(primary, hedge_call=hedge, initial_delay_s=0.005, max_hedge_rate=0.25)
+    for _ in range(8):
+        caller("p", SCHEMA)
+    stats = caller.stats()
+    assert stats["hedges"] == 2
+    assert stats["budget_skips"] == 6
+    assert stats["hedge_rate"] <= 0.25
+    caller.close()
+
+
+def test_threshold_follows_recent_latency_percentile() -> None:
+    caller = HedgedCaller(_Model([0.0]), percentile=0.5, min_samples=3)
+    with caller._lock:
+        caller._latencies.extend([1.0, 2.0, 3.0, 40.0])
+    assert caller.hedge_delay() == 3.0
+    with pytest.raises(ValueError):
+        HedgedCaller(_Model([0.0]), percentile=1.5)
+    caller.close()
+
+
+def test_busy_hedge_pool_does_not_delay_or_inflate_primaries() -> None:
+    caller = HedgedCaller(_Model([0.0]), min_samples=1, max_workers=1)
+    release = threading.Event()
+    caller._pool.submit(release.wait, 5)
+
+    started = time.monotonic()
+    caller("p", SCHEMA)
+    assert time.monotonic() - started < 1.0
+    assert caller.hedge_delay() < 0.5
+    release.set()
+    caller.close()
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from job_queue_v02 import JobQueue, run_worker, run_workers
+from parser_v02 import ParseError
+from runtime_v02 import RunResult
+
+
+PROGRAM = "Echo @n\n/DEF y /TYPE str"
+
+
+def _ok_result(ctx: dict) -> RunResult:
+    return RunResult(ok=True, outputs=["ok"], logs=[], vars_after=ctx, parsed_steps=[])
+
+
+def test_submit_rejects_unparseable_program(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    with pytest.raises(ParseError):
+        queue.submit("/OUT only output", [{}])
+
+
+def test_lease_is_exclusive_and_complete_is_idempotent(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    job_id = queue.submit(PROGRAM, [{"n": 1}])
+
+    item = queue.lease("w1")
+    assert item is not None and item.attempts == 1
+    assert queue.lease("w2") is None
+
+    assert queue.complete(item, _ok_result({"n": 1, "y": "a"})) is True
+    assert queue.complete(item, _ok_result({"n": 1, "y": "b"})) is False
+    assert queue.results(job_id)[0]["result"]["vars_after"]["y"] == "a"
+
+
+def test_worker_that_lost_its_lease_cannot_complete_or_fail(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    job_id = queue.submit(PROGRAM, [{"n": 1}])
+    stale = queue.lease("w1", lease_s=0.01)
+    time.sleep(0.05)
+    current = queue.lease("w2")
+    assert current is not None
+
+    assert queue.complete(stale, _ok_result({"n": 1, "y": "stale"})) is False
+    assert queue.fail(stale, "boom") is None
+    assert queue.complete(current, _ok_result({"n": 1, "y": "fresh"})) is True
+    assert queue.results(job_id)[0]["result"]["vars_after"]["y"] == "fresh"
+
+
+def test_expired_lease_is_resumed_by_another_worker(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    job_id = queue.submit(PROGRAM, [{"n": 1}, {"n": 2}])
+
+    crashed = queue.lease("crashed", lease_s=0.01)
+    assert crashed is not None
+    time.sleep(0.05)
+
+    handled = run_worker(queue, worker_id="w2", job_id=job_id)
+    assert handled == 2
+    assert queue.progress(job_id)["done"] == 2
+    assert queue.results(job_id)[crashed.index]["attempts"] == 2
+
+
+def test_running_item_keeps_its_lease_past_lease_s(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    job_id = queue.submit(PROGRAM, [{"n": 1}])
+    started = threading.Event()
+    calls = {"count": 0}
+
+    def slow(*_: object) -> str:
+        calls["count"] += 1
+        started.set()
+        time.sleep(0.5)
+        return json.dumps({"error": 0, "out": "ok", "vars": {"y": "done"}})
+
+    worker = threading.Thread(target=run_worker, args=(queue,), kwargs={"call_model": slow, "lease_s": 0.1})
+    worker.start()
+    assert started.wait(5)
+    time.sleep(0.3)
+    other = JobQueue(tmp_path / "q.sqlite3")
+    assert other.lease("w2", lease_s=0.1) is None
+    other.close()
+    worker.join(5)
+
+    [row] = queue.results(job_id)
+    assert row["status"] == "done" and row["attempts"] == 1
+    assert calls["count"] == 1
+
+
+def test_failed_attempts_retry_until_max_attempts(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    job_id = queue.submit(PROGRAM, [{"n": 1}], max_attempts=2)
+    calls = {"count": 0}
+
+    def flaky(*_: object) -> str:
+        calls["count"] += 1
+        return "not json"
+
+    run_worker(queue, call_model=flaky, job_id=job_id)
+    [row] = queue.results(job_id)
+    assert calls["count"] == 2
+    assert row["status"] == "failed"
+    assert row["attempts"] == 2
+    assert "not valid JSON" in row["error"]
+
+
+def test_resubmitting_same_job_id_is_idempotent(tmp_path) -> None:
+    queue = JobQueue(tmp_path / "q.sqlite3")
+    queue.submit(PROGRAM, [{"n": 1}], job_id="batch-1")
+    run_worker(queue, job_id="batch-1")
+    queue.submit(PROGRAM, [{"n": 1}, {"n": 2}], job_id="batch-1")
+
+    progress = queue.progress("batch-1")
+    assert progress["done"] == 1 and progress["pending"] == 1
+    with pytest.raises(ValueError, match="different program"):
+        queue.submit("Other program", [{}], job_id="batch-1")
+
+
+def test_worker_processes_drain_the_queue(tmp_path) -> None:
+    db = tmp_path / "q.sqlite3"
+    job_id = JobQueue(db).submit(PROGRAM, [{"n": i} for i in range(12)])
+
+    run_workers(db, processes=3, job_id=job_id)
+
+    queue = JobQueue(db)
+    assert queue.progress(job_id)["done"] == 12
+    results = queue.results(job_id)
+    assert [r["result"]["vars_after"]["n"] for r in results] == list(range(12))
+    assert json.dumps(results)
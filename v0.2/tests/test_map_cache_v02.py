@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from map_cache_v02 import MapElementCache
+
+
+def test_entries_persist_and_reload(tmp_path) -> None:
+    path = tmp_path / "state" / "map.json"
+    cache = MapElementCache(path)
+    cache.put("k1", '{"error": 0}')
+    cache.flush()
+    reloaded = MapElementCache(path)
+    assert reloaded.get("k1") == '{"error": 0}'
+    assert reloaded.get("missing") is None
+    assert reloaded.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entries_are_dropped() -> None:
+    cache = MapElementCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert len(cache) == 2
+
+
+def test_writes_are_batched_until_flush(tmp_path) -> None:
+    path = tmp_path / "map.json"
+    cache = MapElementCache(path, flush_every=4, flush_interval_s=3600)
+    for n in range(10):
+        cache.put(f"k{n}", str(n))
+    assert len(MapElementCache(path)) == 8
+    cache.flush()
+    assert len(MapElementCache(path)) == 10
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import build_step_prompt
+from map_reduce_v02 import MapReduceRetriever, boundary_chunks
+from parser_v02 import parse_dsl
+from search_index_v02 import ChatSearchIndex
+
+
+def _document(n_chunks: int, needle_at: int) -> str:
+    parts = []
+    for i in range(n_chunks):
+        body = f"section {i} " + "filler " * 48
+        if i == needle_at:
+            body = f"section {i} the refund window is thirty days " + "filler " * 42
+        parts.append(body.strip())
+    return " ".join(parts)
+
+
+class _FakeModel:
+    def __init__(self, delay_s: float = 0.0) -> None:
+        self.map_prompts: list[str] = []
+        self.reduce_prompts: list[str] = []
+        self.active = 0
+        self.peak = 0
+        self.delay_s = delay_s
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str, schema: dict) -> str:
+        assert schema["required"] == ["extract"]
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay_s)
+        with self._lock:
+            self.active -= 1
+            if "Excerpt:" in prompt:
+                self.map_prompts.append(prompt)
+                excerpt = prompt.split("Excerpt:\n", 1)[1]
+                extract = "refund window is thirty days" if "refund window" in excerpt else ""
+            else:
+                self.reduce_prompts.append(prompt)
+                extract = "merged: refund window is thirty days"
+        return json.dumps({"extract": extract})
+
+
+def _retriever(model: _FakeModel, **kwargs) -> MapReduceRetriever:
+    return MapReduceRetriever(
+        model, ChatSearchIndex(), threshold_tokens=100, chunk_words=50, chunk_overlap=5, **kwargs
+    )
+
+
+def test_small_variables_go_to_inner_retriever() -> None:
+    model = _FakeModel()
+    retriever = _retriever(model)
+    assert retriever.retrieve("refund", "doc", {"doc": "refund in 5 days"}) == ["refund in 5 days"]
+    assert model.map_prompts == []
+
+
+def test_huge_variable_is_mapped_concurrently_then_reduced() -> None:
+    model = _FakeModel(delay_s=0.02)
+    retriever = _retriever(model, max_workers=3)
+    doc = _document(12, needle_at=7)
+
+    snippets = retriever.retrieve("refund window", "doc", {"doc": doc})
+    assert snippets == ["refund window is thirty days"]
+    assert retriever.map_calls == len(model.map_prompts) >= 12
+    assert 1 < model.peak <= 3
+    # A single non-empty partial needs no reduce call.
+    assert retriever.reduce_calls == 0
+
+
+def test_multiple_partials_are_merged_by_reduce() -> None:
+    model = _FakeModel()
+    retriever = _retriever(model)
+    doc = _document(4, needle_at=1) + " " + _document(4, needle_at=2)
+    assert retriever.retrieve("refund window", "doc", {"doc": doc}) == [
+        "merged: refund window is thirty days"
+    ]
+    assert retriever.reduce_calls == 1
+    assert "- refund window is thirty days\n- refund window is thirty days" in model.reduce_prompts[0]
+
+
+def test_rerun_only_maps_changed_chunks() -> None:
+    model = _FakeModel()
+    retriever = _retriever(model)
+    doc = _document(10, needle_at=3)
+    retriever.retrieve("refund window", "doc", {"doc": doc})
+    first = retriever.map_calls
+
+    retriever.retrieve("refund window", "doc", {"doc": doc})
+    assert retriever.map_calls == first
+
+    edited = doc.replace("section 8 ", "section eight ")
+    retriever.retrieve("refund window", "doc", {"doc": edited})
+    assert 0 < retriever.map_calls - first <= 2
+
+
+def test_inserted_word_only_changes_the_chunks_it_touches() -> None:
+    paragraphs = [f"paragraph {i} " + " ".join(f"w{i}x{j}" for j in range(18)) for i in range(40)]
+    chunks = boundary_chunks("\n\n".join(paragraphs), chunk_words=50)
+    assert all(len(chunk.split()) <= 50 for chunk in chunks)
+    assert "\n".join(chunks).split() == "\n\n".join(paragraphs).split()
+
+    paragraphs[5] = paragraphs[5].replace("w5x3", "w5x3 inserted")
+    edited = boundary_chunks("\n\n".join(paragraphs), chunk_words=50)
+    assert len(set(edited) - set(chunks)) <= 2
+
+
+def test_list_values_are_chunked_on_element_boundaries() -> None:
+    messages = [f"message {i} " + "word " * 20 for i in range(6)]
+    chunks = boundary_chunks(messages, chunk_words=50)
+    for chunk in chunks:
+        assert all(line.startswith("message ") for line in chunk.split("\n"))
+
+
+def test_prompt_uses_reduced_extract_for_in_scope() -> None:
+    steps = parse_dsl("Load\n/DEF doc\n/THEN Answer\n/FROM refund window /IN @doc")
+    retriever = _retriever(_FakeModel())
+    prompt = build_step_prompt(steps[1], {"doc": _document(8, needle_at=5)}, retriever=retriever)
+    assert "- refund window (searched in @doc):\n  > refund window is thirty days" in prompt
+    assert "filler filler" not in prompt
@@ -39,3 +39,16 @@ def test_make_gemini_caller_forwards_model_and_timeout(monkeypatch) -> None:
         "timeout_s": 42,
         "response_schema": schema,
     }
+
+
+def test_make_gemini_caller_forwards_generation_config(monkeypatch) -> None:
+    captured: dict = {}
+
+    def fake_call_gemini(prompt: str, **kwargs) -> str:
+        captured.update(kwargs)
+        return "{}"
+
+    monkeypatch.setattr(model_adapters_v02, "call_gemini", fake_call_gemini)
+    caller = model_adapters_v02.make_gemini_caller(None, timeout_s=5)
+    caller("hello", {"type": "object", "properties": {}, "required": []}, generation_config={"temperature": 0.0})
+    assert captured["generation_config"] == {"temperature": 0.0}
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from replay_v02 import RecordingCaller, ReplayCaller, ReplayMiss, benchmark_replay, load_trace
+from runtime_v02 import run_dsl_text
+
+
+PROGRAM = (
+    "List the cities\n/DEF cities /TYPE list[str]\n"
+    "/THEN Describe @ITEM\n/MAP @cities\n/DEF blurb /TYPE list[str]\n"
+    "/THEN Pick the best blurb\n/FROM @blurb\n/DEF best /TYPE str"
+)
+
+
+def _model(prompt: str, schema: dict, **kwargs) -> str:
+    if "List the cities" in prompt:
+        return json.dumps({"error": 0, "out": "listed", "vars": {"cities": ["Oslo", "Lima"]}})
+    if "Instruction:\nDescribe" in prompt:
+        city = prompt.split("Instruction:\nDescribe ", 1)[1].split("\n", 1)[0]
+        return json.dumps({"error": 0, "out": city, "vars": {"blurb": f"About {city}"}})
+    return json.dumps({"error": 0, "out": "picked", "vars": {"best": "About Lima"}})
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 0.25
+        return self.now
+
+
+def test_recorded_run_replays_identically_offline(tmp_path) -> None:
+    trace_path = tmp_path / "trace.jsonl"
+    recorder = RecordingCaller(_model, trace_path, clock=_Clock())
+    live = run_dsl_text(PROGRAM, {}, call_model=recorder, map_workers=2)
+
+    entries = load_trace(trace_path)
+    assert recorder.recorded == len(entries) == 4
+    assert all(entry.latency_s == 0.25 and entry.error is None for entry in entries)
+
+    replayer = ReplayCaller(trace_path)
+    replayed = run_dsl_text(PROGRAM, {}, call_model=replayer, map_workers=2)
+    assert replayed.ok is True
+    assert replayed.vars_after == live.vars_after
+    assert replayer.served == 4 and replayer.misses == 0
+
+
+def test_replay_scales_recorded_latency_and_reports_misses(tmp_path) -> None:
+    trace_path = tmp_path / "trace.jsonl"
+    RecordingCaller(_model, trace_path, clock=_Clock())("List the cities", {"type": "object"})
+    slept: list[float] = []
+    replayer = ReplayCaller(trace_path, latency_scale=2.0, sleep=slept.append)
+
+    assert json.loads(replayer("List the cities", {"type": "object"}))["out"] == "listed"
+    # Exhausted recordings keep serving the last one.
+    replayer("List the cities", {"type": "object"})
+    assert slept == [0.5, 0.5] and replayer.simulated_latency_s == 1.0
+    with pytest.raises(ReplayMiss):
+        replayer("List the towns", {"type": "object"})
+    with pytest.raises(ReplayMiss):
+        replayer("List the cities", {"type": "object"}, generation_config={"temperature": 0})
+    assert replayer.misses == 2
+
+
+def test_recorded_failures_are_replayed(tmp_path) -> None:
+    def broken(prompt: str, schema: dict, **kwargs) -> str:
+        raise TimeoutError("deadline exceeded")
+
+    trace_path = tmp_path / "trace.jsonl"
+    with pytest.raises(TimeoutError):
+        RecordingCaller(broken, trace_path)("Hi", {})
+    assert load_trace(trace_path)[0].error == "TimeoutError: deadline exceeded"
+    with pytest.raises(RuntimeError, match="replayed failure: TimeoutError"):
+        ReplayCaller(trace_path)("Hi", {})
+
+
+def test_benchmark_separates_model_latency_from_overhead(tmp_path) -> None:
+    trace_path = tmp_path / "trace.jsonl"
+    run_dsl_text(PROGRAM, {}, call_model=RecordingCaller(_model, trace_path, clock=_Clock()))
+
+    results: list[bool] = []
+    report = benchmark_replay(
+        lambda call_model: results.append(run_dsl_text(PROGRAM, {}, call_model=call_model).ok),
+        trace_path,
+        repeats=3,
+        latency_scale=0.01,
+    )
+    assert results == [True, True, True]
+    assert report["repeats"] == 3 and report["calls"] == 4 and report["misses"] == 0
+    assert report["simulated_latency_s"] == pytest.approx(0.01)
+    assert report["wall_s"]["min"] >= report["overhead_s"]["min"]
+
+
+def test_overhead_counts_concurrent_waits_once(tmp_path) -> None:
+    trace_path = tmp_path / "trace.jsonl"
+    run_dsl_text(PROGRAM, {}, call_model=RecordingCaller(_model, trace_path, clock=_Clock()))
+
+    # Four calls of 0.25 s recorded latency scaled to 0.1 s; the two /MAP
+    # elements run side by side, so about 0.3 s of the 0.4 s overlaps.
+    report = benchmark_replay(
+        lambda call_model: run_dsl_text(PROGRAM, {}, call_model=call_model, map_workers=2),
+        trace_path,
+        repeats=1,
+        latency_scale=0.4,
+    )
+    assert report["simulated_latency_s"] == pytest.approx(0.4)
+    assert 0.29 <= report["model_wait_s"] < report["simulated_latency_s"]
+    assert report["overhead_s"]["min"] == pytest.approx(report["wall_s"]["min"] - report["model_wait_s"])
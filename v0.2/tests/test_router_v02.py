@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import build_response_schema, execute_steps
+from generation_v02 import GenerationPolicy
+from parser_v02 import parse_dsl
+from router_v02 import (
+    POLICY_CHEAP_FIRST,
+    POLICY_LATENCY_SLO,
+    ModelRoute,
+    ModelRouter,
+    RoutingHistory,
+    StepFeatures,
+    step_key,
+)
+from tokens_v02 import count_tokens
+
+
+class _Model:
+    def __init__(self, name: str, reply: dict) -> None:
+        self.name = name
+        self.reply = reply
+        self.calls = 0
+
+    def __call__(self, prompt: str, schema: dict) -> str:
+        self.calls += 1
+        return json.dumps(self.reply)
+
+
+def _router(cheap: _Model, main: _Model, **kwargs) -> ModelRouter:
+    return ModelRouter(
+        [
+            ModelRoute("main", main, cost_per_1k_tokens=1.0, model_id="big-model"),
+            ModelRoute("cheap", cheap, cost_per_1k_tokens=0.1),
+        ],
+        **kwargs,
+    )
+
+
+EXTRACT = "Is the ticket urgent?\n/DEF urgent\n/TYPE bool"
+GENERATE = "Write a reply\n/DEF reply"
+
+
+def test_features_mark_structured_extractions() -> None:
+    extract = parse_dsl(EXTRACT)[0]
+    generate = parse_dsl(GENERATE)[0]
+    assert StepFeatures.from_step(extract, "x" * 400).structured_only is True
+    assert StepFeatures.from_step(extract, "x" * 400).prompt_tokens == count_tokens("x" * 400)
+    assert StepFeatures.from_step(generate, "").structured_only is False
+    assert step_key(extract) == step_key(parse_dsl(EXTRACT)[0]) != step_key(generate)
+
+
+def test_cold_start_sends_extractions_cheap_and_generation_main() -> None:
+    cheap = _Model("cheap", {"error": 0, "out": "ok", "vars": {"urgent": True}})
+    main = _Model("main", {"error": 0, "out": "ok", "vars": {"reply": "hi"}})
+    router = _router(cheap, main)
+    extract, generate = parse_dsl(EXTRACT)[0], parse_dsl(GENERATE)[0]
+    assert router.route(extract, "p", build_response_schema(extract)).route.name == "cheap"
+    assert router.route(generate, "p", build_response_schema(generate)).route.name == "main"
+
+
+def test_history_overrides_prior_both_ways() -> None:
+    router = _router(_Model("cheap", {}), _Model("main", {}), min_samples=3)
+    extract, generate = parse_dsl(EXTRACT)[0], parse_dsl(GENERATE)[0]
+    for _ in range(3):
+        router.history.record(step_key(extract), "cheap", False, 1.0)
+        router.history.record(step_key(generate), "cheap", True, 1.0)
+    decision = router.route(extract, "p", build_response_schema(extract))
+    assert decision.route.name == "main"
+    assert router.route(generate, "p", build_response_schema(generate)).route.name == "cheap"
+
+
+def test_oversized_prompt_skips_route_with_context_limit() -> None:
+    router = ModelRouter(
+        [
+            ModelRoute("cheap", _Model("cheap", {}), 0.1, max_prompt_tokens=10),
+            ModelRoute("main", _Model("main", {}), 1.0),
+        ]
+    )
+    extract = parse_dsl(EXTRACT)[0]
+    assert router.route(extract, "x" * 400, build_response_schema(extract)).route.name == "main"
+
+
+def test_latency_slo_prefers_cheapest_route_within_slo() -> None:
+    history = RoutingHistory()
+    for _ in range(10):
+        history.record("other", "cheap", True, 9.0)
+        history.record("other", "main", True, 2.0)
+    router = _router(
+        _Model("cheap", {}), _Model("main", {}), policy=POLICY_LATENCY_SLO, history=history, latency_slo_s=5.0
+    )
+    extract = parse_dsl(EXTRACT)[0]
+    decision = router.route(extract, "p", build_response_schema(extract))
+    assert decision.route.name == "main"
+    assert "p90 2.0s" in decision.reason
+
+    strict = _router(
+        _Model("cheap", {}), _Model("main", {}), policy=POLICY_LATENCY_SLO, history=history, latency_slo_s=1.0
+    )
+    assert "over SLO" in strict.route(extract, "p", build_response_schema(extract)).reason
+
+
+def test_invalid_policy_configuration_is_rejected() -> None:
+    with pytest.raises(ValueError, match="unknown routing policy"):
+        _router(_Model("c", {}), _Model("m", {}), policy="random")
+    with pytest.raises(ValueError, match="latency_slo_s"):
+        _router(_Model("c", {}), _Model("m", {}), policy=POLICY_LATENCY_SLO)
+
+
+def test_execute_steps_logs_routing_and_records_outcomes() -> None:
+    cheap = _Model("cheap", {"error": 0, "out": "ok", "vars": {"urgent": "yes"}})
+    main = _Model("main", {"error": 0, "out": "ok", "vars": {"urgent": True}})
+    router = _router(cheap, main)
+    steps = parse_dsl(EXTRACT)
+
+    with pytest.raises(ValueError, match="expected bool"):
+        execute_steps(steps, {}, router=router)
+    stats = router.history.for_step(step_key(steps[0]), "cheap")
+    assert (stats.attempts, stats.successes) == (1, 0)
+
+    router.min_samples = 1
+    _, logs, _ = execute_steps(steps, {}, router=router)
+    assert main.calls == 1
+    assert logs[0]["routing"]["model"] == "main"
+    assert logs[0]["routing"]["model_id"] == "big-model"
+    assert logs[0]["routing"]["reason"] == "most capable route"
+
+
+@pytest.mark.parametrize(
+    "bad_reply,expected_error",
+    [
+        ("not json", "not valid JSON"),
+        (json.dumps({"error": 0, "out": "ok"}), "vars"),
+        (json.dumps({"error": 0, "out": "ok", "vars": {"urgent": "yes"}}), "expected bool"),
+        (json.dumps({"error": 1, "out": "cannot", "vars": {"urgent": False}}), "error=1"),
+    ],
+)
+def test_cheap_first_escalates_contract_failures(bad_reply: str, expected_error: str) -> None:
+    def cheap(prompt: str, schema: dict) -> str:
+        return bad_reply
+
+    main = _Model("main", {"error": 0, "out": "ok", "vars": {"urgent": True}})
+    router = ModelRouter(
+        [ModelRoute("cheap", cheap, 0.1), ModelRoute("main", main, 1.0)], policy=POLICY_CHEAP_FIRST
+    )
+    context, logs, _ = execute_steps(parse_dsl(EXTRACT), {}, router=router)
+
+    assert context == {"urgent": True}
+    routing = logs[0]["routing"]
+    assert routing["model"] == "main"
+    assert routing["reason"].startswith("escalated from cheap")
+    assert routing["escalated_from"][0]["model"] == "cheap"
+    assert expected_error in routing["escalated_from"][0]["error"]
+
+
+def test_each_route_gets_the_generation_config_of_its_model() -> None:
+    seen: list = []
+
+    def cheap(prompt: str, schema: dict, generation_config=None) -> str:
+        seen.append(("cheap", generation_config))
+        return "not json"
+
+    def main(prompt: str, schema: dict, generation_config=None) -> str:
+        seen.append(("main", generation_config))
+        return json.dumps({"error": 0, "out": "ok", "vars": {"urgent": True}})
+
+    router = ModelRouter(
+        [
+            ModelRoute("cheap", cheap, 0.1, model_id="gemini-2.5-flash"),
+            ModelRoute("main", main, 1.0, model_id="gemini-2.5-pro"),
+        ],
+        policy=POLICY_CHEAP_FIRST,
+    )
+    _, logs, _ = execute_steps(
+        parse_dsl(EXTRACT), {}, router=router, generation=GenerationPolicy(model="gemini-2.5-pro")
+    )
+
+    assert [(name, config["thinkingConfig"]) for name, config in seen] == [
+        ("cheap", {"thinkingBudget": 0}),
+        ("main", {"thinkingBudget": 128}),
+    ]
+    routing = logs[0]["routing"]
+    assert routing["escalated_from"][0]["generation_config"] == seen[0][1]
+    assert logs[0]["generation_config"] == routing["generation_config"] == seen[1][1]
+
+
+def test_cheap_first_keeps_valid_cheap_responses_and_reports_rates() -> None:
+    cheap = _Model("cheap", {"error": 0, "out": "ok", "vars": {"urgent": False}})
+    main = _Model("main", {"error": 0, "out": "ok", "vars": {"urgent": True}})
+    router = _router(cheap, main, policy=POLICY_CHEAP_FIRST)
+    steps = parse_dsl(EXTRACT)
+    for _ in range(3):
+        execute_steps(steps, {}, router=router)
+    cheap.reply = {"error": 0, "out": "ok", "vars": {"urgent": "maybe"}}
+    execute_steps(steps, {}, router=router)
+
+    assert (cheap.calls, main.calls) == (4, 1)
+    report = router.history.escalation_report()
+    assert report == [
+        {
+            "step_key": step_key(steps[0]),
+            "step": "Is the ticket urgent?",
+            "runs": 4,
+            "escalations": 1,
+            "escalation_rate": 0.25,
+        }
+    ]
+    savings = router.cascade_savings()
+    assert savings["escalation_rate"] == 0.25
+    assert savings["estimated_cost_saved"] == pytest.approx(1 - (4 * 0.1 + 1.0) / 4)
+
+
+def test_failure_on_last_route_or_other_policies_is_not_escalated() -> None:
+    bad = _Model("bad", {"error": 1, "out": "no", "vars": {"urgent": False}})
+    for policy in (POLICY_CHEAP_FIRST, "cheapest_that_passes"):
+        router = ModelRouter(
+            [ModelRoute("cheap", bad, 0.1), ModelRoute("main", bad, 1.0)], policy=policy
+        )
+        with pytest.raises(RuntimeError, match="error=1"):
+            execute_steps(parse_dsl(EXTRACT), {}, router=router)
+
+
+def test_model_call_errors_are_not_escalated() -> None:
+    def broken(prompt: str, schema: dict) -> str:
+        raise TimeoutError("slow")
+
+    main = _Model("main", {"error": 0, "out": "ok", "vars": {"urgent": True}})
+    router = _router(_Model("unused", {}), main, policy=POLICY_CHEAP_FIRST)
+    router.routes[0].call_model = broken
+    with pytest.raises(TimeoutError):
+        execute_steps(parse_dsl(EXTRACT), {}, router=router)
+    assert main.calls == 0
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import build_step_prompt, execute_steps
+from parser_v02 import FromDescription, ParseError, parse_dsl
+from search_index_v02 import ChatSearchIndex, InvertedIndex, chunk_text
+
+
+def test_from_parses_descriptions_and_in_scopes() -> None:
+    steps = parse_dsl(
+        "Load doc\n/DEF doc\n/THEN Answer\n/FROM @doc, pricing decisions, refund policy /IN @doc"
+    )
+    assert steps[1].from_vars == ["doc"]
+    assert steps[1].from_descriptions == [
+        FromDescription(text="pricing decisions", scope_var=None, line_no=4),
+        FromDescription(text="refund policy", scope_var="doc", line_no=4),
+    ]
+
+
+@pytest.mark.parametrize(
+    "dsl,err_substr",
+    [
+        ("Answer\n/FROM /IN @ALL", "/IN requires a preceding description"),
+        ("Answer\n/FROM refunds /IN", "exactly one @variable"),
+        ("Answer\n/FROM refunds /IN @ALL @CHAT", "exactly one @variable"),
+        ("Load\n/DEF doc\n/THEN Answer\n/FROM @doc /IN @ALL", "cannot be applied to a variable"),
+        ("Answer\n/FROM refunds /IN @missing", "/IN references undefined variable"),
+        ("Load\n/DEF doc\n/THEN Answer @doc\n/FROM refunds /IN @doc", "not allowed by /FROM"),
+    ],
+)
+def test_malformed_in_scopes_are_parse_errors(dsl: str, err_substr: str) -> None:
+    with pytest.raises(ParseError, match=err_substr):
+        parse_dsl(dsl)
+
+
+def test_bm25_ranks_matching_documents_first() -> None:
+    index = InvertedIndex()
+    index.add("a", "the refund policy allows returns within 30 days", "doc")
+    index.add("b", "shipping is free for orders over 50 dollars", "doc")
+    index.add("c", "refund requests need a receipt", "other")
+    hits = index.search("refund policy", k=2)
+    assert [h.doc_id for h in hits] == ["a", "c"]
+    assert [h.doc_id for h in index.search("refund", sources={"other"})] == ["c"]
+    index.remove("a")
+    assert [h.doc_id for h in index.search("policy")] == []
+
+
+def test_chunk_text_overlaps_windows() -> None:
+    words = [f"w{i}" for i in range(10)]
+    chunks = chunk_text(" ".join(words), chunk_words=4, overlap=2)
+    assert chunks[0] == "w0 w1 w2 w3"
+    assert chunks[1] == "w2 w3 w4 w5"
+    assert chunks[-1].endswith("w9")
+
+
+def test_chat_index_updates_incrementally_on_history_and_commit() -> None:
+    index = ChatSearchIndex(top_k=1)
+    history = [{"id": "m1", "role": "user", "content": "we picked the blue logo"}]
+    assert index.sync_history(history) == 1
+    assert index.sync_history(history) == 0
+    assert index.search("logo color")[0].text == "user: we picked the blue logo"
+
+    index.sync_history([{"id": "m2", "role": "user", "content": "budget is tight"}])
+    assert index.search("logo") == []
+
+    assert index.index_variable("notes", "alpha beta") is True
+    assert index.index_variable("notes", "alpha beta") is False
+    index.record_commit({"notes": "gamma delta"})
+    assert index.search("gamma", scope_var="notes")[0].text == "gamma delta"
+    assert index.search("alpha", scope_var="notes") == []
+
+
+def test_runs_on_different_branches_only_see_their_own_timeline() -> None:
+    index = ChatSearchIndex(top_k=3)
+    root = {"id": "m1", "role": "user", "content": "kickoff notes"}
+    old = index.for_timeline([root, {"id": "m2", "role": "user", "content": "launch in march"}])
+    new = index.for_timeline([root, {"id": "m3", "role": "user", "content": "launch in june"}])
+
+    assert new.retrieve("launch", "CHAT", {}) == ["user: launch in june"]
+    assert old.retrieve("launch", "CHAT", {}) == ["user: launch in march"]
+    assert new.retrieve("launch", "ALL", {}) == ["user: launch in june"]
+    # Only the differing suffix is re-indexed when the branch changes.
+    assert index.sync_history([root]) == 0
+
+
+def test_all_scope_forgets_variables_that_left_the_context() -> None:
+    index = ChatSearchIndex(top_k=3)
+    # A run on the original branch indexed its draft.
+    index.retrieve("launch plan", "ALL", {"draft": "launch plan for the old branch"})
+    # After an edit, the replacing run's context no longer has @draft.
+    assert index.retrieve("launch plan", "ALL", {"notes": "unrelated notes"}) == []
+    assert index.search("launch plan", "draft") == []
+
+    # A concurrent run that still sees @draft does not leak it into this one.
+    index.sync_variables({"draft": "launch plan for the old branch"})
+    assert index.search("launch", variables={"notes": "x"}) == []
+
+
+def test_prompt_includes_only_top_k_chunks_for_scoped_description() -> None:
+    doc = " ".join(
+        ["filler text about nothing in particular"] * 50
+        + ["the refund window is thirty days from delivery"]
+        + ["more filler text about other topics"] * 50
+    )
+    steps = parse_dsl("Load\n/DEF doc\n/THEN Answer\n/FROM refund window /IN @doc")
+    index = ChatSearchIndex(top_k=1, chunk_words=20, chunk_overlap=5)
+    prompt = build_step_prompt(steps[1], {"doc": doc}, retriever=index)
+
+    assert "Relevant context:\n- refund window (searched in @doc):" in prompt
+    assert "refund window is" in prompt
+    assert len(prompt) < len(doc) / 4
+    assert "- doc:" not in prompt
+
+
+def test_description_without_retriever_falls_back_to_whole_scope() -> None:
+    steps = parse_dsl("Load\n/DEF doc\n/THEN Answer\n/FROM refund window /IN @doc")
+    prompt = build_step_prompt(steps[1], {"doc": "full document text"})
+    assert "  > full document text" in prompt
+
+
+def test_execute_steps_indexes_committed_values_for_later_steps() -> None:
+    steps = parse_dsl("Write notes\n/DEF notes\n/THEN Answer\n/FROM launch date /IN @notes")
+    index = ChatSearchIndex()
+    prompts: list[str] = []
+    replies = iter(
+        [
+            json.dumps({"error": 0, "out": "ok", "vars": {"notes": "launch date is March 3"}}),
+            json.dumps({"error": 0, "out": "March 3"}),
+        ]
+    )
+
+    def fake_model(prompt: str, _: dict) -> str:
+        prompts.append(prompt)
+        return next(replies)
+
+    execute_steps(steps, {}, call_model=fake_model, retriever=index)
+    assert "  > launch date is March 3" in prompts[1]
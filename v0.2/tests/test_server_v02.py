@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from server_v02 import DslHTTPServer, DslService
+
+
+def _start(service: DslService, workers: int = 4, max_queue: int = 4) -> DslHTTPServer:
+    server = DslHTTPServer(("127.0.0.1", 0), service, workers=workers, max_queue=max_queue)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _post(server: DslHTTPServer, path: str, body: dict) -> tuple[int, bytes]:
+    host, port = server.server_address
+    req = urllib.request.Request(
+        f"http://{host}:{port}{path}",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+
+
+@pytest.fixture
+def stub_server():
+    server = _start(DslService(call_model=None))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_and_run_endpoints(stub_server) -> None:
+    status, body = _post(stub_server, "/parse", {"text": "One\n/THEN Two"})
+    assert status == 200
+    assert len(json.loads(body)["parsed_steps"]) == 2
+
+    status, body = _post(
+        stub_server, "/run", {"text": "Make x\n/DEF x /TYPE str", "context": {"a": 1}}
+    )
+    result = json.loads(body)
+    assert status == 200
+    assert result["ok"] is True
+    assert result["vars_after"] == {"a": 1, "x": "stub value for x"}
+
+
+def test_batch_reuses_one_parse_and_keeps_order(stub_server) -> None:
+    text = "Echo @n\n/DEF y /TYPE str"
+    status, body = _post(stub_server, "/run/batch", {"text": text, "contexts": [{"n": i} for i in range(5)]})
+    results = json.loads(body)["results"]
+    assert status == 200
+    assert [r["vars_after"]["n"] for r in results] == [0, 1, 2, 3, 4]
+    assert stub_server.service.parse_cache.misses == 1
+
+
+def test_stream_emits_step_events_then_result(stub_server) -> None:
+    status, body = _post(stub_server, "/run/stream", {"text": "One\n/THEN Two"})
+    events = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+    assert status == 200
+    assert [e["event"] for e in events] == ["step", "step", "result"]
+    assert events[-1]["result"]["ok"] is True
+
+
+def test_bad_request_bodies_get_400(stub_server) -> None:
+    status, body = _post(stub_server, "/run", {"text": 3})
+    assert status == 400
+    assert "'text' must be a string" in json.loads(body)["error"]
+
+
+def test_full_queue_answers_429() -> None:
+    release = threading.Event()
+    entered = threading.Semaphore(0)
+
+    def slow_model(*_: object) -> str:
+        entered.release()
+        release.wait(10)
+        return json.dumps({"error": 0, "out": "ok"})
+
+    server = _start(DslService(call_model=slow_model), workers=1, max_queue=0)
+    try:
+        results: list[int] = []
+        first = threading.Thread(
+            target=lambda: results.append(_post(server, "/run", {"text": "Slow"})[0])
+        )
+        first.start()
+        assert entered.acquire(timeout=5)
+
+        status, _ = _post(server, "/run", {"text": "Rejected"})
+        assert status == 429
+        assert server.stats()["rejected"] == 1
+
+        release.set()
+        first.join(5)
+        assert results == [200]
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_slow_rejected_client_does_not_stall_accepts_or_health() -> None:
+    import socket
+    import time
+
+    release = threading.Event()
+    entered = threading.Semaphore(0)
+
+    def slow_model(*_: object) -> str:
+        entered.release()
+        release.wait(10)
+        return json.dumps({"error": 0, "out": "ok"})
+
+    server = _start(DslService(call_model=slow_model), workers=1, max_queue=0)
+    host, port = server.server_address
+    stop = threading.Event()
+
+    def send_slowly(trickle: socket.socket) -> None:
+        with trickle:
+            trickle.sendall(b"POST /run HTTP/1.1\r\nContent-Length: 100000\r\n\r\n")
+            while not stop.wait(0.02):
+                try:
+                    trickle.sendall(b"x")
+                except OSError:
+                    return
+
+    try:
+        first = threading.Thread(target=lambda: _post(server, "/run", {"text": "Slow"}))
+        first.start()
+        assert entered.acquire(timeout=5)
+        trickle = socket.create_connection((host, port))
+        threading.Thread(target=send_slowly, args=(trickle,), daemon=True).start()
+        time.sleep(0.05)
+
+        started = time.monotonic()
+        with urllib.request.urlopen(f"http://{host}:{port}/health", timeout=10) as resp:
+            assert resp.status == 200
+            assert json.loads(resp.read())["in_flight"] == 1
+        status, _ = _post(server, "/run", {"text": "Rejected"})
+        assert status == 429
+        assert time.monotonic() - started < 1.0
+    finally:
+        stop.set()
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_health_reports_coalesced_batch_calls() -> None:
+    import time
+
+    from coalesce_v02 import CoalescingCaller
+
+    def slow_model(prompt: str, schema: dict) -> str:
+        time.sleep(0.1)
+        return json.dumps({"error": 0, "out": "ok"})
+
+    caller = CoalescingCaller(slow_model)
+    server = _start(DslService(call_model=caller, batch_concurrency=4))
+    try:
+        status, _ = _post(server, "/run/batch", {"text": "Same for all", "contexts": [{}] * 4})
+        assert status == 200
+        host, port = server.server_address
+        with urllib.request.urlopen(f"http://{host}:{port}/health", timeout=10) as resp:
+            health = json.loads(resp.read())
+        assert health["model_caller"]["upstream_calls"] == 1
+        assert health["model_caller"]["saved_calls"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
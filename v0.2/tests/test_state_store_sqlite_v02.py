@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from state_store_sqlite_v02 import SqliteChatStore, VersionConflictError, merge_chats
+
+
+def _chat(chat_id: str, history: list | None = None) -> dict:
+    return {"id": chat_id, "name": chat_id, "history": history or [], "vars": {}}
+
+
+def test_store_uses_wal_and_round_trips_state(tmp_path) -> None:
+    store = SqliteChatStore(tmp_path / "chats.sqlite3")
+    assert store.journal_mode() == "wal"
+
+    state = {"active_chat_id": "c1", "chats": [_chat("c1"), _chat("c2")]}
+    store.save_chats(state)
+    loaded = SqliteChatStore(tmp_path / "chats.sqlite3").load_chats()
+    assert loaded["active_chat_id"] == "c1"
+    assert [c["id"] for c in loaded["chats"]] == ["c1", "c2"]
+    assert loaded["chats"][0]["row_version"] == 1
+
+
+def test_save_chat_is_compare_and_swap(tmp_path) -> None:
+    store = SqliteChatStore(tmp_path / "chats.sqlite3")
+    store.save_chat(_chat("c1"))
+    a = store.load_chat("c1")
+    b = store.load_chat("c1")
+
+    a["name"] = "renamed"
+    assert store.save_chat(a) == 2
+
+    b["name"] = "stale"
+    with pytest.raises(VersionConflictError):
+        store.save_chat(b)
+    assert store.load_chat("c1")["name"] == "renamed"
+
+
+def test_concurrent_appends_to_same_chat_are_merged_not_dropped(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    SqliteChatStore(path).save_chats({"active_chat_id": "c1", "chats": [_chat("c1")]})
+
+    tab_a = SqliteChatStore(path)
+    tab_b = SqliteChatStore(path)
+    state_a = tab_a.load_chats()
+    state_b = tab_b.load_chats()
+
+    state_a["chats"][0]["history"].append({"id": "m-a", "content": "from a"})
+    tab_a.save_chats(state_a)
+    state_b["chats"][0]["history"].append({"id": "m-b", "content": "from b"})
+    tab_b.save_chats(state_b)
+
+    history = SqliteChatStore(path).load_chat("c1")["history"]
+    assert [m["id"] for m in history] == ["m-a", "m-b"]
+    assert [m["id"] for m in state_b["chats"][0]["history"]] == ["m-a", "m-b"]
+
+
+def test_independent_chats_written_from_threads_all_persist(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    store = SqliteChatStore(path)
+    errors: list[BaseException] = []
+
+    def writer(chat_id: str) -> None:
+        try:
+            chat = _chat(chat_id)
+            for i in range(20):
+                chat["history"].append({"id": f"{chat_id}-{i}", "content": str(i)})
+                store.save_chat(chat)
+        except BaseException as exc:  # pragma: no cover - surfaced below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer, args=(f"c{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    for i in range(4):
+        chat = store.load_chat(f"c{i}")
+        assert len(chat["history"]) == 20
+        assert chat["row_version"] == 20
+
+
+def test_save_chats_only_deletes_chats_this_store_loaded(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    tab_a = SqliteChatStore(path)
+    tab_a.save_chats({"active_chat_id": "c1", "chats": [_chat("c1"), _chat("c2")]})
+    state_a = tab_a.load_chats()
+
+    SqliteChatStore(path).save_chat(_chat("c3"), position=2)
+
+    state_a["chats"] = [c for c in state_a["chats"] if c["id"] != "c2"]
+    tab_a.save_chats(state_a)
+    ids = [c["id"] for c in SqliteChatStore(path).load_chats()["chats"]]
+    assert ids == ["c1", "c3"]
+
+
+def test_chat_deleted_in_another_tab_is_not_resurrected(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    SqliteChatStore(path).save_chats({"active_chat_id": "c2", "chats": [_chat("c1"), _chat("c2")]})
+    tab_a, tab_b = SqliteChatStore(path), SqliteChatStore(path)
+    state_a, state_b = tab_a.load_chats(), tab_b.load_chats()
+
+    state_a["chats"] = [c for c in state_a["chats"] if c["id"] != "c2"]
+    tab_a.save_chats(state_a)
+
+    state_b["chats"][1]["history"].append({"id": "late", "role": "user", "content": "hi"})
+    tab_b.save_chats(state_b)
+    assert [c["id"] for c in state_b["chats"]] == ["c1"]
+    assert state_b["active_chat_id"] == "c1"
+    assert SqliteChatStore(path).load_chat("c2") is None
+
+
+def test_merge_chats_keeps_remote_order_and_local_scalars() -> None:
+    remote = {"id": "c1", "name": "old", "history": [{"id": "1"}, {"id": "2"}], "vars": {}}
+    local = {"id": "c1", "name": "new", "history": [{"id": "1"}, {"id": "3"}], "vars": {"x": 1}}
+    merged = merge_chats(remote, local)
+    assert merged["name"] == "new"
+    assert merged["vars"] == {"x": 1}
+    assert [m["id"] for m in merged["history"]] == ["1", "2", "3"]
+
+
+def test_merge_chats_merges_vars_by_key() -> None:
+    base = {"a": 1, "b": 1, "c": 1}
+    remote = {"id": "c1", "history": [], "vars": {"a": 2, "b": 1, "c": 1, "r": 1}}
+    local = {"id": "c1", "history": [], "vars": {"a": 1, "b": 3, "l": 1}}
+    assert merge_chats(remote, local, base)["vars"] == {"a": 2, "b": 3, "r": 1, "l": 1}
+    assert merge_chats(remote, local)["vars"] == {"a": 1, "b": 3, "c": 1, "r": 1, "l": 1}
+
+
+def test_concurrent_var_edits_keep_both_writers(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    SqliteChatStore(path).save_chats({"active_chat_id": "c1", "chats": [{**_chat("c1"), "vars": {"x": 1}}]})
+    tab_a, tab_b = SqliteChatStore(path), SqliteChatStore(path)
+    state_a, state_b = tab_a.load_chats(), tab_b.load_chats()
+
+    state_a["chats"][0]["vars"]["x"] = 2
+    tab_a.save_chats(state_a)
+    state_b["chats"][0]["vars"]["y"] = 1
+    tab_b.save_chats(state_b)
+    assert SqliteChatStore(path).load_chat("c1")["vars"] == {"x": 2, "y": 1}
+
+
+def test_chat_edited_elsewhere_is_not_deleted(tmp_path) -> None:
+    path = tmp_path / "chats.sqlite3"
+    SqliteChatStore(path).save_chats({"active_chat_id": "c1", "chats": [_chat("c1"), _chat("c2")]})
+    tab_a, tab_b = SqliteChatStore(path), SqliteChatStore(path)
+    state_a, state_b = tab_a.load_chats(), tab_b.load_chats()
+
+    state_b["chats"][1]["history"].append({"id": "late", "role": "user", "content": "hi"})
+    tab_b.save_chats(state_b)
+    state_a["chats"] = [c for c in state_a["chats"] if c["id"] != "c2"]
+    tab_a.save_chats(state_a)
+    assert SqliteChatStore(path).load_chat("c2")["history"][-1]["id"] == "late"
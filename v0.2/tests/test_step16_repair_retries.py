@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import build_repair_prompt, execute_steps
+from fusion_v02 import execute_fused_steps
+from parser_v02 import parse_dsl
+from router_v02 import POLICY_CHEAP_FIRST, ModelRoute, ModelRouter, RoutingHistory
+
+
+class _Scripted:
+    def __init__(self, *responses: str) -> None:
+        self.responses = list(responses)
+        self.prompts: list[str] = []
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        self.prompts.append(prompt)
+        return self.responses.pop(0)
+
+
+def test_wrong_type_is_repaired_with_a_short_follow_up() -> None:
+    steps = parse_dsl("Count the items in @doc\n/DEF n /TYPE int")
+    model = _Scripted(
+        json.dumps({"error": 0, "out": "counted", "vars": {"n": "3"}}),
+        json.dumps({"error": 0, "out": "counted", "vars": {"n": 3}}),
+    )
+    ctx, logs, outputs = execute_steps(
+        steps, {"doc": "x " * 5000}, call_model=model, repair_attempts=1
+    )
+
+    assert ctx["n"] == 3
+    assert outputs == ["counted"]
+    (repair,) = logs[0]["repairs"]
+    assert "expected int" in repair["error"]
+    assert repair["raw_response"] == json.dumps({"error": 0, "out": "counted", "vars": {"n": "3"}})
+    repair_prompt = model.prompts[1]
+    assert "expected int" in repair_prompt
+    assert '"n": "3"' in repair_prompt
+    # The follow-up does not resend the inputs.
+    assert len(repair_prompt) < 2000
+
+
+def test_repairs_are_bounded_and_the_step_still_fails() -> None:
+    steps = parse_dsl("Create x\n/DEF x /TYPE int")
+    model = _Scripted("not-json", "still not json", "nope")
+    ctx: dict = {}
+    with pytest.raises(ValueError, match=r"after 2 repair attempt"):
+        execute_steps(steps, ctx, call_model=model, repair_attempts=2)
+    assert len(model.prompts) == 3
+    assert ctx == {}
+
+
+def test_error_1_is_not_repaired() -> None:
+    steps = parse_dsl("Create x\n/DEF x /TYPE int")
+    model = _Scripted(json.dumps({"error": 1, "out": "cannot", "vars": {"x": 0}}))
+    with pytest.raises(RuntimeError, match="error=1"):
+        execute_steps(steps, {}, call_model=model, repair_attempts=3)
+    assert len(model.prompts) == 1
+
+
+def test_without_repair_attempts_behaviour_is_unchanged() -> None:
+    steps = parse_dsl("Create x\n/DEF x /TYPE int")
+    model = _Scripted("not-json", json.dumps({"error": 0, "out": "ok", "vars": {"x": 1}}))
+    with pytest.raises(ValueError, match="not valid JSON"):
+        execute_steps(steps, {}, call_model=model)
+    assert len(model.prompts) == 1
+
+
+def test_repair_prompt_lists_missing_variables() -> None:
+    step = parse_dsl("Classify\n/DEF label /TYPE str /AS the ticket label")[0]
+    prompt = build_repair_prompt(step, '{"error": 0, "out": "x", "vars": {}}', ValueError("missing /DEF values"))
+    assert "Task:\nClassify" in prompt
+    assert "- label (str): the ticket label" in prompt
+    assert "Previous response:" in prompt
+
+
+def test_repair_happens_before_router_escalation() -> None:
+    steps = parse_dsl("Create x\n/DEF x /TYPE int")
+    cheap = _Scripted('{"error": 0, "out": "ok", "vars": {"x": "1"}}', '{"error": 0, "out": "ok", "vars": {"x": 1}}')
+    main = _Scripted()
+    router = ModelRouter(
+        [ModelRoute("main", main, 1.0), ModelRoute("cheap", cheap, 0.1)],
+        policy=POLICY_CHEAP_FIRST,
+        history=RoutingHistory(),
+    )
+    ctx, logs, _ = execute_steps(steps, {}, router=router, repair_attempts=1)
+
+    assert ctx == {"x": 1}
+    assert main.prompts == []
+    assert logs[0]["routing"]["model"] == "cheap"
+    assert len(logs[0]["repairs"]) == 1
+
+
+def test_repairs_of_an_escalated_route_stay_with_that_route() -> None:
+    steps = parse_dsl("Create x\n/DEF x /TYPE int")
+    cheap = _Scripted('{"error": 0, "out": "ok", "vars": {"x": "1"}}', '{"error": 0, "out": "ok", "vars": {"x": "2"}}')
+    main = _Scripted('{"error": 0, "out": "ok", "vars": {"x": 3}}')
+    router = ModelRouter(
+        [ModelRoute("main", main, 1.0), ModelRoute("cheap", cheap, 0.1)],
+        policy=POLICY_CHEAP_FIRST,
+        history=RoutingHistory(),
+    )
+    ctx, logs, _ = execute_steps(steps, {}, router=router, repair_attempts=1)
+
+    assert ctx == {"x": 3}
+    (failed,) = logs[0]["routing"]["escalated_from"]
+    assert failed["model"] == "cheap"
+    assert len(failed["repairs"]) == 1
+    assert "repairs" not in logs[0]
+
+
+def test_fused_task_is_repaired_on_its_own() -> None:
+    steps = parse_dsl("Create a\n/DEF a /TYPE int\n/THEN Create b\n/FROM\n/DEF b /TYPE int")
+    model = _Scripted(
+        json.dumps(
+            {
+                "step_0": {"error": 0, "out": "a", "vars": {"a": 1}},
+                "step_1": {"error": 0, "out": "b", "vars": {"b": "two"}},
+            }
+        ),
+        json.dumps({"error": 0, "out": "b", "vars": {"b": 2}}),
+    )
+    ctx, logs, _ = execute_fused_steps(steps, {}, call_model=model, repair_attempts=1)
+
+    assert ctx == {"a": 1, "b": 2}
+    assert "repairs" not in logs[0]
+    assert len(logs[1]["repairs"]) == 1
+    assert "Task:\nCreate b" in model.prompts[1]
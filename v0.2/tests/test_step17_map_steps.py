@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import MapStepError, build_response_schema, execute_steps, value_matches_type
+from fusion_v02 import plan_fusion
+from map_cache_v02 import MapElementCache
+from parser_v02 import ParseError, parse_dsl, steps_from_dicts, steps_to_dicts
+from runtime_v02 import run_dsl_text
+
+
+PROGRAM = (
+    "List the cities\n/DEF cities /TYPE list[str]\n"
+    "/THEN Describe @ITEM in one sentence\n/MAP @cities\n/DEF blurb /TYPE list[str]\n/DEF size /TYPE list[int]"
+)
+
+
+def _item_of(prompt: str) -> str:
+    return prompt.split("Instruction:\nDescribe ", 1)[1].split(" in one sentence", 1)[0]
+
+
+class FakeModel:
+    """Answers the list step, then each /MAP element from its @ITEM value."""
+
+    def __init__(self, cities, fail=(), delay_s: float = 0.0) -> None:
+        self.cities = cities
+        self.fail = set(fail)
+        self.delay_s = delay_s
+        self.element_prompts: list[str] = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str, schema: dict, **kwargs) -> str:
+        if "List the cities" in prompt:
+            return json.dumps({"error": 0, "out": "listed", "vars": {"cities": self.cities}})
+        with self._lock:
+            self.element_prompts.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay_s)
+            city = _item_of(prompt)
+            if city in self.fail:
+                return "not json"
+            return json.dumps({"error": 0, "out": f"{city}!", "vars": {"blurb": f"About {city}", "size": len(city)}})
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_list_types_parse_validate_and_map_to_array_schemas() -> None:
+    steps = parse_dsl("Tags\n/DEF tags /TYPE List[ Str ]")
+    assert steps[0].defs[0].value_type == "list[str]"
+    assert build_response_schema(steps[0])["properties"]["vars"]["properties"]["tags"] == {
+        "type": "array",
+        "items": {"type": "string"},
+    }
+    assert value_matches_type("list[int]", [1, 2]) is True
+    assert value_matches_type("list[int]", [1, True]) is False
+    assert value_matches_type("list[str]", "a") is False
+    with pytest.raises(ParseError, match="invalid /TYPE"):
+        parse_dsl("Tags\n/DEF tags /TYPE list[dict]")
+
+
+def test_map_runs_each_element_concurrently_and_keeps_order() -> None:
+    cities = ["Paris", "Oslo", "Lima", "Rome", "Kyiv", "Bern"]
+    model = FakeModel(cities, delay_s=0.05)
+    ctx, logs, outputs = execute_steps(parse_dsl(PROGRAM), {}, call_model=model, map_workers=3)
+
+    assert ctx["blurb"] == [f"About {c}" for c in cities]
+    assert ctx["size"] == [len(c) for c in cities]
+    assert outputs[1] == "\n".join(f"{c}!" for c in cities)
+    assert 1 < model.max_active <= 3
+    map_log = logs[1]["map"]
+    assert map_log["over"] == "cities"
+    assert map_log["items"] == 6 and map_log["workers"] == 3 and map_log["cached"] == 0
+    assert [e["index"] for e in map_log["elements"]] == list(range(6))
+    assert logs[1]["prompt"] is None
+    assert logs[1]["response_schema"]["properties"]["vars"]["properties"]["size"] == {"type": "integer"}
+
+
+def test_element_prompts_carry_the_item_but_not_the_whole_list() -> None:
+    model = FakeModel(["Paris", "Oslo"])
+    execute_steps(parse_dsl(PROGRAM), {}, call_model=model)
+    for prompt in model.element_prompts:
+        assert "cities" not in prompt
+        assert "- blurb (str)" in prompt and "- size (int)" in prompt
+
+
+def test_partial_failure_reports_every_failed_element_and_commits_nothing() -> None:
+    model = FakeModel(["Paris", "Oslo", "Lima"], fail={"Oslo", "Lima"})
+    ctx = {}
+    with pytest.raises(MapStepError) as excinfo:
+        execute_steps(parse_dsl(PROGRAM), ctx, call_model=model)
+    assert sorted(excinfo.value.failures) == [1, 2]
+    assert excinfo.value.completed == 1
+    assert "failed for 2 of 3 item(s)" in str(excinfo.value)
+    assert "blurb" not in ctx
+
+
+def test_element_cache_only_reruns_new_or_failed_elements(tmp_path) -> None:
+    cache = MapElementCache(tmp_path / "map.json")
+    first = FakeModel(["Paris", "Oslo"], fail={"Oslo"})
+    with pytest.raises(MapStepError):
+        execute_steps(parse_dsl(PROGRAM), {}, call_model=first, map_cache=cache)
+
+    second = FakeModel(["Paris", "Oslo", "Lima"])
+    ctx, logs, _ = execute_steps(parse_dsl(PROGRAM), {}, call_model=second, map_cache=MapElementCache(tmp_path / "map.json"))
+    assert sorted(_item_of(p) for p in second.element_prompts) == ["Lima", "Oslo"]
+    assert logs[1]["map"]["cached"] == 1
+    assert [e["cached"] for e in logs[1]["map"]["elements"]] == [True, False, False]
+    assert ctx["blurb"] == ["About Paris", "About Oslo", "About Lima"]
+
+
+def test_element_cache_is_keyed_by_model_and_generation_config() -> None:
+    cache = MapElementCache()
+    first = FakeModel(["Paris"])
+    first.model_id = "model-a"
+    execute_steps(parse_dsl(PROGRAM), {}, call_model=first, map_cache=cache)
+
+    other_model = FakeModel(["Paris"])
+    other_model.model_id = "model-b"
+    execute_steps(parse_dsl(PROGRAM), {}, call_model=other_model, map_cache=cache)
+    assert len(other_model.element_prompts) == 1
+
+    class _Config:
+        def config_for(self, step):
+            return {"temperature": 0.5}
+
+    same_model = FakeModel(["Paris"])
+    same_model.model_id = "model-a"
+    execute_steps(parse_dsl(PROGRAM), {}, call_model=same_model, map_cache=cache, generation=_Config())
+    assert len(same_model.element_prompts) == 1
+    execute_steps(parse_dsl(PROGRAM), {}, call_model=same_model, map_cache=cache, generation=_Config())
+    assert len(same_model.element_prompts) == 1
+
+
+def test_empty_list_makes_no_calls() -> None:
+    model = FakeModel([])
+    ctx, logs, outputs = execute_steps(parse_dsl(PROGRAM), {}, call_model=model)
+    assert ctx["blurb"] == [] and ctx["size"] == []
+    assert model.element_prompts == []
+    assert outputs[1] == ""
+
+
+def test_map_parse_errors() -> None:
+    with pytest.raises(ParseError, match="not a list"):
+        parse_dsl("A\n/DEF a /TYPE str\n/THEN B @ITEM\n/MAP @a\n/DEF b /TYPE list[str]")
+    with pytest.raises(ParseError, match="undefined variable"):
+        parse_dsl("B @ITEM\n/MAP @a\n/DEF b /TYPE list[str]")
+    with pytest.raises(ParseError, match="must have a list"):
+        parse_dsl("A\n/DEF a /TYPE list[str]\n/THEN B @ITEM\n/MAP @a\n/DEF b /TYPE str")
+    with pytest.raises(ParseError, match="only available in /MAP"):
+        parse_dsl("A\n/DEF a /TYPE list[str]\n/THEN B @ITEM\n/FROM @a")
+    with pytest.raises(ParseError, match="cannot be defined"):
+        parse_dsl("A\n/DEF ITEM /TYPE str")
+
+
+def test_map_with_from_and_local_list_source() -> None:
+    program = (
+        "Notes\n/DEF notes /TYPE str\n/DEF tone /TYPE str\n"
+        "/THEN Split\n/CALL split_lines\n/FROM @notes\n/DEF lines /TYPE list[str]\n"
+        "/THEN Rewrite @ITEM in a @tone tone\n/MAP @lines\n/FROM @tone\n/DEF rewritten /TYPE list[str]"
+    )
+    prompts: list[str] = []
+
+    def model(prompt: str, schema: dict, **kwargs) -> str:
+        if "Instruction:\nNotes" in prompt:
+            return json.dumps({"error": 0, "out": "ok", "vars": {"notes": "a\n\nb", "tone": "calm"}})
+        prompts.append(prompt)
+        item = prompt.split("Rewrite ", 1)[1].split(" in a", 1)[0]
+        return json.dumps({"error": 0, "out": "ok", "vars": {"rewritten": item.upper()}})
+
+    steps = parse_dsl(program)
+    assert steps_from_dicts(json.loads(json.dumps(steps_to_dicts(steps))))[2].map_over == "lines"
+    assert [[s.index for s in g] for g in plan_fusion(steps)] == [[0], [1], [2]]
+    result = run_dsl_text(program, {}, call_model=model)
+    assert result.ok is True
+    assert result.vars_after["rewritten"] == ["A", "B"]
+    assert all("calm tone" in p for p in prompts)
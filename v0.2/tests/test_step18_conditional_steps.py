@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from executor_v02 import execute_steps
+from fusion_v02 import execute_fused_steps, plan_fusion
+from parser_v02 import ParseError, parse_dsl, steps_from_dicts, steps_to_dicts
+from runtime_v02 import run_dsl_text
+
+
+def _model(flags: dict):
+    """Answers the first step with `flags` and every other step with its /DEF names."""
+    prompts: list[str] = []
+
+    def call(prompt: str, schema: dict, **kwargs) -> str:
+        prompts.append(prompt)
+        names = schema["properties"].get("vars", {}).get("required", [])
+        if "Instruction:\nCheck" in prompt:
+            return json.dumps({"error": 0, "out": "checked", "vars": flags})
+        return json.dumps({"error": 0, "out": "done", "vars": {n: f"value of {n}" for n in names}})
+
+    call.prompts = prompts
+    return call
+
+
+PROGRAM = (
+    "Check the request\n/DEF urgent /TYPE bool\n"
+    "/THEN Draft an escalation\n/IF @urgent\n/DEF escalation /TYPE str\n"
+    "/THEN Draft a routine reply\n/UNLESS @urgent\n/DEF reply /TYPE str"
+)
+
+
+@pytest.mark.parametrize("urgent, ran, skipped", [(True, "escalation", "reply"), (False, "reply", "escalation")])
+def test_only_the_taken_branch_calls_the_model(urgent: bool, ran: str, skipped: str) -> None:
+    model = _model({"urgent": urgent})
+    ctx, logs, outputs = execute_steps(parse_dsl(PROGRAM), {}, call_model=model)
+
+    assert len(model.prompts) == 2
+    assert ctx[ran] == f"value of {ran}"
+    assert skipped not in ctx
+    skipped_log = next(log for log in logs if log.get("skipped"))
+    assert skipped_log["prompt"] is None and skipped_log["staged_updates"] == {}
+    assert skipped_log["skipped"]["value"] is urgent
+    assert len(logs) == len(outputs) == 3
+    assert outputs[skipped_log["step_index"]] == ""
+
+
+def test_condition_must_be_a_previously_defined_bool() -> None:
+    with pytest.raises(ParseError, match="is not a bool variable"):
+        parse_dsl("A\n/DEF n /TYPE int\n/THEN B\n/IF @n")
+    with pytest.raises(ParseError, match="undefined variable"):
+        parse_dsl("B\n/IF @flag")
+    with pytest.raises(ParseError, match="at most one /IF or /UNLESS"):
+        parse_dsl("A\n/DEF f /TYPE bool\n/THEN B\n/IF @f\n/UNLESS @f")
+    with pytest.raises(ParseError, match="exactly one"):
+        parse_dsl("A\n/DEF f /TYPE bool\n/THEN B\n/IF f")
+
+
+def test_reading_a_value_of_a_skipped_step_fails() -> None:
+    program = PROGRAM + "\n/THEN Send it\n/FROM @escalation"
+    result = run_dsl_text(program, {}, call_model=_model({"urgent": False}))
+    assert result.ok is False
+    assert "@escalation has no value (its defining step was skipped)" in result.error
+
+
+def test_condition_round_trips_and_splits_fusion_groups() -> None:
+    steps = parse_dsl(PROGRAM)
+    restored = steps_from_dicts(json.loads(json.dumps(steps_to_dicts(steps))))
+    assert (restored[2].condition, restored[2].condition_negated) == ("urgent", True)
+    # Step 2 has no /FROM, so it sees step 1's escalation and cannot be fused with it.
+    assert [[s.index for s in g] for g in plan_fusion(steps)] == [[0], [1], [2]]
+    independent = parse_dsl(PROGRAM.replace("/UNLESS @urgent", "/UNLESS @urgent\n/FROM"))
+    assert [[s.index for s in g] for g in plan_fusion(independent)] == [[0], [1, 2]]
+
+
+def test_fused_group_sends_only_steps_whose_condition_holds() -> None:
+    program = (
+        "Check\n/DEF a /TYPE bool\n/DEF b /TYPE bool\n"
+        "/THEN One\n/IF @a\n/DEF x /TYPE str\n"
+        "/THEN Two\n/IF @b\n/FROM\n/DEF y /TYPE str\n"
+        "/THEN Three\n/FROM\n/DEF z /TYPE str"
+    )
+    fused_requests: list[dict] = []
+
+    def model(prompt: str, schema: dict, **kwargs) -> str:
+        if "Instruction:\nCheck" in prompt:
+            return json.dumps({"error": 0, "out": "ok", "vars": {"a": True, "b": False}})
+        fused_requests.append(schema)
+        return json.dumps(
+            {
+                "step_1": {"error": 0, "out": "one", "vars": {"x": "X"}},
+                "step_3": {"error": 0, "out": "three", "vars": {"z": "Z"}},
+            }
+        )
+
+    ctx, logs, outputs = execute_fused_steps(parse_dsl(program), {}, call_model=model)
+    assert [sorted(schema["properties"]) for schema in fused_requests] == [["step_1", "step_3"]]
+    assert ctx == {"a": True, "b": False, "x": "X", "z": "Z"}
+    assert [log["step_index"] for log in logs] == [0, 1, 2, 3]
+    assert logs[2]["skipped"] == {"condition": "/IF @b", "value": False}
+    assert outputs == ["ok", "one", "", "three"]
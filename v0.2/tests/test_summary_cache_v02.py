@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from builtins_v02 import ChatBuiltins
+from summary_cache_v02 import RollingSummarizer, SummaryCache
+from tokens_v02 import count_tokens
+
+
+def _lines(n: int, prefix: str = "m") -> list[str]:
+    return [f"user: {prefix}{i} " + "x" * 36 for i in range(n)]
+
+
+class _FakeCheapModel:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+
+    def __call__(self, prompt: str, schema: dict) -> str:
+        self.prompts.append(prompt)
+        assert schema["required"] == ["summary"]
+        return json.dumps({"summary": f"summary #{len(self.prompts)}"})
+
+
+def test_short_transcript_is_returned_verbatim() -> None:
+    model = _FakeCheapModel()
+    summarizer = RollingSummarizer(model, token_budget=10_000)
+    assert summarizer.render(_lines(3)) == "\n".join(_lines(3))
+    assert model.prompts == []
+
+
+def test_old_segments_are_summarized_and_tail_kept_within_budget() -> None:
+    model = _FakeCheapModel()
+    summarizer = RollingSummarizer(model, token_budget=60, segment_size=4)
+    lines = _lines(12)
+    text = summarizer.render(lines)
+
+    assert text.startswith("Earlier conversation (summarized):")
+    assert lines[-1] in text
+    assert lines[0] not in text
+    assert count_tokens(text) <= 60 + 10
+    assert len(model.prompts) == summarizer.model_calls > 0
+
+
+def test_appending_messages_reuses_cached_segment_summaries() -> None:
+    model = _FakeCheapModel()
+    summarizer = RollingSummarizer(model, token_budget=200, segment_size=4)
+    summarizer.render(_lines(24))
+    assert len(model.prompts) == 4
+
+    summarizer.render(_lines(24))
+    assert len(model.prompts) == 4
+
+    summarizer.render(_lines(28))
+    assert len(model.prompts) == 5
+
+
+def test_edit_only_invalidates_changed_segments(tmp_path) -> None:
+    cache = SummaryCache(tmp_path / "summaries.json")
+    model = _FakeCheapModel()
+    summarizer = RollingSummarizer(model, token_budget=60, segment_size=4, cache=cache)
+    lines = _lines(12)
+    summarizer.render(lines)
+    summarized = len(model.prompts)
+
+    edited = list(lines)
+    edited[5] = "user: edited"
+    summarizer.render(edited)
+    assert len(model.prompts) == summarized + 1
+
+    reloaded = SummaryCache(tmp_path / "summaries.json")
+    assert len(reloaded) == len(cache)
+
+
+def test_chat_builtin_uses_summarizer_budget() -> None:
+    history = [
+        {"id": f"m{i}", "role": "user", "content": f"message {i} " + "y" * 40} for i in range(30)
+    ]
+    summarizer = RollingSummarizer(_FakeCheapModel(), token_budget=80, segment_size=5)
+    chat = ChatBuiltins(history, summarizer=summarizer).resolve("CHAT", {})
+    assert "Earlier conversation (summarized):" in chat
+    assert "message 29" in chat
+    assert "message 0 " not in chat
+
+
+def test_cache_is_bounded_and_batches_writes(tmp_path) -> None:
+    path = tmp_path / "summaries.json"
+    cache = SummaryCache(path, max_entries=3, flush_every=2, flush_interval_s=3600)
+    for n in range(5):
+        cache.put(f"k{n}", f"s{n}")
+    assert len(cache) == 3 and cache.get("k0") is None
+    assert len(SummaryCache(path)) == 3
+    assert SummaryCache(path).get("k4") is None
+    cache.flush()
+    assert SummaryCache(path).get("k4") == "s4"
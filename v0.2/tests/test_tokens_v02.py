@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+
+V02_DIR = Path(__file__).resolve().parents[1]
+if str(V02_DIR) not in sys.path:
+    sys.path.insert(0, str(V02_DIR))
+
+from tokens_v02 import TokenCounter, count_tokens, count_value_tokens
+
+
+def test_local_count_tracks_words_digits_and_wide_scripts() -> None:
+    assert count_tokens("") == 0
+    assert count_tokens("The quick brown fox jumps over the lazy dog.") == 10
+    # Digits are single tokens, so numeric data is far denser than len // 4 suggests.
+    assert count_tokens("1234567890") == 10
+    assert count_tokens("日本語") == 3
+    assert count_tokens("a\n\nb") == 4
+    assert count_value_tokens({"n": [1, 2]}) == count_tokens('{"n": [1, 2]}')
+
+
+def test_calibration_scales_counts_per_model_and_persists(tmp_path) -> None:
+    path = tmp_path / "calibration.json"
+    counter = TokenCounter(path)
+    text = "The quick brown fox jumps over the lazy dog."
+    assert counter.count(text, "m") == 10
+
+    factor = counter.calibrate("m", [text, text * 3], lambda sample: round(count_tokens(sample) * 1.5))
+    assert factor == pytest.approx(1.5)
+    assert counter.count(text, "m") == 15
+    assert counter.count(text, "other") == 10
+
+    reloaded = TokenCounter(path)
+    assert reloaded.factor("m") == pytest.approx(1.5)
+    assert reloaded.stats()["m"]["samples"] == 2
+
+
+def test_observations_are_written_in_batches(tmp_path) -> None:
+    path = tmp_path / "calibration.json"
+    counter = TokenCounter(path, flush_every=3, flush_interval_s=3600)
+    text = "word " * 10
+    counter.observe("m", text, 20)
+    counter.observe("m", text, 20)
+    assert not path.exists()
+    counter.observe("m", text, 20)
+    assert TokenCounter(path).stats()["m"]["samples"] == 3
+
+    counter.observe("m", text, 20)
+    counter.flush()
+    assert TokenCounter(path).stats()["m"]["samples"] == 4
+
+
+def test_calibration_follows_recent_observations() -> None:
+    counter = TokenCounter(decay_samples=4)
+    text = "word " * 100
+    for _ in range(3):
+        counter.observe("m", text, count_tokens(text) * 2)
+    for _ in range(20):
+        counter.observe("m", text, count_tokens(text))
+    assert 1.0 <= counter.factor("m") < 1.05
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from common_v02 import write_json_atomic
+
+
+# Pre-tokenization close to SentencePiece/BPE vocabularies: runs of letters,
+# single digits, single symbols and whitespace runs.
+_PIECE_PATTERN = re.compile(r"[^\W\d_]+|\d|\s+|[^\w\s]|_", re.UNICODE)
+_DEFAULT_DECAY_SAMPLES = 200
+_DEFAULT_FLUSH_EVERY = 32
+_DEFAULT_FLUSH_INTERVAL_S = 5.0
+_MIN_FACTOR = 0.25
+_MAX_FACTOR = 4.0
+
+
+def _is_wide(ch: str) -> bool:
+    # CJK, kana, hangul and similar scripts: roughly one token per character.
+    return ord(ch) >= 0x2E80
+
+
+def _word_tokens(word: str) -> int:
+    if word.isascii():
+        # Common words are one token; long or rare ones split into ~6-char pieces.
+        return 1 + (len(word) - 1) // 6
+    if _is_wide(word[0]):
+        return len(word)
+    return math.ceil(len(word) / 3)
+
+
+def _whitespace_tokens(space: str) -> int:
+    newlines = space.count("\n")
+    rest = len(space) - newlines
+    # A single space merges into the following word.
+    return newlines + (math.ceil(rest / 8) if rest > 1 else 0)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local, uncalibrated token count of `text`. Much closer to Gemini counts
+    than `len(text) // 4` for numbers, JSON, code and non-Latin scripts, and
+    cheap enough to run on every prompt; see TokenCounter for per-model scaling.
+    """
+    if not text:
+        return 0
+    total = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        first = piece[0]
+        if first.isspace():
+            total += _whitespace_tokens(piece)
+        elif first.isalpha():
+            total += _word_tokens(piece)
+        else:
+            total += 1
+    return total
+
+
+def count_value_tokens(value: Any) -> int:
+    """Token count of a variable value as it is rendered into prompts."""
+    if isinstance(value, str):
+        return count_tokens(value)
+    try:
+        return count_tokens(json.dumps(value, ensure_ascii=False))
+    except TypeError:
+        return count_tokens(repr(value))
+
+
+class TokenCounter:
+    """
+    `count_tokens` scaled by a per-model calibration factor, optionally
+    persisted as JSON. `observe` feeds exact counts (Gemini `countTokens` or
+    `usageMetadata.promptTokenCount`) back in; the factor is the ratio of exact
+    to local counts, weighted by size and decayed so that roughly the last
+    `decay_samples` observations dominate. Unknown models use factor 1.0.
+    Writes are batched: the file is rewritten after `flush_every` observations,
+    when `flush_interval_s` has passed since the last write, or on `flush()`
+    (`calibrate` flushes when it is done).
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path | str] = None,
+        decay_samples: int = _DEFAULT_DECAY_SAMPLES,
+        flush_every: int = _DEFAULT_FLUSH_EVERY,
+        flush_interval_s: float = _DEFAULT_FLUSH_INTERVAL_S,
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.decay_samples = max(1, decay_samples)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval_s = flush_interval_s
+        self._models: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        if self.path is not None and self.path.exists():
+            loaded = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            if isinstance(loaded, dict):
+                self._models.update({k: v for k, v in loaded.items() if isinstance(v, dict)})
+
+    def factor(self, model: Optional[str]) -> float:
+        with self._lock:
+            stats = self._models.get(model or "")
+            if not stats or stats.get("local", 0) <= 0:
+                return 1.0
+            return min(_MAX_FACTOR, max(_MIN_FACTOR, stats["exact"] / stats["local"]))
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        local = count_tokens(text)
+        return local if local == 0 else max(1, round(local * self.factor(model)))
+
+    def count_value(self, value: Any, model: Optional[str] = None) -> int:
+        local = count_value_tokens(value)
+        return local if local == 0 else max(1, round(local * self.factor(model)))
+
+    def observe(self, model: Optional[str], text: str, exact_tokens: int) -> None:
+        local = count_tokens(text)
+        if local <= 0 or exact_tokens <= 0:
+            return
+        keep = 1.0 - 1.0 / self.decay_samples
+        with self._lock:
+            stats = self._models.setdefault(model or "", {"exact": 0.0, "local": 0.0, "samples": 0})
+            stats["exact"] = stats["exact"] * keep + exact_tokens
+            stats["local"] = stats["local"] * keep + local
+            stats["samples"] = int(stats.get("samples", 0)) + 1
+            self._unsaved += 1
+            due = self.path is not None and (
+                self._unsaved >= self.flush_every
+                or time.monotonic() - self._saved_at >= self.flush_interval_s
+            )
+        if due:
+            self.flush()
+
+    def calibrate(self, model: Optional[str], texts: Iterable[str], exact_count: Callable[[str], int]) -> float:
+        """Observe `exact_count(text)` for each text (e.g. gemini_client.count_tokens) and return the new factor."""
+        try:
+            for text in texts:
+                if text:
+                    self.observe(model, text, exact_count(text))
+        finally:
+            self.flush()
+        return self.factor(model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {name: dict(stats) for name, stats in self._models.items()}
+        return {
+            name: {"samples": int(stats.get("samples", 0)), "factor": self.factor(name)}
+            for name, stats in models.items()
+        }
+
+    def flush(self) -> None:
+        """Write pending observations to `path`; a no-op when nothing changed."""
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                snapshot = {name: dict(stats) for name, stats in self._models.items()}
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+            write_json_atomic(self.path, snapshot)